@@ -0,0 +1,197 @@
+"""Native asyncio counterpart of `repository`, built on the async Supabase/PostgREST client.
+
+Routes await these functions directly instead of hopping through `run_in_threadpool`.
+Every query flow is written once in `repository` (see `repository._flow`); this module only
+drives those flows on the async client, so both layers issue the same queries and return
+the same shapes. The exception is apply_stock_lines, which is group-committed per worker by
+`stock_coordinator`.
+"""
+from typing import Optional, Dict, List
+import asyncio
+import functools
+import inspect
+
+from . import repository
+from . import stock_coordinator
+from .repository import (
+    _CLIENT,
+    _Call,
+    _Page,
+    _resume,
+    _stock_request,
+    _forget_products,
+    _stock_rpc_result,
+    _is_missing_rpc,
+    default_reservation_expiry,
+)
+
+
+async def _get_supabase():
+    # lazy import to avoid import errors in tests that don't have top-level `app` module
+    from app.database import get_async_supabase
+    return await get_async_supabase()
+
+
+async def _execute(query):
+    """Execute a PostgREST query builder.
+
+    The async client returns a coroutine from `.execute()`; synchronous fakes used in tests
+    return the result directly, so accept both.
+    """
+    res = query.execute()
+    if inspect.isawaitable(res):
+        res = await res
+    return res
+
+
+async def _step(step):
+    if step is _CLIENT:
+        return await _get_supabase()
+    if isinstance(step, _Call):
+        # this module's version of the repository function (see the check at the end)
+        res = globals()[step.fn.__name__](*step.args, **step.kwargs)
+        return await res if inspect.isawaitable(res) else res
+    if isinstance(step, tuple):
+        return list(await asyncio.gather(*(_step(s) for s in step)))
+    return await _execute(step)
+
+
+async def _run(flow):
+    value, exc = None, None
+    while True:
+        done, step = _resume(flow, value, exc)
+        if done:
+            return step
+        try:
+            value, exc = await _step(step), None
+        except Exception as err:
+            value, exc = None, err
+
+
+async def _iterate(flow):
+    value, exc = None, None
+    try:
+        while True:
+            done, step = _resume(flow, value, exc)
+            if done:
+                return
+            if isinstance(step, _Page):
+                yield step.rows
+                value, exc = None, None
+                continue
+            try:
+                value, exc = await _step(step), None
+            except Exception as err:
+                value, exc = None, err
+    finally:
+        flow.close()
+
+
+def _flow(fn):
+    """The async version of a `repository._flow` function."""
+    @functools.wraps(fn)
+    async def run(*args, **kwargs):
+        return await _run(fn.flow(*args, **kwargs))
+    return run
+
+
+def _iter_flow(fn):
+    """The async version of a `repository._iter_flow` function: returns an async generator."""
+    @functools.wraps(fn)
+    def run(*args, **kwargs):
+        return _iterate(fn.flow(*args, **kwargs))
+    return run
+
+
+_allocate_counter_block = _flow(repository._allocate_counter_block)
+_next_counter_value = _flow(repository._next_counter_value)
+_next_sequential_id = _flow(repository._next_sequential_id)
+next_invoice_number = _flow(repository.next_invoice_number)
+get_billing_stats = _flow(repository.get_billing_stats)
+sales_report = _flow(repository.sales_report)
+stock_as_of = _flow(repository.stock_as_of)
+
+get_product = _flow(repository.get_product)
+get_products_bulk = _flow(repository.get_products_bulk)
+create_product = _flow(repository.create_product)
+update_product = _flow(repository.update_product)
+delete_product = _flow(repository.delete_product)
+undelete_product = _flow(repository.undelete_product)
+list_products = _flow(repository.list_products)
+list_archived_products = _flow(repository.list_archived_products)
+
+get_customer = _flow(repository.get_customer)
+list_customers = _flow(repository.list_customers)
+create_customer = _flow(repository.create_customer)
+update_customer = _flow(repository.update_customer)
+delete_customer = _flow(repository.delete_customer)
+list_suppliers = _flow(repository.list_suppliers)
+create_supplier = _flow(repository.create_supplier)
+
+create_invoice = _flow(repository.create_invoice)
+insert_invoice_items = _flow(repository.insert_invoice_items)
+create_invoice_with_items = _flow(repository.create_invoice_with_items)
+get_invoice = _flow(repository.get_invoice)
+list_invoices = _flow(repository.list_invoices)
+iter_invoice_export_pages = _iter_flow(repository.iter_invoice_export_pages)
+iter_invoice_headers = _iter_flow(repository.iter_invoice_headers)
+
+list_product_variables = _flow(repository.list_product_variables)
+upsert_product_variable = _flow(repository.upsert_product_variable)
+delete_product_variable = _flow(repository.delete_product_variable)
+update_product_variable_enabled = _flow(repository.update_product_variable_enabled)
+set_product_variable_type_enabled = _flow(repository.set_product_variable_type_enabled)
+list_product_variable_types_all = _flow(repository.list_product_variable_types_all)
+
+# Stock primitives
+get_current_stock = _flow(repository.get_current_stock)
+_call_stock_rpc = _flow(repository._call_stock_rpc)
+_apply_stock_request = _flow(repository._apply_stock_request)
+decrement_product_stock = _flow(repository.decrement_product_stock)
+create_stock_movement = _flow(repository.create_stock_movement)
+set_stock_qty = _flow(repository.set_stock_qty)
+apply_purchase = _flow(repository.apply_purchase)
+apply_sale = _flow(repository.apply_sale)
+reserve_stock = _flow(repository.reserve_stock)
+consume_reservation = _flow(repository.consume_reservation)
+release_reservation = _flow(repository.release_reservation)
+release_expired_reservations = _flow(repository.release_expired_reservations)
+
+
+async def apply_stock_lines(lines: List[Dict], reason: str, reference_type: Optional[str] = None, reference_id: Optional[str] = None, created_by: Optional[str] = None, allow_negative: bool = False, meta: Optional[dict] = None) -> Optional[Dict]:
+    """Apply signed stock changes for several products in one atomic round trip (see `repository`).
+
+    Concurrent calls in this worker are group-committed by `stock_coordinator`; each still
+    gets its own result.
+    """
+    request = _stock_request(lines, reason, reference_type, reference_id, created_by, allow_negative, meta)
+    return await stock_coordinator.submit(request, _apply_stock_batch, _apply_stock_request)
+
+
+async def _apply_stock_batch(requests: List[Dict]) -> Optional[List[Optional[Dict]]]:
+    """Several apply_stock_lines requests in one apply_stock_batch call (migration 0023).
+
+    Returns their results in order, or None when the RPC is not installed; raises when the
+    batch failed as a whole.
+    """
+    supabase = await _get_supabase()
+    try:
+        res = await _execute(supabase.rpc('apply_stock_batch', {'p_requests': requests}))
+    except Exception as exc:
+        if _is_missing_rpc(exc):
+            return None
+        raise
+    data = _stock_rpc_result('apply_stock_batch', res)
+    if not data.get('ok'):
+        raise RuntimeError(f"apply_stock_batch failed: {data.get('reason')}")
+    results = data.get('results') or []
+    for request, result in zip(requests, results):
+        if result and result.get('ok'):
+            _forget_products(request['lines'])
+    return results
+
+
+# Flows `_Call` repository functions by reference; each needs its async version here.
+_missing = sorted(set(repository._CALLABLE) - set(globals()))
+if _missing:
+    raise ImportError(f'async_repository has no async version of {", ".join(_missing)}')
@@ -0,0 +1,91 @@
+"""Recompute stored invoice totals from their items (used by backend/scripts/audit_invoice_totals.py).
+
+`audit_page` is a pure function over one page of invoices (items and customer attached), so the
+audit script can fan pages out to a process pool. Totals are recomputed with the batch tax
+engine; pages containing sub-paisa amounts fall back to `calculate_invoice_taxes`.
+"""
+from decimal import Decimal
+from typing import Dict, List, Tuple
+
+from . import gst
+from . import tax as tax_module
+
+# (batch engine field, invoices column)
+AUDIT_FIELDS = (
+    ('subtotal', 'subtotal'),
+    ('cgst', 'cgst_amount'),
+    ('sgst', 'sgst_amount'),
+    ('igst', 'igst_amount'),
+    ('total_tax', 'total_tax'),
+    ('total', 'total_amount'),
+)
+REPORT_COLUMNS = ('invoice_id', 'invoice_number', 'created_at', 'field', 'stored', 'expected')
+
+
+def _stored_paise(value) -> int:
+    return int(tax_module.quantize_two(Decimal(str(value or 0))) * 100)
+
+
+def _expected(invoices: List[Tuple[bool, List[Dict]]]) -> Dict[str, List[int]]:
+    try:
+        return tax_module.calculate_taxes_batch(*tax_module.invoice_columns(invoices))
+    except ValueError:
+        out = {f: [] for f in tax_module.BATCH_FIELDS}
+        for intra, items in invoices:
+            # calculate_invoice_taxes only compares the two states
+            res = tax_module.calculate_invoice_taxes('x', 'x' if intra else 'y', items)
+            for f in tax_module.BATCH_FIELDS:
+                out[f].append(int(res[f] * 100))
+        return out
+
+
+def audit_page(invoices: List[Dict], supplier_state: str) -> Dict:
+    """Check one page; returns {'checked', 'rate_unknown', 'discrepancies': [report rows]}.
+
+    Intra/inter-state comes from the tax the invoice was stored with (`gst.is_inter_state`), not
+    the customer's current state, which may have changed since. The audit therefore checks the
+    arithmetic, not the choice of IGST vs CGST/SGST. Items stored before
+    invoice_items.tax_percent existed can only have their subtotal checked; those invoices are
+    counted in `rate_unknown`.
+    """
+    discrepancies = []
+    rate_unknown = 0
+    batch = []
+    for inv in invoices:
+        items = inv.get('items') or []
+        intra = not gst.is_inter_state(inv, supplier_state)
+        known = all(it.get('tax_percent') is not None for it in items)
+        if not known:
+            rate_unknown += 1
+        batch.append((intra, [{'qty': it.get('qty') or 0, 'unit_price': it.get('unit_price') or 0,
+                               'tax_percent': it.get('tax_percent') or 0} for it in items]))
+
+        for n, it in enumerate(items):
+            if it.get('line_total') is None:
+                continue
+            stored = _stored_paise(it['line_total'])
+            expected = _stored_paise(Decimal(str(it.get('unit_price') or 0)) * int(it.get('qty') or 0))
+            if stored != expected:
+                discrepancies.append(_row(inv, f'items[{n}].line_total', stored, expected))
+
+    expected = _expected(batch)
+    for i, inv in enumerate(invoices):
+        known = all(it.get('tax_percent') is not None for it in inv.get('items') or [])
+        for field, column in AUDIT_FIELDS:
+            if field != 'subtotal' and not known:
+                continue
+            stored = _stored_paise(inv.get(column))
+            if stored != expected[field][i]:
+                discrepancies.append(_row(inv, column, stored, expected[field][i]))
+    return {'checked': len(invoices), 'rate_unknown': rate_unknown, 'discrepancies': discrepancies}
+
+
+def _row(inv: Dict, field: str, stored: int, expected: int) -> Dict:
+    return {
+        'invoice_id': inv.get('id'),
+        'invoice_number': inv.get('invoice_number'),
+        'created_at': inv.get('created_at'),
+        'field': field,
+        'stored': f'{Decimal(stored) / 100:.2f}',
+        'expected': f'{Decimal(expected) / 100:.2f}',
+    }
@@ -0,0 +1,101 @@
+"""In-process caches shared by `repository` and `async_repository`.
+
+Product tax rates and customer states change rarely but are read on every invoice, sale
+and stock check, so catalog rows are kept in a bounded TTL + LRU cache. Writers invalidate
+entries explicitly; the TTL only bounds staleness from changes made by other workers.
+
+Invoices (with their items) never change once created, so `invoice_cache` has no TTL and is
+bounded by size only. Their customer is not part of the cached value: it can still be edited
+and is read through `customer_cache`.
+"""
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional
+import os
+import threading
+import time
+
+MISSING = object()
+
+
+class TTLCache:
+    """Thread-safe LRU cache whose entries also expire after `ttl` seconds.
+
+    `ttl=None` keeps entries until they are evicted by size or invalidated.
+    """
+
+    def __init__(self, name: str, maxsize: int, ttl: Optional[float]):
+        self.name = name
+        self.maxsize = max(1, int(maxsize))
+        self.ttl = ttl
+        self._data: 'OrderedDict[Hashable, tuple]' = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def get(self, key: Hashable) -> Any:
+        """Return the cached value or MISSING."""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return MISSING
+            value, expires_at = entry
+            if expires_at is not None and expires_at <= time.monotonic():
+                del self._data[key]
+                self.expirations += 1
+                self.misses += 1
+                return MISSING
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: Hashable, value: Any) -> None:
+        expires_at = time.monotonic() + self.ttl if self.ttl is not None else None
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key: Hashable) -> None:
+        with self._lock:
+            if self._data.pop(key, None) is not None:
+                self.invalidations += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'size': len(self._data),
+                'maxsize': self.maxsize,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'invalidations': self.invalidations,
+            }
+
+
+CATALOG_CACHE_TTL = float(os.getenv('CATALOG_CACHE_TTL', '300'))
+CATALOG_CACHE_SIZE = int(os.getenv('CATALOG_CACHE_SIZE', '5000'))
+
+# Cached product rows carry stock_qty / reserved_qty as of the fetch. Stock writes made by
+# this worker invalidate the products they touch, but availability checks must still use
+# get_current_stock (or an uncached read), never the cached value.
+product_cache = TTLCache('products', CATALOG_CACHE_SIZE, CATALOG_CACHE_TTL)
+customer_cache = TTLCache('customers', CATALOG_CACHE_SIZE, CATALOG_CACHE_TTL)
+
+INVOICE_CACHE_SIZE = int(os.getenv('INVOICE_CACHE_SIZE', '2000'))
+invoice_cache = TTLCache('invoices', INVOICE_CACHE_SIZE, None)
+
+
+def cache_stats() -> Dict[str, Dict[str, Any]]:
+    return {c.name: c.stats() for c in (product_cache, customer_cache, invoice_cache)}
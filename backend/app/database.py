@@ -1,8 +1,12 @@
 from dotenv import load_dotenv
-from supabase import create_client, Client
+from supabase import create_client, acreate_client, Client, AsyncClient, ClientOptions, AsyncClientOptions
+import asyncio
+import threading
 import os
 import logging
 
+import httpx
+
 load_dotenv()
 
 SUPABASE_URL = os.getenv('SUPABASE_URL')
@@ -15,4 +19,180 @@ if not SUPABASE_URL or not SUPABASE_KEY:
 	logging.error('Missing SUPABASE_URL or SUPABASE_KEY environment variables')
 	raise RuntimeError('SUPABASE_URL and SUPABASE_KEY must be set in the environment')
 
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+
+def _env_float(name: str, default: float) -> float:
+	try:
+		return float(os.getenv(name, default))
+	except ValueError:
+		logging.warning('Invalid %s=%r; using %s', name, os.getenv(name), default)
+		return default
+
+
+def _http2_available() -> bool:
+	try:
+		import h2  # noqa: F401
+		return True
+	except ImportError:
+		return False
+
+
+# Connection pool settings (one pool per worker process, shared by every repository call)
+POOL_MAX_CONNECTIONS = int(_env_float('SUPABASE_POOL_MAX_CONNECTIONS', 20))
+POOL_MAX_KEEPALIVE = int(_env_float('SUPABASE_POOL_MAX_KEEPALIVE', 10))
+POOL_KEEPALIVE_EXPIRY = _env_float('SUPABASE_POOL_KEEPALIVE_EXPIRY', 30.0)
+POOL_HTTP2 = os.getenv('SUPABASE_HTTP2', 'true').lower() in ('1', 'true', 'yes') and _http2_available()
+TIMEOUT_CONNECT = _env_float('SUPABASE_TIMEOUT_CONNECT', 5.0)
+TIMEOUT_READ = _env_float('SUPABASE_TIMEOUT_READ', 30.0)
+TIMEOUT_WRITE = _env_float('SUPABASE_TIMEOUT_WRITE', 30.0)
+# how long a request may wait for a free pooled connection before httpx raises PoolTimeout
+TIMEOUT_POOL = _env_float('SUPABASE_TIMEOUT_POOL', 5.0)
+
+
+class PoolMetrics:
+	"""Thread-safe counters describing how the shared connection pool is used."""
+
+	def __init__(self):
+		self._lock = threading.Lock()
+		self.requests = 0
+		self.in_flight = 0
+		self.peak_in_flight = 0
+		# requests that started while every pooled connection was busy and had to queue
+		self.saturated = 0
+		self.pool_timeouts = 0
+		self.errors = 0
+
+	def started(self):
+		with self._lock:
+			self.requests += 1
+			if self.in_flight >= POOL_MAX_CONNECTIONS:
+				self.saturated += 1
+			self.in_flight += 1
+			self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+
+	def finished(self, exc: Exception = None):
+		with self._lock:
+			self.in_flight -= 1
+			if isinstance(exc, httpx.PoolTimeout):
+				self.pool_timeouts += 1
+			elif exc is not None:
+				self.errors += 1
+
+	def snapshot(self) -> dict:
+		with self._lock:
+			return {
+				'requests': self.requests,
+				'in_flight': self.in_flight,
+				'peak_in_flight': self.peak_in_flight,
+				'saturated': self.saturated,
+				'pool_timeouts': self.pool_timeouts,
+				'errors': self.errors,
+			}
+
+
+sync_pool_metrics = PoolMetrics()
+async_pool_metrics = PoolMetrics()
+
+
+class _InstrumentedTransport(httpx.HTTPTransport):
+	def handle_request(self, request):
+		sync_pool_metrics.started()
+		try:
+			response = super().handle_request(request)
+		except Exception as exc:
+			sync_pool_metrics.finished(exc)
+			raise
+		sync_pool_metrics.finished()
+		return response
+
+
+class _InstrumentedAsyncTransport(httpx.AsyncHTTPTransport):
+	async def handle_async_request(self, request):
+		async_pool_metrics.started()
+		try:
+			response = await super().handle_async_request(request)
+		except Exception as exc:
+			async_pool_metrics.finished(exc)
+			raise
+		async_pool_metrics.finished()
+		return response
+
+
+def _pool_limits() -> httpx.Limits:
+	return httpx.Limits(
+		max_connections=POOL_MAX_CONNECTIONS,
+		max_keepalive_connections=POOL_MAX_KEEPALIVE,
+		keepalive_expiry=POOL_KEEPALIVE_EXPIRY,
+	)
+
+
+def _pool_timeout() -> httpx.Timeout:
+	return httpx.Timeout(connect=TIMEOUT_CONNECT, read=TIMEOUT_READ, write=TIMEOUT_WRITE, pool=TIMEOUT_POOL)
+
+
+def _build_client() -> Client:
+	http = httpx.Client(
+		transport=_InstrumentedTransport(limits=_pool_limits(), http2=POOL_HTTP2),
+		timeout=_pool_timeout(),
+		follow_redirects=True,
+		http2=POOL_HTTP2,
+	)
+	return create_client(SUPABASE_URL, SUPABASE_KEY, options=ClientOptions(httpx_client=http))
+
+
+# The pool is owned by the process that built it: after a fork (eg. gunicorn --preload) the
+# child must not reuse the parent's sockets, so clients are rebuilt when the pid changes.
+_client_lock = threading.Lock()
+_client_pid = None
+_client: Client = None
+
+
+def get_supabase() -> Client:
+	"""Return this worker process's pooled Supabase client (safe to share across threads)."""
+	global _client, _client_pid
+	if _client is None or _client_pid != os.getpid():
+		with _client_lock:
+			if _client is None or _client_pid != os.getpid():
+				_client = _build_client()
+				_client_pid = os.getpid()
+				logging.info('Supabase pool ready: max_connections=%s keepalive=%s http2=%s', POOL_MAX_CONNECTIONS, POOL_MAX_KEEPALIVE, POOL_HTTP2)
+	return _client
+
+
+supabase: Client = get_supabase()
+
+# The async client is created lazily because acreate_client must run inside the event loop.
+_async_supabase: AsyncClient = None
+_async_pid = None
+_async_lock = asyncio.Lock()
+
+
+async def get_async_supabase() -> AsyncClient:
+	"""Return this worker process's pooled async Supabase client."""
+	global _async_supabase, _async_pid
+	if _async_supabase is None or _async_pid != os.getpid():
+		async with _async_lock:
+			if _async_supabase is None or _async_pid != os.getpid():
+				http = httpx.AsyncClient(
+					transport=_InstrumentedAsyncTransport(limits=_pool_limits(), http2=POOL_HTTP2),
+					timeout=_pool_timeout(),
+					follow_redirects=True,
+					http2=POOL_HTTP2,
+				)
+				_async_supabase = await acreate_client(SUPABASE_URL, SUPABASE_KEY, options=AsyncClientOptions(httpx_client=http))
+				_async_pid = os.getpid()
+	return _async_supabase
+
+
+def pool_stats() -> dict:
+	"""Pool configuration plus usage counters for the sync and async clients."""
+	return {
+		'config': {
+			'max_connections': POOL_MAX_CONNECTIONS,
+			'max_keepalive_connections': POOL_MAX_KEEPALIVE,
+			'keepalive_expiry': POOL_KEEPALIVE_EXPIRY,
+			'http2': POOL_HTTP2,
+			'timeouts': {'connect': TIMEOUT_CONNECT, 'read': TIMEOUT_READ, 'write': TIMEOUT_WRITE, 'pool': TIMEOUT_POOL},
+		},
+		'sync': sync_pool_metrics.snapshot(),
+		'async': async_pool_metrics.snapshot(),
+	}
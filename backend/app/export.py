@@ -0,0 +1,91 @@
+"""Streaming invoice exports (`GET /billing/invoices/export?format=csv|ndjson&from=&to=`).
+
+The repositories page through invoices (keyset on created_at, id) and their items a page at a
+time; this module only turns each page into CSV or NDJSON text. Nothing holds more than one
+page, so memory stays flat however long the date range is.
+"""
+from datetime import date, datetime, time, timedelta, timezone
+from typing import Dict, Iterable, List, Optional, Tuple
+import csv
+import io
+import json
+import os
+
+EXPORT_PAGE_SIZE = max(1, int(os.getenv('EXPORT_PAGE_SIZE', '500')))
+
+MEDIA_TYPES = {
+    'csv': 'text/csv; charset=utf-8',
+    'ndjson': 'application/x-ndjson',
+}
+
+INVOICE_COLUMNS = (
+    'id', 'invoice_number', 'created_at', 'customer_id', 'subtotal', 'cgst_amount', 'sgst_amount',
+    'igst_amount', 'total_tax', 'total_amount', 'currency', 'issued_by',
+)
+ITEM_COLUMNS = ('product_id', 'description', 'qty', 'unit_price', 'line_total')
+
+# `from` / `to` are calendar days in India Standard Time, the business day invoices are filed under
+IST = timezone(timedelta(hours=5, minutes=30))
+
+
+class InvalidExport(ValueError):
+    pass
+
+
+def parse_range(date_from: Optional[str], date_to: Optional[str]) -> Tuple[Optional[str], Optional[str]]:
+    """Turn inclusive YYYY-MM-DD bounds into a half-open [start, end) created_at range."""
+    try:
+        start = date.fromisoformat(date_from) if date_from else None
+        end = date.fromisoformat(date_to) if date_to else None
+    except ValueError:
+        raise InvalidExport('from/to must be dates (YYYY-MM-DD)')
+    if start and end and start > end:
+        raise InvalidExport('from must not be after to')
+    return (
+        datetime.combine(start, time.min, IST).isoformat() if start else None,
+        datetime.combine(end + timedelta(days=1), time.min, IST).isoformat() if end else None,
+    )
+
+
+def check_format(fmt: str) -> str:
+    fmt = (fmt or 'csv').lower()
+    if fmt not in MEDIA_TYPES:
+        raise InvalidExport(f"format must be one of: {', '.join(MEDIA_TYPES)}")
+    return fmt
+
+
+def filename(fmt: str, date_from: Optional[str], date_to: Optional[str]) -> str:
+    return f"invoices_{date_from or 'start'}_{date_to or 'now'}.{fmt}"
+
+
+def _cell(value) -> str:
+    if value is None:
+        return ''
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, default=str)
+    return str(value)
+
+
+def csv_header() -> str:
+    return _csv_lines([list(INVOICE_COLUMNS) + [f'item_{c}' for c in ITEM_COLUMNS]])
+
+
+def csv_rows(invoices: Iterable[Dict]) -> str:
+    """One CSV line per invoice item (invoice columns repeated); item-less invoices get one line."""
+    lines: List[List[str]] = []
+    for inv in invoices:
+        head = [_cell(inv.get(c)) for c in INVOICE_COLUMNS]
+        for item in inv.get('items') or [None]:
+            lines.append(head + [_cell(item.get(c)) if item else '' for c in ITEM_COLUMNS])
+    return _csv_lines(lines)
+
+
+def _csv_lines(lines: List[List[str]]) -> str:
+    buf = io.StringIO()
+    csv.writer(buf, lineterminator='\n').writerows(lines)
+    return buf.getvalue()
+
+
+def ndjson_rows(invoices: Iterable[Dict]) -> str:
+    """One JSON document per invoice, items nested."""
+    return ''.join(json.dumps(inv, default=str, separators=(',', ':')) + '\n' for inv in invoices)
@@ -0,0 +1,79 @@
+"""Sparse fieldsets for list and detail reads (`?fields=name,price`).
+
+Requested fields are validated against a per-table allow-list and turned into a PostgREST
+`select` column list, so only the columns a screen shows are read, serialized and sent.
+Derived fields (eg. products.total_price) are computed only when asked for.
+"""
+from typing import Dict, FrozenSet, Iterable, Optional, Tuple
+
+ALLOWED_FIELDS: Dict[str, FrozenSet[str]] = {
+    'products': frozenset({
+        'id', 'sku', 'name', 'description', 'price', 'tax_percent', 'stock_qty', 'reserved_qty', 'company',
+        'variant', 'type', 'selling_price', 'p_code', 'archived', 'created_at', 'total_price',
+    }),
+    'customers': frozenset({
+        'id', 'customer_code', 'name', 'gstin', 'state', 'address', 'phone', 'email', 'created_at',
+    }),
+    'suppliers': frozenset({
+        'id', 'supplier_code', 'name', 'contact', 'address', 'phone', 'email', 'created_at',
+    }),
+    'invoices': frozenset({
+        'id', 'invoice_number', 'customer_id', 'subtotal', 'cgst_amount', 'sgst_amount', 'igst_amount',
+        'total_tax', 'total_amount', 'currency', 'created_at', 'issued_by',
+        # detail-only expansions, fetched with extra queries
+        'items', 'customer',
+    }),
+}
+
+DETAIL_ONLY_FIELDS: Dict[str, FrozenSet[str]] = {
+    'invoices': frozenset({'items', 'customer'}),
+}
+
+# derived field -> columns it is computed from
+DERIVED_FIELDS: Dict[str, Dict[str, Tuple[str, ...]]] = {
+    'products': {'total_price': ('price', 'tax_percent')},
+    'invoices': {'items': (), 'customer': ('customer_id',)},
+}
+
+Fields = Optional[Tuple[str, ...]]
+
+
+class InvalidFields(ValueError):
+    pass
+
+
+def parse_fields(table: str, fields: Optional[str], detail: bool = False) -> Fields:
+    """Parse a comma separated `fields` parameter; None means every column."""
+    if not fields:
+        return None
+    names = tuple(dict.fromkeys(f.strip() for f in fields.split(',') if f.strip()))
+    if not names:
+        return None
+    allowed = ALLOWED_FIELDS[table] if detail else ALLOWED_FIELDS[table] - DETAIL_ONLY_FIELDS.get(table, frozenset())
+    unknown = [n for n in names if n not in allowed]
+    if unknown:
+        raise InvalidFields(f"Unknown field(s) for {table}: {', '.join(unknown)}")
+    return names
+
+
+def select_columns(table: str, fields: Fields, required: Iterable[str] = ()) -> str:
+    """PostgREST select list for `fields` plus columns the query itself needs (eg. keyset keys)."""
+    if fields is None:
+        return '*'
+    derived = DERIVED_FIELDS.get(table, {})
+    cols = []
+    for f in fields:
+        cols.extend(derived[f] if f in derived else (f,))
+    cols.extend(required)
+    return ','.join(dict.fromkeys(cols))
+
+
+def wants(fields: Fields, name: str) -> bool:
+    return fields is None or name in fields
+
+
+def project(row: Dict, fields: Fields) -> Dict:
+    """Drop helper columns that were fetched but not requested."""
+    if fields is None or row is None:
+        return row
+    return {k: row[k] for k in fields if k in row}
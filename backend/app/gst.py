@@ -0,0 +1,160 @@
+"""GSTR-1 summaries (B2B, B2C-large, B2C-small and rate-wise tax) for a filing period.
+
+`Gstr1Report` is fed pages of invoices (items and customer attached, as yielded by
+`iter_invoice_export_pages(..., customers=True)`) and aggregates them in one pass. It keeps only
+running totals keyed by recipient / place of supply and rate, so memory does not grow with the
+number of invoices. Line tax comes from `tax.line_tax_minor`, so amounts are integer paise
+rounded exactly as `tax.calculate_invoice_taxes` rounds them.
+
+Invoice-level detail for the return (invoice numbers and values) comes from
+`/billing/invoices/export`; these are the section summaries.
+"""
+from decimal import Decimal
+from typing import Dict, Iterable, List, Optional, Tuple
+import csv
+import io
+import os
+
+from . import tax as tax_module
+
+# B2C inter-state invoices above this value are reported individually (B2CL); INR.
+B2CL_THRESHOLD = Decimal(os.getenv('GST_B2CL_THRESHOLD', '100000'))
+GST_SLABS = (0, 5, 12, 18, 28)
+
+CSV_COLUMNS = ('section', 'gstin', 'place_of_supply', 'rate', 'invoices', 'taxable', 'cgst', 'sgst', 'igst')
+
+
+def _paise(value) -> int:
+    if value is None or value == '':
+        return 0
+    return int(tax_module.quantize_two(Decimal(str(value))) * 100)
+
+
+def _rupees(paise: int) -> float:
+    return paise / 100
+
+
+def _nearest_slab(rate: Decimal) -> Decimal:
+    return Decimal(min(GST_SLABS, key=lambda s: abs(Decimal(s) - rate)))
+
+
+def line_rate(item: Dict, invoice: Dict) -> Decimal:
+    """Tax rate of a line. Lines stored before invoice_items.tax_percent existed get the invoice's
+    effective rate snapped to the nearest GST slab."""
+    if item.get('tax_percent') is not None:
+        return Decimal(str(item['tax_percent']))
+    subtotal = Decimal(str(invoice.get('subtotal') or 0))
+    if not subtotal:
+        return Decimal(0)
+    return _nearest_slab(Decimal(str(invoice.get('total_tax') or 0)) * 100 / subtotal)
+
+
+def is_inter_state(invoice: Dict, supplier_state: str) -> bool:
+    """Inter-state when IGST was charged; untaxed invoices fall back to comparing states."""
+    if _paise(invoice.get('igst_amount')):
+        return True
+    if _paise(invoice.get('cgst_amount')) or _paise(invoice.get('sgst_amount')):
+        return False
+    customer = invoice.get('customer') or {}
+    return not tax_module.is_intra_state(supplier_state, customer.get('state'))
+
+
+class Gstr1Report:
+    """Single-pass accumulator for one period's GSTR-1 section totals."""
+
+    def __init__(self, supplier_state: Optional[str] = None, b2cl_threshold: Decimal = None):
+        self.supplier_state = supplier_state or os.getenv('SUPPLIER_STATE', 'Karnataka')
+        self.b2cl_threshold_paise = _paise(B2CL_THRESHOLD if b2cl_threshold is None else b2cl_threshold)
+        # section -> (gstin, place_of_supply, rate) -> [invoices, taxable, cgst, sgst, igst]
+        self._sections: Dict[str, Dict[Tuple, List[int]]] = {'b2b': {}, 'b2cl': {}, 'b2cs': {}}
+        self.invoices = 0
+
+    def add_page(self, invoices: Iterable[Dict]) -> None:
+        for inv in invoices:
+            self.add_invoice(inv)
+
+    def add_invoice(self, inv: Dict) -> None:
+        customer = inv.get('customer') or {}
+        gstin = (customer.get('gstin') or '').strip().upper()
+        pos = (customer.get('state') or '').strip() or 'Unknown'
+        inter = is_inter_state(inv, self.supplier_state)
+        if gstin:
+            section = 'b2b'
+        elif inter and _paise(inv.get('total_amount')) > self.b2cl_threshold_paise:
+            section = 'b2cl'
+        else:
+            section = 'b2cs'
+        buckets = self._sections[section]
+        seen_rates = set()
+        for item in inv.get('items') or []:
+            rate = line_rate(item, inv)
+            net = item.get('line_total')
+            if net is None:
+                net = Decimal(str(item.get('qty') or 0)) * Decimal(str(item.get('unit_price') or 0))
+            try:
+                net_paise, rate_bp = tax_module.to_minor(net), tax_module.to_minor(rate)
+                cgst, sgst, igst = tax_module.line_tax_minor(net_paise, rate_bp, not inter)
+            except ValueError:
+                # sub-paisa amounts: fall back to Decimal with the same rounding
+                net = Decimal(str(net))
+                net_paise = _paise(net)
+                line_tax = net * rate / 100
+                cgst = sgst = 0 if inter else _paise(line_tax / 2)
+                igst = _paise(line_tax) if inter else 0
+            key = (gstin or None, pos, rate)
+            b = buckets.get(key)
+            if b is None:
+                b = buckets[key] = [0, 0, 0, 0, 0]
+            if key not in seen_rates:
+                seen_rates.add(key)
+                b[0] += 1
+            b[1] += net_paise
+            b[2] += cgst
+            b[3] += sgst
+            b[4] += igst
+        self.invoices += 1
+
+    def rows(self, section: str) -> List[Dict]:
+        out = []
+        for (gstin, pos, rate), (n, taxable, cgst, sgst, igst) in sorted(
+                self._sections[section].items(), key=lambda kv: (kv[0][0] or '', kv[0][1], kv[0][2])):
+            out.append({
+                'gstin': gstin, 'place_of_supply': pos, 'rate': float(rate), 'invoices': n,
+                'taxable': _rupees(taxable), 'cgst': _rupees(cgst), 'sgst': _rupees(sgst), 'igst': _rupees(igst),
+            })
+        return out
+
+    def rate_summary(self) -> List[Dict]:
+        rates: Dict[Decimal, List[int]] = {}
+        for buckets in self._sections.values():
+            for (_, _, rate), b in buckets.items():
+                r = rates.setdefault(rate, [0, 0, 0, 0])
+                for i in range(4):
+                    r[i] += b[i + 1]
+        return [{'rate': float(rate), 'taxable': _rupees(t), 'cgst': _rupees(c), 'sgst': _rupees(s), 'igst': _rupees(i)}
+                for rate, (t, c, s, i) in sorted(rates.items())]
+
+    def result(self) -> Dict:
+        rates = self.rate_summary()
+        totals = {k: round(sum(r[k] for r in rates), 2) for k in ('taxable', 'cgst', 'sgst', 'igst')}
+        return {
+            'invoices': self.invoices,
+            'b2b': self.rows('b2b'),
+            'b2cl': self.rows('b2cl'),
+            'b2cs': self.rows('b2cs'),
+            'rates': rates,
+            'totals': totals,
+        }
+
+
+def to_csv(result: Dict) -> str:
+    """Flatten a `Gstr1Report.result()` into one CSV table with a `section` column."""
+    buf = io.StringIO()
+    writer = csv.writer(buf, lineterminator='\n')
+    writer.writerow(CSV_COLUMNS)
+    for section in ('b2b', 'b2cl', 'b2cs'):
+        for r in result[section]:
+            writer.writerow([section] + [r.get(c) if r.get(c) is not None else '' for c in CSV_COLUMNS[1:]])
+    for r in result['rates']:
+        writer.writerow(['rate', '', '', r['rate'], '', r['taxable'], r['cgst'], r['sgst'], r['igst']])
+    return buf.getvalue()
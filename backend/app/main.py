@@ -4,6 +4,8 @@ logging.basicConfig(level=logging.INFO)
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from . import routes
+from . import pdf_pool
+from . import reservations
 
 app = FastAPI(title="Billing Project")
 
@@ -21,6 +23,9 @@ app.add_middleware(
 )
 
 app.include_router(routes.router)
+app.router.add_event_handler('shutdown', pdf_pool.shutdown)
+app.router.add_event_handler('startup', reservations.start_sweeper)
+app.router.add_event_handler('shutdown', reservations.stop_sweeper)
 
 @app.get("/")
 def root():
@@ -0,0 +1,91 @@
+"""Keyset (cursor) pagination shared by the list queries.
+
+Pages are ordered by (created_at, id) and continue strictly after the last row returned, so
+the database seeks straight to the next page through the (created_at, id) index instead of
+skipping OFFSET rows: page N costs the same as page 1. Cursors are opaque to clients.
+"""
+from typing import Dict, List, Optional, Tuple
+import base64
+import json
+import os
+
+DEFAULT_PAGE_SIZE = max(1, int(os.getenv('LIST_PAGE_SIZE', '100')))
+MAX_PAGE_SIZE = max(1, int(os.getenv('LIST_PAGE_SIZE_MAX', '1000')))
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def page_size(limit: Optional[int]) -> int:
+    if not limit or int(limit) <= 0:
+        return DEFAULT_PAGE_SIZE
+    return min(int(limit), MAX_PAGE_SIZE)
+
+
+def encode_cursor(row: Dict) -> Optional[str]:
+    if not row or row.get('id') is None:
+        return None
+    raw = json.dumps([row.get('created_at'), str(row['id'])], separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor: str) -> Tuple[Optional[str], str]:
+    """Return (created_at, id) from a cursor; raises InvalidCursor for anything malformed."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        created_at, row_id = json.loads(raw)
+    except Exception:
+        raise InvalidCursor('Invalid cursor')
+    if not isinstance(row_id, str) or not (created_at is None or isinstance(created_at, str)):
+        raise InvalidCursor('Invalid cursor')
+    return created_at, row_id
+
+
+def apply_keyset(qb, cursor: Optional[str], size: int, desc: bool = False):
+    """Order a PostgREST query by (created_at, id), seek past `cursor` and fetch size + 1 rows.
+
+    The extra row only tells whether another page exists; `split_page` drops it. Rows without
+    created_at sort last ascending and first descending (Postgres defaults).
+    """
+    if cursor:
+        qb = qb.or_(_after(cursor, desc))
+    return qb.order('created_at', desc=desc).order('id', desc=desc).limit(size + 1)
+
+
+def _after(cursor: str, desc: bool) -> str:
+    """PostgREST `or` filter selecting the rows that sort after the cursor position."""
+    created_at, row_id = decode_cursor(cursor)
+    op = 'lt' if desc else 'gt'
+    if created_at is None:
+        same = f'and(created_at.is.null,id.{op}."{row_id}")'
+        return f'{same},created_at.not.is.null' if desc else same
+    after = f'created_at.{op}."{created_at}",and(created_at.eq."{created_at}",id.{op}."{row_id}")'
+    return after if desc else f'{after},created_at.is.null'
+
+
+def split_page(rows: List[Dict], size: int) -> Tuple[List[Dict], Optional[str]]:
+    """Trim the look-ahead row and return (page rows, next_cursor)."""
+    rows = rows or []
+    if len(rows) <= size:
+        return rows, None
+    page = rows[:size]
+    return page, encode_cursor(page[-1])
+
+
+# Lists ordered by id alone (eg. the per-product stock report) use the same opaque cursors,
+# carrying only the id of the last row.
+def after_id(cursor: Optional[str]) -> Optional[str]:
+    """The id a cursor of an id-ordered list continues after (None for the first page)."""
+    if not cursor:
+        return None
+    return decode_cursor(cursor)[1]
+
+
+def split_id_page(rows: List[Dict], size: int, key: str = 'id') -> Tuple[List[Dict], Optional[str]]:
+    """`split_page` for lists ordered by id alone; `key` names the id column of the rows."""
+    rows = rows or []
+    if len(rows) <= size:
+        return rows, None
+    page = rows[:size]
+    return page, encode_cursor({'id': page[-1].get(key)})
@@ -56,10 +56,35 @@ def render_invoice_html(invoice: Dict) -> str:
     return html
 
 
+# WeasyPrint's HTML class, imported once per process (False when unavailable)
+_weasy_html = None
+
+
+def _weasyprint_html():
+    global _weasy_html
+    if _weasy_html is None:
+        try:
+            from weasyprint import HTML
+            _weasy_html = HTML
+        except Exception as exc:
+            logging.warning('WeasyPrint not available: %s', exc)
+            _weasy_html = False
+    return _weasy_html or None
+
+
+def warm_up() -> None:
+    """Import WeasyPrint and compile the invoice template ahead of the first render."""
+    _weasyprint_html()
+    if _HAS_JINJA and env is not None:
+        env.get_template('invoice.html')
+
+
 def invoice_to_pdf_bytes(invoice: Dict) -> Optional[bytes]:
     html = render_invoice_html(invoice)
+    HTML = _weasyprint_html()
+    if HTML is None:
+        return None
     try:
-        from weasyprint import HTML
         pdf = HTML(string=html).write_pdf()
         return pdf
     except Exception as exc:
@@ -0,0 +1,163 @@
+"""On-disk cache of rendered invoice PDFs (or the HTML fallback when WeasyPrint is missing).
+
+Layout: PDF_CACHE_DIR/<template version>/<invoice id>/<content hash>.pdf|html. The content
+hash covers the invoice data and the template version and doubles as the ETag. Invoices do not
+change once created, so a hit is served by id alone: no database queries and no render.
+Editing `invoice.html` or the renderer changes the template version, so old entries stop
+matching and get evicted. Call `invalidate` if an invoice is ever modified.
+
+The directory is shared by every API worker. Hits bump the file mtime, and once the total size
+passes PDF_CACHE_MAX_BYTES the least recently used files are removed.
+"""
+from typing import Dict, NamedTuple, Optional
+import hashlib
+import json
+import logging
+import os
+import re
+import shutil
+import tempfile
+import threading
+
+PDF_CACHE_DIR = os.getenv('PDF_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'billing-pdf-cache'))
+PDF_CACHE_MAX_BYTES = max(0, int(os.getenv('PDF_CACHE_MAX_BYTES', str(256 * 1024 * 1024))))
+
+_TEMPLATE_FILES = (
+    os.path.join(os.path.dirname(__file__), 'templates', 'invoice.html'),
+    os.path.join(os.path.dirname(__file__), 'pdf.py'),
+)
+_SAFE_ID = re.compile(r'^[A-Za-z0-9_-]{1,64}$')
+MEDIA_TYPES = {'pdf': 'application/pdf', 'html': 'text/html; charset=utf-8'}
+
+
+class CachedRender(NamedTuple):
+    path: str
+    media_type: str
+    etag: str
+
+
+_lock = threading.Lock()
+_template_version: Optional[str] = None
+_size_estimate: Optional[int] = None
+_stats = {'hits': 0, 'misses': 0, 'stores': 0, 'evictions': 0}
+
+
+def template_version() -> str:
+    global _template_version
+    if _template_version is None:
+        h = hashlib.sha256()
+        for path in _TEMPLATE_FILES:
+            try:
+                with open(path, 'rb') as f:
+                    h.update(f.read())
+            except OSError:
+                h.update(path.encode())
+        _template_version = h.hexdigest()[:12]
+    return _template_version
+
+
+def content_hash(invoice: Dict) -> str:
+    """Hash of the invoice data plus template version; call before rendering (render mutates items)."""
+    raw = json.dumps(invoice, sort_keys=True, default=str, separators=(',', ':'))
+    return hashlib.sha256((template_version() + raw).encode()).hexdigest()[:32]
+
+
+def _invoice_dir(invoice_id: str) -> Optional[str]:
+    if not PDF_CACHE_MAX_BYTES or not _SAFE_ID.match(invoice_id or ''):
+        return None
+    return os.path.join(PDF_CACHE_DIR, template_version(), invoice_id)
+
+
+def lookup(invoice_id: str) -> Optional[CachedRender]:
+    """Cached render for an invoice id, preferring a PDF over an HTML fallback."""
+    d = _invoice_dir(invoice_id)
+    try:
+        names = os.listdir(d) if d else []
+    except FileNotFoundError:
+        names = []
+    for ext in ('pdf', 'html'):
+        for name in names:
+            if name.endswith('.' + ext):
+                path = os.path.join(d, name)
+                try:
+                    os.utime(path)  # LRU: mtime is last use
+                except OSError:
+                    continue
+                _stats['hits'] += 1
+                return CachedRender(path, MEDIA_TYPES[ext], f'"{name[:-len(ext) - 1]}"')
+    _stats['misses'] += 1
+    return None
+
+
+def store(invoice_id: str, digest: str, content: bytes, ext: str) -> Optional[CachedRender]:
+    """Write a render atomically; returns the entry or None when caching is off / fails."""
+    d = _invoice_dir(invoice_id)
+    if d is None or ext not in MEDIA_TYPES:
+        return None
+    path = os.path.join(d, f'{digest}.{ext}')
+    try:
+        os.makedirs(d, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=d, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(content)
+        os.replace(tmp, path)
+    except OSError as exc:
+        logging.warning('PDF cache write failed for %s: %s', invoice_id, exc)
+        return None
+    _stats['stores'] += 1
+    _account(len(content))
+    return CachedRender(path, MEDIA_TYPES[ext], f'"{digest}"')
+
+
+def invalidate(invoice_id: str) -> None:
+    d = _invoice_dir(invoice_id)
+    if d:
+        shutil.rmtree(d, ignore_errors=True)
+
+
+def _account(added: int) -> None:
+    global _size_estimate
+    with _lock:
+        if _size_estimate is None:
+            _size_estimate = _scan_size()
+        else:
+            _size_estimate += added
+        if _size_estimate > PDF_CACHE_MAX_BYTES:
+            _size_estimate = _evict()
+
+
+def _entries():
+    for root, _dirs, files in os.walk(PDF_CACHE_DIR):
+        for name in files:
+            path = os.path.join(root, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            yield st.st_mtime, st.st_size, path
+
+
+def _scan_size() -> int:
+    return sum(size for _, size, _ in _entries())
+
+
+def _evict() -> int:
+    """Delete least recently used files until the cache is at 90% of its budget; returns new size."""
+    entries = sorted(_entries())
+    total = sum(size for _, size, _ in entries)
+    target = PDF_CACHE_MAX_BYTES * 0.9
+    for _, size, path in entries:
+        if total <= target:
+            break
+        try:
+            os.remove(path)
+            total -= size
+            _stats['evictions'] += 1
+        except OSError:
+            continue
+    return total
+
+
+def cache_stats() -> Dict:
+    return {'dir': PDF_CACHE_DIR, 'max_bytes': PDF_CACHE_MAX_BYTES, 'size_estimate': _size_estimate,
+            'template_version': template_version(), **_stats}
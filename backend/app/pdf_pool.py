@@ -0,0 +1,147 @@
+"""Dedicated process pool for invoice PDF rendering.
+
+WeasyPrint is CPU-heavy and holds the GIL, so renders run in worker processes instead of the
+Starlette threadpool the other endpoints share. Each worker imports WeasyPrint and compiles
+`invoice.html` once at start-up (`pdf.warm_up`). At most `PDF_QUEUE_LIMIT` renders may be
+running or waiting (including renders whose caller timed out); beyond that `render_invoice`
+raises `PdfPoolBusy` and the route answers 503 instead of letting a burst of downloads queue up
+without bound.
+
+PDF_WORKERS=0 renders in the threadpool as before (no extra processes).
+"""
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Dict, Optional, Tuple
+import asyncio
+import logging
+import multiprocessing
+import os
+import threading
+import time
+
+from starlette.concurrency import run_in_threadpool
+
+from . import pdf as pdf_module
+
+PDF_WORKERS = max(0, int(os.getenv('PDF_WORKERS', str(min(2, os.cpu_count() or 1)))))
+PDF_QUEUE_LIMIT = max(1, int(os.getenv('PDF_QUEUE_LIMIT', str(max(1, PDF_WORKERS) * 4))))
+PDF_RENDER_TIMEOUT = float(os.getenv('PDF_RENDER_TIMEOUT', '30'))
+# spawn: forking a process that already runs threads (uvicorn, httpx pools) is unsafe
+PDF_START_METHOD = os.getenv('PDF_START_METHOD', 'spawn')
+
+
+class PdfPoolBusy(Exception):
+    """Raised when PDF_QUEUE_LIMIT renders are already running or queued."""
+
+
+def _init_worker() -> None:
+    pdf_module.warm_up()
+
+
+def _render(invoice: Dict) -> Tuple[Optional[bytes], Optional[str], float]:
+    """Worker entry point: (pdf bytes, or HTML when WeasyPrint is unavailable, and render seconds)."""
+    t0 = time.perf_counter()
+    html = None
+    pdf_bytes = pdf_module.invoice_to_pdf_bytes(invoice)
+    if pdf_bytes is None:
+        html = pdf_module.render_invoice_html(invoice)
+    return pdf_bytes, html, time.perf_counter() - t0
+
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+_pending = 0
+_stats: Dict[str, Any] = {
+    'renders': 0,
+    'failures': 0,
+    'timeouts': 0,
+    'rejected': 0,
+    'peak_pending': 0,
+    'render_seconds_total': 0.0,
+    'render_seconds_max': 0.0,
+    'wait_seconds_total': 0.0,
+}
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ProcessPoolExecutor(
+                    max_workers=PDF_WORKERS,
+                    mp_context=multiprocessing.get_context(PDF_START_METHOD),
+                    initializer=_init_worker,
+                )
+    return _pool
+
+
+def _reset_pool() -> None:
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _release_slot(fut: 'asyncio.Future') -> None:
+    global _pending
+    _pending -= 1
+    if not fut.cancelled():
+        fut.exception()  # retrieved here when the caller timed out or went away
+
+
+async def render_invoice(invoice: Dict) -> Tuple[Optional[bytes], Optional[str]]:
+    """Render an invoice to (pdf_bytes, None) or, without WeasyPrint, (None, html).
+
+    Raises PdfPoolBusy when the queue is full and asyncio.TimeoutError after PDF_RENDER_TIMEOUT.
+    """
+    global _pending
+    if _pending >= PDF_QUEUE_LIMIT:
+        _stats['rejected'] += 1
+        raise PdfPoolBusy()
+    t0 = time.perf_counter()
+    try:
+        if PDF_WORKERS == 0:
+            fut = asyncio.ensure_future(run_in_threadpool(_render, invoice))
+        else:
+            fut = asyncio.get_running_loop().run_in_executor(_get_pool(), _render, invoice)
+        # the slot is freed when the render really ends, not when the caller stops waiting: a
+        # timed out render keeps its worker busy, so it keeps counting against PDF_QUEUE_LIMIT
+        _pending += 1
+        _stats['peak_pending'] = max(_stats['peak_pending'], _pending)
+        fut.add_done_callback(_release_slot)
+        # shield: cancelling the wait must not mark the render done while it is still running
+        pdf_bytes, html, render_s = await asyncio.wait_for(asyncio.shield(fut), PDF_RENDER_TIMEOUT)
+    except asyncio.TimeoutError:
+        _stats['timeouts'] += 1
+        raise
+    except BrokenProcessPool:
+        _stats['failures'] += 1
+        logging.exception('PDF worker pool broke; starting a new one on the next render')
+        _reset_pool()
+        raise
+    except Exception:
+        _stats['failures'] += 1
+        raise
+    _stats['renders'] += 1
+    _stats['render_seconds_total'] += render_s
+    _stats['render_seconds_max'] = max(_stats['render_seconds_max'], render_s)
+    _stats['wait_seconds_total'] += max(0.0, time.perf_counter() - t0 - render_s)
+    return pdf_bytes, html
+
+
+def pool_stats() -> Dict[str, Any]:
+    renders = _stats['renders']
+    return {
+        'workers': PDF_WORKERS,
+        'queue_limit': PDF_QUEUE_LIMIT,
+        'pending': _pending,
+        **_stats,
+        'render_seconds_avg': _stats['render_seconds_total'] / renders if renders else 0.0,
+        'wait_seconds_avg': _stats['wait_seconds_total'] / renders if renders else 0.0,
+    }
+
+
+def shutdown() -> None:
+    _reset_pool()
@@ -0,0 +1,137 @@
+"""Streamed ZIP of many invoice PDFs (`POST /billing/invoices/export/pdf`).
+
+Invoices are rendered a bounded window at a time (PDF_ZIP_CONCURRENCY) and each file is written
+to the ZIP as soon as it is ready, so at most a window of PDFs is held in memory whatever the
+export size. Files go in completion order. Entries are stored uncompressed, since PDFs are
+already compressed. A `manifest.csv` listing every invoice and its outcome closes the archive.
+Progress of running exports is kept in a small in-process registry (see `progress`).
+"""
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
+import asyncio
+import csv
+import io
+import logging
+import os
+import re
+import time
+import uuid
+import zipfile
+from collections import OrderedDict
+
+PDF_ZIP_CONCURRENCY = max(1, int(os.getenv('PDF_ZIP_CONCURRENCY', '4')))
+_KEEP_FINISHED = 50
+
+# invoice id -> (content, extension, cached?) ; None when the invoice does not exist
+RenderFn = Callable[[str], Awaitable[Optional[Tuple[bytes, str, bool]]]]
+
+_exports: 'OrderedDict[str, Dict[str, Any]]' = OrderedDict()
+
+
+class _Sink:
+    """Write-only buffer: zipfile sees an unseekable stream and writes data descriptors."""
+
+    def __init__(self):
+        self._buf = io.BytesIO()
+
+    def write(self, data) -> int:
+        return self._buf.write(data)
+
+    def flush(self) -> None:
+        pass
+
+    def take(self) -> bytes:
+        data = self._buf.getvalue()
+        self._buf = io.BytesIO()
+        return data
+
+
+def new_export(total: Optional[int]) -> Dict[str, Any]:
+    export_id = uuid.uuid4().hex
+    state = {'id': export_id, 'status': 'running', 'total': total, 'done': 0, 'cached': 0,
+             'failed': 0, 'started_at': time.time(), 'finished_at': None}
+    _exports[export_id] = state
+    finished = [k for k, v in _exports.items() if v['status'] != 'running']
+    for k in finished[:max(0, len(finished) - _KEEP_FINISHED)]:
+        del _exports[k]
+    return state
+
+
+def progress(export_id: str) -> Optional[Dict[str, Any]]:
+    state = _exports.get(export_id)
+    return dict(state) if state else None
+
+
+def file_name(header: Dict, ext: str) -> str:
+    base = header.get('invoice_number') or header.get('id')
+    return re.sub(r'[^A-Za-z0-9._-]+', '-', str(base)).strip('-') + '.' + ext
+
+
+async def _results(headers: AsyncIterator[List[Dict]], render: RenderFn, window: int):
+    """Yield (header, result or exception) as renders finish, keeping at most `window` running."""
+    pending = {}
+    pages = headers.__aiter__()
+    queue: List[Dict] = []
+    exhausted = False
+    try:
+        while True:
+            while len(pending) < window and not exhausted:
+                if not queue:
+                    try:
+                        queue = list(await pages.__anext__())
+                    except StopAsyncIteration:
+                        exhausted = True
+                        break
+                    continue
+                h = queue.pop(0)
+                pending[asyncio.ensure_future(render(h['id']))] = h
+            if not pending:
+                return
+            done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                h = pending.pop(task)
+                exc = task.exception()
+                yield h, exc if exc else task.result()
+    finally:
+        # client went away or the listing failed: stop outstanding renders
+        for task in pending:
+            task.cancel()
+
+
+async def stream_zip(state: Dict[str, Any], headers: AsyncIterator[List[Dict]], render: RenderFn,
+                     window: int = None) -> AsyncIterator[bytes]:
+    sink = _Sink()
+    manifest = [('invoice_id', 'invoice_number', 'file', 'status')]
+    names = set()
+    results = _results(headers, render, window or PDF_ZIP_CONCURRENCY)
+    try:
+        with zipfile.ZipFile(sink, 'w', zipfile.ZIP_STORED) as zf:
+            async for header, result in results:
+                if isinstance(result, BaseException) or result is None:
+                    if isinstance(result, BaseException):
+                        logging.error('PDF export: rendering %s failed: %s', header.get('id'), result)
+                    state['failed'] += 1
+                    manifest.append((header.get('id'), header.get('invoice_number'), '', 'failed' if result else 'not_found'))
+                else:
+                    content, ext, cached = result
+                    name = file_name(header, ext)
+                    if name in names:
+                        name = f"{name[:-len(ext) - 1]}-{header['id']}.{ext}"
+                    names.add(name)
+                    zf.writestr(zipfile.ZipInfo(name, time.localtime()[:6]), content)
+                    state['cached'] += 1 if cached else 0
+                    manifest.append((header.get('id'), header.get('invoice_number'), name, 'cached' if cached else 'rendered'))
+                state['done'] += 1
+                chunk = sink.take()
+                if chunk:
+                    yield chunk
+            buf = io.StringIO()
+            csv.writer(buf, lineterminator='\n').writerows(manifest)
+            zf.writestr(zipfile.ZipInfo('manifest.csv', time.localtime()[:6]), buf.getvalue())
+        yield sink.take()
+        state['status'] = 'done'
+    except BaseException:
+        state['status'] = 'failed'
+        raise
+    finally:
+        await results.aclose()
+        state['finished_at'] = time.time()
@@ -0,0 +1,88 @@
+"""Plain-text thermal receipts (58/80 mm) for counter sales, without Jinja or WeasyPrint.
+
+`render_receipt` lays the invoice out in a fixed-width monospace grid (32 columns on 58 mm paper,
+48 on 80 mm, Font A). The text prints as-is on ESC/POS printers; `to_escpos` wraps it with the
+init / bold / cut commands for printing raw. Output is ASCII only ('Rs.' instead of the rupee
+sign) because printer code pages vary.
+"""
+from decimal import Decimal, InvalidOperation
+from typing import Dict, List
+import os
+import textwrap
+import unicodedata
+
+PAPER_COLUMNS = {58: 32, 80: 48}
+RECEIPT_HEADER = os.getenv('RECEIPT_HEADER', '')
+RECEIPT_FOOTER = os.getenv('RECEIPT_FOOTER', 'Thank you!')
+
+_ESC_INIT = b'\x1b@'
+_ESC_BOLD_ON = b'\x1bE\x01'
+_ESC_BOLD_OFF = b'\x1bE\x00'
+_ESC_FEED_CUT = b'\x1bd\x03\x1dV\x00'
+
+
+def _ascii(text) -> str:
+    text = unicodedata.normalize('NFKD', str(text or '')).replace('₹', 'Rs.')
+    return text.encode('ascii', 'ignore').decode()
+
+
+def _money(value) -> str:
+    try:
+        return f'{Decimal(str(value or 0)):.2f}'
+    except (InvalidOperation, ValueError):
+        return str(value)
+
+
+def _pair(left: str, right: str, width: int) -> str:
+    left = left[:max(0, width - len(right) - 1)]
+    return left + ' ' * (width - len(left) - len(right)) + right
+
+
+def render_receipt(invoice: Dict, paper: int = 58) -> str:
+    """Receipt text for an invoice as returned by `get_invoice` (items and customer attached)."""
+    width = PAPER_COLUMNS.get(int(paper), PAPER_COLUMNS[58])
+    rule = '-' * width
+    lines: List[str] = []
+    if RECEIPT_HEADER:
+        lines += [_ascii(h).center(width).rstrip() for h in RECEIPT_HEADER.split('|')]
+    lines.append(_pair('Invoice', _ascii(invoice.get('invoice_number') or invoice.get('id')), width))
+    if invoice.get('created_at'):
+        lines.append(_pair('Date', _ascii(str(invoice['created_at'])[:16].replace('T', ' ')), width))
+    customer = invoice.get('customer') or {}
+    if customer.get('name'):
+        lines.append(_pair('Customer', _ascii(customer['name']), width))
+    if customer.get('gstin'):
+        lines.append(_pair('GSTIN', _ascii(customer['gstin']), width))
+    lines.append(rule)
+
+    for it in invoice.get('items') or []:
+        for part in textwrap.wrap(_ascii(it.get('description') or it.get('product_id') or 'Item'), width) or ['Item']:
+            lines.append(part)
+        qty_price = f"  {it.get('qty')} x {_money(it.get('unit_price'))}"
+        total = it.get('line_total')
+        if total is None:
+            total = Decimal(str(it.get('unit_price') or 0)) * int(it.get('qty') or 0)
+        lines.append(_pair(qty_price, _money(total), width))
+    lines.append(rule)
+
+    lines.append(_pair('Subtotal', _money(invoice.get('subtotal')), width))
+    for label, key in (('CGST', 'cgst_amount'), ('SGST', 'sgst_amount'), ('IGST', 'igst_amount')):
+        if Decimal(_money(invoice.get(key))):
+            lines.append(_pair(label, _money(invoice.get(key)), width))
+    lines.append(_pair('TOTAL Rs.', _money(invoice.get('total_amount')), width))
+    if RECEIPT_FOOTER:
+        lines += ['', _ascii(RECEIPT_FOOTER).center(width).rstrip()]
+    return '\n'.join(lines) + '\n'
+
+
+def to_escpos(text: str) -> bytes:
+    """Raw ESC/POS job: initialise, print the receipt with a bold total line, feed and cut."""
+    out = [_ESC_INIT]
+    for line in text.split('\n'):
+        data = line.encode('ascii', 'replace') + b'\n'
+        if line.startswith('TOTAL'):
+            out += [_ESC_BOLD_ON, data, _ESC_BOLD_OFF]
+        else:
+            out.append(data)
+    out.append(_ESC_FEED_CUT)
+    return b''.join(out)
@@ -0,0 +1,34 @@
+"""Compare products.stock_qty with the stock ledger (used by backend/scripts/reconcile_stock.py).
+
+The ledger side is summed in the database (`stock_ledger_batch`, migration 0022), a batch of
+products at a time. This module splits the product id space into ranges that the script's
+workers scan independently, and picks the drifted rows out of each batch.
+"""
+from typing import Dict, List, Optional, Tuple
+import uuid
+
+REPORT_COLUMNS = ('product_id', 'stock_qty', 'ledger_qty', 'drift', 'status')
+_UUID_SPACE = 1 << 128
+
+
+def uuid_ranges(parts: int) -> List[Tuple[Optional[str], Optional[str]]]:
+    """Split the uuid space into `parts` [start, end) ranges; None is unbounded.
+
+    Product ids are random (gen_random_uuid), so the ranges hold similar numbers of products.
+    Postgres orders uuids bytewise, the same order as `uuid.UUID.int`.
+    """
+    parts = max(1, int(parts))
+    bounds = [str(uuid.UUID(int=_UUID_SPACE * k // parts)) for k in range(1, parts)]
+    return list(zip([None] + bounds, bounds + [None]))
+
+
+def drift_rows(rows) -> List[Dict]:
+    """Rows of a stock_ledger_batch result whose cached quantity differs from the ledger."""
+    out = []
+    for r in rows or []:
+        stock = int(r.get('stock_qty') or 0)
+        ledger = int(r.get('ledger_qty') or 0)
+        if stock != ledger:
+            out.append({'product_id': r['product_id'], 'stock_qty': stock, 'ledger_qty': ledger,
+                        'drift': stock - ledger, 'status': 'drift'})
+    return out
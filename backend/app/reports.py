@@ -0,0 +1,58 @@
+"""Sales reports served from the daily rollup tables (migration 0018).
+
+Reports never read `invoices` / `invoice_items`: the sales_report RPC aggregates
+sales_by_product / sales_by_customer / sales_by_state over the requested days, so latency depends
+on the number of days and keys in the period, not on how many invoices exist.
+"""
+from datetime import date
+from typing import Dict, List, Optional, Tuple
+
+from . import sequences
+
+REPORT_GROUPS = ('day', 'product', 'customer', 'state')
+REPORT_LIMIT = 1000
+WALK_IN_CUSTOMER = '00000000-0000-0000-0000-000000000000'
+
+
+class InvalidReport(ValueError):
+    pass
+
+
+def parse_period(date_from: Optional[str], date_to: Optional[str]) -> Tuple[date, date]:
+    """Inclusive (from, to) IST days; defaults to the current month up to today."""
+    today = sequences.local_today()
+    try:
+        end = date.fromisoformat(date_to) if date_to else today
+        start = date.fromisoformat(date_from) if date_from else end.replace(day=1)
+    except ValueError:
+        raise InvalidReport('from/to must be dates (YYYY-MM-DD)')
+    if start > end:
+        raise InvalidReport('from must not be after to')
+    return start, end
+
+
+def check_group(group: str) -> str:
+    if group not in REPORT_GROUPS:
+        raise InvalidReport(f"group must be one of: {', '.join(REPORT_GROUPS)}")
+    return group
+
+
+def shape_rows(group: str, rows) -> List[Dict]:
+    """Normalise sales_report rows (numeric strings -> float, walk-in customer -> None)."""
+    out = []
+    for r in rows or []:
+        key = r.get('key')
+        if group == 'customer' and key == WALK_IN_CUSTOMER:
+            key = None
+        row = {
+            'key': key,
+            'label': r.get('label'),
+            'invoices': int(r.get('invoices') or 0),
+            'net': float(r.get('net') or 0),
+            'tax': float(r.get('tax') or 0),
+            'total': float(r.get('total') or 0),
+        }
+        if group == 'product':
+            row['qty'] = int(r.get('qty') or 0)
+        out.append(row)
+    return out
@@ -1,73 +1,393 @@
-from typing import Optional, Dict, List
+from typing import Callable, Optional, Dict, List, Tuple
+import functools
 import logging
+import os
 import uuid
+from datetime import datetime, timedelta, timezone
 from decimal import Decimal
 
+from .cache import MISSING, product_cache, customer_cache, invoice_cache
+from . import pagination
+from . import export
+from . import reports
+from . import stock_snapshots
+from .fields import Fields, select_columns, project, wants
+from . import sequences
+
 
 def _get_supabase():
-    # lazy import to avoid import errors in tests that don't have top-level `app` module
-    from app.database import supabase
-    return supabase
+    # lazy import to avoid import errors in tests that don't have top-level `app` module;
+    # get_supabase() hands out the worker's shared pooled client
+    from app.database import get_supabase
+    return get_supabase()
 
 
-def _next_sequential_id(table: str, prefix: str, width: int = 6) -> str:
-    """Compute next sequential id for a table with given prefix.
+# Query flows. Each database operation is written once, as a generator that yields the
+# PostgREST query builders it needs and is sent their results; `_flow` runs it here on the
+# sync client and `async_repository` runs the same generator on the async client. Besides a
+# query builder a flow may yield:
+#   - `_CLIENT`: the database client of the module driving the flow;
+#   - a tuple of steps: the results come back as a list (the async client runs them concurrently);
+#   - a `_Call` of another function of this module registered in `_CALLABLE`, run in the
+#     module driving the flow (so `async_repository` awaits its own version, eg. the
+#     group-committed apply_stock_lines);
+#   - in iterator flows (`_iter_flow`), a `_Page` of rows handed to the caller.
+# A query that raises is thrown back into the flow at its `yield`.
+class _Call:
+    """Flow step: call `fn`, a function of this module, in the repository module driving the flow."""
+
+    __slots__ = ('fn', 'args', 'kwargs')
+
+    def __init__(self, fn, *args, **kwargs):
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+
+
+class _Page:
+    """Flow step of an iterator flow: one page of rows for the caller."""
+
+    __slots__ = ('rows',)
+
+    def __init__(self, rows: List[Dict]):
+        self.rows = rows
+
+
+# Flow step: the database client (`_get_supabase` of the module driving the flow).
+_CLIENT = object()
+
+# Functions flows may `_Call`, by name. `async_repository` must define an async version of
+# each, which it checks on import.
+_CALLABLE: Dict[str, Callable] = {}
+
+
+def _callable(fn):
+    """Register `fn` as a `_Call` target."""
+    _CALLABLE[fn.__name__] = fn
+    return fn
 
-    This fetches existing ids from the table and finds the max numeric suffix for ids
-    that start with the prefix, then returns prefix + zero-padded next number.
-    This is a best-effort approach and may race under concurrent writers.
+
+def _resume(flow, value, exc):
+    """Send `value` (or throw `exc`) into a flow: (False, next step) or (True, its return value)."""
+    try:
+        return False, (flow.throw(exc) if exc is not None else flow.send(value))
+    except StopIteration as stop:
+        return True, stop.value
+
+
+def _step(step):
+    if step is _CLIENT:
+        return _get_supabase()
+    if isinstance(step, _Call):
+        return step.fn(*step.args, **step.kwargs)
+    if isinstance(step, tuple):
+        return [_step(s) for s in step]
+    return step.execute()
+
+
+def _run(flow):
+    value, exc = None, None
+    while True:
+        done, step = _resume(flow, value, exc)
+        if done:
+            return step
+        try:
+            value, exc = _step(step), None
+        except Exception as err:
+            value, exc = None, err
+
+
+def _iterate(flow):
+    value, exc = None, None
+    try:
+        while True:
+            done, step = _resume(flow, value, exc)
+            if done:
+                return
+            if isinstance(step, _Page):
+                yield step.rows
+                value, exc = None, None
+                continue
+            try:
+                value, exc = _step(step), None
+            except Exception as err:
+                value, exc = None, err
+    finally:
+        flow.close()
+
+
+def _flow(fn):
+    """Decorator: run the flow generator function `fn` as a plain function on the sync client.
+
+    The generator function stays available as `.flow` for `async_repository`.
     """
+    @functools.wraps(fn)
+    def run(*args, **kwargs):
+        return _run(fn(*args, **kwargs))
+    run.flow = fn
+    return _callable(run)
+
+
+def _iter_flow(fn):
+    """`_flow` for flows that yield `_Page`s: calling the result returns a generator of pages."""
+    @functools.wraps(fn)
+    def run(*args, **kwargs):
+        return _iterate(fn(*args, **kwargs))
+    run.flow = fn
+    return run
+
+
+# Pure helpers shared with `async_repository` so both layers shape rows the same way.
+PRODUCT_META_FIELDS = ('company', 'variant', 'type', 'selling_price', 'p_code', 'product_code')
+
+
+def _first_row(data):
+    """PostgREST returns inserted/updated rows as a list; return the first one (or the dict itself)."""
+    if isinstance(data, list):
+        return data[0] if data else None
+    return data
+
+
+def _sanitize_decimals(record: Dict) -> Dict:
+    """Return a copy of record with Decimal values converted to floats for JSON/POST compatibility."""
+    return {k: (float(v) if isinstance(v, Decimal) else v) for k, v in record.items()}
+
+
+def _sanitize_invoice_record(record: Dict) -> Dict:
+    """Convert Decimals and clear a customer_id that is not a valid UUID (avoids DB errors)."""
+    rec_sanitized = _sanitize_decimals(record)
+    v = rec_sanitized.get('customer_id')
+    if v is not None:
+        try:
+            # accepts both uuid.UUID and string; will raise on invalid
+            uuid.UUID(v if isinstance(v, str) else str(v))
+        except Exception:
+            logging.warning('create_invoice: invalid customer_id provided, clearing field before insert: %s', v)
+            rec_sanitized['customer_id'] = None
+    return rec_sanitized
+
+
+def _meta_to_columns(meta) -> Dict:
+    """Extract well-known product variables from a legacy `meta` payload (dict or JSON string)."""
+    if isinstance(meta, str):
+        try:
+            import json
+            meta = json.loads(meta)
+        except Exception:
+            meta = None
+    if not isinstance(meta, dict):
+        return {}
+    out = {}
+    for fld in PRODUCT_META_FIELDS:
+        if fld in meta and meta.get(fld) is not None:
+            val = meta.get(fld)
+            # convert selling_price decimals to float when needed
+            out[fld] = float(val) if fld == 'selling_price' and isinstance(val, Decimal) else val
+    return out
+
+
+def _is_deleted_marker(prod: Dict) -> bool:
+    nm = prod.get('name')
+    return isinstance(nm, str) and nm.endswith(' [deleted]')
+
+
+def _with_total_price(prod: Dict) -> Dict:
+    """Attach server-side total_price (price + gst) to a product row."""
+    price = prod.get('price')
+    tax = prod.get('tax_percent')
     try:
-        supabase = _get_supabase()
-        # Prefer atomic increment using a counters table if available
-        counter_name = None
-        if table == 'customers':
-            counter_name = 'customer_code'
-        elif table == 'suppliers':
-            counter_name = 'supplier_code'
+        if price is None:
+            prod['total_price'] = None
+        else:
+            # coerce to float for JSON friendliness
+            p = float(price)
+            t = float(tax) if tax is not None else 0.0
+            prod['total_price'] = round(p + (p * (t / 100.0)), 2)
+    except Exception:
+        prod['total_price'] = None
+    return prod
 
-        if counter_name:
+
+def _code_column(table: str) -> str:
+    if table == 'customers':
+        return 'customer_code'
+    if table == 'suppliers':
+        return 'supplier_code'
+    return 'id'
+
+
+def _counter_name(table: str) -> Optional[str]:
+    if table == 'customers':
+        return 'customer_code'
+    if table == 'suppliers':
+        return 'supplier_code'
+    return None
+
+
+def _counter_value(data) -> Optional[int]:
+    """Parse the value returned by the increment_counter RPC."""
+    if not data:
+        return None
+    val = data[0].get('value') if isinstance(data, list) else data.get('value')
+    if isinstance(val, int) or (isinstance(val, str) and val.isdigit()):
+        return int(val)
+    return None
+
+
+def _max_code_suffix(rows: List[Dict], code_col: str, prefix: str) -> int:
+    max_n = 0
+    for row in (rows or []):
+        val = row.get(code_col)
+        if not val or not isinstance(val, str):
+            continue
+        if val.startswith(prefix):
             try:
-                # Use PostgREST update returning: increment and return new value
-                qb = supabase.table('counters').update({'value': 'value + 1'}, returning='representation').eq('name', counter_name)
-                # Note: postgrest python client does not allow arbitrary SQL in update; as a fallback use rpc if available
-                res = supabase.rpc('increment_counter', { 'p_name': counter_name }).execute()
-                if not getattr(res, 'error', None) and res.data:
-                    val = res.data[0].get('value') if isinstance(res.data, list) else res.data.get('value')
-                    if isinstance(val, int) or (isinstance(val, str) and val.isdigit()):
-                        n = int(val)
-                        return f"{prefix}{n:0{width}d}"
+                max_n = max(max_n, int(val[len(prefix):]))
             except Exception:
-                # counters not available or rpc not installed; fall back to scanning
-                logging.info('Counters RPC not available; falling back to scan-based seq for %s', table)
-
-        # Fallback: scan existing rows like before
-        code_col = 'id'
-        if table == 'customers':
-            code_col = 'customer_code'
-        elif table == 'suppliers':
-            code_col = 'supplier_code'
+                continue
+    return max_n
+
+
+def _is_missing_code_column(msg: str, code_col: str, table: str) -> bool:
+    return code_col in msg or f'column {table}.{code_col} does not exist' in msg or 'Could not find the' in msg
+
+
+def _is_missing_rpc(err) -> bool:
+    """True when PostgREST reports that a database function is not installed."""
+    msg = str(err)
+    return 'PGRST202' in msg or 'Could not find the function' in msg or ('function' in msg and 'does not exist' in msg)
+
+
+def _stock_line(product_id: str, change: int, unit_cost=None, reference_id: Optional[str] = None) -> Dict:
+    """One entry of the `p_lines` payload accepted by the apply_stock_lines RPC."""
+    line = {'product_id': product_id, 'change': int(change)}
+    if unit_cost is not None:
+        line['unit_cost'] = float(unit_cost) if isinstance(unit_cost, Decimal) else unit_cost
+    if reference_id is not None:
+        line['reference_id'] = reference_id
+    return line
+
+
+def _stock_rpc_result(fn: str, res) -> Dict:
+    """Normalize the jsonb returned by the stock RPCs (migration 0014)."""
+    if getattr(res, 'error', None):
+        logging.error('%s RPC error: %s', fn, res.error)
+        return {'ok': False, 'reason': 'error'}
+    data = _first_row(res.data)
+    if not isinstance(data, dict):
+        logging.error('%s RPC returned unexpected payload: %r', fn, res.data)
+        return {'ok': False, 'reason': 'error'}
+    return data
+
+
+def _forget_products(rows) -> None:
+    """Drop the cached rows of products whose stock_qty / reserved_qty a stock write changed.
+
+    `rows` may be stock lines, movements or reservations: anything carrying a product_id.
+    """
+    for row in rows or []:
+        if isinstance(row, dict) and row.get('product_id'):
+            product_cache.invalidate(row['product_id'])
+
+
+STATS_COUNTERS = {'stats:customers': 'active_customers', 'stats:low_stock_products': 'low_stock_products'}
+
+
+def _stats_periods(day=None) -> Dict[str, str]:
+    """billing_stats period keys (migration 0017) for the dashboard, by response key."""
+    day = day or sequences.local_today()
+    return {'today': f'day:{day.isoformat()}', 'month': f'month:{day:%Y-%m}', 'all_time': 'all'}
+
+
+def _stats_payload(periods: Dict[str, str], stat_rows, counter_rows) -> Dict:
+    """Shape billing_stats / counters rows into the /billing/stats response; missing rows are zero.
+
+    A period is stored as several slot rows (one per concurrent writer); they are summed here.
+    """
+    out = {key: {'revenue': 0.0, 'tax': 0.0, 'invoices': 0} for key in periods}
+    keys = {period: key for key, period in periods.items()}
+    for row in stat_rows or []:
+        key = keys.get(row.get('period'))
+        if key is None:
+            continue
+        out[key]['revenue'] += float(row.get('revenue') or 0)
+        out[key]['tax'] += float(row.get('tax') or 0)
+        out[key]['invoices'] += int(row.get('invoices') or 0)
+    counters = {r.get('name'): r.get('value') for r in counter_rows or []}
+    for name, key in STATS_COUNTERS.items():
+        out[key] = int(counters.get(name) or 0)
+    return out
+
+
+@_flow
+def _allocate_counter_block(counter_name: str, size: int) -> Optional[Tuple[int, int]]:
+    """Reserve `size` consecutive counter values in one round trip.
+
+    Uses the allocate_counter_block RPC (migration 0015); databases that only have
+    increment_counter (migration 0003) get blocks of one. Returns None when neither exists.
+    """
+    supabase = yield _CLIENT
+    try:
+        res = yield supabase.rpc('allocate_counter_block', {'p_name': counter_name, 'p_size': size})
+        block = sequences.parse_block(res.data) if not getattr(res, 'error', None) else None
+        if block:
+            return block
+    except Exception as exc:
+        if not _is_missing_rpc(exc):
+            logging.warning('allocate_counter_block failed for %s: %s', counter_name, exc)
+    try:
+        # postgrest python client does not allow arbitrary SQL in update; use the rpc if available
+        res = yield supabase.rpc('increment_counter', {'p_name': counter_name})
+        n = _counter_value(res.data) if not getattr(res, 'error', None) else None
+        if n is not None:
+            return (n, n)
+    except Exception:
+        logging.info('Counters RPC not available for %s', counter_name)
+    return None
+
+
+@_flow
+def _next_counter_value(counter_name: str) -> Optional[int]:
+    """Next value of a counter, served from this worker's reserved block when possible."""
+    seq = sequences.get_sequence(counter_name)
+    for _ in range(3):
+        n = seq.take()
+        if n is not None:
+            return n
+        block = yield _Call(_allocate_counter_block, counter_name, seq.block_size)
+        if block is None:
+            return None
+        seq.add_block(*block)
+    return seq.take()
+
+
+@_flow
+def _next_sequential_id(table: str, prefix: str, width: int = 6) -> str:
+    """Compute next sequential id for a table with given prefix.
+
+    Codes come from a block of the table's counter reserved by this worker (no round trip
+    for most inserts). Without the counters table, fall back to reading the highest existing
+    code, which is a best-effort approach and may race under concurrent writers.
+    """
+    try:
+        counter_name = _counter_name(table)
+        if counter_name:
+            n = yield _Call(_next_counter_value, counter_name)
+            if n is not None:
+                return f"{prefix}{n:0{width}d}"
+            logging.info('Counters not available; falling back to scan-based seq for %s', table)
+
+        # Fallback: codes are zero-padded, so the highest one sorts last
+        supabase = yield _CLIENT
+        code_col = _code_column(table)
         try:
-            res = supabase.table(table).select(code_col).execute()
+            res = yield supabase.table(table).select(code_col).like(code_col, f'{prefix}%').order(code_col, desc=True).limit(1)
         except Exception:
             logging.warning('Code column %s not found in table %s; falling back to id for sequence detection. Apply migrations to persist codes.', code_col, table)
-            res = supabase.table(table).select('id').execute()
+            res = yield supabase.table(table).select('id')
         if getattr(res, 'error', None) or not res.data:
             return f"{prefix}{1:0{width}d}"
-        max_n = 0
-        for row in (res.data or []):
-            val = row.get(code_col)
-            if not val or not isinstance(val, str):
-                continue
-            if val.startswith(prefix):
-                num_part = val[len(prefix):]
-                try:
-                    n = int(num_part)
-                    if n > max_n:
-                        max_n = n
-                except Exception:
-                    continue
-        next_n = max_n + 1
+        next_n = _max_code_suffix(res.data, code_col, prefix) + 1
         return f"{prefix}{next_n:0{width}d}"
     except Exception:
         logging.exception('Failed to compute next sequential id for %s', table)
@@ -75,11 +395,152 @@ def _next_sequential_id(table: str, prefix: str, width: int = 6) -> str:
         return prefix + str(uuid.uuid4())
 
 
-def get_product(product_id: str) -> Optional[Dict]:
-    """Return product row dict or None"""
+@_flow
+def next_invoice_number(day=None) -> Optional[str]:
+    """Allocate the next invoice number of the financial year containing `day` (default today).
+
+    Numbers come from this worker's block of the `invoice_number:<fy>` counter. Returns None
+    when the counters RPCs are unavailable.
+    """
+    try:
+        fy = sequences.financial_year(day)
+        name = sequences.invoice_counter_name(fy)
+        sequences.get_sequence(name, sequences.INVOICE_NUMBER_BLOCK_SIZE)
+        n = yield _Call(_next_counter_value, name)
+        return sequences.format_invoice_number(fy, n) if n is not None else None
+    except Exception as exc:
+        logging.exception('next_invoice_number exception: %s', exc)
+        return None
+
+
+@_flow
+def get_billing_stats(day=None) -> Optional[Dict]:
+    """Dashboard totals from the rollup rows kept current by triggers (migration 0017).
+
+    Two indexed lookups (concurrent on the async client), independent of how many invoices
+    exist. Returns None on error.
+    """
+    try:
+        supabase = yield _CLIENT
+        periods = _stats_periods(day)
+        stats_res, counters_res = yield (
+            supabase.table('billing_stats').select('period,revenue,tax,invoices').in_('period', list(periods.values())),
+            supabase.table('counters').select('name,value').in_('name', list(STATS_COUNTERS)),
+        )
+        for res in (stats_res, counters_res):
+            if getattr(res, 'error', None):
+                logging.error('Supabase get_billing_stats error: %s', res.error)
+                return None
+        return _stats_payload(periods, stats_res.data, counters_res.data)
+    except Exception as exc:
+        logging.exception('get_billing_stats exception: %s', exc)
+        return None
+
+
+@_flow
+def sales_report(group: str, start, end, limit: int = reports.REPORT_LIMIT) -> Optional[List[Dict]]:
+    """Aggregate the daily sales rollups (migration 0018) for days start..end by `group`.
+
+    Returns shaped rows, or None when the RPC fails (eg. migration not applied).
+    """
+    try:
+        supabase = yield _CLIENT
+        res = yield supabase.rpc('sales_report', {'p_group': group, 'p_from': start.isoformat(), 'p_to': end.isoformat(), 'p_limit': limit})
+        if getattr(res, 'error', None):
+            logging.error('sales_report RPC error: %s', res.error)
+            return None
+        return reports.shape_rows(group, res.data)
+    except Exception as exc:
+        logging.exception('sales_report exception: %s', exc)
+        return None
+
+
+@_flow
+def stock_as_of(at, product_ids: Optional[List[str]] = None, limit: Optional[int] = None, cursor: Optional[str] = None) -> Optional[Dict]:
+    """One page of per-product stock, cost and value from movements created before `at`.
+
+    Products are paged by id (migration 0027). Returns {'rows': [...], 'next_cursor': str | None},
+    or None when the RPC fails (eg. migration not applied).
+    """
+    try:
+        supabase = yield _CLIENT
+        size = pagination.page_size(limit)
+        res = yield supabase.rpc('stock_as_of', {'p_at': at.isoformat(), 'p_product_ids': product_ids,
+                                                 'p_after': pagination.after_id(cursor), 'p_limit': size + 1})
+        if getattr(res, 'error', None):
+            logging.error('stock_as_of RPC error: %s', res.error)
+            return None
+        rows, next_cursor = pagination.split_id_page(stock_snapshots.shape_rows(res.data), size, 'product_id')
+        return {'rows': rows, 'next_cursor': next_cursor}
+    except Exception as exc:
+        logging.exception('stock_as_of exception: %s', exc)
+        return None
+
+
+def take_stock_snapshots(as_of) -> Optional[int]:
+    """Snapshot every product as of `as_of`; returns rows written (0 if already taken) or None."""
+    try:
+        supabase = _get_supabase()
+        res = supabase.rpc('take_stock_snapshots', {'p_as_of': as_of.isoformat()}).execute()
+        if getattr(res, 'error', None):
+            logging.error('take_stock_snapshots RPC error: %s', res.error)
+            return None
+        return int(res.data or 0)
+    except Exception as exc:
+        logging.exception('take_stock_snapshots exception: %s', exc)
+        return None
+
+
+def stock_ledger_batch(start: Optional[str], end: Optional[str], after: Optional[str], limit: int) -> List[Dict]:
+    """One id-ordered batch of {product_id, stock_qty, ledger_qty} in [start, end) after `after`.
+
+    Raises RuntimeError on query errors (the reconcile script stops rather than under-report).
+    """
     supabase = _get_supabase()
+    res = supabase.rpc('stock_ledger_batch', {'p_from': start, 'p_to': end, 'p_after': after, 'p_limit': limit}).execute()
+    if getattr(res, 'error', None):
+        raise RuntimeError(f'stock_ledger_batch failed: {res.error}')
+    return res.data or []
+
+
+def repair_stock_qty(lines: List[Dict]) -> Optional[List[Dict]]:
+    """Reset stock_qty to the ledger for [{'product_id', 'drift'}]; returns the repaired rows or None.
+
+    Products whose drift changed since it was measured are skipped (see migration 0022).
+    """
     try:
-        res = supabase.table('products').select('*').eq('id', product_id).single().execute()
+        supabase = _get_supabase()
+        res = supabase.rpc('repair_stock_qty', {'p_lines': lines}).execute()
+        if getattr(res, 'error', None):
+            logging.error('repair_stock_qty RPC error: %s', res.error)
+            return None
+        data = res.data[0] if isinstance(res.data, list) else res.data
+        repaired = (data or {}).get('repaired') or []
+        for row in repaired:
+            product_cache.invalidate(row.get('product_id'))
+        return repaired
+    except Exception as exc:
+        logging.exception('repair_stock_qty exception: %s', exc)
+        return None
+
+
+@_flow
+def get_product(product_id: str, fields: Fields = None) -> Optional[Dict]:
+    """Return product row dict or None.
+
+    Rows are cached whole; `fields` trims the returned dict (and adds total_price if asked).
+    """
+    if fields is not None:
+        prod = yield _Call(get_product, product_id)
+        if prod and wants(fields, 'total_price'):
+            prod = _with_total_price(prod)
+        return project(prod, fields)
+    cached = product_cache.get(product_id)
+    if cached is not MISSING:
+        return dict(cached)
+    try:
+        supabase = yield _CLIENT
+        res = yield supabase.table('products').select('*').eq('id', product_id).single()
     except Exception as exc:
         # Postgrest may raise when zero rows are returned or on other API errors; treat as not found
         logging.debug('Supabase get_product exception (treated as not found): %s', exc)
@@ -87,13 +548,58 @@ def get_product(product_id: str) -> Optional[Dict]:
     if getattr(res, 'error', None):
         logging.error('Supabase get_product error: %s', res.error)
         return None
+    if res.data:
+        product_cache.set(product_id, dict(res.data))
     return res.data
 
 
-def get_customer(customer_id: str) -> Optional[Dict]:
-    supabase = _get_supabase()
+@_flow
+def get_products_bulk(product_ids: List[str], use_cache: bool = True) -> Optional[Dict[str, Dict]]:
+    """Fetch many products in a single `in_` query, serving what it can from the catalog cache.
+
+    Returns a mapping of product id -> product row (ids that do not exist are simply absent),
+    or None when the lookup itself failed (eg. no database available). Pass use_cache=False
+    when the caller needs a fresh stock_qty.
+    """
+    ids = list(dict.fromkeys(pid for pid in product_ids if pid))
+    out: Dict[str, Dict] = {}
+    missing = []
+    for pid in ids:
+        cached = product_cache.get(pid) if use_cache else MISSING
+        if cached is MISSING:
+            missing.append(pid)
+        else:
+            out[pid] = dict(cached)
+    if not missing:
+        return out
     try:
-        res = supabase.table('customers').select('*').eq('id', customer_id).single().execute()
+        supabase = yield _CLIENT
+        res = yield supabase.table('products').select('*').in_('id', missing)
+    except Exception as exc:
+        logging.debug('Supabase get_products_bulk exception: %s', exc)
+        return None
+    if getattr(res, 'error', None):
+        logging.error('Supabase get_products_bulk error: %s', res.error)
+        return None
+    for row in (res.data or []):
+        if isinstance(row, dict) and row.get('id'):
+            product_cache.set(row['id'], dict(row))
+            out[row['id']] = row
+    return out
+
+
+@_flow
+def get_customer(customer_id: str, fields: Fields = None) -> Optional[Dict]:
+    # rows are cached whole; `fields` only trims the returned dict
+    if fields is not None:
+        customer = yield _Call(get_customer, customer_id)
+        return project(customer, fields)
+    cached = customer_cache.get(customer_id)
+    if cached is not MISSING:
+        return dict(cached)
+    try:
+        supabase = yield _CLIENT
+        res = yield supabase.table('customers').select('*').eq('id', customer_id).single()
     except Exception as exc:
         # supabase/postgrest may raise on invalid input (eg. bad UUID) or other API errors
         logging.exception('Supabase get_customer exception: %s', exc)
@@ -101,44 +607,45 @@ def get_customer(customer_id: str) -> Optional[Dict]:
     if getattr(res, 'error', None):
         logging.error('Supabase get_customer error: %s', res.error)
         return None
+    if res.data:
+        customer_cache.set(customer_id, dict(res.data))
     return res.data
 
 
+def _list_page(table: str, label: str, limit: Optional[int], cursor: Optional[str], fields: Fields, desc: bool = False):
+    """Flow: one keyset page of `table` as {'rows': [...], 'next_cursor': str | None}."""
+    supabase = yield _CLIENT
+    size = pagination.page_size(limit)
+    res = yield pagination.apply_keyset(supabase.table(table).select(select_columns(table, fields, ('id', 'created_at'))), cursor, size, desc=desc)
+    if getattr(res, 'error', None):
+        logging.error('Supabase %s error: %s', label, res.error)
+        return None
+    rows, next_cursor = pagination.split_page(res.data, size)
+    return {'rows': [project(r, fields) for r in rows], 'next_cursor': next_cursor}
+
+
+@_flow
+def list_customers(limit: Optional[int] = None, cursor: Optional[str] = None, fields: Fields = None) -> Optional[Dict]:
+    """Return one page of customers: {'rows': [...], 'next_cursor': str | None}."""
+    try:
+        return (yield from _list_page('customers', 'list_customers', limit, cursor, fields))
+    except Exception:
+        logging.exception('list_customers exception')
+        return None
+
+
+@_flow
 def create_invoice(record: Dict) -> Optional[Dict]:
     """
     Insert an invoice record and return the created invoice (as dict) or None on error.
     record: dict matching invoices table columns (invoice_number, customer_id, subtotal, cgst_amount, sgst_amount, igst_amount, total_tax, total_amount, currency, issued_by)
     This function does a best-effort insert and returns the inserted row.
     """
-    supabase = _get_supabase()
-    # Convert Decimal objects to floats for JSON/POST compatibility
-    # Also sanitize UUID-like fields (customer_id) to avoid DB errors when the caller provides
-    # invalid values (e.g. the string 'nonexistent' used in tests).
-    rec_sanitized = {}
-    for k, v in record.items():
-        # sanitize decimals
-        if isinstance(v, Decimal):
-            rec_sanitized[k] = float(v)
-            continue
-
-        # sanitize customer_id: ensure it's a valid UUID string, otherwise set to None
-        if k == 'customer_id' and v is not None:
-            try:
-                # accepts both uuid.UUID and string; will raise on invalid
-                if isinstance(v, str):
-                    uuid.UUID(v)
-                else:
-                    # not a string; try to coerce
-                    uuid.UUID(str(v))
-                rec_sanitized[k] = v
-            except Exception:
-                logging.warning('create_invoice: invalid customer_id provided, clearing field before insert: %s', v)
-                rec_sanitized[k] = None
-            continue
-
-        rec_sanitized[k] = v
     try:
-        res = supabase.table('invoices').insert(rec_sanitized).execute()
+        supabase = yield _CLIENT
+        # Decimals become floats and an invalid customer_id (eg. the string 'nonexistent' used
+        # in tests) is cleared, so the insert does not fail on it
+        res = yield supabase.table('invoices').insert(_sanitize_invoice_record(record))
     except Exception as exc:
         logging.exception('Supabase create_invoice exception: %s', exc)
         return None
@@ -146,28 +653,33 @@ def create_invoice(record: Dict) -> Optional[Dict]:
         logging.error('Supabase create_invoice error: %s', res.error)
         return None
     # res.data is typically a list of inserted rows
-    data = res.data
-    if isinstance(data, list):
-        return data[0] if data else None
-    return data
+    return _first_row(res.data)
 
 
+@_flow
 def delete_product(product_id: str) -> bool:
-    """Delete a product row by id. Returns True on success, False otherwise."""
-    supabase = _get_supabase()
+    """Delete a product row by id, falling back to archive / anonymize when it is still referenced.
+
+    Returns True on success, False otherwise.
+    """
+    try:
+        supabase = yield _CLIENT
+    except Exception:
+        logging.exception('delete_product: no database client')
+        return False
     # Attempt to delete the product row; handle APIError which may be raised on FK constraint
     try:
-        res = supabase.table('products').delete().eq('id', product_id).execute()
+        res = yield supabase.table('products').delete().eq('id', product_id)
         if getattr(res, 'error', None):
             logging.error('Supabase delete_product error: %s', res.error)
             # fall through to attempt soft-delete
         else:
+            product_cache.invalidate(product_id)
             return True
     except Exception as exc:
         # Postgrest raises APIError with DB error details; try to detect FK violation code
         msg = str(exc)
         logging.exception('Supabase delete_product exception: %s', exc)
-        # If it's a foreign key violation, attempt soft-delete
         if '23503' in msg or 'foreign key constraint' in msg or 'is still referenced' in msg:
             logging.info('Detected FK constraint preventing product deletion; attempting soft-delete for %s', product_id)
         else:
@@ -175,11 +687,12 @@ def delete_product(product_id: str) -> bool:
 
     # Soft-delete fallback: try archived flag first; if schema lacks it, perform a safe anonymize update
     try:
-        upd = supabase.table('products').update({'archived': True}).eq('id', product_id).execute()
+        upd = yield supabase.table('products').update({'archived': True}).eq('id', product_id)
         if getattr(upd, 'error', None):
             logging.error('Failed to soft-delete product %s via archived flag: %s', product_id, upd.error)
             # fall through to anonymize
         else:
+            product_cache.invalidate(product_id)
             return True
     except Exception as exc:
         # archived column may not exist in schema cache
@@ -187,319 +700,571 @@ def delete_product(product_id: str) -> bool:
 
     # Last-resort: perform a non-destructive anonymize update so product remains referenced but is inert and hidden.
     try:
-        # fetch current product to craft a new sku/name
-        cur = supabase.table('products').select('sku', 'name').eq('id', product_id).single().execute()
-        sku = None
-        name = None
-        if cur and cur.data:
-            sku = cur.data.get('sku')
-            name = cur.data.get('name')
+        cur = yield supabase.table('products').select('sku', 'name').eq('id', product_id).single()
+        sku = cur.data.get('sku') if cur and cur.data else None
+        name = cur.data.get('name') if cur and cur.data else None
         new_sku = (sku or 'DELETED') + '-DELETED-' + product_id.split('-')[0]
         new_name = (name or 'Deleted Product') + ' [deleted]'
-        upd2 = supabase.table('products').update({'sku': new_sku, 'name': new_name, 'price': 0.0, 'stock_qty': 0}).eq('id', product_id).execute()
+        upd2 = yield supabase.table('products').update({'sku': new_sku, 'name': new_name, 'price': 0.0}).eq('id', product_id)
         if getattr(upd2, 'error', None):
             logging.error('Failed to anonymize product %s during delete fallback: %s', product_id, upd2.error)
             return False
+        # the remaining stock is written off through the ledger
+        if not (yield _Call(set_stock_qty, product_id, 0, 'deleted')):
+            logging.warning('Could not write off the stock of anonymized product %s', product_id)
+        product_cache.invalidate(product_id)
         return True
     except Exception as exc:
         logging.exception('Anonymize fallback failed for product %s: %s', product_id, exc)
         return False
 
 
+@_flow
 def insert_invoice_items(invoice_id: str, items: List[Dict]) -> bool:
     """Insert multiple invoice items. items should be list of dicts with invoice_id included."""
     if not items:
         return True
-    supabase = _get_supabase()
-    # sanitize Decimal fields in items
-    sanitized = []
-    for it in items:
-        it_copy = {}
-        for k, v in it.items():
-            if isinstance(v, Decimal):
-                it_copy[k] = float(v)
-            else:
-                it_copy[k] = v
-        sanitized.append(it_copy)
+    rows = [_sanitize_decimals(it) for it in items]
     try:
-        res = supabase.table('invoice_items').insert(sanitized).execute()
+        supabase = yield _CLIENT
+        res = yield supabase.table('invoice_items').insert(rows)
     except Exception as exc:
-        logging.exception('Supabase insert_invoice_items exception: %s', exc)
-        return False
+        if not _is_missing_code_column(str(exc), 'tax_percent', 'invoice_items'):
+            logging.exception('Supabase insert_invoice_items exception: %s', exc)
+            return False
+        # invoice_items.tax_percent arrives with migration 0018; older schemas store lines without it
+        logging.warning('invoice_items.tax_percent column not present; inserting items without it. Apply migration 0018.')
+        try:
+            res = yield supabase.table('invoice_items').insert([{k: v for k, v in it.items() if k != 'tax_percent'} for it in rows])
+        except Exception:
+            logging.exception('Fallback insert_invoice_items without tax_percent also failed')
+            return False
     if getattr(res, 'error', None):
         logging.error('Supabase insert_invoice_items error: %s', res.error)
         return False
     return True
 
 
+@_flow
+def create_invoice_with_items(record: Dict, items: List[Dict]) -> Optional[Dict]:
+    """Insert an invoice and its items; returns the created invoice or None on error.
+
+    Uses the create_invoice_with_items RPC (migration 0025), which writes both in one
+    transaction, so no reader ever sees the invoice without its items. Without the RPC the
+    header and then the items are inserted as before.
+    """
+    try:
+        supabase = yield _CLIENT
+        res = yield supabase.rpc('create_invoice_with_items', {
+            'p_invoice': _sanitize_invoice_record(record),
+            'p_items': [_sanitize_decimals(it) for it in items],
+        })
+        if getattr(res, 'error', None):
+            logging.error('create_invoice_with_items RPC error: %s', res.error)
+            return None
+        return _first_row(res.data)
+    except Exception as exc:
+        if not _is_missing_rpc(exc):
+            logging.exception('create_invoice_with_items exception: %s', exc)
+            return None
+    logging.info('create_invoice_with_items RPC not installed; inserting the invoice and its items separately. Apply migration 0025.')
+    created = yield _Call(create_invoice, record)
+    if created and not (yield _Call(insert_invoice_items, created.get('id'), items)):
+        logging.warning('Invoice created but failed to insert items')
+    return created
+
+
+@_flow
 def decrement_product_stock(product_id: str, qty: int, allow_negative: bool = False) -> bool:
-    """Decrease product stock_qty by qty (best-effort).
+    """Decrease product stock_qty by qty.
 
-    If allow_negative is True, the resulting stock quantity may go below zero (oversell).
+    Uses the atomic apply_stock_lines RPC when installed (which also records the outbound
+    movement and refuses to go below available stock unless allow_negative). Otherwise falls
+    back to a best-effort compare-and-set update (`_add_stock_qty`); if allow_negative is True
+    the resulting stock quantity may go below zero (oversell).
     """
     try:
-        # Use rpc or update: fetch current, subtract, update
-        supabase = _get_supabase()
-        current = supabase.table('products').select('stock_qty').eq('id', product_id).single().execute()
-        if getattr(current, 'error', None) or not current.data:
-            logging.warning('Could not fetch product stock for %s', product_id)
-            return False
-        stock = int(current.data.get('stock_qty') or 0)
-        if allow_negative:
-            new_stock = stock - int(qty)
-        else:
-            new_stock = max(0, stock - int(qty))
-        upd = supabase.table('products').update({'stock_qty': new_stock}).eq('id', product_id).execute()
-        if getattr(upd, 'error', None):
-            logging.error('Supabase update stock error for %s: %s', product_id, upd.error)
+        result = yield _Call(apply_stock_lines, [_stock_line(product_id, -int(qty))], 'sale', reference_type='decrement', allow_negative=allow_negative)
+        if result is not None:
+            if not result.get('ok'):
+                logging.warning('Stock decrement rejected for %s: %s', product_id, result.get('reason'))
+                return False
+            return True
+
+        supabase = yield _CLIENT
+        if (yield from _add_stock_qty(supabase, product_id, -int(qty), clamp=not allow_negative)) is None:
             return False
+        product_cache.invalidate(product_id)
         return True
     except Exception as exc:
         logging.exception('decrement_product_stock exception: %s', exc)
         return False
 
 
-def get_invoice(invoice_id: str) -> Optional[Dict]:
-    """Fetch invoice with items and customer info. Returns dict or None."""
+# PostgREST resource embedding: the invoice, its items and its customer in one select
+INVOICE_EMBEDS = (('items', 'items:invoice_items(*)'), ('customer', 'customer:customers(*)'))
+
+
+def _invoice_detail_select(fields: Fields) -> str:
+    cols = [select_columns('invoices', fields, ('id',))]
+    cols += [embed for name, embed in INVOICE_EMBEDS if wants(fields, name)]
+    return ','.join(cols)
+
+
+def _is_missing_relationship(err) -> bool:
+    """True when PostgREST cannot embed a table (no foreign key in its schema cache)."""
+    msg = str(err)
+    return 'PGRST200' in msg or 'Could not find a relationship' in msg
+
+
+def _copy_invoice(invoice: Dict) -> Dict:
+    # callers (eg. the PDF renderer) modify items in place; never hand out the cached lists
+    out = dict(invoice)
+    if 'items' in out:
+        out['items'] = [dict(it) for it in out['items'] or []]
+    return out
+
+
+def _remember_invoice(invoice: Dict) -> None:
+    """Cache a fully read invoice. Its customer goes to the customer cache instead.
+
+    An invoice without items is not cached: it may have been read between the inserts of its
+    header and its items (when the create_invoice_with_items RPC is not installed).
+    """
+    if not invoice.get('items'):
+        return
+    customer = invoice.get('customer')
+    if customer and customer.get('id'):
+        customer_cache.set(customer['id'], dict(customer))
+    invoice_cache.set(invoice['id'], _copy_invoice({k: v for k, v in invoice.items() if k != 'customer'}))
+
+
+@_flow
+def get_invoice(invoice_id: str, fields: Fields = None) -> Optional[Dict]:
+    """Fetch invoice with items and customer info in one round trip. Returns dict or None.
+
+    Invoices are immutable once created, so full reads are kept in `invoice_cache` and repeat
+    reads need no query. With `fields`, only those invoice columns are read and the items /
+    customer embeds are left out unless requested.
+    """
+    cached = invoice_cache.get(invoice_id)
+    if cached is not MISSING:
+        invoice = _copy_invoice(cached)
+        if wants(fields, 'customer'):
+            invoice['customer'] = (yield _Call(get_customer, invoice['customer_id'])) if invoice.get('customer_id') else None
+        return project(invoice, fields)
     try:
-        supabase = _get_supabase()
-        inv_res = supabase.table('invoices').select('*').eq('id', invoice_id).single().execute()
+        supabase = yield _CLIENT
+        try:
+            inv_res = yield supabase.table('invoices').select(_invoice_detail_select(fields)).eq('id', invoice_id).single()
+        except Exception as exc:
+            if not _is_missing_relationship(exc):
+                raise
+            logging.info('Invoice relationships not in the PostgREST schema cache; reading items and customer separately')
+            return (yield from _get_invoice_separately(supabase, invoice_id, fields))
         if getattr(inv_res, 'error', None) or not inv_res.data:
             logging.warning('Invoice not found: %s', invoice_id)
             return None
         invoice = inv_res.data
-        items_res = supabase.table('invoice_items').select('*').eq('invoice_id', invoice_id).execute()
-        items = items_res.data if not getattr(items_res, 'error', None) else []
+        if fields is None:
+            _remember_invoice(invoice)
+        return project(invoice, fields)
+    except Exception as exc:
+        logging.exception('get_invoice exception: %s', exc)
+        return None
+
+
+def _get_invoice_separately(supabase, invoice_id: str, fields: Fields):
+    """`get_invoice` without embedding: the invoice and its items together, then the customer."""
+    inv_query = supabase.table('invoices').select(select_columns('invoices', fields, ('id',))).eq('id', invoice_id).single()
+    if wants(fields, 'items'):
+        inv_res, items_res = yield (inv_query, supabase.table('invoice_items').select('*').eq('invoice_id', invoice_id))
+    else:
+        inv_res, items_res = (yield inv_query), None
+    if getattr(inv_res, 'error', None) or not inv_res.data:
+        logging.warning('Invoice not found: %s', invoice_id)
+        return None
+    invoice = inv_res.data
+    if items_res is not None:
+        invoice['items'] = items_res.data if not getattr(items_res, 'error', None) else []
+    if wants(fields, 'customer'):
         customer = None
         if invoice.get('customer_id'):
-            cust_res = supabase.table('customers').select('*').eq('id', invoice.get('customer_id')).single().execute()
+            cust_res = yield supabase.table('customers').select('*').eq('id', invoice.get('customer_id')).single()
             if not getattr(cust_res, 'error', None):
                 customer = cust_res.data
-        invoice['items'] = items
         invoice['customer'] = customer
-        return invoice
-    except Exception as exc:
-        logging.exception('get_invoice exception: %s', exc)
-        return None
+    if fields is None:
+        _remember_invoice(invoice)
+    return project(invoice, fields)
 
 
-def list_invoices(limit: Optional[int] = None) -> Optional[List[Dict]]:
-    """Return a list of invoices. If limit is provided, limit the number of rows returned."""
+@_flow
+def list_invoices(limit: Optional[int] = None, cursor: Optional[str] = None, fields: Fields = None) -> Optional[Dict]:
+    """Return one page of invoices, newest first: {'rows': [...], 'next_cursor': str | None}."""
     try:
-        supabase = _get_supabase()
-        qb = supabase.table('invoices').select('*')
-        if limit:
-            # postgrest expects limit as int
-            qb = qb.limit(int(limit))
-        res = qb.execute()
-        if getattr(res, 'error', None):
-            logging.error('Supabase list_invoices error: %s', res.error)
-            return None
-        return res.data or []
+        return (yield from _list_page('invoices', 'list_invoices', limit, cursor, fields, desc=True))
     except Exception as exc:
         logging.exception('list_invoices exception: %s', exc)
         return None
 
 
-def create_customer(record: Dict) -> Optional[Dict]:
-    """Insert a customer record and return the created row or None on error."""
-    try:
-        supabase = _get_supabase()
-        rec = record.copy()
-        # ensure id exists as UUID for DB integrity
-        if not rec.get('id'):
-            rec['id'] = str(uuid.uuid4())
+def _attach_export_items(supabase, invoices: List[Dict], page_size: int):
+    """Attach invoice_items to one page of invoices, reading the items in id-ordered pages too."""
+    by_id = {inv['id']: inv for inv in invoices}
+    for inv in invoices:
+        inv['items'] = []
+    last_id = None
+    while by_id:
+        q = supabase.table('invoice_items').select('*').in_('invoice_id', list(by_id))
+        if last_id is not None:
+            q = q.gt('id', last_id)
+        res = yield q.order('id').limit(page_size)
+        if getattr(res, 'error', None):
+            raise RuntimeError(f'invoice_items export query failed: {res.error}')
+        rows = res.data or []
+        for item in rows:
+            by_id[item['invoice_id']]['items'].append(item)
+        if len(rows) < page_size:
+            return
+        last_id = rows[-1]['id']
+
+
+def _attach_export_customers(supabase, invoices: List[Dict]):
+    """Attach id/name/gstin/state of each invoice's customer with one `in_` query per page."""
+    ids = list({inv['customer_id'] for inv in invoices if inv.get('customer_id')})
+    by_id = {}
+    if ids:
+        res = yield supabase.table('customers').select('id,name,gstin,state').in_('id', ids)
+        if getattr(res, 'error', None):
+            raise RuntimeError(f'customers export query failed: {res.error}')
+        by_id = {c['id']: c for c in res.data or []}
+    for inv in invoices:
+        inv['customer'] = by_id.get(inv.get('customer_id'))
+
+
+def _created_between(q, start: Optional[str], end: Optional[str]):
+    if start:
+        q = q.gte('created_at', start)
+    if end:
+        q = q.lt('created_at', end)
+    return q
+
 
-        # Retry loop: compute next code and try to insert with code; on unique conflict, retry a few times
-        max_attempts = 5
-        for attempt in range(max_attempts):
-            code = _next_sequential_id('customers', 'CID')
-            rec_with_code = rec.copy()
-            rec_with_code['customer_code'] = code
+@_iter_flow
+def iter_invoice_export_pages(start: Optional[str] = None, end: Optional[str] = None, page_size: Optional[int] = None, customers: bool = False, cursor: Optional[str] = None):
+    """Yield lists of invoices (oldest first, items attached) with start <= created_at < end.
+
+    Pages are read with the (created_at, id) keyset, so only one page is held at a time.
+    With `customers`, each invoice also gets a `customer` dict (id, name, gstin, state).
+    `cursor` resumes after a previous page (`pagination.encode_cursor(page[-1])`).
+    Unlike the other reads this raises on a failed query: a silently truncated export is worse
+    than an aborted one.
+    """
+    size = page_size or export.EXPORT_PAGE_SIZE
+    supabase = yield _CLIENT
+    while True:
+        res = yield pagination.apply_keyset(_created_between(supabase.table('invoices').select('*'), start, end), cursor, size)
+        if getattr(res, 'error', None):
+            raise RuntimeError(f'invoice export query failed: {res.error}')
+        rows, cursor = pagination.split_page(res.data, size)
+        if rows:
+            yield from _attach_export_items(supabase, rows, size)
+            if customers:
+                yield from _attach_export_customers(supabase, rows)
+            yield _Page(rows)
+        if not cursor:
+            return
+
+
+@_iter_flow
+def iter_invoice_headers(invoice_ids: Optional[List[str]] = None, start: Optional[str] = None, end: Optional[str] = None, page_size: Optional[int] = None):
+    """Yield pages of {id, invoice_number, created_at}: the given ids (in chunks) or, without ids,
+    every invoice with start <= created_at < end in keyset order. Raises on query errors."""
+    size = page_size or export.EXPORT_PAGE_SIZE
+    supabase = yield _CLIENT
+    cols = 'id,invoice_number,created_at'
+    if invoice_ids is not None:
+        ids = list(dict.fromkeys(invoice_ids))
+        for i in range(0, len(ids), size):
+            res = yield supabase.table('invoices').select(cols).in_('id', ids[i:i + size])
+            if getattr(res, 'error', None):
+                raise RuntimeError(f'invoice header query failed: {res.error}')
+            if res.data:
+                yield _Page(res.data)
+        return
+    cursor = None
+    while True:
+        res = yield pagination.apply_keyset(_created_between(supabase.table('invoices').select(cols), start, end), cursor, size)
+        if getattr(res, 'error', None):
+            raise RuntimeError(f'invoice header query failed: {res.error}')
+        rows, cursor = pagination.split_page(res.data, size)
+        if rows:
+            yield _Page(rows)
+        if not cursor:
+            return
+
+
+def _insert_with_code(table: str, code_col: str, prefix: str, record: Dict):
+    """Flow: insert a customer/supplier with a generated code, retrying on code conflicts.
+
+    When the code column does not exist yet, insert without it and return the computed code.
+    """
+    supabase = yield _CLIENT
+    rec = record.copy()
+    # ensure id exists as UUID for DB integrity
+    if not rec.get('id'):
+        rec['id'] = str(uuid.uuid4())
+
+    max_attempts = 5
+    for attempt in range(max_attempts):
+        code = yield _Call(_next_sequential_id, table, prefix)
+        try:
+            res = yield supabase.table(table).insert({**rec, code_col: code})
+        except Exception as exc:
+            logging.exception('Supabase insert into %s exception: %s', table, exc)
+            if not _is_missing_code_column(str(exc), code_col, table):
+                return None
+            logging.warning('%s.%s column not present; inserting without code and returning computed code in response. Apply migration to persist codes.', table, code_col)
             try:
-                res = supabase.table('customers').insert(rec_with_code).execute()
-            except Exception as exc:
-                # If the DB/PostgREST reports that the column does not exist, fall back to inserting without the code
-                msg = str(exc)
-                logging.exception('Supabase create_customer exception on insert: %s', exc)
-                if 'customer_code' in msg or 'column customers.customer_code does not exist' in msg or 'Could not find the' in msg:
-                    logging.warning('customers.customer_code column not present; inserting without code and returning computed code in response. Apply migration to persist codes.')
-                    try:
-                        res2 = supabase.table('customers').insert(rec).execute()
-                    except Exception:
-                        logging.exception('Fallback insert without customer_code also failed')
-                        return None
-                    if getattr(res2, 'error', None):
-                        logging.error('Fallback create_customer insert error: %s', res2.error)
-                        return None
-                    data = res2.data
-                    if isinstance(data, list):
-                        out = data[0] if data else None
-                    else:
-                        out = data
-                    if out is not None and isinstance(out, dict):
-                        out['customer_code'] = code
-                    return out
+                res2 = yield supabase.table(table).insert(rec)
+            except Exception:
+                logging.exception('Fallback insert without %s also failed', code_col)
                 return None
-            if getattr(res, 'error', None):
-                # detect unique constraint on customer_code and retry
-                err = res.error
-                logging.error('Supabase create_customer error (attempt %s): %s', attempt + 1, err)
-                if isinstance(err, dict) and 'message' in err and 'duplicate' in err['message'].lower():
-                    # conflict on code, retry
-                    continue
+            if getattr(res2, 'error', None):
+                logging.error('Fallback insert into %s error: %s', table, res2.error)
                 return None
-            data = res.data
-            if isinstance(data, list):
-                out = data[0] if data else None
-            else:
-                out = data
-            if out is not None and isinstance(out, dict):
-                out['customer_code'] = code
+            out = _first_row(res2.data)
+            if isinstance(out, dict):
+                out[code_col] = code
             return out
-        logging.error('Failed to create customer after %s attempts due to code conflicts', max_attempts)
-        return None
+        if getattr(res, 'error', None):
+            err = res.error
+            logging.error('Supabase insert into %s error (attempt %s): %s', table, attempt + 1, err)
+            # a unique conflict on the code: retry with the next one
+            if isinstance(err, dict) and 'message' in err and 'duplicate' in err['message'].lower():
+                continue
+            return None
+        out = _first_row(res.data)
+        if isinstance(out, dict):
+            out[code_col] = code
+        return out
+    logging.error('Failed to insert into %s after %s attempts due to code conflicts', table, max_attempts)
+    return None
+
+
+@_flow
+def create_customer(record: Dict) -> Optional[Dict]:
+    """Insert a customer record and return the created row or None on error."""
+    try:
+        return (yield from _insert_with_code('customers', 'customer_code', 'CID', record))
     except Exception as exc:
         logging.exception('Supabase create_customer exception: %s', exc)
         return None
 
 
-def list_suppliers() -> Optional[List[Dict]]:
+@_flow
+def list_suppliers(limit: Optional[int] = None, cursor: Optional[str] = None, fields: Fields = None) -> Optional[Dict]:
+    """Return one page of suppliers: {'rows': [...], 'next_cursor': str | None}."""
     try:
-        supabase = _get_supabase()
-        res = supabase.table('suppliers').select('*').execute()
-        if getattr(res, 'error', None):
-            logging.error('Supabase list_suppliers error: %s', res.error)
-            return None
-        return res.data or []
+        return (yield from _list_page('suppliers', 'list_suppliers', limit, cursor, fields))
     except Exception:
         logging.exception('list_suppliers exception')
         return None
 
 
+@_flow
 def create_supplier(record: Dict) -> Optional[Dict]:
     try:
-        supabase = _get_supabase()
-        rec = record.copy()
-        if not rec.get('id'):
-            rec['id'] = str(uuid.uuid4())
-
-        max_attempts = 5
-        for attempt in range(max_attempts):
-            code = _next_sequential_id('suppliers', 'SID')
-            rec_with_code = rec.copy()
-            rec_with_code['supplier_code'] = code
-            try:
-                res = supabase.table('suppliers').insert(rec_with_code).execute()
-            except Exception as exc:
-                msg = str(exc)
-                logging.exception('Supabase create_supplier exception on insert: %s', exc)
-                if 'supplier_code' in msg or 'column suppliers.supplier_code does not exist' in msg or 'Could not find the' in msg:
-                    logging.warning('suppliers.supplier_code column not present; inserting without code and returning computed code in response. Apply migration to persist codes.')
-                    try:
-                        res2 = supabase.table('suppliers').insert(rec).execute()
-                    except Exception:
-                        logging.exception('Fallback insert without supplier_code also failed')
-                        return None
-                    if getattr(res2, 'error', None):
-                        logging.error('Fallback create_supplier insert error: %s', res2.error)
-                        return None
-                    data = res2.data
-                    if isinstance(data, list):
-                        out = data[0] if data else None
-                    else:
-                        out = data
-                    if out is not None and isinstance(out, dict):
-                        out['supplier_code'] = code
-                    return out
-                return None
-            if getattr(res, 'error', None):
-                err = res.error
-                logging.error('Supabase create_supplier error (attempt %s): %s', attempt + 1, err)
-                if isinstance(err, dict) and 'message' in err and 'duplicate' in err['message'].lower():
-                    continue
-                return None
-            data = res.data
-            if isinstance(data, list):
-                out = data[0] if data else None
-            else:
-                out = data
-            if out is not None and isinstance(out, dict):
-                out['supplier_code'] = code
-            return out
-        logging.error('Failed to create supplier after %s attempts due to code conflicts', max_attempts)
-        return None
+        return (yield from _insert_with_code('suppliers', 'supplier_code', 'SID', record))
     except Exception as exc:
         logging.exception('Supabase create_supplier exception: %s', exc)
         return None
 
 
+def _purchase_movements(items: List[Dict], supplier_id: Optional[str], received_by: Optional[str]) -> List[Dict]:
+    """stock_movements rows for a purchase recorded without the stock RPCs (one bulk insert)."""
+    return [_sanitize_decimals({
+        'product_id': it.get('product_id'),
+        'change': int(it.get('qty', 0)),
+        'reason': 'purchase',
+        'reference_type': 'supplier',
+        'reference_id': supplier_id,
+        'unit_cost': it.get('unit_cost'),
+        'created_by': received_by,
+    }) for it in items]
+
+
+def _stock_deltas(movements: List[Dict]) -> Dict[str, int]:
+    """Summed stock change per product, so each product row is updated once."""
+    deltas: Dict[str, int] = {}
+    for mv in movements:
+        deltas[mv['product_id']] = deltas.get(mv['product_id'], 0) + int(mv['change'])
+    return deltas
+
+
+# Attempts of `_add_stock_qty` before it gives up on a product whose stock keeps changing.
+STOCK_UPDATE_RETRIES = int(os.getenv('STOCK_UPDATE_RETRIES', '5'))
+
+
+def _add_stock_qty(supabase, product_id: str, change: int, stock: Optional[int] = None, clamp: bool = False):
+    """Flow helper for the fallbacks without stock RPCs: add `change` to products.stock_qty.
+
+    PostgREST cannot express `stock_qty = stock_qty + change`, so the update only applies while
+    stock_qty still has the value it was computed from (`stock`, when the caller already read
+    it) and is retried on a fresh read when another writer changed it first; no update is lost.
+    With `clamp` the stock does not go below zero. Returns the new stock_qty, or None when the
+    product is missing or the update failed.
+    """
+    for _ in range(STOCK_UPDATE_RETRIES):
+        if stock is None:
+            cur = yield supabase.table('products').select('stock_qty').eq('id', product_id).single()
+            if getattr(cur, 'error', None) or not cur.data:
+                logging.warning('Could not fetch product stock for %s', product_id)
+                return None
+            stock = int(cur.data.get('stock_qty') or 0)
+        new_stock = max(0, stock + change) if clamp else stock + change
+        upd = yield supabase.table('products').update({'stock_qty': new_stock}).eq('id', product_id).eq('stock_qty', stock)
+        if getattr(upd, 'error', None):
+            logging.error('Supabase update stock error for %s: %s', product_id, upd.error)
+            return None
+        if upd.data:
+            return new_stock
+        stock = None
+    logging.error('products.stock_qty of %s kept changing; gave up after %s attempts', product_id, STOCK_UPDATE_RETRIES)
+    return None
+
+
+@_flow
 def apply_purchase(supplier_id: str, items: List[Dict], received_by: Optional[str] = None) -> Optional[Dict]:
-    """Record a purchase and increase product stock. Returns movement record or None on error."""
+    """Record a purchase and increase product stock.
+
+    With the record_purchase RPC (migration 0024) the `purchases` header, every movement (one
+    bulk insert) and the stock increase commit in one transaction, and an unknown product
+    rejects the whole purchase. Returns {'status': 'ok', 'purchase_id': ..., 'purchase': {...}}
+    or None on error; purchase_id is None when the purchases table is not installed yet.
+    Status 'partial' (fallback path only) means the movements were recorded but the stock of
+    `failed_product_ids` was not updated.
+    """
     try:
-        supabase = _get_supabase()
-        # insert a purchase record in purchases table if exists (best-effort); otherwise just update stock
-        for it in items:
-            pid = it.get('product_id')
-            qty = int(it.get('qty', 0))
-            # create stock movement (positive change)
-            mv = create_stock_movement(pid, int(qty), 'purchase', reference_type='supplier', reference_id=supplier_id, unit_cost=it.get('unit_cost'), created_by=received_by)
-            if not mv:
-                logging.error('Failed to create stock movement for purchase of %s qty %s', pid, qty)
+        purchase_id = str(uuid.uuid4())
+        lines = [_stock_line(it.get('product_id'), int(it.get('qty', 0)), it.get('unit_cost')) for it in items]
+        result = yield _Call(_call_stock_rpc, 'record_purchase', {'p_lines': lines, 'p_supplier_id': supplier_id, 'p_received_by': received_by, 'p_purchase_id': purchase_id})
+        if result is None:
+            # before migration 0024 there is no header: movements reference the supplier
+            purchase_id = None
+            result = yield _Call(apply_stock_lines, lines, 'purchase', reference_type='supplier', reference_id=supplier_id, created_by=received_by, allow_negative=True)
+        if result is not None:
+            if not result.get('ok'):
+                logging.error('apply_purchase rejected: %s (product %s)', result.get('reason'), result.get('product_id'))
                 return None
-        return {'status': 'ok'}
+            return {'status': 'ok', 'purchase_id': purchase_id, 'purchase': result.get('purchase')}
+
+        # validate every referenced product up front with one query so a bad line
+        # does not leave the earlier lines of the purchase half-applied
+        products = yield _Call(get_products_bulk, [it.get('product_id') for it in items], use_cache=False)
+        if products is None:
+            logging.error('apply_purchase: could not load products for purchase')
+            return None
+        missing = [it.get('product_id') for it in items if it.get('product_id') not in products]
+        if missing:
+            logging.error('apply_purchase: unknown products %s', missing)
+            return None
+        supabase = yield _CLIENT
+        movements = _purchase_movements(items, supplier_id, received_by)
+        res = yield supabase.table('stock_movements').insert(movements)
+        if getattr(res, 'error', None):
+            logging.error('apply_purchase: stock movement insert failed: %s', res.error)
+            return None
+        failed = []
+        for pid, change in _stock_deltas(movements).items():
+            stock = int(products[pid].get('stock_qty') or 0)
+            if (yield from _add_stock_qty(supabase, pid, change, stock)) is None:
+                failed.append(pid)
+        _forget_products(movements)
+        if failed:
+            # the movements are committed, so retrying the purchase would record them twice
+            logging.error('apply_purchase: movements recorded but products.stock_qty not updated for %s', failed)
+            return {'status': 'partial', 'purchase_id': None, 'purchase': None, 'failed_product_ids': failed}
+        return {'status': 'ok', 'purchase_id': None, 'purchase': None}
     except Exception as exc:
         logging.exception('apply_purchase exception: %s', exc)
         return None
 
 
+@_flow
 def apply_sale(customer_id: Optional[str], items: List[Dict], issued_by: Optional[str] = None, allow_oversale: bool = False) -> Optional[Dict]:
-    """Record a sale: create invoice-like movement and decrement stock. Returns summary or None."""
+    """Record a sale: one atomic apply_stock_lines call, or reserve/consume (or decrement) per line."""
     try:
+        # one atomic round trip when the stock RPCs are installed: availability is checked and
+        # every line decremented under row locks, so concurrent sales cannot oversell
+        lines = [_stock_line(it.get('product_id'), -int(it.get('qty', 0))) for it in items]
+        result = yield _Call(apply_stock_lines, lines, 'sale', reference_type='customer', reference_id=customer_id, created_by=issued_by, allow_negative=allow_oversale)
+        if result is not None:
+            if not result.get('ok'):
+                logging.error('apply_sale rejected: %s (product %s, available %s)', result.get('reason'), result.get('product_id'), result.get('available'))
+                return None
+            return {'status': 'ok'}
+
+        # Load all products in one round trip: reject unknown products and obviously
+        # insufficient stock before any reservation is written.
+        products = yield _Call(get_products_bulk, [it.get('product_id') for it in items], use_cache=False)
+        if products is None:
+            logging.error('apply_sale: could not load products for sale')
+            return None
+        wanted: Dict[str, int] = {}
+        for it in items:
+            pid = it.get('product_id')
+            if pid not in products:
+                logging.error('apply_sale: unknown product %s', pid)
+                return None
+            wanted[pid] = wanted.get(pid, 0) + int(it.get('qty', 0))
+        if not allow_oversale:
+            for pid, qty in wanted.items():
+                on_hand = int(products[pid].get('stock_qty') or 0)
+                if on_hand < qty:
+                    logging.error('Insufficient stock for product %s: need %s on hand %s', pid, qty, on_hand)
+                    return None
+
         # Similar to invoice creation: reserve/consume or decrement
         reservations = []
         for it in items:
             pid = it.get('product_id')
             qty = int(it.get('qty', 0))
-            # attempt reservation
-            res = reserve_stock(pid, qty, None, None, issued_by)
+            res = yield _Call(reserve_stock, pid, qty, None, default_reservation_expiry(), issued_by)
             if res is None:
                 # try oversell decrement
-                decremented = decrement_product_stock(pid, qty, allow_negative=allow_oversale)
+                decremented = yield _Call(decrement_product_stock, pid, qty, allow_negative=allow_oversale)
                 if not decremented:
-                    # rollback any previous reservations
-                    for r in reservations:
-                        try:
-                            release_reservation(r.get('id'), 'sale-abort')
-                        except Exception:
-                            logging.exception('Failed to release reservation')
+                    # roll back the earlier reservations
+                    yield tuple(_Call(release_reservation, r.get('id'), 'sale-abort') for r in reservations)
                     logging.error('Insufficient stock for product %s', pid)
                     return None
             else:
                 reservations.append(res)
 
-        # consume reservations
+        # consumed one at a time: lines for the same product would race on products.stock_qty
         for r in reservations:
-            consume_reservation(r.get('id'), issued_by)
-
+            yield _Call(consume_reservation, r.get('id'), issued_by)
         return {'status': 'ok'}
     except Exception as exc:
         logging.exception('apply_sale exception: %s', exc)
         return None
 
 
-def list_product_variables(vtype: str) -> Optional[List[str]]:
+@_flow
+def list_product_variables(vtype: str) -> Optional[Dict]:
     try:
-        supabase = _get_supabase()
+        supabase = yield _CLIENT
         # Some versions of the supabase client have different .order() signatures.
         # To be robust, fetch relevant columns and sort in Python.
-        # Try to include the `enabled` column and filter enabled entries when possible.
+        cols = 'value, value_num, sort_order, created_at, enabled'
         try:
             # attempt to filter by enabled true (newer schema)
-            res = supabase.table('product_variables').select('value, value_num, sort_order, created_at, enabled').eq('vtype', vtype).eq('enabled', True).execute()
+            res = yield supabase.table('product_variables').select(cols).eq('vtype', vtype).eq('enabled', True)
         except Exception:
             # fallback: schema may not have `enabled`, select without filter
-            res = supabase.table('product_variables').select('value, value_num, sort_order, created_at, enabled').eq('vtype', vtype).execute()
+            res = yield supabase.table('product_variables').select(cols).eq('vtype', vtype)
         if getattr(res, 'error', None):
             logging.error('list_product_variables error: %s', res.error)
             return None
@@ -509,11 +1274,9 @@ def list_product_variables(vtype: str) -> Optional[List[str]]:
             rows_sorted = sorted(rows, key=lambda r: (r.get('sort_order') or 0, r.get('created_at') or ''))
         except Exception:
             rows_sorted = rows
-        # Return rows (as dicts) so callers can inspect enabled/value_num etc.
         # Also attach the vtype-enabled flag (if present) so callers can know if the whole type is enabled.
         try:
-            tv = supabase.table('product_variable_types').select('enabled').eq('vtype', vtype).single().execute()
-            vtype_enabled = True
+            tv = yield supabase.table('product_variable_types').select('enabled').eq('vtype', vtype).single()
             if getattr(tv, 'error', None) or not tv.data:
                 vtype_enabled = True
             else:
@@ -526,9 +1289,10 @@ def list_product_variables(vtype: str) -> Optional[List[str]]:
         return None
 
 
+@_flow
 def upsert_product_variable(vtype: str, value: str) -> Optional[Dict]:
     try:
-        supabase = _get_supabase()
+        supabase = yield _CLIENT
         # best-effort: insert and ignore duplicates
         payload = {'vtype': vtype, 'value': value, 'enabled': True}
         if vtype == 'gst':
@@ -539,35 +1303,27 @@ def upsert_product_variable(vtype: str, value: str) -> Optional[Dict]:
                 # leave value_num null if parsing fails
                 pass
         try:
-            res = supabase.table('product_variables').insert(payload).execute()
+            res = yield supabase.table('product_variables').insert(payload)
         except Exception as exc:
-            msg = str(exc)
-            # fallback: some Supabase/PostgREST instances may not have value_num column yet.
-            if 'value_num' in msg or "Could not find the 'value_num'" in msg:
-                try:
-                    # remove value_num and retry
-                    payload.pop('value_num', None)
-                    res = supabase.table('product_variables').insert(payload).execute()
-                except Exception:
-                    raise
-            else:
+            # some Supabase/PostgREST instances may not have the value_num column yet
+            if 'value_num' not in str(exc):
                 raise
+            payload.pop('value_num', None)
+            res = yield supabase.table('product_variables').insert(payload)
         if getattr(res, 'error', None):
             logging.error('upsert_product_variable error: %s', res.error)
             return None
-        data = res.data
-        if isinstance(data, list):
-            return data[0] if data else None
-        return data
+        return _first_row(res.data)
     except Exception:
         logging.exception('upsert_product_variable exception')
         return None
 
 
+@_flow
 def delete_product_variable(vtype: str, value: str) -> bool:
     try:
-        supabase = _get_supabase()
-        res = supabase.table('product_variables').delete().eq('vtype', vtype).eq('value', value).execute()
+        supabase = yield _CLIENT
+        res = yield supabase.table('product_variables').delete().eq('vtype', vtype).eq('value', value)
         if getattr(res, 'error', None):
             logging.error('delete_product_variable error: %s', res.error)
             return False
@@ -577,11 +1333,12 @@ def delete_product_variable(vtype: str, value: str) -> bool:
         return False
 
 
+@_flow
 def update_product_variable_enabled(vtype: str, value: str, enabled: bool) -> bool:
     """Set the enabled flag on a product variable row identified by vtype+value."""
     try:
-        supabase = _get_supabase()
-        res = supabase.table('product_variables').update({'enabled': bool(enabled)}).eq('vtype', vtype).eq('value', value).execute()
+        supabase = yield _CLIENT
+        res = yield supabase.table('product_variables').update({'enabled': bool(enabled)}).eq('vtype', vtype).eq('value', value)
         if getattr(res, 'error', None):
             logging.error('update_product_variable_enabled error: %s', res.error)
             return False
@@ -591,20 +1348,21 @@ def update_product_variable_enabled(vtype: str, value: str, enabled: bool) -> bo
         return False
 
 
+@_flow
 def set_product_variable_type_enabled(vtype: str, enabled: bool) -> bool:
     """Enable or disable an entire variable type (e.g., company, variant, gst)."""
     try:
-        supabase = _get_supabase()
-        # Upsert into product_variable_types
+        supabase = yield _CLIENT
+        row = {'vtype': vtype, 'enabled': bool(enabled)}
         try:
-            res = supabase.table('product_variable_types').upsert({'vtype': vtype, 'enabled': bool(enabled)}).execute()
+            yield supabase.table('product_variable_types').upsert(row)
         except Exception:
             # Fallback: try update then insert
             try:
-                res = supabase.table('product_variable_types').update({'enabled': bool(enabled)}).eq('vtype', vtype).execute()
+                res = yield supabase.table('product_variable_types').update({'enabled': bool(enabled)}).eq('vtype', vtype)
                 if getattr(res, 'error', None):
                     # insert if update did not find a row
-                    res2 = supabase.table('product_variable_types').insert({'vtype': vtype, 'enabled': bool(enabled)}).execute()
+                    yield supabase.table('product_variable_types').insert(row)
             except Exception:
                 logging.exception('set_product_variable_type_enabled upsert fallback failed')
                 return False
@@ -614,6 +1372,7 @@ def set_product_variable_type_enabled(vtype: str, enabled: bool) -> bool:
         return False
 
 
+@_flow
 def list_product_variable_types_all() -> Dict[str, bool]:
     """Return a mapping of vtype -> enabled (bool) for all known variable types.
 
@@ -621,18 +1380,17 @@ def list_product_variable_types_all() -> Dict[str, bool]:
     """
     defaults = { 'company': True, 'variant': True, 'gst': True, 'type': True }
     try:
-        supabase = _get_supabase()
+        supabase = yield _CLIENT
         try:
-            res = supabase.table('product_variable_types').select('vtype, enabled').execute()
+            res = yield supabase.table('product_variable_types').select('vtype, enabled')
         except Exception:
             # table may not exist on older DB; return defaults
             return defaults
         if getattr(res, 'error', None):
             logging.error('list_product_variable_types_all error: %s', res.error)
             return defaults
-        rows = res.data or []
         out = {}
-        for r in rows:
+        for r in (res.data or []):
             if not r or not isinstance(r, dict):
                 continue
             vt = r.get('vtype')
@@ -648,94 +1406,71 @@ def list_product_variable_types_all() -> Dict[str, bool]:
         return defaults
 
 
+@_flow
 def update_customer(customer_id: str, changes: Dict) -> Optional[Dict]:
     """Perform partial update on customer record and return updated row or None."""
     try:
-        supabase = _get_supabase()
-        # sanitize if Decimal present (unlikely for customer)
-        rec = {}
-        for k, v in changes.items():
-            if isinstance(v, Decimal):
-                rec[k] = float(v)
-            else:
-                rec[k] = v
-        res = supabase.table('customers').update(rec).eq('id', customer_id).execute()
+        supabase = yield _CLIENT
+        res = yield supabase.table('customers').update(_sanitize_decimals(changes)).eq('id', customer_id)
         if getattr(res, 'error', None):
             logging.error('Supabase update_customer error: %s', res.error)
             return None
-        data = res.data
-        if isinstance(data, list):
-            return data[0] if data else None
-        return data
+        customer_cache.invalidate(customer_id)
+        return _first_row(res.data)
     except Exception as exc:
         logging.exception('update_customer exception: %s', exc)
         return None
 
 
+@_flow
 def delete_customer(customer_id: str) -> bool:
     """Delete a customer by id. Returns True on success, False otherwise."""
     try:
-        supabase = _get_supabase()
-        res = supabase.table('customers').delete().eq('id', customer_id).execute()
+        supabase = yield _CLIENT
+        res = yield supabase.table('customers').delete().eq('id', customer_id)
         if getattr(res, 'error', None):
             logging.error('Supabase delete_customer error: %s', res.error)
             return False
+        customer_cache.invalidate(customer_id)
         return True
     except Exception:
         logging.exception('delete_customer exception')
         return False
 
 
+@_flow
 def create_product(record: Dict) -> Optional[Dict]:
     """Insert a product record and return the created row or None on error. Uses UID... ids."""
     try:
-        supabase = _get_supabase()
+        supabase = yield _CLIENT
         rec = record.copy()
         # If caller provided a `meta` object, extract well-known product variables
         # into top-level columns so we don't persist JSONB meta anymore.
-        meta = rec.get('meta')
+        meta = rec.pop('meta', None)
         if meta:
-            # meta may be a JSON string in some clients
-            if isinstance(meta, str):
-                try:
-                    import json
-                    meta = json.loads(meta)
-                except Exception:
-                    meta = None
-            if isinstance(meta, dict):
-                for fld in ('company', 'variant', 'type', 'selling_price', 'p_code', 'product_code'):
-                    if fld in meta and meta.get(fld) is not None:
-                        # convert selling_price decimals to float when needed
-                        if fld == 'selling_price':
-                            val = meta.get(fld)
-                            if isinstance(val, Decimal):
-                                rec[fld] = float(val)
-                            else:
-                                rec[fld] = val
-                        else:
-                            rec[fld] = meta.get(fld)
-            # Always drop 'meta' from the payload to avoid writing JSONB into products table
-            rec.pop('meta', None)
+            rec.update(_meta_to_columns(meta))
         if not rec.get('id'):
             rec['id'] = str(uuid.uuid4())
-        # sanitize Decimal fields
-        for k, v in list(rec.items()):
-            if isinstance(v, Decimal):
-                rec[k] = float(v)
+        # opening stock is recorded as a stock movement below, so the ledger accounts for it
+        opening = int(rec.pop('stock_qty', 0) or 0)
         # Single-attempt insert: we no longer write a JSONB `meta` column for products.
         try:
-            res = supabase.table('products').insert(rec).execute()
+            res = yield supabase.table('products').insert(_sanitize_decimals(rec))
         except Exception as exc:
             logging.exception('Supabase create_product exception on insert: %s', exc)
             return None
-
         if getattr(res, 'error', None):
             logging.error('Supabase create_product returned error: %s', res.error)
             return None
-        data = res.data
-        out = data[0] if isinstance(data, list) and data else data
+        out = _first_row(res.data)
+        if opening and isinstance(out, dict):
+            moved = yield _Call(create_stock_movement, out['id'], opening, 'opening', 'product', out['id'])
+            if moved is None:
+                logging.error('create_product: opening stock of %s for %s was not recorded', opening, out['id'])
+            else:
+                out['stock_qty'] = opening
         # prefer returning UID if it already exists in top-level p_code/product_code
-        if out is not None and isinstance(out, dict):
+        if isinstance(out, dict):
             if out.get('p_code'):
                 out['product_code'] = out.get('p_code')
             elif out.get('product_code'):
@@ -746,175 +1481,179 @@ def create_product(record: Dict) -> Optional[Dict]:
         return None
 
 
-def list_products() -> Optional[List[Dict]]:
-    """Return products list and compute server-side total_price (price + gst)."""
+@_flow
+def list_products(limit: Optional[int] = None, cursor: Optional[str] = None, fields: Fields = None) -> Optional[Dict]:
+    """Return one page of products with server-side total_price (price + gst).
+
+    Anonymized deletions are filtered after the fetch, so a page may hold fewer than `limit`
+    rows while `next_cursor` is still set. total_price is only computed when requested.
+    """
     try:
-        supabase = _get_supabase()
+        supabase = yield _CLIENT
+        size = pagination.page_size(limit)
+        cols = select_columns('products', fields, ('id', 'created_at', 'name'))
         # Prefer to exclude archived products if the column exists
         try:
-            res = supabase.table('products').select('*').neq('archived', True).execute()
+            res = yield pagination.apply_keyset(supabase.table('products').select(cols).neq('archived', True), cursor, size)
         except Exception:
             # If the archived column does not exist, fall back to selecting all and filter anonymized deletions
             logging.debug('products.archived column not present; returning non-deleted products by name marker.')
-            res = supabase.table('products').select('*').execute()
+            res = yield pagination.apply_keyset(supabase.table('products').select(cols), cursor, size)
         if getattr(res, 'error', None):
             logging.error('Supabase list_products error: %s', res.error)
             return None
-        rows = res.data or []
+        rows, next_cursor = pagination.split_page(res.data, size)
         out = []
         for r in rows:
             prod = r.copy() if isinstance(r, dict) else dict(r)
             # Skip anonymized deleted products (name marker)
-            nm = prod.get('name')
-            if isinstance(nm, str) and nm.endswith(' [deleted]'):
+            if _is_deleted_marker(prod):
                 continue
-            price = prod.get('price')
-            tax = prod.get('tax_percent')
-            try:
-                if price is None:
-                    prod['total_price'] = None
-                else:
-                    # coerce to float for JSON friendliness
-                    p = float(price) if not isinstance(price, Decimal) else float(price)
-                    t = float(tax) if tax is not None else 0.0
-                    prod['total_price'] = round(p + (p * (t / 100.0)), 2)
-            except Exception:
-                prod['total_price'] = None
-            out.append(prod)
-        return out
+            if wants(fields, 'total_price'):
+                prod = _with_total_price(prod)
+            out.append(project(prod, fields))
+        return {'rows': out, 'next_cursor': next_cursor}
     except Exception:
         logging.exception('list_products exception')
         return None
 
 
-def list_archived_products() -> Optional[List[Dict]]:
-    """Return products that are archived or anonymized (name ends with ' [deleted]')."""
+@_flow
+def list_archived_products(limit: Optional[int] = None, cursor: Optional[str] = None, fields: Fields = None) -> Optional[Dict]:
+    """Return one page of products that are archived or anonymized (name ends with ' [deleted]')."""
     try:
-        supabase = _get_supabase()
+        supabase = yield _CLIENT
+        size = pagination.page_size(limit)
+        cols = select_columns('products', fields, ('id', 'created_at', 'name', 'archived'))
         try:
-            res = supabase.table('products').select('*').eq('archived', True).execute()
+            res = yield pagination.apply_keyset(supabase.table('products').select(cols).eq('archived', True), cursor, size)
         except Exception:
             # archived column missing: select all and filter name markers
-            res = supabase.table('products').select('*').execute()
+            res = yield pagination.apply_keyset(supabase.table('products').select(select_columns('products', fields, ('id', 'created_at', 'name'))), cursor, size)
         if getattr(res, 'error', None):
             logging.error('Supabase list_archived_products error: %s', res.error)
             return None
-        rows = res.data or []
+        rows, next_cursor = pagination.split_page(res.data, size)
         out = []
         for r in rows:
             prod = r.copy() if isinstance(r, dict) else dict(r)
-            nm = prod.get('name')
-            if prod.get('archived') is True or (isinstance(nm, str) and nm.endswith(' [deleted]')):
-                out.append(prod)
-        return out
+            if prod.get('archived') is True or _is_deleted_marker(prod):
+                out.append(project(prod, fields))
+        return {'rows': out, 'next_cursor': next_cursor}
     except Exception:
         logging.exception('list_archived_products exception')
         return None
 
 
+@_flow
 def undelete_product(product_id: str) -> bool:
     """Attempt to reverse anonymize/archived markers on a product. Returns True on success."""
     try:
-        supabase = _get_supabase()
+        supabase = yield _CLIENT
         # If archived column exists, simply set it to False
         try:
-            upd = supabase.table('products').update({'archived': False}).eq('id', product_id).execute()
+            upd = yield supabase.table('products').update({'archived': False}).eq('id', product_id)
             if not getattr(upd, 'error', None) and upd.data:
+                product_cache.invalidate(product_id)
                 return True
         except Exception:
             # archived column may not exist; fall back to try to revert anonymize pattern in name/sku
             pass
 
         # Fetch current product to try to restore name/sku where possible. Note: we can't know original values reliably
-        cur = supabase.table('products').select('sku', 'name').eq('id', product_id).single().execute()
+        cur = yield supabase.table('products').select('sku', 'name').eq('id', product_id).single()
         if getattr(cur, 'error', None) or not cur.data:
             logging.warning('undelete_product: product not found %s', product_id)
             return False
         sku = cur.data.get('sku')
         name = cur.data.get('name')
         # Attempt best-effort revert: remove ' [deleted]' suffix from name and strip '-DELETED-<idprefix>' from sku
-        new_name = name
-        if isinstance(name, str) and name.endswith(' [deleted]'):
-            new_name = name[:-10]
-        new_sku = sku
-        if isinstance(sku, str) and '-DELETED-' in sku:
-            new_sku = sku.split('-DELETED-')[0]
-        upd2 = supabase.table('products').update({'sku': new_sku, 'name': new_name}).eq('id', product_id).execute()
+        new_name = name[:-10] if isinstance(name, str) and name.endswith(' [deleted]') else name
+        new_sku = sku.split('-DELETED-')[0] if isinstance(sku, str) and '-DELETED-' in sku else sku
+        upd2 = yield supabase.table('products').update({'sku': new_sku, 'name': new_name}).eq('id', product_id)
         if getattr(upd2, 'error', None):
             logging.error('undelete_product failed update: %s', upd2.error)
             return False
+        product_cache.invalidate(product_id)
         return True
     except Exception as exc:
         logging.exception('undelete_product exception: %s', exc)
         return False
 
 
+@_flow
 def update_product(product_id: str, changes: Dict) -> Optional[Dict]:
-    """Perform partial update on product record with graceful fallback for missing columns like meta."""
+    """Perform partial update on product record, extracting legacy `meta` values into columns.
+
+    A new stock_qty is applied through set_stock_qty, which records the difference as a movement.
+    """
     try:
-        supabase = _get_supabase()
-        # Build the update payload, extracting any known product variables from a provided `meta` key
+        supabase = yield _CLIENT
         rec = {}
         # If caller sent a meta payload, extract known fields into top-level columns
-        meta = None
-        if 'meta' in changes:
-            meta = changes.get('meta')
+        meta = changes.get('meta')
         if meta:
-            if isinstance(meta, str):
-                try:
-                    import json
-                    meta = json.loads(meta)
-                except Exception:
-                    meta = None
-            if isinstance(meta, dict):
-                for fld in ('company', 'variant', 'type', 'selling_price', 'p_code', 'product_code'):
-                    if fld in meta and meta.get(fld) is not None:
-                        if fld == 'selling_price' and isinstance(meta.get(fld), Decimal):
-                            rec[fld] = float(meta.get(fld))
-                        else:
-                            rec[fld] = meta.get(fld)
-
+            rec.update(_meta_to_columns(meta))
         # Add other explicit changes (non-meta)
-        for k, v in changes.items():
-            if k == 'meta':
-                continue
-            if isinstance(v, Decimal):
-                rec[k] = float(v)
-            else:
-                rec[k] = v
-
+        rec.update(_sanitize_decimals({k: v for k, v in changes.items() if k != 'meta'}))
+        # a stock edit is an adjustment movement, so the ledger accounts for it
+        stock_qty = rec.pop('stock_qty', None)
+        if stock_qty is not None and not (yield _Call(set_stock_qty, product_id, stock_qty)):
+            logging.error('update_product: could not set stock_qty of %s', product_id)
+            return None
         try:
-            res = supabase.table('products').update(rec).eq('id', product_id).execute()
+            if rec:
+                res = yield supabase.table('products').update(rec).eq('id', product_id)
+            else:
+                res = yield supabase.table('products').select('*').eq('id', product_id)
         except Exception as exc:
             logging.exception('Supabase update_product exception: %s', exc)
             return None
-
         if getattr(res, 'error', None):
             logging.error('Supabase update_product error: %s', res.error)
             return None
-        data = res.data
-        if isinstance(data, list):
-            return data[0] if data else None
-        return data
+        product_cache.invalidate(product_id)
+        return _first_row(res.data)
     except Exception as exc:
         logging.exception('update_product exception: %s', exc)
         return None
 
 
 # Stock primitives
+RESERVATION_TTL_SECONDS = int(os.getenv('RESERVATION_TTL_SECONDS', '900'))
+
+
+def default_reservation_expiry() -> Optional[str]:
+    """expires_at for reservations held while an invoice or sale is written (None: TTL disabled)."""
+    if RESERVATION_TTL_SECONDS <= 0:
+        return None
+    return (datetime.now(timezone.utc) + timedelta(seconds=RESERVATION_TTL_SECONDS)).isoformat()
+
+
+@_flow
 def get_current_stock(product_id: str) -> Optional[Dict]:
-    """Return cached stock_qty from products and reserved qty (sum of active reservations).
+    """Return stock_qty and reserved qty from the product row (products.reserved_qty, migration 0020).
 
+    Without that column the active reservations are summed instead.
     Returns a dict: {'on_hand': int, 'reserved': int, 'available': int} or None on error.
     """
     try:
-        supabase = _get_supabase()
-        prod = supabase.table('products').select('stock_qty').eq('id', product_id).single().execute()
-        stock = int(prod.data.get('stock_qty') or 0) if prod and prod.data else 0
+        supabase = yield _CLIENT
+        try:
+            prod = yield supabase.table('products').select('stock_qty,reserved_qty').eq('id', product_id).single()
+        except Exception as exc:
+            if 'reserved_qty' not in str(exc):
+                raise
+            prod = yield supabase.table('products').select('stock_qty').eq('id', product_id).single()
+        row = prod.data if prod and prod.data else {}
+        stock = int(row.get('stock_qty') or 0)
 
-        # fake/test proxy expects a single eq('product_id', ...) call; it will only return active reservations
-        res = supabase.table('stock_reservations').select('qty').eq('product_id', product_id).execute()
-        reserved = sum([r.get('qty', 0) for r in (res.data or [])]) if res and res.data else 0
+        if 'reserved_qty' in row:
+            reserved = int(row.get('reserved_qty') or 0)
+        else:
+            # only active holds count; served by the partial index from migration 0019
+            res = yield supabase.table('stock_reservations').select('qty').eq('status', 'active').eq('product_id', product_id)
+            reserved = sum([r.get('qty', 0) for r in (res.data or [])]) if res and res.data else 0
 
         return {'on_hand': stock, 'reserved': reserved, 'available': stock - reserved}
     except Exception:
@@ -922,16 +1661,80 @@ def get_current_stock(product_id: str) -> Optional[Dict]:
         return None
 
 
+@_flow
+def _call_stock_rpc(fn: str, params: Dict) -> Optional[Dict]:
+    """Run one of the atomic stock RPCs from migration 0014.
+
+    Returns the function's jsonb result ({'ok': True, ...} or {'ok': False, 'reason': ...}),
+    or None when the function is not installed so callers can use the per-line fallback.
+    """
+    supabase = yield _CLIENT
+    try:
+        res = yield supabase.rpc(fn, params)
+    except Exception as exc:
+        if _is_missing_rpc(exc):
+            logging.info('%s RPC not installed; falling back to per-line stock updates', fn)
+            return None
+        logging.exception('%s RPC exception: %s', fn, exc)
+        return {'ok': False, 'reason': 'error'}
+    result = _stock_rpc_result(fn, res)
+    if result.get('ok'):
+        _forget_products(params.get('p_lines'))
+        _forget_products(result.get('consumed'))
+    return result
+
+
+def _stock_request(lines: List[Dict], reason: str, reference_type: Optional[str] = None, reference_id: Optional[str] = None, created_by: Optional[str] = None, allow_negative: bool = False, meta: Optional[dict] = None) -> Dict:
+    """An apply_stock_lines request; prefixed with `p_` it is the RPC's parameters."""
+    return {
+        'lines': lines,
+        'reason': reason,
+        'reference_type': reference_type,
+        'reference_id': reference_id,
+        'created_by': created_by,
+        'allow_negative': allow_negative,
+        'meta': meta,
+    }
+
+
+@_flow
+def _apply_stock_request(request: Dict) -> Optional[Dict]:
+    """One apply_stock_lines RPC call (None when the RPC is not installed)."""
+    try:
+        return (yield _Call(_call_stock_rpc, 'apply_stock_lines', {'p_' + k: v for k, v in request.items()}))
+    except Exception as exc:
+        logging.exception('apply_stock_lines exception: %s', exc)
+        return {'ok': False, 'reason': 'error'}
+
+
+@_callable
+def apply_stock_lines(lines: List[Dict], reason: str, reference_type: Optional[str] = None, reference_id: Optional[str] = None, created_by: Optional[str] = None, allow_negative: bool = False, meta: Optional[dict] = None) -> Optional[Dict]:
+    """Apply signed stock changes for several products in one atomic round trip.
+
+    `lines` are built with `_stock_line`. Returns {'ok': True, 'movements': [...]} or
+    {'ok': False, 'reason': 'not_found' | 'insufficient_stock' | 'error', 'product_id': ...},
+    or None when the apply_stock_lines RPC is not installed.
+    """
+    return _apply_stock_request(_stock_request(lines, reason, reference_type, reference_id, created_by, allow_negative, meta))
+
+
+@_flow
 def create_stock_movement(product_id: str, change: int, reason: str, reference_type: str = None, reference_id: str = None, unit_cost: Optional[float] = None, created_by: Optional[str] = None, meta: Optional[dict] = None) -> Optional[Dict]:
-    """Insert a stock_movement and update cached products.stock_qty (best-effort).
-    Note: Supabase client does not expose DB-level transactions here; this is best-effort and should be wrapped server-side if strong consistency is required.
+    """Insert a stock_movement and update cached products.stock_qty.
+
+    Goes through the atomic apply_stock_lines RPC when installed; otherwise falls back to a
+    best-effort insert followed by a compare-and-set update of products.stock_qty.
     """
     try:
-        supabase = _get_supabase()
-        # sanitize unit_cost if Decimal
-        if isinstance(unit_cost, Decimal):
-            unit_cost = float(unit_cost)
-        mv = {
+        result = yield _Call(apply_stock_lines, [_stock_line(product_id, change, unit_cost)], reason, reference_type, reference_id, created_by, allow_negative=True, meta=meta)
+        if result is not None:
+            if not result.get('ok'):
+                logging.error('create_stock_movement rejected for %s: %s', product_id, result.get('reason'))
+                return None
+            return _first_row(result.get('movements'))
+
+        supabase = yield _CLIENT
+        mv = _sanitize_decimals({
             'product_id': product_id,
             'change': change,
             'reason': reason,
@@ -941,43 +1744,78 @@ def create_stock_movement(product_id: str, change: int, reason: str, reference_t
             'created_by': created_by,
             # keep metadata attached to stock_movements table only; do not copy into products
             'meta': meta,
-        }
-        res = supabase.table('stock_movements').insert(mv).execute()
+        })
+        res = yield supabase.table('stock_movements').insert(mv)
         if getattr(res, 'error', None):
             logging.error('create_stock_movement error: %s', res.error)
             return None
 
-    # update cached product stock_qty by adding change (do not touch product.meta)
-        # fetch current
-        cur = supabase.table('products').select('stock_qty').eq('id', product_id).single().execute()
-        if not getattr(cur, 'error', None) and cur.data:
-            stock = int(cur.data.get('stock_qty') or 0)
-            new_stock = stock + int(change)
-            upd = supabase.table('products').update({'stock_qty': new_stock}).eq('id', product_id).execute()
-            if getattr(upd, 'error', None):
-                logging.warning('Failed to update products.stock_qty for %s: %s', product_id, upd.error)
-
-        data = res.data
-        if isinstance(data, list):
-            return data[0] if data else None
-        return data
+        # update cached product stock_qty by adding change (do not touch product.meta)
+        if (yield from _add_stock_qty(supabase, product_id, int(change))) is None:
+            logging.warning('Failed to update products.stock_qty for %s', product_id)
+        product_cache.invalidate(product_id)
+        return _first_row(res.data)
     except Exception as exc:
         logging.exception('create_stock_movement exception: %s', exc)
         return None
 
 
+@_flow
+def set_stock_qty(product_id: str, qty: int, reason: str = 'adjustment', created_by: Optional[str] = None) -> bool:
+    """Set a product's stock_qty, recording the difference as a stock movement.
+
+    Uses the set_stock_qty RPC (migration 0026), which locks the product row so the difference
+    is taken from the quantity it replaces. Without it the current quantity is read and the
+    difference goes through create_stock_movement. Returns True on success.
+    """
+    try:
+        result = yield _Call(_call_stock_rpc, 'set_stock_qty', {'p_product_id': product_id, 'p_qty': int(qty), 'p_reason': reason, 'p_created_by': created_by})
+        if result is not None:
+            if not result.get('ok'):
+                logging.error('set_stock_qty rejected for %s: %s', product_id, result.get('reason'))
+                return False
+            product_cache.invalidate(product_id)
+            return True
+
+        current = yield _Call(get_current_stock, product_id)
+        if current is None:
+            return False
+        change = int(qty) - current['on_hand']
+        if change == 0:
+            return True
+        return (yield _Call(create_stock_movement, product_id, change, reason, 'product', product_id, created_by=created_by)) is not None
+    except Exception as exc:
+        logging.exception('set_stock_qty exception: %s', exc)
+        return False
+
+
+@_flow
 def reserve_stock(product_id: str, qty: int, invoice_id: Optional[str] = None, expires_at: Optional[str] = None, created_by: Optional[str] = None, meta: Optional[dict] = None) -> Optional[Dict]:
     """Attempt to reserve stock. Returns reservation row or None on failure/insufficient stock."""
     try:
+        # atomic check-and-insert when the reserve_stock_lines RPC is installed
+        result = yield _Call(_call_stock_rpc, 'reserve_stock_lines', {
+            'p_lines': [{'product_id': product_id, 'qty': int(qty)}],
+            'p_invoice_id': invoice_id,
+            'p_expires_at': expires_at,
+            'p_created_by': created_by,
+            'p_meta': meta,
+        })
+        if result is not None:
+            if not result.get('ok'):
+                logging.info('Reservation rejected for %s: %s (available %s)', product_id, result.get('reason'), result.get('available'))
+                return None
+            return _first_row(result.get('reservations'))
+
         # check availability
-        cur = get_current_stock(product_id)
+        cur = yield _Call(get_current_stock, product_id)
         if cur is None:
             return None
         if cur['available'] < qty:
             logging.info('Insufficient available stock for %s: need %s available %s', product_id, qty, cur['available'])
             return None
 
-        supabase = _get_supabase()
+        supabase = yield _CLIENT
         rec = {
             'product_id': product_id,
             'qty': qty,
@@ -987,25 +1825,34 @@ def reserve_stock(product_id: str, qty: int, invoice_id: Optional[str] = None, e
             # store reservation metadata in reservations table only
             'meta': meta,
         }
-        res = supabase.table('stock_reservations').insert(rec).execute()
+        res = yield supabase.table('stock_reservations').insert(rec)
         if getattr(res, 'error', None):
             logging.error('reserve_stock insert error: %s', res.error)
             return None
-        data = res.data
-        if isinstance(data, list):
-            return data[0] if data else None
-        return data
+        # the reserved_qty trigger (migration 0020) has changed the product row
+        product_cache.invalidate(product_id)
+        return _first_row(res.data)
     except Exception as exc:
         logging.exception('reserve_stock exception: %s', exc)
         return None
 
 
+@_flow
 def consume_reservation(reservation_id: str, created_by: Optional[str] = None) -> bool:
     """Mark reservation consumed and create final stock movement (outbound)."""
     try:
-        supabase = _get_supabase()
+        # status flip, movement and stock decrement in one statement when the RPC is installed
+        result = yield _Call(_call_stock_rpc, 'consume_reservations', {'p_ids': [reservation_id], 'p_created_by': created_by})
+        if result is not None:
+            consumed = [r.get('id') for r in (result.get('consumed') or [])]
+            if not result.get('ok') or reservation_id not in consumed:
+                logging.warning('Reservation not consumed (missing or no longer active): %s', reservation_id)
+                return False
+            return True
+
+        supabase = yield _CLIENT
         # Update the reservation to consumed and get the updated row (test proxy returns the row on update)
-        upd = supabase.table('stock_reservations').update({'status': 'consumed'}).eq('id', reservation_id).execute()
+        upd = yield supabase.table('stock_reservations').update({'status': 'consumed'}).eq('id', reservation_id)
         if getattr(upd, 'error', None) or not upd.data:
             logging.warning('Reservation not found or update failed: %s', reservation_id)
             return False
@@ -1015,7 +1862,7 @@ def consume_reservation(reservation_id: str, created_by: Optional[str] = None) -
             return False
 
         # create movement (negative change)
-        mv = create_stock_movement(rec['product_id'], -int(rec['qty']), 'sale', reference_type='reservation', reference_id=reservation_id, created_by=created_by)
+        mv = yield _Call(create_stock_movement, rec['product_id'], -int(rec['qty']), 'sale', reference_type='reservation', reference_id=reservation_id, created_by=created_by)
         if not mv:
             logging.error('Failed to create movement for reservation %s', reservation_id)
             return False
@@ -1025,16 +1872,56 @@ def consume_reservation(reservation_id: str, created_by: Optional[str] = None) -
         return False
 
 
+@_flow
 def release_reservation(reservation_id: str, reason: str = 'released') -> bool:
     """Release a reservation without creating movement (reservation was not consumed)."""
     try:
-        supabase = _get_supabase()
-        # Update reservation status to released and return status
-        upd = supabase.table('stock_reservations').update({'status': 'released', 'meta': {'released_reason': reason}}).eq('id', reservation_id).execute()
+        supabase = yield _CLIENT
+        upd = yield supabase.table('stock_reservations').update({'status': 'released', 'meta': {'released_reason': reason}}).eq('id', reservation_id)
         if getattr(upd, 'error', None) or not upd.data:
             logging.warning('Failed to mark reservation released %s: %s', reservation_id, getattr(upd, 'error', None))
             return False
+        _forget_products(upd.data)
         return True
     except Exception as exc:
         logging.exception('release_reservation exception: %s', exc)
         return False
+
+
+@_flow
+def release_expired_reservations(batch: int = 500) -> Optional[int]:
+    """Release up to `batch` active reservations past their expires_at; returns how many.
+
+    Uses the release_expired_reservations RPC (migration 0019) when installed, otherwise a
+    select + conditional update. Returns None on error.
+    """
+    try:
+        supabase = yield _CLIENT
+        try:
+            res = yield supabase.rpc('release_expired_reservations', {'p_batch': int(batch)})
+            if getattr(res, 'error', None):
+                logging.error('release_expired_reservations RPC error: %s', res.error)
+                return None
+            released = int(res.data or 0)
+            if released:
+                # the RPC only reports a count, so every cached reserved_qty is suspect
+                product_cache.clear()
+            return released
+        except Exception as exc:
+            if not _is_missing_rpc(exc):
+                raise
+        now = datetime.now(timezone.utc).isoformat()
+        res = yield supabase.table('stock_reservations').select('id').eq('status', 'active').lt('expires_at', now).order('expires_at').limit(int(batch))
+        ids = [r['id'] for r in (res.data or [])]
+        if not ids:
+            return 0
+        # status filter again: a reservation consumed since the select must stay consumed
+        upd = yield supabase.table('stock_reservations').update({'status': 'released', 'meta': {'released_reason': 'expired'}}).in_('id', ids).eq('status', 'active')
+        if getattr(upd, 'error', None):
+            logging.error('release_expired_reservations update error: %s', upd.error)
+            return None
+        _forget_products(upd.data)
+        return len(upd.data or [])
+    except Exception as exc:
+        logging.exception('release_expired_reservations exception: %s', exc)
+        return None
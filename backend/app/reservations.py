@@ -0,0 +1,78 @@
+"""Background sweeper that releases expired stock reservations.
+
+Reservations held while an invoice or sale is written carry an expires_at
+(`repository.default_reservation_expiry`, RESERVATION_TTL_SECONDS). If the request dies between
+reserve and consume the hold would stay `active` and block that stock forever; the sweeper
+releases such rows in batches every RESERVATION_SWEEP_INTERVAL seconds. Every API worker runs
+one; the database function skips rows another sweeper has locked.
+
+RESERVATION_SWEEP_INTERVAL=0 disables the sweeper (eg. when a cron job calls the
+release_expired_reservations RPC instead).
+"""
+from typing import Any, Dict, Optional
+import asyncio
+import logging
+import os
+import time
+
+from . import async_repository
+
+RESERVATION_SWEEP_INTERVAL = float(os.getenv('RESERVATION_SWEEP_INTERVAL', '60'))
+RESERVATION_SWEEP_BATCH = max(1, int(os.getenv('RESERVATION_SWEEP_BATCH', '500')))
+# stop after this many batches per run so one sweep never monopolises the connection pool
+_MAX_BATCHES_PER_RUN = 20
+
+_task: Optional[asyncio.Task] = None
+_stats: Dict[str, Any] = {'runs': 0, 'released': 0, 'errors': 0, 'last_run_at': None}
+
+
+async def sweep_once(batch: int = None) -> Optional[int]:
+    """Release expired reservations batch by batch until none are left; returns the count or None on error."""
+    batch = batch or RESERVATION_SWEEP_BATCH
+    total = 0
+    for _ in range(_MAX_BATCHES_PER_RUN):
+        released = await async_repository.release_expired_reservations(batch)
+        if released is None:
+            _stats['errors'] += 1
+            return None
+        total += released
+        if released < batch:
+            break
+    _stats['runs'] += 1
+    _stats['released'] += total
+    _stats['last_run_at'] = time.time()
+    if total:
+        logging.info('Released %s expired stock reservations', total)
+    return total
+
+
+async def _run() -> None:
+    while True:
+        try:
+            await sweep_once()
+        except Exception:
+            _stats['errors'] += 1
+            logging.exception('Reservation sweep failed')
+        await asyncio.sleep(RESERVATION_SWEEP_INTERVAL)
+
+
+async def start_sweeper() -> None:
+    global _task
+    if RESERVATION_SWEEP_INTERVAL > 0 and _task is None:
+        _task = asyncio.get_running_loop().create_task(_run())
+
+
+async def stop_sweeper() -> None:
+    global _task
+    task, _task = _task, None
+    if task is not None:
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+
+
+def sweeper_stats() -> Dict[str, Any]:
+    return {'interval': RESERVATION_SWEEP_INTERVAL, 'batch': RESERVATION_SWEEP_BATCH,
+            'running': _task is not None, **_stats}
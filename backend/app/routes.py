@@ -1,17 +1,30 @@
 import os
+import asyncio
 import logging
 import uuid
 from decimal import Decimal
 
-from fastapi import APIRouter, HTTPException, Request, Body
-from typing import TYPE_CHECKING
-from starlette.concurrency import run_in_threadpool
-from . import repository
+from fastapi import APIRouter, HTTPException, Request, Body, Query, Header
+from typing import TYPE_CHECKING, Optional
+from . import async_repository
 from . import tax as tax_module
+from . import cache as cache_module
+from . import sequences as sequences_module
+from . import pagination
+from . import export as export_module
+from . import reports as reports_module
+from . import stock_snapshots
+from . import gst as gst_module
+from .fields import InvalidFields, parse_fields
 from .schemas import InvoiceCreate, Product, ProductCreate, ProductUpdate, CustomerUpdate
-from .schemas import SupplierCreate, PurchaseCreate, PurchaseItem, SaleCreate
-from fastapi.responses import Response, HTMLResponse
-from . import pdf as pdf_module
+from .schemas import SupplierCreate, PurchaseCreate, PurchaseItem, SaleCreate, InvoicePdfExport
+from fastapi.responses import Response, HTMLResponse, StreamingResponse, FileResponse
+from . import pdf_pool
+from . import pdf_cache
+from . import pdf_zip
+from . import receipt as receipt_module
+from . import reservations
+from . import stock_coordinator
 
 logging.info(f"Loaded routes.py from: {os.path.abspath(__file__)}")
 
@@ -23,14 +36,43 @@ if TYPE_CHECKING:
 router = APIRouter(prefix="/billing", tags=["Billing"])
 
 
+def _check_cursor(cursor: Optional[str]):
+    if cursor:
+        try:
+            pagination.decode_cursor(cursor)
+        except pagination.InvalidCursor:
+            raise HTTPException(status_code=400, detail='Invalid cursor')
+
+
+def _parse_fields(table: str, fields: Optional[str], detail: bool = False):
+    try:
+        return parse_fields(table, fields, detail)
+    except InvalidFields as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+
+
+def _page_response(page: dict) -> dict:
+    # list endpoints return one page; pass next_cursor back as ?cursor= to get the next one
+    return {"status": "success", "data": page['rows'], "next_cursor": page['next_cursor']}
+
+
 @router.get('/customers')
-async def list_customers():
-    from app.database import supabase
-    res = supabase.table('customers').select('*').execute()
-    logging.info(f"Fetched customers: {res.data}")
-    if getattr(res, 'error', None):
-        raise HTTPException(status_code=500, detail=str(res.error))
-    return {"status": "success", "data": res.data}
+async def list_customers(limit: int = 0, cursor: Optional[str] = None, fields: Optional[str] = None):
+    _check_cursor(cursor)
+    selected = _parse_fields('customers', fields)
+    res = await async_repository.list_customers(limit, cursor, selected)
+    if res is None:
+        raise HTTPException(status_code=500, detail='Failed to fetch customers')
+    return _page_response(res)
+
+
+@router.get('/customers/{customer_id}')
+async def get_customer(customer_id: str, fields: Optional[str] = None):
+    selected = _parse_fields('customers', fields, detail=True)
+    cust = await async_repository.get_customer(customer_id, selected)
+    if not cust:
+        raise HTTPException(status_code=404, detail='Customer not found')
+    return {"status": "success", "data": cust}
 
 
 @router.post('/customers')
@@ -41,7 +83,7 @@ async def create_customer(request: Request):
         if not body.get('name'):
             raise HTTPException(status_code=400, detail='Missing customer name')
         # insert via repository
-        created = await run_in_threadpool(repository.create_customer, body)
+        created = await async_repository.create_customer(body)
         if not created:
             raise HTTPException(status_code=500, detail='Failed to create customer')
         return {"status": "success", "data": created}
@@ -58,7 +100,7 @@ async def update_customer(customer_id: str, changes: 'CustomerUpdate' = Body(...
     rec = changes.dict(exclude_unset=True)
     if not rec:
         raise HTTPException(status_code=400, detail='No changes provided')
-    updated = await run_in_threadpool(repository.update_customer, customer_id, rec)
+    updated = await async_repository.update_customer(customer_id, rec)
     if not updated:
         raise HTTPException(status_code=500, detail='Failed to update customer')
     return {"status": "success", "data": updated}
@@ -67,27 +109,31 @@ async def update_customer(customer_id: str, changes: 'CustomerUpdate' = Body(...
 
 @router.delete('/customers/{customer_id}')
 async def remove_customer(customer_id: str):
-    ok = await run_in_threadpool(repository.delete_customer, customer_id)
+    ok = await async_repository.delete_customer(customer_id)
     if not ok:
         raise HTTPException(status_code=500, detail='Failed to delete customer')
     return {"status": "success"}
 
 
 @router.get('/products')
-async def list_products():
-    res = await run_in_threadpool(repository.list_products)
+async def list_products(limit: int = 0, cursor: Optional[str] = None, fields: Optional[str] = None):
+    _check_cursor(cursor)
+    selected = _parse_fields('products', fields)
+    res = await async_repository.list_products(limit, cursor, selected)
     if res is None:
         raise HTTPException(status_code=500, detail='Failed to fetch products')
-    return {"status": "success", "data": res}
+    return _page_response(res)
 
 
 
 @router.get('/suppliers')
-async def list_suppliers():
-    res = await run_in_threadpool(repository.list_suppliers)
+async def list_suppliers(limit: int = 0, cursor: Optional[str] = None, fields: Optional[str] = None):
+    _check_cursor(cursor)
+    selected = _parse_fields('suppliers', fields)
+    res = await async_repository.list_suppliers(limit, cursor, selected)
     if res is None:
         raise HTTPException(status_code=500, detail='Failed to fetch suppliers')
-    return {"status": "success", "data": res}
+    return _page_response(res)
 
 
 @router.post('/suppliers')
@@ -96,7 +142,7 @@ async def create_supplier(request: Request):
         body = await request.json()
         if not body.get('name'):
             raise HTTPException(status_code=400, detail='Missing supplier name')
-        created = await run_in_threadpool(repository.create_supplier, body)
+        created = await async_repository.create_supplier(body)
         if not created:
             raise HTTPException(status_code=500, detail='Failed to create supplier')
         return {"status": "success", "data": created}
@@ -110,7 +156,7 @@ async def create_supplier(request: Request):
 
 @router.get('/product-variables/{vtype}')
 async def get_product_variables(vtype: str):
-    res = await run_in_threadpool(repository.list_product_variables, vtype)
+    res = await async_repository.list_product_variables(vtype)
     if res is None:
         raise HTTPException(status_code=500, detail='Failed to fetch variables')
     # repository.list_product_variables now returns { vtype_enabled, rows }
@@ -124,7 +170,7 @@ async def add_product_variable(vtype: str, request: Request):
         value = body.get('value')
         if not value:
             raise HTTPException(status_code=400, detail='Missing value')
-        created = await run_in_threadpool(repository.upsert_product_variable, vtype, value)
+        created = await async_repository.upsert_product_variable(vtype, value)
         if not created:
             raise HTTPException(status_code=500, detail='Failed to add variable')
         return {'status': 'success', 'data': created}
@@ -142,7 +188,7 @@ async def remove_product_variable(vtype: str, request: Request):
         value = body.get('value')
         if not value:
             raise HTTPException(status_code=400, detail='Missing value')
-        ok = await run_in_threadpool(repository.delete_product_variable, vtype, value)
+        ok = await async_repository.delete_product_variable(vtype, value)
         if not ok:
             raise HTTPException(status_code=500, detail='Failed to delete variable')
         return {'status': 'success'}
@@ -161,7 +207,7 @@ async def toggle_product_variable(vtype: str, request: Request):
         enabled = body.get('enabled')
         if value is None or enabled is None:
             raise HTTPException(status_code=400, detail='Missing value or enabled')
-        ok = await run_in_threadpool(repository.update_product_variable_enabled, vtype, value, bool(enabled))
+        ok = await async_repository.update_product_variable_enabled(vtype, value, bool(enabled))
         if not ok:
             raise HTTPException(status_code=500, detail='Failed to update variable')
         return {'status': 'success'}
@@ -176,7 +222,7 @@ async def toggle_product_variable(vtype: str, request: Request):
 async def get_product_variable_type(vtype: str):
     try:
         # return whether the type is enabled
-        res = await run_in_threadpool(repository.list_product_variables, vtype)
+        res = await async_repository.list_product_variables(vtype)
         if res is None:
             raise HTTPException(status_code=500, detail='Failed to fetch variable type')
         # res has vtype_enabled
@@ -195,7 +241,7 @@ async def set_product_variable_type(vtype: str, request: Request):
         enabled = body.get('enabled')
         if enabled is None:
             raise HTTPException(status_code=400, detail='Missing enabled')
-        ok = await run_in_threadpool(repository.set_product_variable_type_enabled, vtype, bool(enabled))
+        ok = await async_repository.set_product_variable_type_enabled(vtype, bool(enabled))
         if not ok:
             raise HTTPException(status_code=500, detail='Failed to update variable type')
         return {'status': 'success'}
@@ -209,7 +255,7 @@ async def set_product_variable_type(vtype: str, request: Request):
 @router.get('/product-variable-types')
 async def list_product_variable_types():
     try:
-        res = await run_in_threadpool(repository.list_product_variable_types_all)
+        res = await async_repository.list_product_variable_types_all()
         if res is None:
             raise HTTPException(status_code=500, detail='Failed to fetch variable types')
         return {'status': 'success', 'data': res}
@@ -223,16 +269,24 @@ async def list_product_variable_types():
 @router.post('/purchases')
 async def create_purchase(payload: PurchaseCreate):
     # payload contains supplier_id and items
-    created = await run_in_threadpool(repository.apply_purchase, payload.supplier_id, [it.dict() for it in payload.items], payload.received_by)
+    created = await async_repository.apply_purchase(payload.supplier_id, [it.dict() for it in payload.items], payload.received_by)
     if not created:
         raise HTTPException(status_code=500, detail='Failed to record purchase')
-    return {"status": "success", "data": created}
+    # 'partial': recorded, but some stock was not updated; not an error the client should retry
+    return {"status": "success" if created['status'] == 'ok' else created['status'], "data": created}
 
 
 @router.post('/sales')
 async def create_sale(payload: SaleCreate):
     allow_oversale = os.getenv('ALLOW_OVERSALE', 'false').lower() in ('1', 'true', 'yes')
-    created = await run_in_threadpool(repository.apply_sale, payload.customer_id, [it.dict() for it in payload.items], payload.issued_by, allow_oversale)
+    # customer_id becomes the movements' reference_id (a uuid column): reject anything else with
+    # a 400 rather than let the stock RPC fail and the sale look like a stock shortage
+    if payload.customer_id:
+        try:
+            uuid.UUID(str(payload.customer_id))
+        except Exception:
+            raise HTTPException(status_code=400, detail='Invalid customer_id: must be a UUID')
+    created = await async_repository.apply_sale(payload.customer_id, [it.dict() for it in payload.items], payload.issued_by, allow_oversale)
     if not created:
         raise HTTPException(status_code=409, detail='Insufficient stock or failed to record sale')
     return {"status": "success", "data": created}
@@ -250,7 +304,7 @@ async def create_product(request: Request):
         if isinstance(body, dict) and 'meta' in body:
             rec['meta'] = body.get('meta')
         # delegate creation to repository so it can assign UID... ids
-        created = await run_in_threadpool(repository.create_product, rec)
+        created = await async_repository.create_product(rec)
         if not created:
             raise HTTPException(status_code=500, detail='Failed to create product')
         return {"status": "success", "data": created}
@@ -268,7 +322,7 @@ async def update_product(product_id: str, request: Request):
         rec = product_data.dict(exclude_unset=True)
         if isinstance(body, dict) and 'meta' in body:
             rec['meta'] = body.get('meta')
-        updated = await run_in_threadpool(repository.update_product, product_id, rec)
+        updated = await async_repository.update_product(product_id, rec)
         if not updated:
             raise HTTPException(status_code=500, detail='Failed to update product')
         return {"status": "success", "data": updated}
@@ -284,12 +338,12 @@ async def update_product(product_id: str, request: Request):
 async def remove_product(product_id: str):
     # repository.delete_product may perform hard delete or soft-delete/anonymize.
     # Return a result dict with a hint so frontend can show an appropriate toast.
-    res = await run_in_threadpool(repository.delete_product, product_id)
+    res = await async_repository.delete_product(product_id)
     if res is None or res is False:
         raise HTTPException(status_code=500, detail='Failed to delete product')
     # repository.delete_product returns True on success; to indicate soft-delete we rely on repository to set an attribute
     # For simplicity, call repository.get_product to inspect archived/name marker
-    prod = await run_in_threadpool(repository.get_product, product_id)
+    prod = await async_repository.get_product(product_id)
     if not prod:
         # Hard-deleted
         return {"status": "success", "deleted": "hard"}
@@ -300,13 +354,15 @@ async def remove_product(product_id: str):
 
 
 @router.get('/products/archived')
-async def list_archived_products():
+async def list_archived_products(limit: int = 0, cursor: Optional[str] = None, fields: Optional[str] = None):
     # Return products that are archived or anonymized (name endswith ' [deleted]')
+    _check_cursor(cursor)
+    selected = _parse_fields('products', fields)
     try:
-        res = await run_in_threadpool(repository.list_archived_products)
+        res = await async_repository.list_archived_products(limit, cursor, selected)
         if res is None:
             raise HTTPException(status_code=500, detail='Failed to fetch archived products')
-        return {"status": "success", "data": res}
+        return _page_response(res)
     except HTTPException:
         raise
     except Exception as exc:
@@ -314,10 +370,20 @@ async def list_archived_products():
         raise HTTPException(status_code=500, detail='Internal error')
 
 
+@router.get('/products/{product_id}')
+async def get_product(product_id: str, fields: Optional[str] = None):
+    # declared after /products/archived so that path is not captured as a product id
+    selected = _parse_fields('products', fields, detail=True)
+    prod = await async_repository.get_product(product_id, selected)
+    if not prod:
+        raise HTTPException(status_code=404, detail='Product not found')
+    return {"status": "success", "data": prod}
+
+
 @router.post('/products/{product_id}/undelete')
 async def undelete_product(product_id: str):
     # Attempt to restore an anonymized/archived product
-    ok = await run_in_threadpool(repository.undelete_product, product_id)
+    ok = await async_repository.undelete_product(product_id)
     if not ok:
         raise HTTPException(status_code=500, detail='Failed to undelete product')
     return {"status": "success"}
@@ -326,6 +392,19 @@ async def undelete_product(product_id: str):
 # Legacy billing handlers removed. Use repository functions / new endpoints instead.
 
 
+async def _revert_invoice_stock(stock_applied: bool, stock_lines: list, invoice_id: str, issued_by):
+    """Put back stock taken by apply_stock_lines when the invoice could not be created."""
+    if not stock_applied:
+        return
+    reverse = [{'product_id': ln['product_id'], 'change': -ln['change']} for ln in stock_lines]
+    try:
+        res = await async_repository.apply_stock_lines(reverse, 'sale-reversal', reference_type='invoice', reference_id=invoice_id, created_by=issued_by, allow_negative=True)
+        if not res or not res.get('ok'):
+            logging.error('Failed to revert stock for aborted invoice %s: %s', invoice_id, res)
+    except Exception:
+        logging.exception('Failed to revert stock for aborted invoice %s', invoice_id)
+
+
 @router.post('/invoices/')
 async def create_invoice(payload: InvoiceCreate):
     allow_oversale = os.getenv('ALLOW_OVERSALE', 'false').lower() in ('1', 'true', 'yes')
@@ -336,18 +415,24 @@ async def create_invoice(payload: InvoiceCreate):
             uuid.UUID(str(payload.customer_id))
         except Exception:
             raise HTTPException(status_code=400, detail='Invalid customer_id: must be a UUID')
+    # Load every referenced product in one query (None means no database is reachable) and
+    # the customer concurrently; neither lookup depends on the other.
+    products, customer = await asyncio.gather(
+        async_repository.get_products_bulk([it.product_id for it in payload.items]),
+        async_repository.get_customer(payload.customer_id),
+    )
+
     # Resolve product tax_percent when not provided per-line
     items_for_tax = []
     for it in payload.items:
         taxp = it.tax_percent
         if taxp is None and it.product_id:
-            prod = await run_in_threadpool(repository.get_product, it.product_id)
+            prod = (products or {}).get(it.product_id)
             if prod and prod.get('tax_percent') is not None:
                 taxp = prod.get('tax_percent')
         items_for_tax.append({'qty': it.qty, 'unit_price': it.unit_price, 'tax_percent': taxp})
 
-    # fetch customer to determine state for intra/inter state tax
-    customer = await run_in_threadpool(repository.get_customer, payload.customer_id)
+    # customer state determines intra/inter state tax
     supplier_state = None
     customer_state = None
     if customer:
@@ -359,9 +444,10 @@ async def create_invoice(payload: InvoiceCreate):
 
     taxes = tax_module.calculate_invoice_taxes(supplier_state, customer_state, items_for_tax)
 
-    invoice_number = str(uuid.uuid4())[:8]
+    # The id is generated here so stock movements can reference the invoice before it is inserted.
+    invoice_id = str(uuid.uuid4())
     invoice_record = {
-        'invoice_number': invoice_number,
+        'id': invoice_id,
         'customer_id': payload.customer_id,
         'subtotal': taxes['subtotal'],
         'cgst_amount': taxes['cgst'],
@@ -373,30 +459,39 @@ async def create_invoice(payload: InvoiceCreate):
         'issued_by': payload.issued_by,
     }
 
-    # Reserve stock for each product before creating an invoice to avoid oversell.
+    # Preferred stock path: one apply_stock_lines RPC checks, records movements and decrements
+    # stock for every line atomically. Invoices may oversell (as before), so only unknown
+    # products are rejected. `None` means the RPC is not installed: use per-line reservations.
+    stock_lines = [{'product_id': it.product_id, 'change': -it.qty} for it in payload.items if it.product_id]
+    stock_applied = False
+    if products is not None and stock_lines:
+        applied = await async_repository.apply_stock_lines(stock_lines, 'sale', reference_type='invoice', reference_id=invoice_id, created_by=payload.issued_by, allow_negative=True)
+        if applied is not None:
+            if not applied.get('ok'):
+                if applied.get('reason') == 'error':
+                    raise HTTPException(status_code=500, detail='Failed to update stock')
+                raise HTTPException(status_code=409, detail=f"Insufficient stock for product {applied.get('product_id')}")
+            stock_applied = True
+
+    # Legacy path: reserve stock for each product before creating an invoice to avoid oversell.
     # We keep track of created reservations so we can release them if something fails.
     reservations = []
     try:
         for it in payload.items:
-            if it.product_id:
-                # Probe current stock first; in test envs this may return None (no DB available).
-                try:
-                    cur = await run_in_threadpool(repository.get_current_stock, it.product_id)
-                except Exception:
-                    cur = None
-
-                if cur is None:
+            if it.product_id and not stock_applied:
+                # The bulk product lookup doubles as the database probe; in test envs it returns None.
+                if products is None:
                     logging.info('Skipping reservations: no database available in this environment')
                     res = 'SKIPPED_NO_DB'
                 else:
                     # Try to reserve from DB; reserve_stock will return None on insufficient stock
-                    res = await run_in_threadpool(repository.reserve_stock, it.product_id, it.qty, None, None, payload.issued_by)
+                    res = await async_repository.reserve_stock(it.product_id, it.qty, None, async_repository.default_reservation_expiry(), payload.issued_by)
 
                 if res is None:
                     # insufficient stock or error - try best-effort oversell by decrementing stock allowing negative
                     logging.info('Failed to reserve stock for product %s qty %s; attempting best-effort oversell', it.product_id, it.qty)
                     try:
-                        decremented = await run_in_threadpool(repository.decrement_product_stock, it.product_id, it.qty, True)
+                        decremented = await async_repository.decrement_product_stock(it.product_id, it.qty, True)
                     except Exception:
                         decremented = False
                     if decremented:
@@ -410,85 +505,375 @@ async def create_invoice(payload: InvoiceCreate):
                 if isinstance(res, dict):
                     reservations.append(res)
 
-        # All reservations succeeded; create invoice and items
-        created = await run_in_threadpool(repository.create_invoice, invoice_record)
-        if not created:
-            raise HTTPException(status_code=500, detail='Failed to create invoice')
+        # Stock is secured; only now take an invoice number, so a rejected invoice (409/500
+        # above) does not leave a gap in the GST invoice series.
+        invoice_number = await async_repository.next_invoice_number()
+        if not invoice_number:
+            # counters not installed: fall back to a random number (unique constraint still applies)
+            invoice_number = str(uuid.uuid4())[:8]
+        invoice_record['invoice_number'] = invoice_number
 
-        # prepare and insert invoice items
+        # All reservations succeeded; create the invoice and its items together
         items_to_insert = []
-        for it in payload.items:
+        for it, tax_it in zip(payload.items, items_for_tax):
             items_to_insert.append({
-                'invoice_id': created.get('id'),
+                'invoice_id': invoice_id,
                 'product_id': it.product_id,
                 'description': it.description,
                 'qty': it.qty,
                 'unit_price': it.unit_price,
                 'line_total': (it.unit_price * it.qty),
+                'tax_percent': tax_it['tax_percent'],
             })
 
-        ok = await run_in_threadpool(repository.insert_invoice_items, created.get('id'), items_to_insert)
-        if not ok:
-            logging.warning('Invoice created but failed to insert items')
+        created = await async_repository.create_invoice_with_items(invoice_record, items_to_insert)
+        if not created:
+            raise HTTPException(status_code=500, detail='Failed to create invoice')
 
-        # If we created reservations, consume them (preferred).
+        # If we created reservations, consume them (stock already applied via RPC needs nothing).
         # If reservations were skipped (no DB in test env), fall back to best-effort decrement_product_stock.
         if reservations:
+            # consumed one at a time: lines for the same product would race on products.stock_qty
             for r in reservations:
                 try:
-                    await run_in_threadpool(repository.consume_reservation, r.get('id'), payload.issued_by)
+                    await async_repository.consume_reservation(r.get('id'), payload.issued_by)
                 except Exception:
                     logging.exception('Failed to consume reservation %s', r.get('id'))
-        else:
+        elif products is None:
             # best-effort decrement for environments without reservations
             for it in payload.items:
                 if it.product_id:
                     try:
-                        await run_in_threadpool(repository.decrement_product_stock, it.product_id, it.qty, allow_oversale)
+                        await async_repository.decrement_product_stock(it.product_id, it.qty, allow_oversale)
                     except Exception:
                         logging.exception('decrement_product_stock failed for %s', it.product_id)
 
         return {"status": "success", "data": created}
     except HTTPException:
+        await _revert_invoice_stock(stock_applied, stock_lines, invoice_id, payload.issued_by)
         # release any reservations we created
         for r in reservations:
             try:
-                await run_in_threadpool(repository.release_reservation, r.get('id'), 'invoice-abort')
+                await async_repository.release_reservation(r.get('id'), 'invoice-abort')
             except Exception:
                 logging.exception('Failed to release reservation %s', r.get('id'))
         raise
     except Exception:
+        await _revert_invoice_stock(stock_applied, stock_lines, invoice_id, payload.issued_by)
         # unexpected failure: release reservations and surface 500
         for r in reservations:
             try:
-                await run_in_threadpool(repository.release_reservation, r.get('id'), 'invoice-error')
+                await async_repository.release_reservation(r.get('id'), 'invoice-error')
             except Exception:
                 logging.exception('Failed to release reservation %s', r.get('id'))
         raise HTTPException(status_code=500, detail='Internal error creating invoice')
 
 
 @router.get('/invoices')
-async def list_invoices(limit: int = 0):
-    """Return invoices list. Frontend calls this endpoint without auth in dev."""
-    if limit and limit > 0:
-        res = await run_in_threadpool(repository.list_invoices, limit)
-    else:
-        res = await run_in_threadpool(repository.list_invoices, None)
+async def list_invoices(limit: int = 0, cursor: Optional[str] = None, fields: Optional[str] = None):
+    """Return one page of invoices, newest first. Frontend calls this endpoint without auth in dev."""
+    _check_cursor(cursor)
+    selected = _parse_fields('invoices', fields)
+    res = await async_repository.list_invoices(limit if limit and limit > 0 else None, cursor, selected)
     if res is None:
         raise HTTPException(status_code=500, detail='Failed to fetch invoices')
-    return {"status": "success", "data": res}
+    return _page_response(res)
+
+
+@router.get('/invoices/export')
+async def export_invoices(format: str = 'csv', date_from: Optional[str] = Query(None, alias='from'),
+                          date_to: Optional[str] = Query(None, alias='to')):
+    """Stream invoices with their line items as CSV (one line per item) or NDJSON (one invoice per line).
+
+    `from` / `to` are inclusive YYYY-MM-DD days. Invoices are read a page at a time, so memory
+    stays constant whatever the range.
+    """
+    try:
+        fmt = export_module.check_format(format)
+        start, end = export_module.parse_range(date_from, date_to)
+    except export_module.InvalidExport as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+
+    pages = async_repository.iter_invoice_export_pages(start, end)
+    # read the first page before the 200 goes out so an unreachable database is still a 500
+    try:
+        first = await pages.__anext__()
+    except StopAsyncIteration:
+        first = None
+    except Exception:
+        logging.exception('Invoice export failed')
+        raise HTTPException(status_code=500, detail='Failed to export invoices')
+
+    render = export_module.csv_rows if fmt == 'csv' else export_module.ndjson_rows
+
+    async def body():
+        if fmt == 'csv':
+            yield export_module.csv_header()
+        if first is None:
+            return
+        yield render(first)
+        try:
+            async for page in pages:
+                yield render(page)
+        except Exception:
+            # headers are already sent; abort the stream so the client sees a failed download
+            logging.exception('Invoice export failed mid-stream')
+            raise
+
+    name = export_module.filename(fmt, date_from, date_to)
+    return StreamingResponse(body(), media_type=export_module.MEDIA_TYPES[fmt],
+                             headers={'Content-Disposition': f'attachment; filename="{name}"'})
+
+
+@router.get('/invoices/{invoice_id}')
+async def get_invoice(invoice_id: str, fields: Optional[str] = None):
+    """Invoice with its items and customer; `fields` may also name `items` / `customer`."""
+    selected = _parse_fields('invoices', fields, detail=True)
+    inv = await async_repository.get_invoice(invoice_id, selected)
+    if not inv:
+        raise HTTPException(status_code=404, detail='Invoice not found')
+    return {"status": "success", "data": inv}
+
+
+@router.get('/stats')
+async def billing_stats():
+    """Dashboard totals (today / this month / all time, customers, low stock) from rollup counters."""
+    stats = await async_repository.get_billing_stats()
+    if stats is None:
+        raise HTTPException(status_code=500, detail='Failed to fetch stats')
+    return {'status': 'success', 'data': stats}
+
+
+@router.get('/reports/sales')
+async def sales_report(group: str = 'day', date_from: Optional[str] = Query(None, alias='from'),
+                       date_to: Optional[str] = Query(None, alias='to'), limit: int = 0):
+    """Sales by day, product, customer or state for inclusive IST days (default: this month).
+
+    Served from the daily rollup tables only, so it stays fast however many invoices exist.
+    """
+    try:
+        group = reports_module.check_group(group)
+        start, end = reports_module.parse_period(date_from, date_to)
+    except reports_module.InvalidReport as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+    size = min(limit, reports_module.REPORT_LIMIT) if limit and limit > 0 else reports_module.REPORT_LIMIT
+    rows = await async_repository.sales_report(group, start, end, size)
+    if rows is None:
+        raise HTTPException(status_code=500, detail='Failed to build sales report')
+    return {'status': 'success', 'group': group, 'from': start.isoformat(), 'to': end.isoformat(), 'data': rows}
+
+
+@router.get('/stock/as-of')
+async def stock_as_of(at: Optional[str] = None, product_ids: Optional[str] = None, limit: int = 0, cursor: Optional[str] = None):
+    """On-hand quantity and value per product as of `at` (a date means the end of that IST day).
+
+    Computed from the latest stock snapshot before `at` plus the movements since, so the cost
+    does not grow with the length of the stock history. `product_ids` is a comma separated list.
+    Products come a page at a time, by id; `total_value` is the value of the page.
+    """
+    _check_cursor(cursor)
+    try:
+        when = stock_snapshots.parse_as_of(at)
+        if cursor:
+            # the page continues after a product id
+            uuid.UUID(pagination.after_id(cursor))
+    except stock_snapshots.InvalidAsOf as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+    except ValueError:
+        raise HTTPException(status_code=400, detail='Invalid cursor')
+    ids = None
+    if product_ids:
+        ids = [p.strip() for p in product_ids.split(',') if p.strip()]
+        try:
+            for pid in ids:
+                uuid.UUID(pid)
+        except ValueError:
+            raise HTTPException(status_code=400, detail='product_ids must be UUIDs')
+    page = await async_repository.stock_as_of(when, ids, limit, cursor)
+    if page is None:
+        raise HTTPException(status_code=500, detail='Failed to compute stock')
+    return {'status': 'success', 'at': when.isoformat(), 'data': page['rows'], 'next_cursor': page['next_cursor'],
+            'total_value': round(sum(r['value'] for r in page['rows']), 2)}
+
+
+@router.get('/reports/gstr1')
+async def gstr1_report(format: str = 'json', date_from: Optional[str] = Query(None, alias='from'),
+                       date_to: Optional[str] = Query(None, alias='to')):
+    """GSTR-1 section summaries (B2B, B2CL, B2CS, rate-wise) for inclusive IST days (default: this month).
+
+    Invoices are streamed a page at a time and folded into running totals in a single pass.
+    """
+    if format not in ('json', 'csv'):
+        raise HTTPException(status_code=400, detail='format must be one of: json, csv')
+    try:
+        start, end = reports_module.parse_period(date_from, date_to)
+        bounds = export_module.parse_range(start.isoformat(), end.isoformat())
+    except (reports_module.InvalidReport, export_module.InvalidExport) as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+
+    report = gst_module.Gstr1Report()
+    try:
+        async for page in async_repository.iter_invoice_export_pages(*bounds, customers=True):
+            report.add_page(page)
+    except Exception:
+        logging.exception('GSTR-1 report failed')
+        raise HTTPException(status_code=500, detail='Failed to build GSTR-1 report')
+    result = report.result()
+    if format == 'csv':
+        name = f'gstr1_{start.isoformat()}_{end.isoformat()}.csv'
+        return Response(content=gst_module.to_csv(result), media_type='text/csv; charset=utf-8',
+                        headers={'Content-Disposition': f'attachment; filename="{name}"'})
+    return {'status': 'success', 'from': start.isoformat(), 'to': end.isoformat(), 'data': result}
+
+
+@router.get('/metrics')
+async def metrics():
+    """Operational counters for this worker process."""
+    from app.database import pool_stats
+    return {'status': 'success', 'data': {
+        'supabase_pool': pool_stats(),
+        'catalog_cache': cache_module.cache_stats(),
+        'sequences': sequences_module.sequence_stats(),
+        'pdf_pool': pdf_pool.pool_stats(),
+        'pdf_cache': pdf_cache.cache_stats(),
+        'reservation_sweeper': reservations.sweeper_stats(),
+        'stock_coordinator': stock_coordinator.coordinator_stats(),
+    }}
+
+
+def _cached_render_response(entry, if_none_match: Optional[str]):
+    headers = {'ETag': entry.etag, 'Cache-Control': 'private, max-age=0, must-revalidate'}
+    if if_none_match and entry.etag in [t.strip() for t in if_none_match.split(',')]:
+        return Response(status_code=304, headers=headers)
+    return FileResponse(entry.path, media_type=entry.media_type, headers=headers)
+
+
+async def _render_and_cache(invoice_id: str, inv: Optional[dict] = None):
+    """Render an invoice through the PDF pool and cache it: (content, 'pdf' | 'html', digest).
+
+    Returns None when the invoice does not exist; PdfPoolBusy / timeouts propagate.
+    """
+    if inv is None:
+        inv = await async_repository.get_invoice(invoice_id)
+        if not inv:
+            return None
+    digest = pdf_cache.content_hash(inv)
+    pdf_bytes, html = await pdf_pool.render_invoice(inv)
+    content, ext = (pdf_bytes, 'pdf') if pdf_bytes else (html.encode(), 'html')
+    if inv.get('items'):
+        # an invoice read without items may be mid-create; do not keep its PDF
+        pdf_cache.store(invoice_id, digest, content, ext)
+    return content, ext, digest
 
 
 @router.get('/invoices/{invoice_id}/pdf')
-async def invoice_pdf(invoice_id: str):
-    inv = await run_in_threadpool(repository.get_invoice, invoice_id)
+async def invoice_pdf(invoice_id: str, if_none_match: Optional[str] = Header(None), format: str = 'pdf', paper: int = 58):
+    """Invoice PDF (HTML when WeasyPrint is unavailable); repeat downloads come from the disk cache.
+
+    `format=receipt` returns a plain-text 58/80 mm (`paper`) thermal receipt and `format=escpos`
+    the same receipt as a raw ESC/POS print job; neither goes through the PDF pool.
+    """
+    if format in ('receipt', 'escpos'):
+        if paper not in receipt_module.PAPER_COLUMNS:
+            raise HTTPException(status_code=400, detail='paper must be 58 or 80')
+        inv = await async_repository.get_invoice(invoice_id)
+        if not inv:
+            raise HTTPException(status_code=404, detail='Invoice not found')
+        text = receipt_module.render_receipt(inv, paper)
+        if format == 'escpos':
+            return Response(content=receipt_module.to_escpos(text), media_type='application/octet-stream')
+        return Response(content=text, media_type='text/plain; charset=utf-8')
+    if format != 'pdf':
+        raise HTTPException(status_code=400, detail='format must be one of: pdf, receipt, escpos')
+
+    cached = pdf_cache.lookup(invoice_id)
+    if cached:
+        return _cached_render_response(cached, if_none_match)
+
+    inv = await async_repository.get_invoice(invoice_id)
     if not inv:
         raise HTTPException(status_code=404, detail='Invoice not found')
 
-    pdf_bytes = await run_in_threadpool(pdf_module.invoice_to_pdf_bytes, inv)
-    if pdf_bytes:
-        return Response(content=pdf_bytes, media_type='application/pdf')
+    try:
+        content, ext, digest = await _render_and_cache(invoice_id, inv)
+    except pdf_pool.PdfPoolBusy:
+        raise HTTPException(status_code=503, detail='PDF renderer busy, retry shortly', headers={'Retry-After': '2'})
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=504, detail='PDF rendering timed out')
+    except Exception:
+        logging.exception('PDF rendering failed for invoice %s', invoice_id)
+        raise HTTPException(status_code=500, detail='Failed to render invoice')
+    headers = {'ETag': f'"{digest}"'}
+    if ext == 'pdf':
+        return Response(content=content, media_type='application/pdf', headers=headers)
 
     # Fallback: return HTML rendering
-    html = await run_in_threadpool(pdf_module.render_invoice_html, inv)
-    return HTMLResponse(content=html)
+    return HTMLResponse(content=content.decode(), headers=headers)
+
+
+async def _zip_render(invoice_id: str):
+    """pdf_zip render callback: cached file if present, else render; waits while the pool is busy."""
+    cached = pdf_cache.lookup(invoice_id)
+    if cached:
+        with open(cached.path, 'rb') as f:
+            return f.read(), cached.path.rsplit('.', 1)[-1], True
+    while True:
+        try:
+            res = await _render_and_cache(invoice_id)
+            return (res[0], res[1], False) if res else None
+        except pdf_pool.PdfPoolBusy:
+            # share the pool with interactive downloads instead of failing the export
+            await asyncio.sleep(0.5)
+
+
+@router.post('/invoices/export/pdf')
+async def export_invoice_pdfs(payload: InvoicePdfExport):
+    """Stream a ZIP of invoice PDFs for `invoice_ids` or a `date_from`..`date_to` range.
+
+    Follow progress at GET /billing/invoices/export/pdf/{X-Export-Id}.
+    """
+    if payload.invoice_ids is None and not (payload.date_from or payload.date_to):
+        raise HTTPException(status_code=400, detail='Provide invoice_ids or a date range')
+    try:
+        start, end = export_module.parse_range(payload.date_from, payload.date_to)
+    except export_module.InvalidExport as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+
+    if payload.invoice_ids is not None:
+        try:
+            for invoice_id in payload.invoice_ids:
+                uuid.UUID(str(invoice_id))
+        except ValueError:
+            raise HTTPException(status_code=400, detail=f'Invalid invoice id: {invoice_id}')
+
+    total = len(set(payload.invoice_ids)) if payload.invoice_ids is not None else None
+    # read the first page before answering 200, so a failing query is a 500 and not a
+    # truncated ZIP
+    pages = async_repository.iter_invoice_headers(payload.invoice_ids, start, end)
+    try:
+        first = await pages.__anext__()
+    except StopAsyncIteration:
+        first = None
+    except Exception as exc:
+        logging.exception('export_invoice_pdfs: header query failed: %s', exc)
+        raise HTTPException(status_code=500, detail='Failed to list invoices')
+
+    async def header_pages():
+        if first is None:
+            return
+        yield first
+        async for page in pages:
+            yield page
+
+    state = pdf_zip.new_export(total)
+    name = f"invoices_{payload.date_from or 'selected'}_{payload.date_to or ''}".rstrip('_') + '.zip'
+    return StreamingResponse(pdf_zip.stream_zip(state, header_pages(), _zip_render), media_type='application/zip',
+                             headers={'Content-Disposition': f'attachment; filename="{name}"', 'X-Export-Id': state['id']})
+
+
+@router.get('/invoices/export/pdf/{export_id}')
+async def export_invoice_pdfs_progress(export_id: str):
+    state = pdf_zip.progress(export_id)
+    if not state:
+        raise HTTPException(status_code=404, detail='Export not found')
+    return {'status': 'success', 'data': state}
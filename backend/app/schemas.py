@@ -83,6 +83,13 @@ class InvoiceResponse(BaseModel):
     created_at: Optional[str] = None
 
 
+class InvoicePdfExport(BaseModel):
+    # either explicit invoice ids or an inclusive IST date range (YYYY-MM-DD)
+    invoice_ids: Optional[List[str]] = Field(None, max_length=5000)
+    date_from: Optional[str] = None
+    date_to: Optional[str] = None
+
+
 class Supplier(BaseModel):
     id: Optional[str]
     name: str
@@ -0,0 +1,135 @@
+"""Block-allocated (hi/lo) sequences backed by the `counters` table.
+
+Each worker reserves a block of values with one `allocate_counter_block` call and then
+hands values out locally, so most inserts need no round trip for their code. Blocks never
+overlap across workers because the database advances the counter by the whole block size;
+values left in a block when a worker exits are skipped (codes may have gaps, never repeats).
+
+This module holds only the local bookkeeping; `repository` / `async_repository` fetch blocks.
+"""
+from collections import deque
+from datetime import date, datetime, timedelta, timezone
+from typing import Any, Dict, Optional, Tuple
+import logging
+import os
+import threading
+
+SEQUENCE_BLOCK_SIZE = max(1, int(os.getenv('SEQUENCE_BLOCK_SIZE', '20')))
+
+# Invoice numbers restart every Indian financial year (April-March), eg. INV/2026-27/000123.
+# GST requires a consecutive series, so the default block size is 1: numbers increase across
+# workers in issue order and a restarting worker leaves no gap. Larger blocks save the counter
+# round trip per invoice but number out of order across workers and skip the unused rest of a
+# block on restart.
+DEFAULT_INVOICE_NUMBER_FORMAT = 'INV/{fy}/{seq:06d}'
+INVOICE_NUMBER_FORMAT = os.getenv('INVOICE_NUMBER_FORMAT', DEFAULT_INVOICE_NUMBER_FORMAT)
+INVOICE_NUMBER_BLOCK_SIZE = max(1, int(os.getenv('INVOICE_NUMBER_BLOCK_SIZE', '1')))
+_IST = timezone(timedelta(hours=5, minutes=30))
+
+
+class BlockSequence:
+    """Thread-safe local pool of values reserved from one counter."""
+
+    def __init__(self, name: str, block_size: int):
+        self.name = name
+        self.block_size = max(1, int(block_size))
+        self._blocks: 'deque[list]' = deque()
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+        self.blocks_allocated = 0
+        self.values_issued = 0
+
+    def _check_pid(self) -> None:
+        # a forked child must not hand out values from its parent's block
+        if self._pid != os.getpid():
+            self._blocks.clear()
+            self._pid = os.getpid()
+
+    def take(self) -> Optional[int]:
+        """Return the next locally reserved value, or None when a new block is needed."""
+        with self._lock:
+            self._check_pid()
+            while self._blocks:
+                block = self._blocks[0]
+                if block[0] <= block[1]:
+                    value = block[0]
+                    block[0] += 1
+                    self.values_issued += 1
+                    return value
+                self._blocks.popleft()
+            return None
+
+    def add_block(self, first: int, last: int) -> None:
+        """Queue a reserved block [first, last]; concurrent refills are kept, not dropped."""
+        with self._lock:
+            self._check_pid()
+            self._blocks.append([int(first), int(last)])
+            self.blocks_allocated += 1
+
+    def remaining(self) -> int:
+        with self._lock:
+            return sum(max(0, b[1] - b[0] + 1) for b in self._blocks)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'block_size': self.block_size,
+            'blocks_allocated': self.blocks_allocated,
+            'values_issued': self.values_issued,
+            'remaining': self.remaining(),
+        }
+
+
+_sequences: Dict[str, BlockSequence] = {}
+_registry_lock = threading.Lock()
+
+
+def get_sequence(name: str, block_size: Optional[int] = None) -> BlockSequence:
+    """Return the process-wide BlockSequence for a counter name."""
+    seq = _sequences.get(name)
+    if seq is None:
+        with _registry_lock:
+            seq = _sequences.get(name)
+            if seq is None:
+                seq = BlockSequence(name, block_size or SEQUENCE_BLOCK_SIZE)
+                _sequences[name] = seq
+    return seq
+
+
+def parse_block(data) -> Optional[Tuple[int, int]]:
+    """Parse the (first_value, last_value) row returned by the allocate_counter_block RPC."""
+    row = data[0] if isinstance(data, list) and data else data
+    if not isinstance(row, dict):
+        return None
+    try:
+        first, last = int(row['first_value']), int(row['last_value'])
+    except (KeyError, TypeError, ValueError):
+        return None
+    return (first, last) if first <= last else None
+
+
+def local_today() -> date:
+    """Today's date in IST, the calendar invoices are numbered and reported by."""
+    return datetime.now(_IST).date()
+
+
+def financial_year(day: Optional[date] = None) -> str:
+    """Indian financial year label for a date, eg. 2026-04-01 .. 2027-03-31 -> '2026-27'."""
+    day = day or local_today()
+    start = day.year if day.month >= 4 else day.year - 1
+    return f"{start}-{(start + 1) % 100:02d}"
+
+
+def invoice_counter_name(fy: str) -> str:
+    return f'invoice_number:{fy}'
+
+
+def format_invoice_number(fy: str, seq: int) -> str:
+    try:
+        return INVOICE_NUMBER_FORMAT.format(fy=fy, seq=seq)
+    except (KeyError, IndexError, ValueError):
+        logging.warning('Invalid INVOICE_NUMBER_FORMAT %r; using %r', INVOICE_NUMBER_FORMAT, DEFAULT_INVOICE_NUMBER_FORMAT)
+        return DEFAULT_INVOICE_NUMBER_FORMAT.format(fy=fy, seq=seq)
+
+
+def sequence_stats() -> Dict[str, Dict[str, Any]]:
+    return {name: seq.stats() for name, seq in list(_sequences.items())}
@@ -0,0 +1,91 @@
+"""Group commit for concurrent stock updates within one API worker.
+
+`async_repository.apply_stock_lines` submits its request here. If no batch is in flight, the
+request is sent at once as a batch of one. Requests that arrive while a batch is in flight
+queue up, and all of them (up to STOCK_BATCH_MAX) go out together as the next batch, one
+apply_stock_batch round trip (migration 0023). So N concurrent invoices for a hot product cost
+roughly one round trip per batch instead of N lock waits, and an idle worker adds no delay.
+Every caller still gets its own apply_stock_lines result (ok, or insufficient_stock ...).
+
+Until apply_stock_batch is installed, or if a batch fails as a whole, requests fall back to
+one apply_stock_lines call each. STOCK_GROUP_COMMIT=false always calls them one at a time.
+"""
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+import asyncio
+import logging
+import os
+
+STOCK_GROUP_COMMIT = os.getenv('STOCK_GROUP_COMMIT', 'true').lower() not in ('0', 'false', 'no')
+STOCK_BATCH_MAX = max(1, int(os.getenv('STOCK_BATCH_MAX', '100')))
+
+# requests -> results in the same order; None when the batch RPC is not installed
+BatchFn = Callable[[List[Dict]], Awaitable[Optional[List[Optional[Dict]]]]]
+SingleFn = Callable[[Dict], Awaitable[Optional[Dict]]]
+
+_queue: List[Tuple[Dict, asyncio.Future]] = []
+_drain: Optional[asyncio.Task] = None
+_batch_supported = True
+_stats: Dict[str, Any] = {'requests': 0, 'batches': 0, 'batched_requests': 0, 'max_batch': 0, 'fallbacks': 0}
+
+
+async def submit(request: Dict, run_batch: BatchFn, run_single: SingleFn) -> Optional[Dict]:
+    global _drain
+    if not STOCK_GROUP_COMMIT or not _batch_supported:
+        return await run_single(request)
+    loop = asyncio.get_running_loop()
+    if _drain is None or _drain.done() or _drain.get_loop() is not loop:
+        # nothing in flight on this loop (futures left by a previous loop are dead)
+        _queue.clear()
+        _drain = loop.create_task(_drain_queue(run_batch, run_single))
+    fut = loop.create_future()
+    _queue.append((request, fut))
+    _stats['requests'] += 1
+    return await fut
+
+
+async def _drain_queue(run_batch: BatchFn, run_single: SingleFn) -> None:
+    # runs while requests keep arriving; each pass commits what queued during the previous one
+    await asyncio.sleep(0)
+    while _queue:
+        batch = _queue[:STOCK_BATCH_MAX]
+        del _queue[:len(batch)]
+        try:
+            results = await _commit([req for req, _ in batch], run_batch, run_single)
+        except Exception as exc:
+            logging.exception('Stock batch failed: %s', exc)
+            results = [{'ok': False, 'reason': 'error'}] * len(batch)
+        for (_, fut), result in zip(batch, results):
+            if not fut.done():
+                fut.set_result(result)
+
+
+async def _commit(requests: List[Dict], run_batch: BatchFn, run_single: SingleFn) -> List[Optional[Dict]]:
+    global _batch_supported
+    if _batch_supported:
+        try:
+            results = await run_batch(requests)
+        except Exception as exc:
+            # one malformed request fails the whole transaction: retry them one by one so the
+            # others still go through and each caller gets its own answer
+            logging.warning('apply_stock_batch failed for %s requests, applying them singly: %s', len(requests), exc)
+            _stats['fallbacks'] += 1
+            results = None
+        else:
+            if results is None:
+                logging.info('apply_stock_batch RPC not installed; stock updates are not group-committed')
+                _batch_supported = False
+            elif len(results) != len(requests):
+                logging.error('apply_stock_batch returned %s results for %s requests', len(results), len(requests))
+                _stats['fallbacks'] += 1
+            else:
+                _stats['batches'] += 1
+                _stats['batched_requests'] += len(requests)
+                _stats['max_batch'] = max(_stats['max_batch'], len(requests))
+                return results
+    return list(await asyncio.gather(*(run_single(r) for r in requests)))
+
+
+def coordinator_stats() -> Dict[str, Any]:
+    batches = _stats['batches']
+    return {'enabled': STOCK_GROUP_COMMIT and _batch_supported, 'batch_max': STOCK_BATCH_MAX, 'queued': len(_queue), **_stats,
+            'avg_batch': _stats['batched_requests'] / batches if batches else 0.0}
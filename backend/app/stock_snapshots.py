@@ -0,0 +1,48 @@
+"""Point-in-time stock from the snapshot table (migration 0021).
+
+`stock_as_of` in the database adds the movements since each product's latest snapshot to
+that snapshot, so "stock as of 31 March" reads a handful of rows per product rather than
+the whole stock_movements history. Times follow the IST calendar used elsewhere: a bare date
+means the end of that day.
+"""
+from datetime import date, datetime, time, timedelta
+from typing import Dict, List, Optional
+
+from .export import IST
+
+
+class InvalidAsOf(ValueError):
+    pass
+
+
+def parse_as_of(value: Optional[str]) -> datetime:
+    """`YYYY-MM-DD` -> end of that IST day; ISO datetime (naive = IST) as given; None -> now."""
+    if not value:
+        return datetime.now(IST)
+    try:
+        if len(value) == 10:
+            return datetime.combine(date.fromisoformat(value) + timedelta(days=1), time.min, IST)
+        at = datetime.fromisoformat(value)
+    except ValueError:
+        raise InvalidAsOf('at must be a date (YYYY-MM-DD) or an ISO datetime')
+    return at if at.tzinfo else at.replace(tzinfo=IST)
+
+
+def default_snapshot_time() -> datetime:
+    """Start of the current IST day: late enough to be useful, early enough that no movement
+    stamped before it can still be uncommitted."""
+    return datetime.combine(datetime.now(IST).date(), time.min, IST)
+
+
+def shape_rows(rows) -> List[Dict]:
+    out = []
+    for r in rows or []:
+        out.append({
+            'product_id': r.get('product_id'),
+            'name': r.get('name'),
+            'qty': int(r.get('qty') or 0),
+            'unit_cost': float(r['unit_cost']) if r.get('unit_cost') is not None else None,
+            'value': float(r.get('value') or 0),
+            'snapshot_as_of': r.get('snapshot_as_of'),
+        })
+    return out
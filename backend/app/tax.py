@@ -1,5 +1,5 @@
 from decimal import Decimal, ROUND_HALF_UP, getcontext
-from typing import List, Dict
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
 
 getcontext().prec = 28
 
@@ -52,3 +52,121 @@ def calculate_invoice_taxes(supplier_state: str, customer_state: str, items: Lis
         'total_tax': total_tax,
         'total': total,
     }
+
+
+# --- Batch engine -------------------------------------------------------------------------
+# Same results as calculate_invoice_taxes, computed in integer minor units: amounts in paise,
+# rates in hundredths of a percent (18% -> 1800). Line tax is net * rate / 10000 paise (halved
+# for CGST/SGST), rounded half away from zero like ROUND_HALF_UP, so every figure matches the
+# Decimal path exactly for prices with at most 2 decimals and rates with at most 2 decimals.
+# NumPy is used when installed and the values fit comfortably in int64.
+
+try:
+    import numpy as np
+    _HAS_NUMPY = True
+except Exception:
+    np = None
+    _HAS_NUMPY = False
+
+# net paise * rate (x2 for rounding) must stay below 2**63 for the int64 path
+_NUMPY_SAFE_PRODUCT = 2 ** 61
+
+BATCH_FIELDS = ('subtotal', 'cgst', 'sgst', 'igst', 'total_tax', 'total')
+
+
+def to_minor(value, scale: int = 100) -> int:
+    """Exact integer value * scale (eg. Decimal('10.05') -> 1005); ValueError if not exact."""
+    d = Decimal(str(value or 0)) * scale
+    if d != d.to_integral_value():
+        raise ValueError(f'{value!r} has more precision than 1/{scale}')
+    return int(d)
+
+
+def _round_div(num: int, den: int) -> int:
+    """num / den rounded half away from zero (Decimal ROUND_HALF_UP), den > 0."""
+    q = (2 * abs(num) + den) // (2 * den)
+    return q if num >= 0 else -q
+
+
+def line_tax_minor(net: int, rate_bp: int, intra: bool) -> Tuple[int, int, int]:
+    """(cgst, sgst, igst) paise for one line of `net` paise at `rate_bp` hundredths of a percent."""
+    if intra:
+        half = _round_div(net * rate_bp, 20000)
+        return half, half, 0
+    return 0, 0, _round_div(net * rate_bp, 10000)
+
+
+def invoice_columns(invoices: Iterable[Tuple[bool, List[Dict]]]):
+    """Build batch columns from (intra, items) pairs, items shaped as for calculate_invoice_taxes."""
+    offsets, intra, qty, price, rate = [0], [], [], [], []
+    for is_intra, items in invoices:
+        intra.append(bool(is_intra))
+        for it in items:
+            qty.append(int(it['qty']))
+            price.append(to_minor(it['unit_price']))
+            rate.append(to_minor(it.get('tax_percent') or 0))
+        offsets.append(len(qty))
+    return offsets, intra, qty, price, rate
+
+
+def calculate_taxes_batch(offsets: Sequence[int], intra: Sequence[bool], qty: Sequence[int],
+                          unit_price: Sequence[int], tax_percent: Sequence[int],
+                          use_numpy: Optional[bool] = None) -> Dict[str, List[int]]:
+    """Taxes for many invoices at once, from columnar line arrays.
+
+    Invoice i owns lines offsets[i]:offsets[i+1]; intra[i] says whether CGST/SGST applies.
+    unit_price is in paise and tax_percent in hundredths of a percent (see `invoice_columns`).
+    Returns {field: [paise per invoice]} for the fields in BATCH_FIELDS.
+    """
+    if len(offsets) != len(intra) + 1:
+        raise ValueError('offsets must have one more entry than intra')
+    if use_numpy is None:
+        use_numpy = _HAS_NUMPY
+    if use_numpy and _HAS_NUMPY and qty:
+        out = _batch_numpy(offsets, intra, qty, unit_price, tax_percent)
+        if out is not None:
+            return out
+    return _batch_python(offsets, intra, qty, unit_price, tax_percent)
+
+
+def _batch_python(offsets, intra, qty, unit_price, tax_percent) -> Dict[str, List[int]]:
+    out = {f: [] for f in BATCH_FIELDS}
+    for i, is_intra in enumerate(intra):
+        subtotal = cgst = sgst = igst = 0
+        den = 20000 if is_intra else 10000
+        for j in range(offsets[i], offsets[i + 1]):
+            net = qty[j] * unit_price[j]
+            subtotal += net
+            t = _round_div(net * tax_percent[j], den)
+            if is_intra:
+                cgst += t
+                sgst += t
+            else:
+                igst += t
+        total_tax = cgst + sgst + igst
+        for f, v in zip(BATCH_FIELDS, (subtotal, cgst, sgst, igst, total_tax, subtotal + total_tax)):
+            out[f].append(v)
+    return out
+
+
+def _batch_numpy(offsets, intra, qty, unit_price, tax_percent) -> Optional[Dict[str, List[int]]]:
+    off = np.asarray(offsets, dtype=np.int64)
+    net = np.asarray(qty, dtype=np.int64) * np.asarray(unit_price, dtype=np.int64)
+    rate = np.asarray(tax_percent, dtype=np.int64)
+    if int(np.abs(net).max()) * max(int(np.abs(rate).max()), 1) >= _NUMPY_SAFE_PRODUCT:
+        return None  # could overflow int64; the Python path has arbitrary precision
+    line_intra = np.repeat(np.asarray(intra, dtype=bool), np.diff(off))
+    den = np.where(line_intra, 20000, 10000)
+    num = net * rate
+    t = np.sign(num) * ((2 * np.abs(num) + den) // (2 * den))
+
+    def seg_sum(x):
+        cs = np.concatenate(([0], np.cumsum(x)))
+        return cs[off[1:]] - cs[off[:-1]]
+
+    subtotal = seg_sum(net)
+    half = seg_sum(np.where(line_intra, t, 0))
+    igst = seg_sum(np.where(line_intra, 0, t))
+    total_tax = 2 * half + igst
+    cols = (subtotal, half, half, igst, total_tax, subtotal + total_tax)
+    return {f: [int(v) for v in c] for f, c in zip(BATCH_FIELDS, cols)}
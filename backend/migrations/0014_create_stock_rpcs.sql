@@ -0,0 +1,192 @@
+-- Migration 0014: atomic stock RPCs
+-- Availability check, reservation / movement insert and the products.stock_qty adjustment
+-- happen inside one function call for a whole list of lines, so the application needs a
+-- single round trip per invoice/sale/purchase and there is no read-modify-write window.
+--
+-- Product rows are locked FOR UPDATE in id order before anything is checked, so concurrent
+-- calls touching the same products serialize instead of deadlocking or losing updates.
+-- Every function returns jsonb: {"ok": true, ...} or {"ok": false, "reason": ..., "product_id": ...}.
+
+BEGIN;
+
+-- Apply signed stock changes and write one stock_movements row per line.
+-- p_lines: [{"product_id": uuid, "change": int, "unit_cost": numeric?, "reference_id": uuid?}]
+-- Negative changes are rejected when they would take available stock (on hand minus active
+-- reservations) below zero, unless p_allow_negative is true.
+CREATE OR REPLACE FUNCTION apply_stock_lines(
+  p_lines jsonb,
+  p_reason text,
+  p_reference_type text DEFAULT NULL,
+  p_reference_id uuid DEFAULT NULL,
+  p_created_by text DEFAULT NULL,
+  p_allow_negative boolean DEFAULT false,
+  p_meta jsonb DEFAULT NULL
+) RETURNS jsonb AS $$
+DECLARE
+  v_short record;
+  v_movements jsonb;
+BEGIN
+  PERFORM 1 FROM products
+  WHERE id IN (SELECT (l->>'product_id')::uuid FROM jsonb_array_elements(p_lines) l)
+  ORDER BY id
+  FOR UPDATE;
+
+  SELECT w.product_id,
+         (p.id IS NULL) AS missing,
+         COALESCE(p.stock_qty, 0) - COALESCE(r.reserved, 0) AS available
+    INTO v_short
+    FROM (
+      SELECT (l->>'product_id')::uuid AS product_id, SUM((l->>'change')::int) AS change
+      FROM jsonb_array_elements(p_lines) l
+      GROUP BY 1
+    ) w
+    LEFT JOIN products p ON p.id = w.product_id
+    LEFT JOIN (
+      SELECT product_id, SUM(qty) AS reserved
+      FROM stock_reservations
+      WHERE status = 'active'
+      GROUP BY product_id
+    ) r ON r.product_id = w.product_id
+   WHERE p.id IS NULL
+      OR (NOT p_allow_negative AND w.change < 0
+          AND COALESCE(p.stock_qty, 0) - COALESCE(r.reserved, 0) + w.change < 0)
+   LIMIT 1;
+
+  IF FOUND THEN
+    RETURN jsonb_build_object(
+      'ok', false,
+      'reason', CASE WHEN v_short.missing THEN 'not_found' ELSE 'insufficient_stock' END,
+      'product_id', v_short.product_id,
+      'available', v_short.available);
+  END IF;
+
+  WITH ins AS (
+    INSERT INTO stock_movements (product_id, change, reason, reference_type, reference_id, unit_cost, created_by, meta)
+    SELECT (l->>'product_id')::uuid,
+           (l->>'change')::int,
+           p_reason,
+           p_reference_type,
+           COALESCE((l->>'reference_id')::uuid, p_reference_id),
+           (l->>'unit_cost')::numeric,
+           p_created_by,
+           p_meta
+    FROM jsonb_array_elements(p_lines) l
+    RETURNING *
+  )
+  SELECT COALESCE(jsonb_agg(to_jsonb(ins)), '[]'::jsonb) INTO v_movements FROM ins;
+
+  UPDATE products p
+     SET stock_qty = p.stock_qty + w.change
+    FROM (
+      SELECT (l->>'product_id')::uuid AS product_id, SUM((l->>'change')::int) AS change
+      FROM jsonb_array_elements(p_lines) l
+      GROUP BY 1
+    ) w
+   WHERE p.id = w.product_id;
+
+  RETURN jsonb_build_object('ok', true, 'movements', v_movements);
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER SET search_path = public;
+
+-- Reserve stock for several lines at once; all lines are reserved or none are.
+-- p_lines: [{"product_id": uuid, "qty": int}]
+CREATE OR REPLACE FUNCTION reserve_stock_lines(
+  p_lines jsonb,
+  p_invoice_id uuid DEFAULT NULL,
+  p_expires_at timestamptz DEFAULT NULL,
+  p_created_by text DEFAULT NULL,
+  p_meta jsonb DEFAULT NULL
+) RETURNS jsonb AS $$
+DECLARE
+  v_short record;
+  v_reservations jsonb;
+BEGIN
+  PERFORM 1 FROM products
+  WHERE id IN (SELECT (l->>'product_id')::uuid FROM jsonb_array_elements(p_lines) l)
+  ORDER BY id
+  FOR UPDATE;
+
+  SELECT w.product_id,
+         (p.id IS NULL) AS missing,
+         COALESCE(p.stock_qty, 0) - COALESCE(r.reserved, 0) AS available
+    INTO v_short
+    FROM (
+      SELECT (l->>'product_id')::uuid AS product_id, SUM((l->>'qty')::int) AS qty
+      FROM jsonb_array_elements(p_lines) l
+      GROUP BY 1
+    ) w
+    LEFT JOIN products p ON p.id = w.product_id
+    LEFT JOIN (
+      SELECT product_id, SUM(qty) AS reserved
+      FROM stock_reservations
+      WHERE status = 'active'
+      GROUP BY product_id
+    ) r ON r.product_id = w.product_id
+   WHERE p.id IS NULL
+      OR COALESCE(p.stock_qty, 0) - COALESCE(r.reserved, 0) < w.qty
+   LIMIT 1;
+
+  IF FOUND THEN
+    RETURN jsonb_build_object(
+      'ok', false,
+      'reason', CASE WHEN v_short.missing THEN 'not_found' ELSE 'insufficient_stock' END,
+      'product_id', v_short.product_id,
+      'available', v_short.available);
+  END IF;
+
+  WITH ins AS (
+    INSERT INTO stock_reservations (product_id, qty, invoice_id, expires_at, created_by, meta)
+    SELECT (l->>'product_id')::uuid, (l->>'qty')::int, p_invoice_id, p_expires_at, p_created_by, p_meta
+    FROM jsonb_array_elements(p_lines) l
+    RETURNING *
+  )
+  SELECT COALESCE(jsonb_agg(to_jsonb(ins)), '[]'::jsonb) INTO v_reservations FROM ins;
+
+  RETURN jsonb_build_object('ok', true, 'reservations', v_reservations);
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER SET search_path = public;
+
+-- Consume active reservations: mark them consumed, write the outbound movements and
+-- decrement products.stock_qty in a single statement. Reservations that are no longer
+-- active are skipped, so retrying a consume is harmless.
+CREATE OR REPLACE FUNCTION consume_reservations(
+  p_ids uuid[],
+  p_created_by text DEFAULT NULL
+) RETURNS jsonb AS $$
+DECLARE
+  v_consumed jsonb;
+BEGIN
+  PERFORM 1 FROM products
+  WHERE id IN (SELECT product_id FROM stock_reservations WHERE id = ANY(p_ids))
+  ORDER BY id
+  FOR UPDATE;
+
+  WITH upd AS (
+    UPDATE stock_reservations
+       SET status = 'consumed'
+     WHERE id = ANY(p_ids) AND status = 'active'
+    RETURNING id, product_id, qty
+  ), mv AS (
+    INSERT INTO stock_movements (product_id, change, reason, reference_type, reference_id, created_by)
+    SELECT product_id, -qty, 'sale', 'reservation', id, p_created_by FROM upd
+    RETURNING product_id, change
+  ), stock AS (
+    UPDATE products p
+       SET stock_qty = p.stock_qty + agg.change
+      FROM (SELECT product_id, SUM(change) AS change FROM mv GROUP BY product_id) agg
+     WHERE p.id = agg.product_id
+    RETURNING p.id
+  )
+  SELECT COALESCE(jsonb_agg(jsonb_build_object('id', id, 'product_id', product_id, 'qty', qty)), '[]'::jsonb)
+    INTO v_consumed
+    FROM upd;
+
+  RETURN jsonb_build_object('ok', true, 'consumed', v_consumed);
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER SET search_path = public;
+
+COMMIT;
+
+-- Usage (PostgREST): POST /rest/v1/rpc/apply_stock_lines
+--   {"p_lines": [{"product_id": "...", "change": -2}], "p_reason": "sale",
+--    "p_reference_type": "invoice", "p_reference_id": "..."}
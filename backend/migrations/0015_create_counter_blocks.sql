@@ -0,0 +1,21 @@
+-- Migration 0015: block allocation for counters (hi/lo sequences)
+-- Workers reserve p_size values at once and hand them out locally (see backend/app/sequences.py).
+-- The counter row is advanced by the whole block inside one statement, so blocks never overlap
+-- across workers. A missing counter row is created starting at 1.
+
+CREATE OR REPLACE FUNCTION allocate_counter_block(p_name text, p_size integer DEFAULT 1)
+RETURNS TABLE(first_value bigint, last_value bigint) AS $$
+BEGIN
+  IF p_size IS NULL OR p_size < 1 THEN
+    RAISE EXCEPTION 'allocate_counter_block: p_size must be >= 1';
+  END IF;
+
+  INSERT INTO counters AS c (name, value)
+  VALUES (p_name, p_size)
+  ON CONFLICT (name) DO UPDATE SET value = c.value + EXCLUDED.value
+  RETURNING c.value - p_size + 1, c.value INTO first_value, last_value;
+  RETURN NEXT;
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER SET search_path = public;
+
+-- Usage (PostgREST): POST /rest/v1/rpc/allocate_counter_block {"p_name": "customer_code", "p_size": 20}
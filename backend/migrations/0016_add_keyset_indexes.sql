@@ -0,0 +1,13 @@
+-- Migration 0016: composite (created_at, id) indexes for keyset pagination
+-- List endpoints order by (created_at, id) and continue after the last row of the previous
+-- page, so each page is an index range scan regardless of how deep it is.
+-- idx_invoices_created_at stays for created_at range queries (reports/exports).
+
+BEGIN;
+
+CREATE INDEX IF NOT EXISTS idx_invoices_created_at_id ON public.invoices (created_at, id);
+CREATE INDEX IF NOT EXISTS idx_customers_created_at_id ON public.customers (created_at, id);
+CREATE INDEX IF NOT EXISTS idx_products_created_at_id ON public.products (created_at, id);
+CREATE INDEX IF NOT EXISTS idx_suppliers_created_at_id ON public.suppliers (created_at, id);
+
+COMMIT;
@@ -0,0 +1,143 @@
+-- Migration 0017: incrementally maintained dashboard counters for GET /billing/stats
+-- billing_stats holds revenue / tax / invoice count per period:
+--   'all', 'day:YYYY-MM-DD' and 'month:YYYY-MM' (calendar periods in Asia/Kolkata).
+-- Active customers and low-stock products are kept in `counters` as 'stats:customers' and
+-- 'stats:low_stock_products'. Triggers apply deltas on every write, so reading the stats is a
+-- few index lookups whatever the size of invoices / products.
+--
+-- Every invoice insert touches the same 'all', month and day periods, so each period is split
+-- into billing_stats_slots() rows. A transaction bumps the slot picked by its backend pid, so
+-- concurrent invoice inserts do not queue on one row lock until commit. Readers sum the slots.
+
+BEGIN;
+
+CREATE TABLE IF NOT EXISTS billing_stats (
+  period text NOT NULL,
+  slot smallint NOT NULL DEFAULT 0,
+  revenue numeric(16,2) NOT NULL DEFAULT 0,
+  tax numeric(16,2) NOT NULL DEFAULT 0,
+  invoices bigint NOT NULL DEFAULT 0,
+  updated_at timestamptz NOT NULL DEFAULT now(),
+  PRIMARY KEY (period, slot)
+);
+
+CREATE OR REPLACE FUNCTION billing_stats_slots() RETURNS integer AS $$
+  SELECT 16;
+$$ LANGUAGE sql IMMUTABLE;
+
+-- Products at or below this quantity count as low stock. Redefine the function to change it,
+-- then run SELECT rebuild_billing_stats(); to recount.
+CREATE OR REPLACE FUNCTION low_stock_threshold() RETURNS integer AS $$
+  SELECT 5;
+$$ LANGUAGE sql IMMUTABLE;
+
+CREATE OR REPLACE FUNCTION bump_billing_stats(p_at timestamptz, p_revenue numeric, p_tax numeric, p_count integer)
+RETURNS void AS $$
+DECLARE
+  local_day date := (COALESCE(p_at, now()) AT TIME ZONE 'Asia/Kolkata')::date;
+  v_slot smallint := pg_backend_pid() % billing_stats_slots();
+BEGIN
+  INSERT INTO billing_stats AS s (period, slot, revenue, tax, invoices)
+  VALUES ('all', v_slot, COALESCE(p_revenue, 0), COALESCE(p_tax, 0), p_count),
+         ('day:' || to_char(local_day, 'YYYY-MM-DD'), v_slot, COALESCE(p_revenue, 0), COALESCE(p_tax, 0), p_count),
+         ('month:' || to_char(local_day, 'YYYY-MM'), v_slot, COALESCE(p_revenue, 0), COALESCE(p_tax, 0), p_count)
+  ON CONFLICT (period, slot) DO UPDATE
+    SET revenue = s.revenue + EXCLUDED.revenue,
+        tax = s.tax + EXCLUDED.tax,
+        invoices = s.invoices + EXCLUDED.invoices,
+        updated_at = now();
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION bump_stats_counter(p_name text, p_delta integer)
+RETURNS void AS $$
+BEGIN
+  IF p_delta = 0 THEN
+    RETURN;
+  END IF;
+  INSERT INTO counters AS c (name, value) VALUES (p_name, p_delta)
+  ON CONFLICT (name) DO UPDATE SET value = c.value + EXCLUDED.value;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION billing_stats_invoices_trg() RETURNS trigger AS $$
+BEGIN
+  IF TG_OP IN ('UPDATE', 'DELETE') THEN
+    PERFORM bump_billing_stats(OLD.created_at, -OLD.total_amount, -OLD.total_tax, -1);
+  END IF;
+  IF TG_OP IN ('INSERT', 'UPDATE') THEN
+    PERFORM bump_billing_stats(NEW.created_at, NEW.total_amount, NEW.total_tax, 1);
+  END IF;
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION billing_stats_customers_trg() RETURNS trigger AS $$
+BEGIN
+  PERFORM bump_stats_counter('stats:customers', CASE TG_OP WHEN 'INSERT' THEN 1 ELSE -1 END);
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION billing_stats_products_trg() RETURNS trigger AS $$
+DECLARE
+  was_low integer := 0;
+  is_low integer := 0;
+BEGIN
+  IF TG_OP IN ('UPDATE', 'DELETE') AND OLD.archived IS NOT TRUE AND OLD.stock_qty <= low_stock_threshold() THEN
+    was_low := 1;
+  END IF;
+  IF TG_OP IN ('INSERT', 'UPDATE') AND NEW.archived IS NOT TRUE AND NEW.stock_qty <= low_stock_threshold() THEN
+    is_low := 1;
+  END IF;
+  PERFORM bump_stats_counter('stats:low_stock_products', is_low - was_low);
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS billing_stats_invoices ON invoices;
+CREATE TRIGGER billing_stats_invoices
+  AFTER INSERT OR DELETE OR UPDATE OF total_amount, total_tax, created_at ON invoices
+  FOR EACH ROW EXECUTE FUNCTION billing_stats_invoices_trg();
+
+DROP TRIGGER IF EXISTS billing_stats_customers ON customers;
+CREATE TRIGGER billing_stats_customers
+  AFTER INSERT OR DELETE ON customers
+  FOR EACH ROW EXECUTE FUNCTION billing_stats_customers_trg();
+
+DROP TRIGGER IF EXISTS billing_stats_products ON products;
+CREATE TRIGGER billing_stats_products
+  AFTER INSERT OR DELETE OR UPDATE OF stock_qty, archived ON products
+  FOR EACH ROW EXECUTE FUNCTION billing_stats_products_trg();
+
+-- Recount everything from the base tables (initial backfill, or after changing the threshold).
+CREATE OR REPLACE FUNCTION rebuild_billing_stats() RETURNS void AS $$
+BEGIN
+  LOCK TABLE invoices, customers, products IN SHARE MODE;
+  DELETE FROM billing_stats;
+  INSERT INTO billing_stats (period, revenue, tax, invoices)
+  SELECT period, SUM(total_amount), SUM(total_tax), COUNT(*)
+  FROM (
+    SELECT COALESCE(total_amount, 0) AS total_amount, COALESCE(total_tax, 0) AS total_tax,
+           (COALESCE(created_at, now()) AT TIME ZONE 'Asia/Kolkata')::date AS local_day
+    FROM invoices
+  ) i
+  CROSS JOIN LATERAL (VALUES
+    ('all'),
+    ('day:' || to_char(i.local_day, 'YYYY-MM-DD')),
+    ('month:' || to_char(i.local_day, 'YYYY-MM'))
+  ) p(period)
+  GROUP BY period;
+
+  INSERT INTO counters (name, value) SELECT 'stats:customers', COUNT(*) FROM customers
+  ON CONFLICT (name) DO UPDATE SET value = EXCLUDED.value;
+  INSERT INTO counters (name, value)
+  SELECT 'stats:low_stock_products', COUNT(*) FROM products
+  WHERE archived IS NOT TRUE AND stock_qty <= low_stock_threshold()
+  ON CONFLICT (name) DO UPDATE SET value = EXCLUDED.value;
+END;
+$$ LANGUAGE plpgsql;
+
+SELECT rebuild_billing_stats();
+
+COMMIT;
@@ -0,0 +1,256 @@
+-- Migration 0018: daily sales rollups for the reports endpoints
+-- Three tables keyed by IST calendar day:
+--   sales_by_product  (day, product_id)  -- from invoice_items
+--   sales_by_customer (day, customer_id) -- from invoices; walk-in sales use the nil UUID
+--   sales_by_state    (day, state)       -- customer state at invoice time ('Unknown' if none)
+-- AFTER INSERT triggers on invoices / invoice_items add each new invoice. Invoices created before
+-- this migration (created_at < rollup_backfill.cutoff) are left to backfill_sales_rollups(), which
+-- backend/scripts/backfill_sales_rollups.py calls in batches, so nothing is counted twice.
+-- sales_report() aggregates the rollups only; its cost depends on days x keys, not on invoices.
+--
+-- Concurrent invoices of one day share rows (same state, popular products, walk-in customer),
+-- so like billing_stats (0017) each key is split into billing_stats_slots() rows. A transaction
+-- adds to the slot picked by its backend pid, so invoice inserts do not queue on one row lock
+-- until commit. sales_report() sums the slots.
+
+BEGIN;
+
+-- per-line tax rate, needed for product tax totals and the GST summaries
+ALTER TABLE invoice_items ADD COLUMN IF NOT EXISTS tax_percent numeric(5,2);
+
+CREATE TABLE IF NOT EXISTS sales_by_product (
+  day date NOT NULL,
+  product_id uuid NOT NULL,
+  invoices bigint NOT NULL DEFAULT 0,   -- invoice lines
+  qty bigint NOT NULL DEFAULT 0,
+  net numeric(16,2) NOT NULL DEFAULT 0,
+  tax numeric(16,2) NOT NULL DEFAULT 0,
+  slot smallint NOT NULL DEFAULT 0,
+  PRIMARY KEY (day, product_id, slot)
+);
+
+CREATE TABLE IF NOT EXISTS sales_by_customer (
+  day date NOT NULL,
+  customer_id uuid NOT NULL,
+  invoices bigint NOT NULL DEFAULT 0,
+  net numeric(16,2) NOT NULL DEFAULT 0,
+  tax numeric(16,2) NOT NULL DEFAULT 0,
+  total numeric(16,2) NOT NULL DEFAULT 0,
+  slot smallint NOT NULL DEFAULT 0,
+  PRIMARY KEY (day, customer_id, slot)
+);
+
+CREATE TABLE IF NOT EXISTS sales_by_state (
+  day date NOT NULL,
+  state text NOT NULL,
+  invoices bigint NOT NULL DEFAULT 0,
+  net numeric(16,2) NOT NULL DEFAULT 0,
+  tax numeric(16,2) NOT NULL DEFAULT 0,
+  total numeric(16,2) NOT NULL DEFAULT 0,
+  slot smallint NOT NULL DEFAULT 0,
+  PRIMARY KEY (day, state, slot)
+);
+
+CREATE TABLE IF NOT EXISTS rollup_backfill (
+  name text PRIMARY KEY,
+  cutoff timestamptz NOT NULL,
+  last_created_at timestamptz,
+  last_id uuid,
+  done boolean NOT NULL DEFAULT false
+);
+
+INSERT INTO rollup_backfill (name, cutoff) VALUES ('sales', now())
+ON CONFLICT (name) DO NOTHING;
+
+CREATE OR REPLACE FUNCTION sales_rollup_cutoff() RETURNS timestamptz AS $$
+  SELECT cutoff FROM rollup_backfill WHERE name = 'sales';
+$$ LANGUAGE sql STABLE;
+
+CREATE OR REPLACE FUNCTION sales_rollup_day(p_at timestamptz) RETURNS date AS $$
+  SELECT (COALESCE(p_at, now()) AT TIME ZONE 'Asia/Kolkata')::date;
+$$ LANGUAGE sql STABLE;
+
+CREATE OR REPLACE FUNCTION add_invoice_to_rollups(p_day date, p_customer_id uuid, p_state text,
+                                                  p_net numeric, p_tax numeric, p_total numeric, p_invoices bigint)
+RETURNS void AS $$
+DECLARE
+  v_slot smallint := pg_backend_pid() % billing_stats_slots();
+BEGIN
+  INSERT INTO sales_by_customer AS s (day, customer_id, slot, invoices, net, tax, total)
+  VALUES (p_day, COALESCE(p_customer_id, '00000000-0000-0000-0000-000000000000'), v_slot, p_invoices,
+          COALESCE(p_net, 0), COALESCE(p_tax, 0), COALESCE(p_total, 0))
+  ON CONFLICT (day, customer_id, slot) DO UPDATE
+    SET invoices = s.invoices + EXCLUDED.invoices, net = s.net + EXCLUDED.net,
+        tax = s.tax + EXCLUDED.tax, total = s.total + EXCLUDED.total;
+
+  INSERT INTO sales_by_state AS s (day, state, slot, invoices, net, tax, total)
+  VALUES (p_day, COALESCE(NULLIF(btrim(p_state), ''), 'Unknown'), v_slot, p_invoices,
+          COALESCE(p_net, 0), COALESCE(p_tax, 0), COALESCE(p_total, 0))
+  ON CONFLICT (day, state, slot) DO UPDATE
+    SET invoices = s.invoices + EXCLUDED.invoices, net = s.net + EXCLUDED.net,
+        tax = s.tax + EXCLUDED.tax, total = s.total + EXCLUDED.total;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION add_item_to_rollup(p_day date, p_product_id uuid, p_lines bigint,
+                                              p_qty bigint, p_net numeric, p_tax numeric)
+RETURNS void AS $$
+DECLARE
+  v_slot smallint := pg_backend_pid() % billing_stats_slots();
+BEGIN
+  IF p_product_id IS NULL THEN
+    RETURN;
+  END IF;
+  INSERT INTO sales_by_product AS s (day, product_id, slot, invoices, qty, net, tax)
+  VALUES (p_day, p_product_id, v_slot, p_lines, COALESCE(p_qty, 0), COALESCE(p_net, 0), COALESCE(p_tax, 0))
+  ON CONFLICT (day, product_id, slot) DO UPDATE
+    SET invoices = s.invoices + EXCLUDED.invoices, qty = s.qty + EXCLUDED.qty,
+        net = s.net + EXCLUDED.net, tax = s.tax + EXCLUDED.tax;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION sales_rollups_invoices_trg() RETURNS trigger AS $$
+DECLARE
+  v_state text;
+BEGIN
+  IF NEW.created_at < sales_rollup_cutoff() THEN
+    RETURN NULL;  -- history: counted by backfill_sales_rollups()
+  END IF;
+  SELECT state INTO v_state FROM customers WHERE id = NEW.customer_id;
+  PERFORM add_invoice_to_rollups(sales_rollup_day(NEW.created_at), NEW.customer_id, v_state,
+                                 NEW.subtotal, NEW.total_tax, NEW.total_amount, 1);
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION sales_rollups_items_trg() RETURNS trigger AS $$
+DECLARE
+  v_at timestamptz;
+  v_net numeric;
+BEGIN
+  SELECT created_at INTO v_at FROM invoices WHERE id = NEW.invoice_id;
+  IF v_at < sales_rollup_cutoff() THEN
+    RETURN NULL;
+  END IF;
+  v_net := COALESCE(NEW.line_total, NEW.qty * NEW.unit_price);
+  PERFORM add_item_to_rollup(sales_rollup_day(v_at), NEW.product_id, 1, NEW.qty, v_net,
+                             round(v_net * COALESCE(NEW.tax_percent, 0) / 100, 2));
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS sales_rollups_invoices ON invoices;
+CREATE TRIGGER sales_rollups_invoices
+  AFTER INSERT ON invoices
+  FOR EACH ROW EXECUTE FUNCTION sales_rollups_invoices_trg();
+
+DROP TRIGGER IF EXISTS sales_rollups_items ON invoice_items;
+CREATE TRIGGER sales_rollups_items
+  AFTER INSERT ON invoice_items
+  FOR EACH ROW EXECUTE FUNCTION sales_rollups_items_trg();
+
+-- Next batch of pre-cutoff invoices after the saved (created_at, id) position.
+CREATE OR REPLACE FUNCTION sales_backfill_batch(p_cutoff timestamptz, p_after_at timestamptz,
+                                                p_after_id uuid, p_batch integer)
+RETURNS TABLE(id uuid, created_at timestamptz, customer_id uuid, subtotal numeric,
+              total_tax numeric, total_amount numeric) AS $$
+  SELECT i.id, i.created_at, i.customer_id, i.subtotal, i.total_tax, i.total_amount
+  FROM invoices i
+  WHERE i.created_at < p_cutoff
+    AND (p_after_at IS NULL OR (i.created_at, i.id) > (p_after_at, p_after_id))
+  ORDER BY i.created_at, i.id
+  LIMIT p_batch;
+$$ LANGUAGE sql STABLE;
+
+-- Fold the next p_batch historical invoices into the rollups and save the position.
+-- Progress is committed with the rollup rows, so the job can be stopped and resumed.
+CREATE OR REPLACE FUNCTION backfill_sales_rollups(p_batch integer DEFAULT 1000)
+RETURNS jsonb AS $$
+DECLARE
+  st rollup_backfill%ROWTYPE;
+  v_n integer;
+  v_last_at timestamptz;
+  v_last_id uuid;
+BEGIN
+  SELECT * INTO st FROM rollup_backfill WHERE name = 'sales' FOR UPDATE;
+  IF st.done THEN
+    RETURN jsonb_build_object('processed', 0, 'done', true);
+  END IF;
+
+  CREATE TEMP TABLE IF NOT EXISTS sales_backfill_rows ON COMMIT DROP AS
+    SELECT * FROM sales_backfill_batch(st.cutoff, st.last_created_at, st.last_id, p_batch);
+
+  PERFORM add_invoice_to_rollups(g.day, g.customer_id, g.state, g.net, g.tax, g.total, g.n)
+  FROM (
+    SELECT sales_rollup_day(b.created_at) AS day, b.customer_id, c.state, count(*) AS n,
+           sum(b.subtotal) AS net, sum(b.total_tax) AS tax, sum(b.total_amount) AS total
+    FROM sales_backfill_rows b LEFT JOIN customers c ON c.id = b.customer_id
+    GROUP BY 1, 2, 3
+  ) g;
+
+  PERFORM add_item_to_rollup(g.day, g.product_id, g.n, g.qty, g.net, g.tax)
+  FROM (
+    SELECT sales_rollup_day(b.created_at) AS day, it.product_id, count(*) AS n, sum(it.qty) AS qty,
+           sum(COALESCE(it.line_total, it.qty * it.unit_price)) AS net,
+           sum(round(COALESCE(it.line_total, it.qty * it.unit_price) * COALESCE(it.tax_percent, 0) / 100, 2)) AS tax
+    FROM sales_backfill_rows b JOIN invoice_items it ON it.invoice_id = b.id
+    GROUP BY 1, 2
+  ) g;
+
+  SELECT count(*) INTO v_n FROM sales_backfill_rows;
+  SELECT b.created_at, b.id INTO v_last_at, v_last_id
+  FROM sales_backfill_rows b ORDER BY b.created_at DESC, b.id DESC LIMIT 1;
+  DROP TABLE sales_backfill_rows;
+
+  UPDATE rollup_backfill
+  SET last_created_at = COALESCE(v_last_at, last_created_at),
+      last_id = COALESCE(v_last_id, last_id),
+      done = v_n < p_batch
+  WHERE name = 'sales';
+  RETURN jsonb_build_object('processed', v_n, 'done', v_n < p_batch);
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER SET search_path = public;
+
+-- Report over the rollups. p_group: 'day' | 'product' | 'customer' | 'state'.
+-- Every grouping sums over the slots of its keys.
+-- `invoices` counts invoice lines for the product grouping; qty is only set for products.
+CREATE OR REPLACE FUNCTION sales_report(p_group text, p_from date, p_to date, p_limit integer DEFAULT 1000)
+RETURNS TABLE(key text, label text, invoices bigint, qty bigint, net numeric, tax numeric, total numeric) AS $$
+BEGIN
+  IF p_group = 'day' THEN
+    RETURN QUERY
+      SELECT s.day::text, s.day::text, sum(s.invoices)::bigint, NULL::bigint, sum(s.net), sum(s.tax), sum(s.total)
+      FROM sales_by_state s WHERE s.day BETWEEN p_from AND p_to
+      GROUP BY s.day ORDER BY s.day LIMIT p_limit;
+  ELSIF p_group = 'state' THEN
+    RETURN QUERY
+      SELECT s.state, s.state, sum(s.invoices)::bigint, NULL::bigint, sum(s.net), sum(s.tax), sum(s.total)
+      FROM sales_by_state s WHERE s.day BETWEEN p_from AND p_to
+      GROUP BY s.state ORDER BY sum(s.total) DESC LIMIT p_limit;
+  ELSIF p_group = 'customer' THEN
+    RETURN QUERY
+      SELECT g.customer_id::text, COALESCE(c.name, 'Walk-in'), g.invoices, NULL::bigint, g.net, g.tax, g.total
+      FROM (
+        SELECT s.customer_id, sum(s.invoices)::bigint AS invoices, sum(s.net) AS net, sum(s.tax) AS tax, sum(s.total) AS total
+        FROM sales_by_customer s WHERE s.day BETWEEN p_from AND p_to
+        GROUP BY s.customer_id ORDER BY sum(s.total) DESC LIMIT p_limit
+      ) g LEFT JOIN customers c ON c.id = g.customer_id
+      ORDER BY g.total DESC;
+  ELSIF p_group = 'product' THEN
+    RETURN QUERY
+      SELECT g.product_id::text, COALESCE(p.name, g.product_id::text), g.invoices, g.qty, g.net, g.tax, g.net + g.tax
+      FROM (
+        SELECT s.product_id, sum(s.invoices)::bigint AS invoices, sum(s.qty)::bigint AS qty, sum(s.net) AS net, sum(s.tax) AS tax
+        FROM sales_by_product s WHERE s.day BETWEEN p_from AND p_to
+        GROUP BY s.product_id ORDER BY sum(s.net) DESC LIMIT p_limit
+      ) g LEFT JOIN products p ON p.id = g.product_id
+      ORDER BY g.net DESC;
+  ELSE
+    RAISE EXCEPTION 'sales_report: unknown group %', p_group;
+  END IF;
+END;
+$$ LANGUAGE plpgsql STABLE;
+
+COMMIT;
+
+-- Usage (PostgREST): POST /rest/v1/rpc/sales_report {"p_group": "product", "p_from": "2026-10-01", "p_to": "2026-10-31"}
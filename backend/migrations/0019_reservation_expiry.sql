@@ -0,0 +1,47 @@
+-- Migration 0019: bounded active-reservation set
+-- stock_reservations keeps every consumed / released row forever, but availability only ever
+-- reads status = 'active'. A partial index over the active rows keeps those lookups (and the
+-- SUM in the stock RPCs from 0014) proportional to the open holds, not the table's history.
+-- Holds left active past expires_at (eg. a request that died between reserve and consume)
+-- are released in batches by release_expired_reservations, which the API's background
+-- sweeper calls (RESERVATION_SWEEP_INTERVAL).
+
+BEGIN;
+
+CREATE INDEX IF NOT EXISTS idx_stock_reservations_active_product
+  ON public.stock_reservations (product_id) INCLUDE (qty)
+  WHERE status = 'active';
+
+CREATE INDEX IF NOT EXISTS idx_stock_reservations_active_expiry
+  ON public.stock_reservations (expires_at)
+  WHERE status = 'active' AND expires_at IS NOT NULL;
+
+-- Release up to p_batch expired active reservations; returns how many were released.
+-- SKIP LOCKED lets several API workers sweep at once, and rows being consumed by a
+-- concurrent consume_reservations call are left alone.
+CREATE OR REPLACE FUNCTION release_expired_reservations(p_batch integer DEFAULT 500)
+RETURNS integer AS $$
+DECLARE
+  v_count integer;
+BEGIN
+  WITH expired AS (
+    SELECT id
+      FROM stock_reservations
+     WHERE status = 'active' AND expires_at < now()
+     ORDER BY expires_at
+     LIMIT p_batch
+     FOR UPDATE SKIP LOCKED
+  )
+  UPDATE stock_reservations r
+     SET status = 'released',
+         meta = COALESCE(r.meta, '{}'::jsonb) || jsonb_build_object('released_reason', 'expired')
+    FROM expired
+   WHERE r.id = expired.id;
+  GET DIAGNOSTICS v_count = ROW_COUNT;
+  RETURN v_count;
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER SET search_path = public;
+
+COMMIT;
+
+-- Usage (PostgREST): POST /rest/v1/rpc/release_expired_reservations {"p_batch": 500}
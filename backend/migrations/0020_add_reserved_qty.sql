@@ -0,0 +1,213 @@
+-- Migration 0020: products.reserved_qty
+-- Quantity held by active stock_reservations, kept on the product row by a trigger so every
+-- path that creates, consumes, releases or expires a reservation (the RPCs, the per-line
+-- fallbacks in the API and the expiry sweeper) updates it in the same statement.
+-- Availability becomes stock_qty - reserved_qty: one primary-key row read, however many
+-- reservations a product has accumulated. The stock RPCs from 0014 are redefined to use it.
+-- If the column is ever suspected to have drifted, run SELECT rebuild_reserved_qty();
+
+BEGIN;
+
+ALTER TABLE public.products ADD COLUMN IF NOT EXISTS reserved_qty integer NOT NULL DEFAULT 0;
+
+CREATE OR REPLACE FUNCTION stock_reservations_reserved_qty_trg() RETURNS trigger AS $$
+BEGIN
+  IF TG_OP IN ('UPDATE', 'DELETE') AND OLD.status = 'active' THEN
+    UPDATE products SET reserved_qty = reserved_qty - OLD.qty WHERE id = OLD.product_id;
+  END IF;
+  IF TG_OP IN ('INSERT', 'UPDATE') AND NEW.status = 'active' THEN
+    UPDATE products SET reserved_qty = reserved_qty + NEW.qty WHERE id = NEW.product_id;
+  END IF;
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS stock_reservations_reserved_qty ON stock_reservations;
+CREATE TRIGGER stock_reservations_reserved_qty
+  AFTER INSERT OR DELETE OR UPDATE OF status, qty, product_id ON stock_reservations
+  FOR EACH ROW EXECUTE FUNCTION stock_reservations_reserved_qty_trg();
+
+CREATE OR REPLACE FUNCTION rebuild_reserved_qty() RETURNS void AS $$
+BEGIN
+  LOCK TABLE stock_reservations IN SHARE MODE;
+  UPDATE products p
+     SET reserved_qty = x.reserved
+    FROM (
+      SELECT p2.id, COALESCE(SUM(r.qty), 0) AS reserved
+      FROM products p2
+      LEFT JOIN stock_reservations r ON r.product_id = p2.id AND r.status = 'active'
+      GROUP BY p2.id
+    ) x
+   WHERE p.id = x.id AND p.reserved_qty <> x.reserved;
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER SET search_path = public;
+
+SELECT rebuild_reserved_qty();
+
+-- Same contract as 0014; availability now reads products.reserved_qty from the locked row.
+CREATE OR REPLACE FUNCTION apply_stock_lines(
+  p_lines jsonb,
+  p_reason text,
+  p_reference_type text DEFAULT NULL,
+  p_reference_id uuid DEFAULT NULL,
+  p_created_by text DEFAULT NULL,
+  p_allow_negative boolean DEFAULT false,
+  p_meta jsonb DEFAULT NULL
+) RETURNS jsonb AS $$
+DECLARE
+  v_short record;
+  v_movements jsonb;
+BEGIN
+  PERFORM 1 FROM products
+  WHERE id IN (SELECT (l->>'product_id')::uuid FROM jsonb_array_elements(p_lines) l)
+  ORDER BY id
+  FOR UPDATE;
+
+  SELECT w.product_id,
+         (p.id IS NULL) AS missing,
+         COALESCE(p.stock_qty, 0) - COALESCE(p.reserved_qty, 0) AS available
+    INTO v_short
+    FROM (
+      SELECT (l->>'product_id')::uuid AS product_id, SUM((l->>'change')::int) AS change
+      FROM jsonb_array_elements(p_lines) l
+      GROUP BY 1
+    ) w
+    LEFT JOIN products p ON p.id = w.product_id
+   WHERE p.id IS NULL
+      OR (NOT p_allow_negative AND w.change < 0
+          AND COALESCE(p.stock_qty, 0) - COALESCE(p.reserved_qty, 0) + w.change < 0)
+   LIMIT 1;
+
+  IF FOUND THEN
+    RETURN jsonb_build_object(
+      'ok', false,
+      'reason', CASE WHEN v_short.missing THEN 'not_found' ELSE 'insufficient_stock' END,
+      'product_id', v_short.product_id,
+      'available', v_short.available);
+  END IF;
+
+  WITH ins AS (
+    INSERT INTO stock_movements (product_id, change, reason, reference_type, reference_id, unit_cost, created_by, meta)
+    SELECT (l->>'product_id')::uuid,
+           (l->>'change')::int,
+           p_reason,
+           p_reference_type,
+           COALESCE((l->>'reference_id')::uuid, p_reference_id),
+           (l->>'unit_cost')::numeric,
+           p_created_by,
+           p_meta
+    FROM jsonb_array_elements(p_lines) l
+    RETURNING *
+  )
+  SELECT COALESCE(jsonb_agg(to_jsonb(ins)), '[]'::jsonb) INTO v_movements FROM ins;
+
+  UPDATE products p
+     SET stock_qty = p.stock_qty + w.change
+    FROM (
+      SELECT (l->>'product_id')::uuid AS product_id, SUM((l->>'change')::int) AS change
+      FROM jsonb_array_elements(p_lines) l
+      GROUP BY 1
+    ) w
+   WHERE p.id = w.product_id;
+
+  RETURN jsonb_build_object('ok', true, 'movements', v_movements);
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER SET search_path = public;
+
+CREATE OR REPLACE FUNCTION reserve_stock_lines(
+  p_lines jsonb,
+  p_invoice_id uuid DEFAULT NULL,
+  p_expires_at timestamptz DEFAULT NULL,
+  p_created_by text DEFAULT NULL,
+  p_meta jsonb DEFAULT NULL
+) RETURNS jsonb AS $$
+DECLARE
+  v_short record;
+  v_reservations jsonb;
+BEGIN
+  PERFORM 1 FROM products
+  WHERE id IN (SELECT (l->>'product_id')::uuid FROM jsonb_array_elements(p_lines) l)
+  ORDER BY id
+  FOR UPDATE;
+
+  SELECT w.product_id,
+         (p.id IS NULL) AS missing,
+         COALESCE(p.stock_qty, 0) - COALESCE(p.reserved_qty, 0) AS available
+    INTO v_short
+    FROM (
+      SELECT (l->>'product_id')::uuid AS product_id, SUM((l->>'qty')::int) AS qty
+      FROM jsonb_array_elements(p_lines) l
+      GROUP BY 1
+    ) w
+    LEFT JOIN products p ON p.id = w.product_id
+   WHERE p.id IS NULL
+      OR COALESCE(p.stock_qty, 0) - COALESCE(p.reserved_qty, 0) < w.qty
+   LIMIT 1;
+
+  IF FOUND THEN
+    RETURN jsonb_build_object(
+      'ok', false,
+      'reason', CASE WHEN v_short.missing THEN 'not_found' ELSE 'insufficient_stock' END,
+      'product_id', v_short.product_id,
+      'available', v_short.available);
+  END IF;
+
+  WITH ins AS (
+    INSERT INTO stock_reservations (product_id, qty, invoice_id, expires_at, created_by, meta)
+    SELECT (l->>'product_id')::uuid, (l->>'qty')::int, p_invoice_id, p_expires_at, p_created_by, p_meta
+    FROM jsonb_array_elements(p_lines) l
+    RETURNING *
+  )
+  SELECT COALESCE(jsonb_agg(to_jsonb(ins)), '[]'::jsonb) INTO v_reservations FROM ins;
+
+  RETURN jsonb_build_object('ok', true, 'reservations', v_reservations);
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER SET search_path = public;
+
+-- The reserved_qty trigger now writes the product row, so take the product locks first (in id
+-- order, like the other stock functions) to avoid deadlocking with consume_reservations.
+-- The batch is fixed into an array before anything is locked. Exactly the products of that
+-- batch are locked, and only those reservations are updated, so the trigger never touches a
+-- product this call has not locked. Reservations are not locked before their products:
+-- consume_reservations takes the locks in that order, and the reverse order could deadlock.
+-- SKIP LOCKED leaves out rows another transaction is changing; the next sweep picks them up.
+CREATE OR REPLACE FUNCTION release_expired_reservations(p_batch integer DEFAULT 500)
+RETURNS integer AS $$
+DECLARE
+  v_ids uuid[];
+  v_count integer;
+BEGIN
+  SELECT array_agg(id) INTO v_ids
+    FROM (
+      SELECT id
+        FROM stock_reservations
+       WHERE status = 'active' AND expires_at < now()
+       ORDER BY expires_at
+       LIMIT p_batch
+    ) e;
+  IF v_ids IS NULL THEN
+    RETURN 0;
+  END IF;
+
+  PERFORM 1 FROM products
+  WHERE id IN (SELECT product_id FROM stock_reservations WHERE id = ANY(v_ids))
+  ORDER BY id
+  FOR UPDATE;
+
+  WITH expired AS (
+    SELECT id
+      FROM stock_reservations
+     WHERE id = ANY(v_ids) AND status = 'active'
+     FOR UPDATE SKIP LOCKED
+  )
+  UPDATE stock_reservations r
+     SET status = 'released',
+         meta = COALESCE(r.meta, '{}'::jsonb) || jsonb_build_object('released_reason', 'expired')
+    FROM expired
+   WHERE r.id = expired.id;
+  GET DIAGNOSTICS v_count = ROW_COUNT;
+  RETURN v_count;
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER SET search_path = public;
+
+COMMIT;
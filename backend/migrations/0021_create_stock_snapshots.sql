@@ -0,0 +1,80 @@
+-- Migration 0021: per-product stock snapshots for point-in-time stock
+-- stock_movements is the stock ledger; products.stock_qty is only a cache of its running sum.
+-- A snapshot row records, per product, the quantity after every movement created before
+-- as_of, the last known purchase cost and the stock value. Stock at any time T is then the
+-- latest snapshot at or before T plus the movements between that snapshot and T (one
+-- (product_id, created_at) index range), instead of the product's whole history.
+--
+-- Snapshots are taken by backend/scripts/take_stock_snapshots.py (eg. nightly, as of the
+-- last IST midnight) or directly: SELECT take_stock_snapshots('2026-04-01 00:00+05:30');
+-- Take them a little in the past: a movement is stamped with its transaction's start time, so
+-- one still in flight at as_of would otherwise be missed by the snapshot.
+
+BEGIN;
+
+CREATE TABLE IF NOT EXISTS public.stock_snapshots (
+  product_id uuid NOT NULL REFERENCES public.products(id) ON DELETE CASCADE,
+  as_of timestamptz NOT NULL,          -- covers movements with created_at < as_of
+  qty integer NOT NULL,
+  unit_cost numeric(12,2),             -- cost of the latest inbound movement with a cost
+  value numeric(14,2) NOT NULL,
+  created_at timestamptz NOT NULL DEFAULT now(),
+  PRIMARY KEY (product_id, as_of)
+);
+
+CREATE INDEX IF NOT EXISTS idx_stock_movements_product_created_at
+  ON public.stock_movements (product_id, created_at);
+
+-- Stock of every product (or p_product_ids) from movements created before p_at.
+-- Value uses the last known purchase cost, else the product price.
+CREATE OR REPLACE FUNCTION stock_as_of(p_at timestamptz, p_product_ids uuid[] DEFAULT NULL)
+RETURNS TABLE (product_id uuid, name text, qty bigint, unit_cost numeric, value numeric, snapshot_as_of timestamptz) AS $$
+  SELECT p.id,
+         p.name,
+         COALESCE(s.qty, 0) + COALESCE(m.delta, 0),
+         COALESCE(m.last_cost, s.unit_cost),
+         ROUND((COALESCE(s.qty, 0) + COALESCE(m.delta, 0)) * COALESCE(m.last_cost, s.unit_cost, p.price, 0), 2),
+         s.as_of
+    FROM products p
+    LEFT JOIN LATERAL (
+      SELECT ss.qty, ss.unit_cost, ss.as_of
+        FROM stock_snapshots ss
+       WHERE ss.product_id = p.id AND ss.as_of <= p_at
+       ORDER BY ss.as_of DESC
+       LIMIT 1
+    ) s ON true
+    LEFT JOIN LATERAL (
+      SELECT SUM(mv.change) AS delta,
+             (array_agg(mv.unit_cost ORDER BY mv.created_at DESC)
+                FILTER (WHERE mv.unit_cost IS NOT NULL AND mv.change > 0))[1] AS last_cost
+        FROM stock_movements mv
+       WHERE mv.product_id = p.id
+         AND mv.created_at >= COALESCE(s.as_of, '-infinity'::timestamptz)
+         AND mv.created_at < p_at
+    ) m ON true
+   WHERE p_product_ids IS NULL OR p.id = ANY(p_product_ids)
+   ORDER BY p.id;
+$$ LANGUAGE sql STABLE SECURITY DEFINER SET search_path = public;
+
+-- Snapshot every product as of p_as_of (built from the previous snapshot, so each run only
+-- reads the movements since the last one). Re-running for the same as_of is a no-op.
+CREATE OR REPLACE FUNCTION take_stock_snapshots(p_as_of timestamptz)
+RETURNS integer AS $$
+DECLARE
+  v_count integer;
+BEGIN
+  IF p_as_of > now() THEN
+    RAISE EXCEPTION 'snapshot time % is in the future', p_as_of;
+  END IF;
+  INSERT INTO stock_snapshots (product_id, as_of, qty, unit_cost, value)
+  SELECT s.product_id, p_as_of, s.qty, s.unit_cost, s.value
+    FROM stock_as_of(p_as_of) s
+  ON CONFLICT (product_id, as_of) DO NOTHING;
+  GET DIAGNOSTICS v_count = ROW_COUNT;
+  RETURN v_count;
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER SET search_path = public;
+
+COMMIT;
+
+-- Usage (PostgREST): POST /rest/v1/rpc/stock_as_of {"p_at": "2026-04-01T00:00:00+05:30"}
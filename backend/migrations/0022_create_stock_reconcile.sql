@@ -0,0 +1,81 @@
+-- Migration 0022: reconcile products.stock_qty with the stock ledger
+-- The fallback stock paths (create_stock_movement, decrement_product_stock) insert the movement
+-- and update products.stock_qty in separate requests, so the cached quantity can drift from
+-- the ledger. backend/scripts/reconcile_stock.py scans products in id ranges with
+-- stock_ledger_batch and, with --repair, fixes drifted rows with repair_stock_qty.
+-- The ledger quantity is the latest stock snapshot (0021) plus the movements since.
+
+BEGIN;
+
+CREATE OR REPLACE FUNCTION ledger_qty(p_product_id uuid) RETURNS bigint AS $$
+  SELECT COALESCE(s.qty, 0) + COALESCE((
+           SELECT SUM(mv.change)
+             FROM stock_movements mv
+            WHERE mv.product_id = p_product_id
+              AND mv.created_at >= COALESCE(s.as_of, '-infinity'::timestamptz)
+         ), 0)
+    FROM (SELECT 1) one
+    LEFT JOIN LATERAL (
+      SELECT ss.qty, ss.as_of
+        FROM stock_snapshots ss
+       WHERE ss.product_id = p_product_id
+       ORDER BY ss.as_of DESC
+       LIMIT 1
+    ) s ON true;
+$$ LANGUAGE sql STABLE;
+
+-- One batch of products in [p_from, p_to) after the p_after cursor, ordered by id, with the
+-- cached and the ledger quantity read in the same statement (so from one snapshot).
+CREATE OR REPLACE FUNCTION stock_ledger_batch(
+  p_from uuid DEFAULT NULL,
+  p_to uuid DEFAULT NULL,
+  p_after uuid DEFAULT NULL,
+  p_limit integer DEFAULT 1000
+) RETURNS TABLE (product_id uuid, stock_qty integer, ledger_qty bigint) AS $$
+  SELECT p.id, COALESCE(p.stock_qty, 0), ledger_qty(p.id)
+    FROM (
+      SELECT id, stock_qty
+        FROM products
+       WHERE (p_from IS NULL OR id >= p_from)
+         AND (p_to IS NULL OR id < p_to)
+         AND (p_after IS NULL OR id > p_after)
+       ORDER BY id
+       LIMIT p_limit
+    ) p
+   ORDER BY p.id;
+$$ LANGUAGE sql STABLE SECURITY DEFINER SET search_path = public;
+
+-- Set stock_qty to the ledger quantity for the given products.
+-- p_lines: [{"product_id": uuid, "drift": int}] where drift = stock_qty - ledger_qty as seen by
+-- the scan. Rows are locked in id order like the other stock functions, and a product is
+-- only updated when its drift is still the one that was reported. A drift that changed in
+-- the meantime was caused by a write in flight, so that product is left for the next run.
+CREATE OR REPLACE FUNCTION repair_stock_qty(p_lines jsonb) RETURNS jsonb AS $$
+DECLARE
+  v_repaired jsonb;
+BEGIN
+  PERFORM 1 FROM products
+  WHERE id IN (SELECT (l->>'product_id')::uuid FROM jsonb_array_elements(p_lines) l)
+  ORDER BY id
+  FOR UPDATE;
+
+  WITH cur AS (
+    SELECT p.id, COALESCE(p.stock_qty, 0) AS stock_qty, ledger_qty(p.id) AS ledger, (l->>'drift')::bigint AS seen
+      FROM jsonb_array_elements(p_lines) l
+      JOIN products p ON p.id = (l->>'product_id')::uuid
+  ), upd AS (
+    UPDATE products p
+       SET stock_qty = cur.ledger
+      FROM cur
+     WHERE p.id = cur.id AND cur.seen <> 0 AND cur.stock_qty - cur.ledger = cur.seen
+    RETURNING p.id, cur.stock_qty, cur.ledger
+  )
+  SELECT COALESCE(jsonb_agg(jsonb_build_object('product_id', id, 'stock_qty', stock_qty, 'ledger_qty', ledger)), '[]'::jsonb)
+    INTO v_repaired
+    FROM upd;
+
+  RETURN jsonb_build_object('ok', true, 'repaired', v_repaired);
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER SET search_path = public;
+
+COMMIT;
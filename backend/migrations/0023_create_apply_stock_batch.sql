@@ -0,0 +1,44 @@
+-- Migration 0023: group commit for apply_stock_lines
+-- During promotions many invoices touch the same few products at once. Each apply_stock_lines
+-- call is its own transaction queueing on the same product row locks. The API now collects
+-- the calls that arrive while one is in flight and sends them together (see
+-- backend/app/stock_coordinator.py). This function applies them in one transaction, taking
+-- the locks for all of their products once.
+--
+-- Requests are applied in order and each sees the stock left by the ones before it. Every
+-- request is still all-or-nothing over its own lines and gets its own apply_stock_lines result.
+
+BEGIN;
+
+-- p_requests: [{"lines": [...], "reason": text, "reference_type": text?, "reference_id": uuid?,
+--               "created_by": text?, "allow_negative": bool?, "meta": jsonb?}]
+-- Returns {"ok": true, "results": [<apply_stock_lines result>, ...]} in request order.
+CREATE OR REPLACE FUNCTION apply_stock_batch(p_requests jsonb) RETURNS jsonb AS $$
+DECLARE
+  v_req jsonb;
+  v_results jsonb := '[]'::jsonb;
+BEGIN
+  PERFORM 1 FROM products
+  WHERE id IN (
+    SELECT (l->>'product_id')::uuid
+      FROM jsonb_array_elements(p_requests) r, jsonb_array_elements(r->'lines') l
+  )
+  ORDER BY id
+  FOR UPDATE;
+
+  FOR v_req IN SELECT value FROM jsonb_array_elements(p_requests) LOOP
+    v_results := v_results || jsonb_build_array(apply_stock_lines(
+      v_req->'lines',
+      v_req->>'reason',
+      v_req->>'reference_type',
+      (v_req->>'reference_id')::uuid,
+      v_req->>'created_by',
+      COALESCE((v_req->>'allow_negative')::boolean, false),
+      NULLIF(v_req->'meta', 'null'::jsonb)));
+  END LOOP;
+
+  RETURN jsonb_build_object('ok', true, 'results', v_results);
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER SET search_path = public;
+
+COMMIT;
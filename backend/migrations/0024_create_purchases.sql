@@ -0,0 +1,66 @@
+-- Migration 0024: purchases header and record_purchase
+-- A purchase used to exist only as loose stock_movements rows pointing at the supplier. It now
+-- gets a `purchases` row, and its movements point at that row
+-- (reference_type 'purchase', reference_id = purchases.id).
+--
+-- record_purchase writes the whole purchase in one transaction. apply_stock_lines inserts all
+-- movement rows in one statement and applies the summed stock change per product in one UPDATE.
+-- The header is then inserted. An unknown product rejects the purchase before anything is
+-- written, and a failing header insert (eg. unknown supplier) rolls the movements back.
+
+BEGIN;
+
+CREATE TABLE IF NOT EXISTS purchases (
+  id uuid PRIMARY KEY DEFAULT gen_random_uuid(),
+  supplier_id uuid REFERENCES suppliers (id),
+  received_by text,
+  line_count int NOT NULL DEFAULT 0,
+  total_qty int NOT NULL DEFAULT 0,
+  total_cost numeric(14, 2) NOT NULL DEFAULT 0,
+  created_at timestamptz NOT NULL DEFAULT now()
+);
+
+CREATE INDEX IF NOT EXISTS purchases_supplier_created_idx
+  ON purchases (supplier_id, created_at DESC);
+
+CREATE INDEX IF NOT EXISTS stock_movements_purchase_idx
+  ON stock_movements (reference_id) WHERE reference_type = 'purchase';
+
+-- p_lines: the apply_stock_lines payload, [{"product_id": uuid, "change": int, "unit_cost": numeric?}]
+-- Returns the apply_stock_lines result plus "purchase" (the header row), or
+-- {"ok": false, "reason": "empty" | "not_found", ...}.
+CREATE OR REPLACE FUNCTION record_purchase(
+  p_lines jsonb,
+  p_supplier_id uuid DEFAULT NULL,
+  p_received_by text DEFAULT NULL,
+  p_purchase_id uuid DEFAULT NULL
+) RETURNS jsonb AS $$
+DECLARE
+  v_id uuid := COALESCE(p_purchase_id, gen_random_uuid());
+  v_result jsonb;
+  v_purchase jsonb;
+BEGIN
+  IF COALESCE(jsonb_array_length(p_lines), 0) = 0 THEN
+    RETURN jsonb_build_object('ok', false, 'reason', 'empty');
+  END IF;
+
+  v_result := apply_stock_lines(p_lines, 'purchase', 'purchase', v_id, p_received_by, true, NULL);
+  IF NOT (v_result->>'ok')::boolean THEN
+    RETURN v_result;
+  END IF;
+
+  INSERT INTO purchases (id, supplier_id, received_by, line_count, total_qty, total_cost)
+  SELECT v_id,
+         p_supplier_id,
+         p_received_by,
+         count(*),
+         COALESCE(SUM((l->>'change')::int), 0),
+         COALESCE(SUM((l->>'change')::int * COALESCE((l->>'unit_cost')::numeric, 0)), 0)
+    FROM jsonb_array_elements(p_lines) l
+  RETURNING to_jsonb(purchases.*) INTO v_purchase;
+
+  RETURN v_result || jsonb_build_object('purchase', v_purchase);
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER SET search_path = public;
+
+COMMIT;
@@ -0,0 +1,44 @@
+-- Migration 0025: create_invoice_with_items
+-- An invoice header and its items used to be two separate inserts. A read between them (the
+-- invoice endpoint, its PDF, the ZIP export) saw the invoice without items, and since invoices
+-- are cached as immutable the API kept serving it that way.
+--
+-- create_invoice_with_items inserts the header and every item in one transaction, so readers
+-- see the whole invoice or nothing, and a failing item insert no longer leaves a header behind.
+-- Requires invoice_items.tax_percent (migration 0018).
+
+BEGIN;
+
+-- p_invoice: the invoices row (id, invoice_number, customer_id, amounts, currency, issued_by)
+-- p_items: [invoice_items rows]; their invoice_id is taken from the inserted header
+-- Returns the inserted invoices row.
+CREATE OR REPLACE FUNCTION create_invoice_with_items(p_invoice jsonb, p_items jsonb DEFAULT '[]'::jsonb)
+RETURNS jsonb AS $$
+DECLARE
+  v_invoice invoices%ROWTYPE;
+BEGIN
+  INSERT INTO invoices (id, invoice_number, customer_id, subtotal, cgst_amount, sgst_amount,
+                        igst_amount, total_tax, total_amount, currency, issued_by)
+  SELECT COALESCE(r.id, gen_random_uuid()),
+         r.invoice_number,
+         r.customer_id,
+         r.subtotal,
+         COALESCE(r.cgst_amount, 0),
+         COALESCE(r.sgst_amount, 0),
+         COALESCE(r.igst_amount, 0),
+         COALESCE(r.total_tax, 0),
+         r.total_amount,
+         COALESCE(r.currency, 'INR'),
+         r.issued_by
+    FROM jsonb_populate_record(NULL::invoices, p_invoice) r
+  RETURNING * INTO v_invoice;
+
+  INSERT INTO invoice_items (invoice_id, product_id, description, qty, unit_price, line_total, tax_percent)
+  SELECT v_invoice.id, i.product_id, i.description, i.qty, i.unit_price, i.line_total, i.tax_percent
+    FROM jsonb_populate_recordset(NULL::invoice_items, COALESCE(p_items, '[]'::jsonb)) i;
+
+  RETURN to_jsonb(v_invoice);
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER SET search_path = public;
+
+COMMIT;
@@ -0,0 +1,63 @@
+-- Migration 0026: manual stock changes go through the stock ledger
+-- Opening stock (POST /products), stock edits (PUT /products/{id}) and the zeroing of an
+-- anonymized product used to write products.stock_qty directly, without a stock_movements
+-- row. The ledger (ledger_qty, stock_ledger_batch, stock_as_of) never saw that stock, so
+-- reconcile_stock.py reported those products as drifted and --repair would have reset them to
+-- the ledger, wiping real inventory.
+--
+-- The API now records opening stock as an 'opening' movement, and sets stock through
+-- set_stock_qty, which writes the difference as an 'adjustment' movement. The backfill below
+-- records the stock the ledger has not seen so far, once, as 'opening' movements.
+-- Apply it while no API worker runs on the fallback stock paths (see reconcile_stock.py).
+
+BEGIN;
+
+-- Set a product's stock_qty to p_qty, recording the difference as one movement
+-- (reference_type 'product', reference_id = the product). The row is locked first, so the
+-- difference is taken from the quantity it replaces.
+-- Returns {"ok": true, "stock_qty": p_qty, "movements": [...]} or {"ok": false, "reason": "not_found"}.
+CREATE OR REPLACE FUNCTION set_stock_qty(
+  p_product_id uuid,
+  p_qty integer,
+  p_reason text DEFAULT 'adjustment',
+  p_created_by text DEFAULT NULL
+) RETURNS jsonb AS $$
+DECLARE
+  v_stock integer;
+  v_result jsonb;
+BEGIN
+  SELECT COALESCE(stock_qty, 0) INTO v_stock FROM products WHERE id = p_product_id FOR UPDATE;
+  IF NOT FOUND THEN
+    RETURN jsonb_build_object('ok', false, 'reason', 'not_found', 'product_id', p_product_id);
+  END IF;
+  IF v_stock = p_qty THEN
+    RETURN jsonb_build_object('ok', true, 'stock_qty', p_qty, 'movements', '[]'::jsonb);
+  END IF;
+
+  v_result := apply_stock_lines(
+    jsonb_build_array(jsonb_build_object('product_id', p_product_id, 'change', p_qty - v_stock)),
+    p_reason, 'product', p_product_id, p_created_by, true, NULL);
+  RETURN v_result || jsonb_build_object('stock_qty', p_qty);
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER SET search_path = public;
+
+-- Backfill: one 'opening' movement per product whose stock_qty the ledger does not explain.
+-- A product without any movement or snapshot gets it at its creation time, so stock_as_of
+-- is right for its whole history; any other product gets it now.
+INSERT INTO stock_movements (product_id, change, reason, reference_type, reference_id, created_at)
+SELECT p.id,
+       COALESCE(p.stock_qty, 0) - ledger_qty(p.id),
+       'opening',
+       'product',
+       p.id,
+       CASE WHEN EXISTS (SELECT 1 FROM stock_movements mv WHERE mv.product_id = p.id)
+              OR EXISTS (SELECT 1 FROM stock_snapshots ss WHERE ss.product_id = p.id)
+            THEN now()
+            ELSE COALESCE(p.created_at, now())
+       END
+  FROM products p
+ WHERE COALESCE(p.stock_qty, 0) <> ledger_qty(p.id);
+
+COMMIT;
+
+-- Usage (PostgREST): POST /rest/v1/rpc/set_stock_qty {"p_product_id": "...", "p_qty": 12}
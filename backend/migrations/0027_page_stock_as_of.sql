@@ -0,0 +1,54 @@
+-- Migration 0027: page stock_as_of by product id
+-- stock_as_of (0021) returned every product in one result, so GET /stock/as-of without
+-- product_ids grew with the catalog. It now takes an (id) keyset: p_after continues after a
+-- product id and p_limit caps the page. Both apply before the per-product snapshot and
+-- movement lookups, so a page only reads the rows of its own products.
+-- take_stock_snapshots still calls stock_as_of(p_as_of) and reads every product.
+
+BEGIN;
+
+DROP FUNCTION IF EXISTS stock_as_of(timestamptz, uuid[]);
+
+CREATE OR REPLACE FUNCTION stock_as_of(
+  p_at timestamptz,
+  p_product_ids uuid[] DEFAULT NULL,
+  p_after uuid DEFAULT NULL,
+  p_limit integer DEFAULT NULL
+) RETURNS TABLE (product_id uuid, name text, qty bigint, unit_cost numeric, value numeric, snapshot_as_of timestamptz) AS $$
+  SELECT p.id,
+         p.name,
+         COALESCE(s.qty, 0) + COALESCE(m.delta, 0),
+         COALESCE(m.last_cost, s.unit_cost),
+         ROUND((COALESCE(s.qty, 0) + COALESCE(m.delta, 0)) * COALESCE(m.last_cost, s.unit_cost, p.price, 0), 2),
+         s.as_of
+    FROM (
+      SELECT id, name, price
+        FROM products
+       WHERE (p_product_ids IS NULL OR id = ANY(p_product_ids))
+         AND (p_after IS NULL OR id > p_after)
+       ORDER BY id
+       LIMIT p_limit
+    ) p
+    LEFT JOIN LATERAL (
+      SELECT ss.qty, ss.unit_cost, ss.as_of
+        FROM stock_snapshots ss
+       WHERE ss.product_id = p.id AND ss.as_of <= p_at
+       ORDER BY ss.as_of DESC
+       LIMIT 1
+    ) s ON true
+    LEFT JOIN LATERAL (
+      SELECT SUM(mv.change) AS delta,
+             (array_agg(mv.unit_cost ORDER BY mv.created_at DESC)
+                FILTER (WHERE mv.unit_cost IS NOT NULL AND mv.change > 0))[1] AS last_cost
+        FROM stock_movements mv
+       WHERE mv.product_id = p.id
+         AND mv.created_at >= COALESCE(s.as_of, '-infinity'::timestamptz)
+         AND mv.created_at < p_at
+    ) m ON true
+   ORDER BY p.id;
+$$ LANGUAGE sql STABLE SECURITY DEFINER SET search_path = public;
+
+COMMIT;
+
+-- Usage (PostgREST): POST /rest/v1/rpc/stock_as_of
+--   {"p_at": "2026-04-01T00:00:00+05:30", "p_after": "<last product_id>", "p_limit": 100}
@@ -0,0 +1,110 @@
+"""Audit stored invoice totals against their invoice_items.
+
+Streams invoices (oldest first) with their items and customers in keyset pages, recomputes
+subtotal / CGST / SGST / IGST / total with the tax module in a process pool, and appends every
+mismatch to a CSV report. Progress (the cursor after the last fully audited page) is saved to a
+state file after each page, so a nightly run resumes where the previous one stopped; pass
+--restart to audit the whole history again.
+
+Usage:
+  source .venv/bin/activate
+  python backend/scripts/audit_invoice_totals.py [--workers 4] [--page 500]
+      [--state audit_state.json] [--report audit_discrepancies.csv] [--from 2026-04-01] [--to 2026-04-30]
+
+Requires SUPABASE_URL and SUPABASE_KEY (the project's usual setup). SUPPLIER_STATE must match
+the value the API used when the invoices were created.
+"""
+import argparse
+import csv
+import json
+import logging
+import os
+import sys
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from app import audit, export, pagination, repository  # noqa: E402
+
+
+def load_state(path: str) -> dict:
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def save_state(path: str, state: dict) -> None:
+    # write-then-rename so an interrupted run never leaves a half-written cursor
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(state, f)
+    os.replace(tmp, path)
+
+
+def run(args) -> int:
+    state = {} if args.restart else load_state(args.state)
+    cursor = state.get('cursor')
+    totals = {'checked': state.get('checked', 0), 'rate_unknown': state.get('rate_unknown', 0),
+              'discrepancies': state.get('discrepancies', 0)}
+    start, end = export.parse_range(args.date_from, args.date_to)
+    supplier_state = os.getenv('SUPPLIER_STATE', 'Karnataka')
+
+    new_report = args.restart or not os.path.exists(args.report)
+    report = open(args.report, 'w' if new_report else 'a', newline='')
+    writer = csv.DictWriter(report, fieldnames=audit.REPORT_COLUMNS)
+    if new_report:
+        writer.writeheader()
+
+    pages = repository.iter_invoice_export_pages(start, end, page_size=args.page, customers=True, cursor=cursor)
+    # at most 2 pages per worker in flight: the next pages are fetched while earlier ones are
+    # audited, and memory stays bounded
+    in_flight = deque()
+    try:
+        with ProcessPoolExecutor(max_workers=args.workers) as pool:
+            for page in pages:
+                in_flight.append((pool.submit(audit.audit_page, page, supplier_state), pagination.encode_cursor(page[-1])))
+                while in_flight and (len(in_flight) >= 2 * args.workers or in_flight[0][0].done()):
+                    _record(in_flight.popleft(), writer, report, totals, args.state)
+            while in_flight:
+                _record(in_flight.popleft(), writer, report, totals, args.state)
+    except Exception:
+        logging.exception('Audit stopped; %s invoices checked. Re-run to resume.', totals['checked'])
+        return 1
+    finally:
+        report.close()
+    logging.info('Audit complete: %(checked)s invoices checked, %(discrepancies)s discrepancies, '
+                 '%(rate_unknown)s with unknown line rates (subtotal only)', totals)
+    return 0
+
+
+def _record(entry, writer, report, totals, state_path) -> None:
+    # pages complete in submission order, so the saved cursor never skips an unaudited page
+    future, page_cursor = entry
+    result = future.result()
+    writer.writerows(result['discrepancies'])
+    report.flush()
+    totals['checked'] += result['checked']
+    totals['rate_unknown'] += result['rate_unknown']
+    totals['discrepancies'] += len(result['discrepancies'])
+    save_state(state_path, {'cursor': page_cursor, **totals})
+    logging.info('Audited %s invoices, %s discrepancies', totals['checked'], totals['discrepancies'])
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 2)
+    parser.add_argument('--page', type=int, default=500, help='invoices per page')
+    parser.add_argument('--state', default='audit_state.json', help='resume cursor file')
+    parser.add_argument('--report', default='audit_discrepancies.csv', help='discrepancy CSV')
+    parser.add_argument('--from', dest='date_from', help='first day (YYYY-MM-DD, IST)')
+    parser.add_argument('--to', dest='date_to', help='last day (YYYY-MM-DD, IST)')
+    parser.add_argument('--restart', action='store_true', help='ignore saved progress')
+    raise SystemExit(run(parser.parse_args()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,52 @@
+"""Build the daily sales rollups from invoice history.
+
+Run this once after applying backend/migrations/0018_create_sales_rollups.sql. Invoices created
+after the migration are rolled up by triggers; this job folds in everything older, one batch
+per RPC call. Progress is saved in the database with each batch, so the script can be stopped
+and re-run safely; it exits once the backfill is marked done.
+
+Usage:
+  source .venv/bin/activate
+  python backend/scripts/backfill_sales_rollups.py [--batch 1000] [--pause 0.2]
+
+The script uses the project's Supabase client (app.database.supabase) and requires
+SUPABASE_URL and SUPABASE_KEY to be set in the environment (the project's usual setup).
+"""
+import argparse
+import logging
+import time
+
+from app.database import supabase
+
+
+def run(batch: int, pause: float) -> int:
+    total = 0
+    while True:
+        try:
+            res = supabase.rpc('backfill_sales_rollups', {'p_batch': batch}).execute()
+        except Exception as exc:
+            logging.error('backfill_sales_rollups failed after %s invoices: %s', total, exc)
+            return 1
+        if getattr(res, 'error', None):
+            logging.error('backfill_sales_rollups error after %s invoices: %s', total, res.error)
+            return 1
+        data = res.data[0] if isinstance(res.data, list) else res.data
+        total += int(data.get('processed') or 0)
+        logging.info('Rolled up %s historical invoices', total)
+        if data.get('done'):
+            return 0
+        # short pause between batches keeps the backfill from crowding out live traffic
+        time.sleep(pause)
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--batch', type=int, default=1000, help='invoices per RPC call')
+    parser.add_argument('--pause', type=float, default=0.2, help='seconds to sleep between batches')
+    args = parser.parse_args()
+    raise SystemExit(run(args.batch, args.pause))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+"""Benchmark the GSTR-1 aggregator on a synthetic month of invoices.
+
+Generates pages shaped like `iter_invoice_export_pages(..., customers=True)` output and times
+`Gstr1Report` over them. No database is involved, so this measures the aggregation pass alone.
+
+Usage:
+  python backend/scripts/bench_gstr1.py [--invoices 60000] [--lines 4] [--page 500]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from decimal import Decimal
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..'))
+
+from backend.app import gst, tax  # noqa: E402
+
+STATES = ['Karnataka', 'Kerala', 'Tamil Nadu', 'Maharashtra', 'Goa', 'Delhi']
+
+
+def make_page(rng: random.Random, start: int, size: int, lines: int, supplier_state: str):
+    page = []
+    for n in range(start, start + size):
+        state = rng.choice(STATES)
+        customer = {'id': f'c{n % 2000}', 'state': state, 'gstin': f'29ABCDE{n % 2000:04d}F1Z5' if n % 3 == 0 else None}
+        items = []
+        for k in range(lines):
+            qty = rng.randint(1, 20)
+            price = Decimal(rng.randint(100, 500000)) / 100
+            items.append({'id': f'{n}-{k}', 'qty': qty, 'unit_price': str(price), 'line_total': str(qty * price),
+                          'tax_percent': rng.choice(gst.GST_SLABS)})
+        taxes = tax.calculate_invoice_taxes(supplier_state, state, items)
+        page.append({
+            'id': str(n), 'customer_id': customer['id'], 'customer': customer, 'items': items,
+            'subtotal': str(taxes['subtotal']), 'cgst_amount': str(taxes['cgst']), 'sgst_amount': str(taxes['sgst']),
+            'igst_amount': str(taxes['igst']), 'total_tax': str(taxes['total_tax']), 'total_amount': str(taxes['total']),
+        })
+    return page
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--invoices', type=int, default=60000, help='invoices in the month')
+    parser.add_argument('--lines', type=int, default=4, help='line items per invoice')
+    parser.add_argument('--page', type=int, default=500, help='invoices per page')
+    args = parser.parse_args()
+
+    rng = random.Random(1)
+    supplier_state = 'Karnataka'
+    pages = [make_page(rng, i, min(args.page, args.invoices - i), args.lines, supplier_state)
+             for i in range(0, args.invoices, args.page)]
+
+    report = gst.Gstr1Report(supplier_state=supplier_state)
+    t0 = time.perf_counter()
+    for page in pages:
+        report.add_page(page)
+    result = report.result()
+    elapsed = time.perf_counter() - t0
+
+    lines = args.invoices * args.lines
+    print(f'{args.invoices} invoices / {lines} lines in {elapsed:.2f}s '
+          f'({lines / elapsed:,.0f} lines/s); b2b={len(result["b2b"])} b2cl={len(result["b2cl"])} '
+          f'b2cs={len(result["b2cs"])} rows, totals={result["totals"]}')
+
+
+if __name__ == '__main__':
+    main()
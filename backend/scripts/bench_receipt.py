@@ -0,0 +1,62 @@
+"""Benchmark the thermal receipt renderer against the WeasyPrint invoice PDF.
+
+Renders the same synthetic invoice repeatedly with `receipt.render_receipt` (+ ESC/POS framing)
+and with `pdf.invoice_to_pdf_bytes`. Without WeasyPrint installed the PDF column falls back to
+`render_invoice_html` (template only), which understates the real PDF cost.
+
+Usage:
+  python backend/scripts/bench_receipt.py [--lines 8] [--runs 200] [--paper 58]
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..'))
+
+from backend.app import pdf, receipt  # noqa: E402
+
+
+def make_invoice(lines: int):
+    items = [{'product_id': f'p{k}', 'description': f'Product number {k} with a longish name',
+              'qty': k % 5 + 1, 'unit_price': '149.50', 'line_total': str((k % 5 + 1) * 149.5)}
+             for k in range(lines)]
+    subtotal = sum(float(it['line_total']) for it in items)
+    return {'id': 'bench', 'invoice_number': 'INV-2026-000123', 'created_at': '2026-10-17T11:42:00+05:30',
+            'customer': {'name': 'Walk-in Customer', 'state': 'Karnataka'}, 'items': items,
+            'subtotal': f'{subtotal:.2f}', 'cgst_amount': f'{subtotal * 0.09:.2f}',
+            'sgst_amount': f'{subtotal * 0.09:.2f}', 'igst_amount': '0.00', 'total_amount': f'{subtotal * 1.18:.2f}'}
+
+
+def timed(fn, runs: int):
+    samples = []
+    for _ in range(runs):
+        t0 = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - t0)
+    samples.sort()
+    return statistics.median(samples) * 1000, samples[int(len(samples) * 0.95) - 1] * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--lines', type=int, default=8, help='line items per invoice')
+    parser.add_argument('--runs', type=int, default=200)
+    parser.add_argument('--paper', type=int, default=58, choices=sorted(receipt.PAPER_COLUMNS))
+    args = parser.parse_args()
+
+    invoice = make_invoice(args.lines)
+    rec_p50, rec_p95 = timed(lambda: receipt.to_escpos(receipt.render_receipt(invoice, args.paper)), args.runs)
+    print(f'receipt ({args.paper} mm):  p50 {rec_p50:8.3f} ms  p95 {rec_p95:8.3f} ms')
+
+    have_pdf = pdf.invoice_to_pdf_bytes(invoice) is not None  # also warms WeasyPrint / the template
+    label = 'weasyprint pdf' if have_pdf else 'html only (no weasyprint)'
+    render = pdf.invoice_to_pdf_bytes if have_pdf else pdf.render_invoice_html
+    runs = max(1, args.runs // 10) if have_pdf else args.runs
+    pdf_p50, pdf_p95 = timed(lambda: render(dict(invoice, items=[dict(it) for it in invoice['items']])), runs)
+    print(f'{label}:  p50 {pdf_p50:8.3f} ms  p95 {pdf_p95:8.3f} ms  ({pdf_p50 / rec_p50:,.1f}x receipt)')
+
+
+if __name__ == '__main__':
+    main()
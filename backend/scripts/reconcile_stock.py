@@ -0,0 +1,111 @@
+"""Reconcile products.stock_qty with the stock_movements ledger.
+
+Splits the product id space into ranges and scans them on a thread pool. Each range is read in
+id-ordered batches from the stock_ledger_batch RPC (migration 0022), which returns the cached and
+the ledger quantity side by side. Every product whose cache has drifted goes to a CSV report.
+With --repair the drifted products are reset to the ledger, in batches, after --confirm-delay
+seconds. A product whose drift changed in that time (a sale was being written) is skipped and
+reported as `changed`; run again to pick it up.
+
+Only reads and row-locked single-statement updates are used, so it is safe to run while sales
+continue -- as long as every API worker writes stock through the atomic RPCs (migration 0014).
+Without them the API falls back to inserting a movement and updating products.stock_qty in two
+requests. A repair that lands between the two counts that movement twice, and a worker stalled
+for longer than --confirm-delay slips past the drift-unchanged check. Only use --repair when
+no worker can be on those fallback paths, and only after migration 0026, which brings opening
+stock and manual stock edits into the ledger.
+
+Usage:
+  source .venv/bin/activate
+  python backend/scripts/reconcile_stock.py [--workers 8] [--batch 1000] [--report stock_drift.csv]
+      [--repair] [--confirm-delay 5]
+
+Requires SUPABASE_URL and SUPABASE_KEY (the project's usual setup).
+"""
+import argparse
+import csv
+import logging
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from app import reconcile, repository  # noqa: E402
+
+
+def scan_range(start, end, batch: int):
+    """Walk one id range; returns (products checked, drifted rows)."""
+    checked, drifted, after = 0, [], None
+    while True:
+        rows = repository.stock_ledger_batch(start, end, after, batch)
+        checked += len(rows)
+        drifted.extend(reconcile.drift_rows(rows))
+        if len(rows) < batch:
+            return checked, drifted
+        after = rows[-1]['product_id']
+
+
+def repair(drifted, batch: int, pool) -> int:
+    """Repair drifted rows in batches; marks each row repaired / changed / failed."""
+    chunks = [drifted[i:i + batch] for i in range(0, len(drifted), batch)]
+    lines = [[{'product_id': r['product_id'], 'drift': r['drift']} for r in chunk] for chunk in chunks]
+    repaired = 0
+    for chunk, result in zip(chunks, pool.map(repository.repair_stock_qty, lines)):
+        if result is None:
+            for row in chunk:
+                row['status'] = 'failed'
+            continue
+        done = {r['product_id'] for r in result}
+        for row in chunk:
+            row['status'] = 'repaired' if row['product_id'] in done else 'changed'
+        repaired += len(done)
+    return repaired
+
+
+def run(args) -> int:
+    t0 = time.monotonic()
+    # several ranges per worker so one slow range does not leave the others idle
+    ranges = reconcile.uuid_ranges(args.workers * 4)
+    checked, drifted = 0, []
+    with ThreadPoolExecutor(max_workers=args.workers) as pool:
+        try:
+            for n, d in pool.map(lambda r: scan_range(r[0], r[1], args.batch), ranges):
+                checked += n
+                drifted.extend(d)
+        except Exception:
+            logging.exception('Scan failed after %s products; nothing was repaired', checked)
+            return 1
+        logging.info('Scanned %s products in %.1fs: %s drifted', checked, time.monotonic() - t0, len(drifted))
+
+        repaired = 0
+        if args.repair and drifted:
+            # a drift seen mid-write has usually resolved itself by now and will be skipped
+            time.sleep(args.confirm_delay)
+            repaired = repair(drifted, args.batch, pool)
+            logging.info('Repaired %s of %s drifted products', repaired, len(drifted))
+
+    drifted.sort(key=lambda r: r['product_id'])
+    with open(args.report, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=reconcile.REPORT_COLUMNS)
+        writer.writeheader()
+        writer.writerows(drifted)
+    logging.info('Drift report written to %s', args.report)
+    return 1 if any(r['status'] == 'failed' for r in drifted) else 0
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--workers', type=int, default=8, help='concurrent RPC calls')
+    parser.add_argument('--batch', type=int, default=1000, help='products per RPC call')
+    parser.add_argument('--report', default='stock_drift.csv', help='drift report CSV')
+    parser.add_argument('--repair', action='store_true', help='reset drifted stock_qty to the ledger (needs the 0014 stock RPCs on every worker)')
+    parser.add_argument('--confirm-delay', type=float, default=5.0,
+                        help='seconds between the scan and the repair')
+    raise SystemExit(run(parser.parse_args()))
+
+
+if __name__ == '__main__':
+    main()
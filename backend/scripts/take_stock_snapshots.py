@@ -0,0 +1,40 @@
+"""Write per-product stock snapshots (migration 0021).
+
+Each run snapshots every product as of the start of the current IST day (or --as-of), building
+on the previous snapshot, so `GET /billing/stock/as-of` only has to add the movements since.
+Schedule it nightly; re-running for a time that already has snapshots changes nothing.
+
+Usage:
+  source .venv/bin/activate
+  python backend/scripts/take_stock_snapshots.py [--as-of 2026-04-01T00:00:00+05:30]
+
+Requires SUPABASE_URL and SUPABASE_KEY (the project's usual setup).
+"""
+import argparse
+import logging
+import os
+import sys
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from app import repository, stock_snapshots  # noqa: E402
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--as-of', help='snapshot time (ISO date or datetime, IST when no offset); default: last IST midnight')
+    args = parser.parse_args()
+    as_of = stock_snapshots.default_snapshot_time()
+    if args.as_of:
+        as_of = datetime.fromisoformat(args.as_of)
+        as_of = as_of if as_of.tzinfo else as_of.replace(tzinfo=stock_snapshots.IST)
+    written = repository.take_stock_snapshots(as_of)
+    if written is None:
+        raise SystemExit(1)
+    logging.info('Wrote %s stock snapshots as of %s', written, as_of.isoformat())
+
+
+if __name__ == '__main__':
+    main()
@@ -1,6 +1,7 @@
 import React, { useState, useEffect } from 'react';
 import { useNavigate } from 'react-router-dom';
 import axios from 'axios';
+import fetchAllPages from '../utils/fetchAllPages';
 const API_BASE_URL = import.meta.env.VITE_API_BASE_URL || 'http://127.0.0.1:8000';
 
 export default function Customers() {
@@ -20,7 +21,7 @@ export default function Customers() {
   useEffect(() => {
     setLoading(true);
     setError(null);
-    axios.get(`${API_BASE_URL}/billing/customers`)
+    fetchAllPages(`${API_BASE_URL}/billing/customers`)
       .then(res => {
         setCustomers(res.data.data || []);
         setLoading(false);
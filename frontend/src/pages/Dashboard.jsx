@@ -8,7 +8,7 @@ const API_BASE_URL = 'https://billing-project-s0ql.onrender.com';
 
 export default function Dashboard() {
   const { theme, formatCurrency } = useSettings();
-  const [stats, setStats] = useState({ revenue: 0, invoices: 0, customers: 0, products: 0 });
+  const [stats, setStats] = useState({ revenue: 0, invoices: 0, customers: 0, lowStock: 0 });
   const [recentInvoices, setRecentInvoices] = useState([]);
 
   useEffect(() => {
@@ -17,7 +17,13 @@ export default function Dashboard() {
       fetch(`${API_BASE_URL}/billing/stats`).then(r => r.json()),
       fetch(`${API_BASE_URL}/billing/invoices?limit=5`).then(r => r.json())
     ]).then(([statsData, invoicesData]) => {
-      setStats(statsData);
+      const s = statsData.data || {};
+      setStats({
+        revenue: s.month?.revenue || 0,
+        invoices: s.today?.invoices || 0,
+        customers: s.active_customers || 0,
+        lowStock: s.low_stock_products || 0,
+      });
       setRecentInvoices(invoicesData.data || []);
     });
   }, []);
@@ -26,10 +32,10 @@ export default function Dashboard() {
     <div className={`p-6 min-h-screen ${theme === 'dark' ? 'bg-gray-900 text-gray-100' : 'bg-gray-50'}`}>
       <h1 className="text-3xl font-bold mb-6">Dashboard</h1>
       <div className="grid grid-cols-1 md:grid-cols-4 gap-6 mb-8">
-  <StatsCard title="Revenue" value={formatCurrency(stats.revenue)} icon="💰" />
-        <StatsCard title="Invoices" value={stats.invoices} icon="🧾" />
+  <StatsCard title="Revenue (this month)" value={formatCurrency(stats.revenue)} icon="💰" />
+        <StatsCard title="Invoices today" value={stats.invoices} icon="🧾" />
         <StatsCard title="Customers" value={stats.customers} icon="👥" />
-        <StatsCard title="Products" value={stats.products} icon="📦" />
+        <StatsCard title="Low stock" value={stats.lowStock} icon="📦" />
       </div>
 
       <div className="grid grid-cols-1 md:grid-cols-2 gap-6">
@@ -1,6 +1,6 @@
 import React, { useState, useEffect } from 'react';
 
-import axios from 'axios';
+import fetchAllPages from '../utils/fetchAllPages';
 import { useSettings } from '../context/SettingsContext';
 const API_BASE_URL = import.meta.env.VITE_API_BASE_URL || 'http://127.0.0.1:8000';
 
@@ -17,7 +17,7 @@ export default function Invoices() {
   useEffect(() => {
     setLoading(true);
     setError(null);
-  axios.get(`${API_BASE_URL}/billing/invoices`)
+  fetchAllPages(`${API_BASE_URL}/billing/invoices`, { fields: 'id,invoice_number,customer_id,created_at,total_amount' })
       .then(res => {
         setInvoices(res.data.data || []);
         setLoading(false);
@@ -2,6 +2,7 @@ import React, { useState, useEffect } from 'react';
 import { useSettings } from '../context/SettingsContext';
 import { useNavigate } from 'react-router-dom';
 import axios from 'axios';
+import fetchAllPages from '../utils/fetchAllPages';
 const API_BASE_URL = import.meta.env.VITE_API_BASE_URL || 'http://127.0.0.1:8000';
 
 export default function Products() {
@@ -45,7 +46,7 @@ export default function Products() {
   const fetchProducts = () => {
     setLoading(true);
     setError(null);
-    axios.get(`${API_BASE_URL}/billing/products`)
+    fetchAllPages(`${API_BASE_URL}/billing/products`)
       .then(res => {
         const data = res.data.data || [];
         setProducts(data);
@@ -67,7 +68,7 @@ export default function Products() {
   };
 
   const fetchArchivedProducts = () => {
-    axios.get(`${API_BASE_URL}/billing/products/archived`)
+    fetchAllPages(`${API_BASE_URL}/billing/products/archived`)
       .then(res => {
         const data = (res.data && res.data.data) ? res.data.data : []
         setArchivedProducts(data)
@@ -1,5 +1,6 @@
 import React, { useEffect, useState } from 'react';
 import axios from 'axios';
+import fetchAllPages from '../utils/fetchAllPages';
 const API_BASE_URL = import.meta.env.VITE_API_BASE_URL || 'http://127.0.0.1:8000';
 
 function EmptyState({children}){
@@ -18,8 +19,8 @@ export default function Purchases(){
   const [saving,setSaving] = useState(false)
 
   useEffect(()=>{
-    axios.get(`${API_BASE_URL}/billing/suppliers`).then(r=>setSuppliers(r.data.data||[])).catch(()=>setSuppliers([]))
-    axios.get(`${API_BASE_URL}/billing/products`).then(r=>setProducts(r.data.data||[])).catch(()=>setProducts([]))
+    fetchAllPages(`${API_BASE_URL}/billing/suppliers`).then(r=>setSuppliers(r.data.data||[])).catch(()=>setSuppliers([]))
+    fetchAllPages(`${API_BASE_URL}/billing/products`).then(r=>setProducts(r.data.data||[])).catch(()=>setProducts([]))
     // attempt to fetch purchases list; backend may or may not expose this route — handle gracefully
     axios.get(`${API_BASE_URL}/billing/purchases`).then(r=>setPurchases(r.data.data||[])).catch(()=>setPurchases([]))
   },[])
@@ -1,11 +1,78 @@
-import React from 'react';
+import React, { useEffect, useState } from 'react';
+import axios from 'axios';
+const API_BASE_URL = import.meta.env.VITE_API_BASE_URL || 'http://127.0.0.1:8000';
+
+const GROUPS = [
+  { value: 'day', label: 'Day' },
+  { value: 'product', label: 'Product' },
+  { value: 'customer', label: 'Customer' },
+  { value: 'state', label: 'State' },
+];
 
 export default function Reports() {
+  const [group, setGroup] = useState('day')
+  const [from, setFrom] = useState('')
+  const [to, setTo] = useState('')
+  const [rows, setRows] = useState([])
+  const [loading, setLoading] = useState(true)
+  const [error, setError] = useState(null)
+
+  useEffect(() => {
+    setLoading(true)
+    setError(null)
+    const params = { group }
+    if (from) params.from = from
+    if (to) params.to = to
+    axios.get(`${API_BASE_URL}/billing/reports/sales`, { params })
+      .then(r => { setRows(r.data.data || []); setLoading(false) })
+      .catch(err => { setError(err.response?.data?.detail || 'Failed to load report'); setRows([]); setLoading(false) })
+  }, [group, from, to])
+
+  const fmt = v => Number(v || 0).toFixed(2)
+
   return (
     <div className="p-6">
       <h1 className="text-2xl font-bold mb-4">Reports</h1>
-      {/* Sales, GST breakdown, CSV/PDF download */}
-      <div className="bg-white shadow rounded p-4">Reports Placeholder</div>
+      <div className="flex gap-2 mb-4 items-center">
+        <label>Sales by</label>
+        <select className="input" value={group} onChange={e => setGroup(e.target.value)}>
+          {GROUPS.map(g => <option key={g.value} value={g.value}>{g.label}</option>)}
+        </select>
+        <label>From</label>
+        <input type="date" className="input" value={from} onChange={e => setFrom(e.target.value)} />
+        <label>To</label>
+        <input type="date" className="input" value={to} onChange={e => setTo(e.target.value)} />
+      </div>
+      <div className="bg-white shadow rounded p-4">
+        {loading ? <div>Loading...</div> : error ? <div className="text-red-600">{error}</div> : (
+          <table className="w-full text-left">
+            <thead>
+              <tr>
+                <th className="py-2">{GROUPS.find(g => g.value === group).label}</th>
+                {group === 'product' && <th className="py-2">Qty</th>}
+                <th className="py-2">{group === 'product' ? 'Lines' : 'Invoices'}</th>
+                <th className="py-2">Net</th>
+                <th className="py-2">Tax</th>
+                <th className="py-2">Total</th>
+              </tr>
+            </thead>
+            <tbody>
+              {rows.length === 0 ? (
+                <tr><td colSpan={6} className="py-4 text-gray-400">No sales in this period.</td></tr>
+              ) : rows.map(r => (
+                <tr key={r.key || 'walk-in'} className="border-t">
+                  <td className="py-2">{r.label}</td>
+                  {group === 'product' && <td className="py-2">{r.qty}</td>}
+                  <td className="py-2">{r.invoices}</td>
+                  <td className="py-2">{fmt(r.net)}</td>
+                  <td className="py-2">{fmt(r.tax)}</td>
+                  <td className="py-2">{fmt(r.total)}</td>
+                </tr>
+              ))}
+            </tbody>
+          </table>
+        )}
+      </div>
     </div>
   );
 }
@@ -1,5 +1,6 @@
 import React, { useEffect, useState } from 'react';
 import axios from 'axios';
+import fetchAllPages from '../utils/fetchAllPages';
 import { useSettings } from '../context/SettingsContext';
 const API_BASE_URL = import.meta.env.VITE_API_BASE_URL || 'http://127.0.0.1:8000';
 
@@ -11,8 +12,8 @@ export default function Sales(){
   const [customerId,setCustomerId] = useState('')
 
   useEffect(()=>{
-    axios.get(`${API_BASE_URL}/billing/customers`).then(r=>setCustomers(r.data.data||[])).catch(()=>{})
-    axios.get(`${API_BASE_URL}/billing/products`).then(r=>setProducts(r.data.data||[])).catch(()=>{})
+    fetchAllPages(`${API_BASE_URL}/billing/customers`).then(r=>setCustomers(r.data.data||[])).catch(()=>{})
+    fetchAllPages(`${API_BASE_URL}/billing/products`).then(r=>setProducts(r.data.data||[])).catch(()=>{})
   },[])
 
   const save = async ()=>{
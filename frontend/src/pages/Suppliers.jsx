@@ -1,5 +1,6 @@
 import React, { useEffect, useState } from 'react';
 import axios from 'axios';
+import fetchAllPages from '../utils/fetchAllPages';
 import { useNavigate } from 'react-router-dom';
 const API_BASE_URL = import.meta.env.VITE_API_BASE_URL || 'http://127.0.0.1:8000';
 
@@ -12,7 +13,7 @@ export default function Suppliers(){
 
   useEffect(()=>{
     setLoading(true)
-    axios.get(`${API_BASE_URL}/billing/suppliers`).then(r=>{setSuppliers(r.data.data||[]);setLoading(false)}).catch(()=>{setLoading(false)})
+    fetchAllPages(`${API_BASE_URL}/billing/suppliers`).then(r=>{setSuppliers(r.data.data||[]);setLoading(false)}).catch(()=>{setLoading(false)})
   },[])
 
   const save = async ()=>{
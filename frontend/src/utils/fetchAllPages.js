@@ -0,0 +1,16 @@
+import axios from 'axios'
+
+// List endpoints are cursor-paginated ({ data, next_cursor }). Follow next_cursor until the
+// last page and resolve with an axios-like response whose data.data holds every row.
+export async function fetchAllPages(url, params = {}) {
+  const rows = []
+  let cursor = null
+  do {
+    const res = await axios.get(url, { params: cursor ? { ...params, cursor } : params })
+    rows.push(...((res.data && res.data.data) || []))
+    cursor = res.data ? res.data.next_cursor : null
+  } while (cursor)
+  return { data: { status: 'success', data: rows } }
+}
+
+export default fetchAllPages
@@ -0,0 +1,88 @@
+from decimal import Decimal
+
+from backend.app import audit
+from backend.app import repository as repo
+from backend.app import pagination
+from backend.app.tax import calculate_invoice_taxes
+
+
+def stored_invoice(n, state, items, **overrides):
+    taxes = calculate_invoice_taxes('Karnataka', state, items)
+    inv = {
+        'id': f'i{n}', 'invoice_number': f'INV/2026-27/{n:06d}', 'created_at': '2026-05-01T10:00:00+05:30',
+        'customer': {'state': state},
+        'items': [dict(it, line_total=it['qty'] * it['unit_price']) for it in items],
+        'subtotal': taxes['subtotal'], 'cgst_amount': taxes['cgst'], 'sgst_amount': taxes['sgst'],
+        'igst_amount': taxes['igst'], 'total_tax': taxes['total_tax'], 'total_amount': taxes['total'],
+    }
+    inv.update(overrides)
+    return inv
+
+
+ITEMS = [{'qty': 3, 'unit_price': Decimal('99.99'), 'tax_percent': Decimal('18')}]
+
+
+def test_consistent_invoices_pass():
+    res = audit.audit_page([stored_invoice(1, 'Karnataka', ITEMS), stored_invoice(2, 'Kerala', ITEMS)], 'Karnataka')
+    assert res == {'checked': 2, 'rate_unknown': 0, 'discrepancies': []}
+
+
+def test_mismatches_are_reported_per_field():
+    bad_total = stored_invoice(1, 'Kerala', ITEMS, total_amount=Decimal('353.97'))
+    bad_line = stored_invoice(2, 'Kerala', ITEMS)
+    bad_line['items'][0]['line_total'] = Decimal('300.00')
+    res = audit.audit_page([bad_total, bad_line], 'Karnataka')
+    assert [(d['invoice_id'], d['field'], d['stored'], d['expected']) for d in res['discrepancies']] == [
+        ('i2', 'items[0].line_total', '300.00', '299.97'),
+        ('i1', 'total_amount', '353.97', '353.96'),
+    ]
+
+
+def test_items_without_rate_only_check_subtotal():
+    inv = stored_invoice(1, 'Kerala', ITEMS, igst_amount=Decimal('1.00'))
+    del inv['items'][0]['tax_percent']
+    res = audit.audit_page([inv], 'Karnataka')
+    assert res['rate_unknown'] == 1 and res['discrepancies'] == []
+
+
+def test_export_pages_resume_from_cursor(monkeypatch):
+    seen = []
+
+    class Q:
+        def table(self, name):
+            self.name = name
+            return self
+
+        def select(self, *a):
+            return self
+
+        def or_(self, expr):
+            seen.append(expr)
+            return self
+
+        def order(self, *a, **k):
+            return self
+
+        def limit(self, n):
+            return self
+
+        def in_(self, *a):
+            return self
+
+        def execute(self):
+            class R:
+                error = None
+                data = []
+            return R()
+
+    monkeypatch.setattr(repo, '_get_supabase', lambda: Q())
+    cursor = pagination.encode_cursor({'id': 'i9', 'created_at': '2026-05-01T10:00:00+05:30'})
+    assert list(repo.iter_invoice_export_pages(cursor=cursor)) == []
+    assert seen and '"i9"' in seen[0]
+
+
+def test_customer_moving_state_does_not_flag_old_invoices():
+    # billed intra-state (CGST/SGST); the customer has since moved to Kerala
+    inv = stored_invoice(1, 'Karnataka', ITEMS)
+    inv['customer'] = {'state': 'Kerala'}
+    assert audit.audit_page([inv], 'Karnataka')['discrepancies'] == []
@@ -0,0 +1,127 @@
+from backend.app import cache
+from backend.app import repository as repo
+
+
+class SimpleResult:
+    def __init__(self, data):
+        self.data = data
+        self.error = None
+
+
+class CountingSupabase:
+    """Fake client that serves products/customers and counts round trips."""
+
+    def __init__(self):
+        self.rows = {
+            'products': {'p1': {'id': 'p1', 'tax_percent': 18}, 'p2': {'id': 'p2', 'tax_percent': 5}},
+            'customers': {'c1': {'id': 'c1', 'state': 'Karnataka'}},
+        }
+        self.calls = 0
+
+    def table(self, name):
+        return Query(self, name)
+
+
+class Query:
+    def __init__(self, db, name):
+        self.db = db
+        self.name = name
+        self.ids = []
+        self.op = 'select'
+        self.payload = None
+        self.one = False
+
+    def select(self, *args):
+        return self
+
+    def single(self):
+        self.one = True
+        return self
+
+    def eq(self, k, v):
+        self.ids = [v]
+        return self
+
+    def in_(self, k, values):
+        self.ids = list(values)
+        return self
+
+    def update(self, payload):
+        self.op = 'update'
+        self.payload = payload
+        return self
+
+    def execute(self):
+        self.db.calls += 1
+        rows = self.db.rows[self.name]
+        if self.op == 'update':
+            rows[self.ids[0]].update(self.payload)
+            return SimpleResult([rows[self.ids[0]]])
+        found = [dict(rows[i]) for i in self.ids if i in rows]
+        if self.one:
+            return SimpleResult(found[0] if found else None)
+        return SimpleResult(found)
+
+
+def _fresh_caches(monkeypatch):
+    monkeypatch.setattr(repo, 'product_cache', cache.TTLCache('products', 10, 60))
+    monkeypatch.setattr(repo, 'customer_cache', cache.TTLCache('customers', 10, 60))
+
+
+def test_lru_eviction_and_counters():
+    c = cache.TTLCache('t', maxsize=2, ttl=None)
+    c.set('a', 1)
+    c.set('b', 2)
+    assert c.get('a') == 1  # 'a' becomes most recently used
+    c.set('c', 3)           # evicts 'b'
+    assert c.get('b') is cache.MISSING
+    assert c.get('c') == 3
+    stats = c.stats()
+    assert stats['evictions'] == 1
+    assert stats['hits'] == 2
+    assert stats['misses'] == 1
+
+
+def test_ttl_expiry(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(cache.time, 'monotonic', lambda: now[0])
+    c = cache.TTLCache('t', maxsize=10, ttl=5)
+    c.set('k', 'v')
+    now[0] += 4
+    assert c.get('k') == 'v'
+    now[0] += 2
+    assert c.get('k') is cache.MISSING
+    assert c.stats()['expirations'] == 1
+
+
+def test_warm_catalog_makes_no_round_trips(monkeypatch):
+    _fresh_caches(monkeypatch)
+    fake = CountingSupabase()
+    monkeypatch.setattr(repo, '_get_supabase', lambda: fake)
+
+    assert set(repo.get_products_bulk(['p1', 'p2'])) == {'p1', 'p2'}
+    assert repo.get_customer('c1')['state'] == 'Karnataka'
+    cold = fake.calls
+
+    assert repo.get_products_bulk(['p1', 'p2'])['p1']['tax_percent'] == 18
+    assert repo.get_product('p2')['tax_percent'] == 5
+    assert repo.get_customer('c1')['state'] == 'Karnataka'
+    assert fake.calls == cold
+
+    # bypassing the cache always reads through
+    repo.get_products_bulk(['p1'], use_cache=False)
+    assert fake.calls == cold + 1
+
+
+def test_updates_invalidate_cached_rows(monkeypatch):
+    _fresh_caches(monkeypatch)
+    fake = CountingSupabase()
+    monkeypatch.setattr(repo, '_get_supabase', lambda: fake)
+
+    assert repo.get_product('p1')['tax_percent'] == 18
+    repo.update_product('p1', {'tax_percent': 12})
+    assert repo.get_product('p1')['tax_percent'] == 12
+
+    assert repo.get_customer('c1')['state'] == 'Karnataka'
+    repo.update_customer('c1', {'state': 'Kerala'})
+    assert repo.get_customer('c1')['state'] == 'Kerala'
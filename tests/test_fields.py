@@ -0,0 +1,173 @@
+import asyncio
+from decimal import Decimal
+
+import pytest
+from fastapi import HTTPException
+
+from backend.app import fields
+from backend.app import repository as repo
+from backend.app import async_repository as arepo
+from backend.app import cache
+from backend.app.routes import list_products, get_invoice
+
+
+class SimpleResult:
+    def __init__(self, data):
+        self.data = data
+        self.error = None
+
+
+class ProjectingQuery:
+    """Fake that honours the select list like PostgREST would and records it."""
+
+    def __init__(self, tables):
+        self.tables = tables
+        self.selects = []
+
+    def table(self, name):
+        q = ProjectingQuery(self.tables)
+        q.selects = self.selects
+        q.name = name
+        q._single = False
+        q._eq = None
+        return q
+
+    def select(self, cols):
+        self.selects.append((self.name, cols))
+        self.cols = cols
+        return self
+
+    def eq(self, k, v):
+        self._eq = (k, v)
+        return self
+
+    def neq(self, *args):
+        return self
+
+    def single(self):
+        self._single = True
+        return self
+
+    def order(self, *args, **kwargs):
+        return self
+
+    def limit(self, n):
+        return self
+
+    def execute(self):
+        rows = self.tables[self.name]
+        if self._eq:
+            rows = [r for r in rows if r.get(self._eq[0]) == self._eq[1]]
+        keep = [c for c in self.cols.split(',') if '(' not in c]
+        embeds = [c for c in self.cols.split(',') if '(' in c]
+        if keep != ['*']:
+            rows = [{k: r[k] for k in keep if k in r} for r in rows]
+        for embed in embeds:
+            # alias:table(*) -- one-to-many for invoice_items, many-to-one for customers
+            alias, table = embed[:-3].split(':')
+            for r in rows:
+                if table == 'customers':
+                    r[alias] = next((c for c in self.tables[table] if c['id'] == r.get('customer_id')), None)
+                else:
+                    r[alias] = [it for it in self.tables[table] if it['invoice_id'] == r['id']]
+        if self._single:
+            return SimpleResult(rows[0] if rows else None)
+        return SimpleResult(rows)
+
+
+TABLES = {
+    'products': [
+        {'id': 'p1', 'name': 'Pen', 'price': Decimal('10.00'), 'tax_percent': Decimal('18'), 'stock_qty': 5,
+         'description': 'x' * 200, 'created_at': '2026-01-01T00:00:00+00:00'},
+    ],
+    'invoices': [{'id': 'i1', 'invoice_number': 'INV/2026-27/000001', 'customer_id': 'c1', 'total_amount': 10,
+                  'created_at': '2026-01-01T00:00:00+00:00'}],
+    'invoice_items': [{'id': 'it1', 'invoice_id': 'i1', 'qty': 1}],
+    'customers': [{'id': 'c1', 'name': 'Asha'}],
+}
+
+
+@pytest.fixture
+def fake(monkeypatch):
+    db = ProjectingQuery(TABLES)
+
+    async def fake_get_supabase():
+        return db
+    monkeypatch.setattr(repo, '_get_supabase', lambda: db)
+    monkeypatch.setattr(arepo, '_get_supabase', fake_get_supabase)
+    monkeypatch.setattr(cache, 'product_cache', cache.TTLCache('products', 10, 60))
+    # both repository layers run the flows in `repository`, which read its caches
+    monkeypatch.setattr(repo, 'product_cache', cache.product_cache)
+    for name in ('customer_cache', 'invoice_cache'):
+        monkeypatch.setattr(repo, name, cache.TTLCache(name, 10, None))
+    return db
+
+
+def test_parse_fields_validates_against_allow_list():
+    assert fields.parse_fields('products', 'name, price,name') == ('name', 'price')
+    assert fields.parse_fields('products', '') is None
+    with pytest.raises(fields.InvalidFields):
+        fields.parse_fields('products', 'name,password')
+    # products.meta was dropped by migration 0013
+    with pytest.raises(fields.InvalidFields):
+        fields.parse_fields('products', 'meta')
+    # expansions are only available on the invoice detail route
+    with pytest.raises(fields.InvalidFields):
+        fields.parse_fields('invoices', 'items')
+    assert fields.parse_fields('invoices', 'items', detail=True) == ('items',)
+
+
+def test_select_list_includes_dependencies_and_keyset_columns():
+    cols = fields.select_columns('products', ('name', 'total_price'), ('id', 'created_at'))
+    assert cols == 'name,price,tax_percent,id,created_at'
+    assert fields.select_columns('products', None) == '*'
+
+
+def test_list_products_projects_and_derives_on_request(fake):
+    res = asyncio.run(list_products(fields='name,total_price'))
+    assert res['data'] == [{'name': 'Pen', 'total_price': 11.8}]
+    assert fake.selects[-1] == ('products', 'name,price,tax_percent,id,created_at')
+
+    res = asyncio.run(list_products(fields='name'))
+    # total_price is not computed (or returned) unless requested
+    assert res['data'] == [{'name': 'Pen'}]
+
+
+def test_unknown_field_is_a_bad_request(fake):
+    with pytest.raises(HTTPException) as exc:
+        asyncio.run(list_products(fields='name,secret'))
+    assert exc.value.status_code == 400
+
+
+def test_invoice_detail_skips_unrequested_expansions(fake):
+    res = asyncio.run(get_invoice('i1', fields='invoice_number,total_amount'))
+    assert res['data'] == {'invoice_number': 'INV/2026-27/000001', 'total_amount': 10}
+    # neither invoice_items nor customers were queried
+    assert [t for t, _ in fake.selects] == ['invoices']
+
+    full = repo.get_invoice('i1', fields=('invoice_number', 'items', 'customer'))
+    assert full['items'] == [{'id': 'it1', 'invoice_id': 'i1', 'qty': 1}]
+    assert full['customer'] == {'id': 'c1', 'name': 'Asha'}
+
+
+def test_invoice_detail_is_one_embedded_select_then_cached(fake):
+    inv = repo.get_invoice('i1')
+    assert inv['items'] == [{'id': 'it1', 'invoice_id': 'i1', 'qty': 1}]
+    assert inv['customer'] == {'id': 'c1', 'name': 'Asha'}
+    assert fake.selects == [('invoices', '*,items:invoice_items(*),customer:customers(*)')]
+
+    # repeat reads (sync or async, any fieldset) come from the invoice and customer caches
+    inv['items'][0]['qty'] = 99
+    again = asyncio.run(arepo.get_invoice('i1'))
+    assert again['items'][0]['qty'] == 1 and again['customer']['name'] == 'Asha'
+    assert repo.get_invoice('i1', fields=('invoice_number',)) == {'invoice_number': 'INV/2026-27/000001'}
+    assert len(fake.selects) == 1
+
+
+def test_invoice_read_without_items_is_not_cached(fake, monkeypatch):
+    # read between the header and item inserts: the next read must see the items
+    monkeypatch.setitem(TABLES, 'invoices', TABLES['invoices'] + [{'id': 'i2', 'customer_id': 'c1'}])
+    assert repo.get_invoice('i2')['items'] == []
+    monkeypatch.setitem(TABLES, 'invoice_items', TABLES['invoice_items'] + [{'id': 'it2', 'invoice_id': 'i2', 'qty': 3}])
+    assert repo.get_invoice('i2')['items'] == [{'id': 'it2', 'invoice_id': 'i2', 'qty': 3}]
+    assert len(fake.selects) == 2
@@ -0,0 +1,71 @@
+import asyncio
+from decimal import Decimal
+
+from backend.app import async_repository as arepo
+from backend.app import gst, tax
+from backend.app.routes import gstr1_report
+
+
+def invoice(n, state, items, gstin=None, supplier_state='Karnataka'):
+    taxes = tax.calculate_invoice_taxes(supplier_state, state, items)
+    return {
+        'id': f'i{n}', 'customer': {'state': state, 'gstin': gstin}, 'items': items,
+        'subtotal': taxes['subtotal'], 'cgst_amount': taxes['cgst'], 'sgst_amount': taxes['sgst'],
+        'igst_amount': taxes['igst'], 'total_tax': taxes['total_tax'], 'total_amount': taxes['total'],
+    }
+
+
+def line(qty, price, rate, with_rate=True):
+    it = {'qty': qty, 'unit_price': Decimal(price), 'line_total': qty * Decimal(price)}
+    if with_rate:
+        it['tax_percent'] = Decimal(rate)
+    return it
+
+
+def test_sections_and_rate_totals_match_invoice_taxes():
+    invoices = [
+        invoice(1, 'Karnataka', [line(3, '10.05', 18), line(1, '99.99', 5)], gstin='29abcde1234f1z5'),
+        invoice(2, 'Kerala', [line(1, '150000.00', 28)]),          # inter-state B2C above threshold
+        invoice(3, 'Kerala', [line(2, '12.34', 12)]),              # inter-state B2C small
+        invoice(4, 'Karnataka', [line(7, '3.33', 18)]),            # intra-state B2C
+    ]
+    report = gst.Gstr1Report(supplier_state='Karnataka', b2cl_threshold=Decimal('100000'))
+    report.add_page(invoices[:2])
+    report.add_page(invoices[2:])
+    res = report.result()
+
+    assert res['invoices'] == 4
+    assert {r['gstin'] for r in res['b2b']} == {'29ABCDE1234F1Z5'}
+    assert [(r['place_of_supply'], r['rate'], r['invoices']) for r in res['b2cl']] == [('Kerala', 28.0, 1)]
+    assert {(r['place_of_supply'], r['rate']) for r in res['b2cs']} == {('Kerala', 12.0), ('Karnataka', 18.0)}
+
+    # per-line rounding is the same as the invoice engine, so the section totals reconcile
+    for key, col in (('cgst', 'cgst_amount'), ('sgst', 'sgst_amount'), ('igst', 'igst_amount')):
+        assert Decimal(str(res['totals'][key])) == sum(inv[col] for inv in invoices)
+    assert Decimal(str(res['totals']['taxable'])) == sum(inv['subtotal'] for inv in invoices)
+
+
+def test_lines_without_stored_rate_use_invoice_rate():
+    inv = invoice(1, 'Karnataka', [line(1, '100', 18), line(2, '50', 18)])
+    for it in inv['items']:
+        del it['tax_percent']
+    report = gst.Gstr1Report(supplier_state='Karnataka')
+    report.add_invoice(inv)
+    assert [r['rate'] for r in report.rate_summary()] == [18.0]
+
+
+def test_gstr1_route_streams_pages(monkeypatch):
+    calls = []
+
+    async def fake_pages(start, end, page_size=None, customers=False):
+        calls.append((start, end, customers))
+        yield [invoice(1, 'Karnataka', [line(1, '100', 18)])]
+        yield [invoice(2, 'Kerala', [line(1, '100', 18)])]
+
+    monkeypatch.setattr(arepo, 'iter_invoice_export_pages', fake_pages)
+    res = asyncio.run(gstr1_report(format='json', date_from='2026-09-01', date_to='2026-09-30'))
+    assert calls == [('2026-09-01T00:00:00+05:30', '2026-10-01T00:00:00+05:30', True)]
+    assert res['data']['totals'] == {'taxable': 200.0, 'cgst': 9.0, 'sgst': 9.0, 'igst': 18.0}
+
+    csv_res = asyncio.run(gstr1_report(format='csv', date_from='2026-09-01', date_to='2026-09-30'))
+    assert csv_res.body.decode().splitlines()[0] == ','.join(gst.CSV_COLUMNS)
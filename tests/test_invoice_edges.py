@@ -1,11 +1,19 @@
 from decimal import Decimal
 import asyncio
+import uuid
 import pytest
 from pydantic import ValidationError
 
 from backend.app.schemas import InvoiceItem, InvoiceCreate
 from backend.app.routes import create_invoice
-from backend.app import repository as repo
+from backend.app import async_repository as repo
+
+
+def _async(fn):
+    """Wrap a synchronous fake so it can stand in for an async_repository coroutine."""
+    async def wrapper(*args, **kwargs):
+        return fn(*args, **kwargs)
+    return wrapper
 
 
 def test_invoice_item_qty_validation():
@@ -17,7 +25,7 @@ def test_invoice_item_qty_validation():
 def test_missing_customer_uses_supplier_state_and_igst(monkeypatch):
     # Product has tax 18%, but customer lookup returns None -> inter-state assumed -> IGST
     items = [InvoiceItem(product_id='p1', description='P1', qty=1, unit_price=Decimal('100.00'), tax_percent=Decimal('18'))]
-    payload = InvoiceCreate(customer_id='missing-customer', items=items)
+    payload = InvoiceCreate(customer_id=str(uuid.uuid4()), items=items)
 
     def fake_get_product(pid):
         return {'id': pid, 'tax_percent': Decimal('18')}
@@ -25,15 +33,14 @@ def test_missing_customer_uses_supplier_state_and_igst(monkeypatch):
     def fake_get_customer(cid):
         return None
 
-    def fake_create_invoice(record):
+    def fake_create_invoice(record, items):
         return {'id': 'inv-missing-cust', **record}
 
-    monkeypatch.setattr(repo, 'get_product', fake_get_product)
-    monkeypatch.setattr(repo, 'get_customer', fake_get_customer)
-    monkeypatch.setattr(repo, 'create_invoice', fake_create_invoice)
-    monkeypatch.setattr(repo, 'insert_invoice_items', lambda a,b: True)
+    monkeypatch.setattr(repo, 'get_products_bulk', _async(lambda ids: None))
+    monkeypatch.setattr(repo, 'get_customer', _async(fake_get_customer))
+    monkeypatch.setattr(repo, 'create_invoice_with_items', _async(fake_create_invoice))
     # decrement may be called but we'll allow it to return False
-    monkeypatch.setattr(repo, 'decrement_product_stock', lambda a,b: False)
+    monkeypatch.setattr(repo, 'decrement_product_stock', _async(lambda a,b,c=False: False))
 
     res = asyncio.run(create_invoice(payload))
     assert res['status'] == 'success'
@@ -47,19 +54,19 @@ def test_missing_customer_uses_supplier_state_and_igst(monkeypatch):
 
 def test_decrement_stock_failure_does_not_block_invoice(monkeypatch):
     items = [InvoiceItem(product_id='p1', description='P1', qty=2, unit_price=Decimal('25.00'), tax_percent=Decimal('12'))]
-    payload = InvoiceCreate(customer_id='c1', items=items)
+    payload = InvoiceCreate(customer_id=str(uuid.uuid4()), items=items)
 
-    monkeypatch.setattr(repo, 'get_product', lambda pid: {'id': pid, 'tax_percent': Decimal('12')})
-    monkeypatch.setattr(repo, 'get_customer', lambda cid: {'id': cid, 'state': 'Karnataka'})
-    monkeypatch.setattr(repo, 'create_invoice', lambda record: {'id': 'inv-decr', **record})
-    monkeypatch.setattr(repo, 'insert_invoice_items', lambda a,b: True)
+    # no database reachable: reservations are skipped and stock is decremented best-effort
+    monkeypatch.setattr(repo, 'get_products_bulk', _async(lambda ids: None))
+    monkeypatch.setattr(repo, 'get_customer', _async(lambda cid: {'id': cid, 'state': 'Karnataka'}))
+    monkeypatch.setattr(repo, 'create_invoice_with_items', _async(lambda record, items: dict(record)))
 
     # simulate decrement failure
-    monkeypatch.setattr(repo, 'decrement_product_stock', lambda a,b: False)
+    monkeypatch.setattr(repo, 'decrement_product_stock', _async(lambda a,b,c=False: False))
 
     res = asyncio.run(create_invoice(payload))
     assert res['status'] == 'success'
     created = res['data']
-    # invoice created despite decrement failure
-    assert created['id'] == 'inv-decr'
+    # invoice created despite decrement failure, under the id generated by the route
+    assert uuid.UUID(created['id'])
     assert created['subtotal'] == Decimal('50.00')
@@ -1,18 +1,26 @@
 from decimal import Decimal
 import asyncio
+import uuid
 
 from backend.app.routes import create_invoice
-from backend.app import repository as repo
+from backend.app import async_repository as repo
 from backend.app.schemas import InvoiceCreate, InvoiceItem
 
 
+def _async(fn):
+    """Wrap a synchronous fake so it can stand in for an async_repository coroutine."""
+    async def wrapper(*args, **kwargs):
+        return fn(*args, **kwargs)
+    return wrapper
+
+
 def test_create_invoice_resolves_product_tax_and_creates_invoice(monkeypatch):
     # prepare payload: one item without tax_percent, product provides tax_percent
     items = [
         InvoiceItem(product_id='p1', description='Product 1', qty=2, unit_price=Decimal('100.00'), tax_percent=None),
         InvoiceItem(product_id='p2', description='Product 2', qty=1, unit_price=Decimal('50.00'), tax_percent=Decimal('12')),
     ]
-    payload = InvoiceCreate(customer_id='c1', items=items, issued_by='tester')
+    payload = InvoiceCreate(customer_id=str(uuid.uuid4()), items=items, issued_by='tester')
 
     # mocks
     def fake_get_product(pid):
@@ -25,38 +33,50 @@ def test_create_invoice_resolves_product_tax_and_creates_invoice(monkeypatch):
 
     created_called = {}
 
-    def fake_create_invoice(record):
-        # capture the record passed in
+    def fake_create_invoice_with_items(record, items_list):
+        # capture the record and items passed in
         created_called['record'] = record
+        created_called['items'] = items_list
         # return a created invoice dict
         result = {'id': 'inv1', 'invoice_number': record['invoice_number']}
         result.update(record)
         return result
 
-    def fake_insert_invoice_items(invoice_id, items_list):
-        created_called['items'] = items_list
-        return True
+    def fake_reserve_stock(pid, qty, *args):
+        return {'id': 'r-' + pid, 'product_id': pid, 'qty': qty}
 
-    def fake_decrement_stock(pid, qty):
+    def fake_consume_reservation(rid, created_by=None):
         # record calls
-        created_called.setdefault('decrements', []).append((pid, qty))
+        created_called.setdefault('consumed', []).append(rid)
         return True
 
-    monkeypatch.setattr(repo, 'get_product', fake_get_product)
-    monkeypatch.setattr(repo, 'get_customer', fake_get_customer)
-    monkeypatch.setattr(repo, 'create_invoice', fake_create_invoice)
-    monkeypatch.setattr(repo, 'insert_invoice_items', fake_insert_invoice_items)
-    monkeypatch.setattr(repo, 'decrement_product_stock', fake_decrement_stock)
+    def fake_get_products_bulk(ids):
+        created_called.setdefault('bulk_calls', []).append(list(ids))
+        return {pid: fake_get_product(pid) for pid in ids}
+
+    def fake_apply_stock_lines(lines, reason, **kwargs):
+        created_called.setdefault('stock_calls', []).append((lines, reason, kwargs))
+        return {'ok': True, 'movements': []}
+
+    monkeypatch.setattr(repo, 'get_products_bulk', _async(fake_get_products_bulk))
+    monkeypatch.setattr(repo, 'get_customer', _async(fake_get_customer))
+    monkeypatch.setattr(repo, 'create_invoice_with_items', _async(fake_create_invoice_with_items))
+    monkeypatch.setattr(repo, 'apply_stock_lines', _async(fake_apply_stock_lines))
+    monkeypatch.setattr(repo, 'next_invoice_number', _async(lambda: 'INV/2026-27/000123'))
+    monkeypatch.setattr(repo, 'reserve_stock', _async(fake_reserve_stock))
+    monkeypatch.setattr(repo, 'consume_reservation', _async(fake_consume_reservation))
 
     # run the route coroutine
     res = asyncio.run(create_invoice(payload))
 
     assert res['status'] == 'success'
     created = res['data']
-    assert created['id'] == 'inv1'
+    # the route generates the invoice id so stock movements can reference it
+    assert created['id'] == created_called['record']['id']
 
     # verify invoice record values (tax calc)
     rec = created_called['record']
+    assert rec['invoice_number'] == 'INV/2026-27/000123'
     assert rec['subtotal'] == Decimal('250.00')
     assert rec['cgst_amount'] == Decimal('21.00')
     assert rec['sgst_amount'] == Decimal('21.00')
@@ -66,14 +86,42 @@ def test_create_invoice_resolves_product_tax_and_creates_invoice(monkeypatch):
 
     # verify items were inserted
     assert len(created_called['items']) == 2
-    # verify stock decrements called
-    assert ('p1', 2) in created_called['decrements']
-    assert ('p2', 1) in created_called['decrements']
+    assert all(it['invoice_id'] == rec['id'] for it in created_called['items'])
+    # products are resolved with a single bulk lookup
+    assert created_called['bulk_calls'] == [['p1', 'p2']]
+    # all stock lines go through one atomic RPC call; no per-line reservations
+    assert len(created_called['stock_calls']) == 1
+    lines, reason, kwargs = created_called['stock_calls'][0]
+    assert lines == [{'product_id': 'p1', 'change': -2}, {'product_id': 'p2', 'change': -1}]
+    assert reason == 'sale'
+    assert kwargs['reference_id'] == created['id']
+    assert 'consumed' not in created_called
+
+
+def test_create_invoice_falls_back_to_reservations_without_stock_rpc(monkeypatch):
+    items = [
+        InvoiceItem(product_id='p1', description='Product 1', qty=2, unit_price=Decimal('100.00'), tax_percent=Decimal('18')),
+        InvoiceItem(product_id='p2', description='Product 2', qty=1, unit_price=Decimal('50.00'), tax_percent=Decimal('12')),
+    ]
+    payload = InvoiceCreate(customer_id=str(uuid.uuid4()), items=items, issued_by='tester')
+    consumed = []
+
+    monkeypatch.setattr(repo, 'get_products_bulk', _async(lambda ids: {pid: {'id': pid} for pid in ids}))
+    monkeypatch.setattr(repo, 'get_customer', _async(lambda cid: {'id': cid, 'state': 'Karnataka'}))
+    monkeypatch.setattr(repo, 'create_invoice_with_items', _async(lambda record, items: dict(record)))
+    # RPC not installed
+    monkeypatch.setattr(repo, 'apply_stock_lines', _async(lambda lines, reason, **kwargs: None))
+    monkeypatch.setattr(repo, 'reserve_stock', _async(lambda pid, qty, *args: {'id': 'r-' + pid, 'product_id': pid, 'qty': qty}))
+    monkeypatch.setattr(repo, 'consume_reservation', _async(lambda rid, created_by=None: consumed.append(rid) or True))
+
+    res = asyncio.run(create_invoice(payload))
+    assert res['status'] == 'success'
+    assert consumed == ['r-p1', 'r-p2']
 
 
 def test_invoice_with_inter_state_uses_igst(monkeypatch):
     items = [InvoiceItem(product_id='p3', description='P3', qty=3, unit_price=Decimal('99.99'), tax_percent=Decimal('18'))]
-    payload = InvoiceCreate(customer_id='c2', items=items)
+    payload = InvoiceCreate(customer_id=str(uuid.uuid4()), items=items)
 
     def fake_get_product(pid):
         return {'id': pid, 'tax_percent': Decimal('18')}
@@ -81,14 +129,15 @@ def test_invoice_with_inter_state_uses_igst(monkeypatch):
     def fake_get_customer(cid):
         return {'id': cid, 'state': 'Maharashtra'}
 
-    def fake_create_invoice(record):
+    def fake_create_invoice(record, items):
         return {'id': 'inv2', 'invoice_number': record['invoice_number'], **record}
 
-    monkeypatch.setattr(repo, 'get_product', fake_get_product)
-    monkeypatch.setattr(repo, 'get_customer', fake_get_customer)
-    monkeypatch.setattr(repo, 'create_invoice', fake_create_invoice)
-    monkeypatch.setattr(repo, 'insert_invoice_items', lambda a,b: True)
-    monkeypatch.setattr(repo, 'decrement_product_stock', lambda a,b: True)
+    monkeypatch.setattr(repo, 'get_products_bulk', _async(lambda ids: {pid: fake_get_product(pid) for pid in ids}))
+    monkeypatch.setattr(repo, 'get_customer', _async(fake_get_customer))
+    monkeypatch.setattr(repo, 'create_invoice_with_items', _async(fake_create_invoice))
+    monkeypatch.setattr(repo, 'apply_stock_lines', _async(lambda lines, reason, **kwargs: {'ok': True, 'movements': []}))
+    monkeypatch.setattr(repo, 'reserve_stock', _async(lambda pid, qty, *args: {'id': 'r-' + pid}))
+    monkeypatch.setattr(repo, 'consume_reservation', _async(lambda rid, created_by=None: True))
 
     res = asyncio.run(create_invoice(payload))
     assert res['status'] == 'success'
@@ -100,3 +149,65 @@ def test_invoice_with_inter_state_uses_igst(monkeypatch):
     # igst should be rounded to 53.99 per tax module tests
     assert created['igst_amount'] == Decimal('53.99')
     assert created['total_amount'] == Decimal('353.96')
+
+
+def test_rejected_invoice_does_not_take_an_invoice_number(monkeypatch):
+    import pytest
+    from fastapi import HTTPException
+
+    items = [InvoiceItem(product_id='p1', description='P1', qty=5, unit_price=Decimal('10.00'), tax_percent=Decimal('18'))]
+    payload = InvoiceCreate(customer_id=str(uuid.uuid4()), items=items)
+    numbers = []
+
+    monkeypatch.setattr(repo, 'get_products_bulk', _async(lambda ids: {pid: {'id': pid} for pid in ids}))
+    monkeypatch.setattr(repo, 'get_customer', _async(lambda cid: None))
+    monkeypatch.setattr(repo, 'next_invoice_number', _async(lambda: numbers.append(1) or 'INV/2026-27/000001'))
+    monkeypatch.setattr(repo, 'apply_stock_lines', _async(lambda lines, reason, **kwargs: {'ok': False, 'reason': 'insufficient_stock', 'product_id': 'p1'}))
+
+    with pytest.raises(HTTPException) as exc:
+        asyncio.run(create_invoice(payload))
+    assert exc.value.status_code == 409
+    assert numbers == []
+
+
+class _InvoiceRpc:
+    """Fake async client exposing only the create_invoice_with_items RPC."""
+
+    def __init__(self, installed=True):
+        self.installed = installed
+        self.calls = []
+
+    def rpc(self, name, params):
+        self.calls.append((name, params))
+        return self
+
+    def execute(self):
+        if not self.installed:
+            raise Exception('Could not find the function public.create_invoice_with_items(p_invoice, p_items) in the schema cache')
+        name, params = self.calls[-1]
+        return type('Res', (), {'data': dict(params['p_invoice'], created_at='now'), 'error': None})()
+
+
+def test_create_invoice_with_items_is_one_rpc(monkeypatch):
+    db = _InvoiceRpc()
+    monkeypatch.setattr(repo, '_get_supabase', _async(lambda: db))
+    record = {'id': 'i1', 'invoice_number': 'INV/1', 'subtotal': Decimal('10.00'), 'total_amount': Decimal('11.80')}
+    items = [{'invoice_id': 'i1', 'qty': 1, 'unit_price': Decimal('10.00')}]
+
+    created = asyncio.run(repo.create_invoice_with_items(record, items))
+    assert created['id'] == 'i1'
+    assert db.calls == [('create_invoice_with_items', {
+        'p_invoice': {'id': 'i1', 'invoice_number': 'INV/1', 'subtotal': 10.0, 'total_amount': 11.8},
+        'p_items': [{'invoice_id': 'i1', 'qty': 1, 'unit_price': 10.0}],
+    })]
+
+
+def test_create_invoice_with_items_falls_back_without_rpc(monkeypatch):
+    calls = []
+    monkeypatch.setattr(repo, '_get_supabase', _async(lambda: _InvoiceRpc(installed=False)))
+    monkeypatch.setattr(repo, 'create_invoice', _async(lambda record: calls.append('header') or dict(record)))
+    monkeypatch.setattr(repo, 'insert_invoice_items', _async(lambda invoice_id, items: calls.append(('items', invoice_id)) or True))
+
+    created = asyncio.run(repo.create_invoice_with_items({'id': 'i1'}, [{'invoice_id': 'i1', 'qty': 1}]))
+    assert created == {'id': 'i1'}
+    assert calls == ['header', ('items', 'i1')]
@@ -0,0 +1,110 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+from backend.app import pagination
+from backend.app import repository as repo
+from backend.app import async_repository as arepo
+from backend.app.routes import list_invoices
+
+
+class SimpleResult:
+    def __init__(self, data):
+        self.data = data
+        self.error = None
+
+
+class RecordingQuery:
+    """Query builder fake that records keyset calls and serves rows after the cursor."""
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.calls = []
+
+    def table(self, name):
+        self.calls.append(('table', name))
+        return self
+
+    def select(self, *args):
+        return self
+
+    def neq(self, *args):
+        return self
+
+    def or_(self, expr):
+        self.calls.append(('or', expr))
+        return self
+
+    def order(self, col, desc=False):
+        self.calls.append(('order', col, desc))
+        return self
+
+    def limit(self, n):
+        self.calls.append(('limit', n))
+        self._limit = n
+        return self
+
+    def execute(self):
+        rows = self.rows
+        for call in self.calls:
+            if call[0] == 'or':
+                # emulate "after (created_at, id)" for ascending pages
+                last = [c for c in rows if f'"{c["created_at"]}"' in call[1] and c['id'] in call[1]][0]
+                rows = [r for r in rows if (r['created_at'], r['id']) > (last['created_at'], last['id'])]
+        return SimpleResult(rows[:self._limit])
+
+
+ROWS = [{'id': f'c{i}', 'created_at': f'2026-01-0{i}T00:00:00+00:00'} for i in range(1, 6)]
+
+
+def test_cursor_round_trip_and_rejects_garbage():
+    cursor = pagination.encode_cursor(ROWS[2])
+    assert pagination.decode_cursor(cursor) == (ROWS[2]['created_at'], 'c3')
+    with pytest.raises(pagination.InvalidCursor):
+        pagination.decode_cursor('not-a-cursor')
+
+
+def test_page_size_is_capped(monkeypatch):
+    monkeypatch.setattr(pagination, 'MAX_PAGE_SIZE', 50)
+    assert pagination.page_size(0) == pagination.DEFAULT_PAGE_SIZE
+    assert pagination.page_size(10) == 10
+    assert pagination.page_size(10_000) == 50
+
+
+def test_customers_are_paged_by_created_at_and_id(monkeypatch):
+    seen = []
+    cursor = None
+    while True:
+        fake = RecordingQuery(ROWS)
+        monkeypatch.setattr(repo, '_get_supabase', lambda: fake)
+        page = repo.list_customers(limit=2, cursor=cursor)
+        seen += [r['id'] for r in page['rows']]
+        # one extra row is fetched to detect the next page
+        assert ('limit', 3) in fake.calls
+        assert ('order', 'created_at', False) in fake.calls and ('order', 'id', False) in fake.calls
+        cursor = page['next_cursor']
+        if not cursor:
+            break
+    assert seen == ['c1', 'c2', 'c3', 'c4', 'c5']
+
+
+def test_invoices_page_newest_first(monkeypatch):
+    fake = RecordingQuery(list(reversed(ROWS)))
+
+    async def fake_get_supabase():
+        return fake
+    monkeypatch.setattr(arepo, '_get_supabase', fake_get_supabase)
+    page = asyncio.run(arepo.list_invoices(limit=2))
+    assert ('order', 'created_at', True) in fake.calls
+    assert [r['id'] for r in page['rows']] == ['c5', 'c4']
+    # the next page seeks below the last row returned
+    after = pagination._after(page['next_cursor'], desc=True)
+    assert after.startswith('created_at.lt."2026-01-04T00:00:00+00:00"')
+    assert 'id.lt."c4"' in after
+
+
+def test_invalid_cursor_is_a_bad_request():
+    with pytest.raises(HTTPException) as exc:
+        asyncio.run(list_invoices(limit=5, cursor='%%%'))
+    assert exc.value.status_code == 400
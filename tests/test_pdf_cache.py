@@ -0,0 +1,68 @@
+import asyncio
+import os
+
+import pytest
+from fastapi.responses import FileResponse
+
+from backend.app import async_repository as arepo
+from backend.app import pdf_cache, pdf_pool
+from backend.app.routes import invoice_pdf
+
+
+@pytest.fixture
+def cache_dir(monkeypatch, tmp_path):
+    monkeypatch.setattr(pdf_cache, 'PDF_CACHE_DIR', str(tmp_path))
+    monkeypatch.setattr(pdf_cache, '_size_estimate', None)
+    return tmp_path
+
+
+def test_repeat_download_skips_database_and_render(monkeypatch, cache_dir):
+    calls = []
+
+    async def fake_get_invoice(invoice_id, fields=None):
+        calls.append('get_invoice')
+        return {'id': invoice_id, 'invoice_number': 'INV/2026-27/000007', 'items': [{'qty': 1}], 'total_amount': 10}
+
+    async def fake_render(inv):
+        calls.append('render')
+        return b'%PDF-1.7 fake', None
+
+    monkeypatch.setattr(arepo, 'get_invoice', fake_get_invoice)
+    monkeypatch.setattr(pdf_pool, 'render_invoice', fake_render)
+
+    first = asyncio.run(invoice_pdf('inv-7', None))
+    etag = first.headers['etag']
+    assert first.body == b'%PDF-1.7 fake' and calls == ['get_invoice', 'render']
+
+    second = asyncio.run(invoice_pdf('inv-7', None))
+    assert isinstance(second, FileResponse) and second.headers['etag'] == etag
+    with open(second.path, 'rb') as f:
+        assert f.read() == b'%PDF-1.7 fake'
+
+    not_modified = asyncio.run(invoice_pdf('inv-7', etag))
+    assert not_modified.status_code == 304
+    # neither the database nor the renderer were touched again
+    assert calls == ['get_invoice', 'render']
+
+
+def test_hash_changes_with_data():
+    a = pdf_cache.content_hash({'id': 'x', 'total_amount': 10})
+    assert a == pdf_cache.content_hash({'total_amount': 10, 'id': 'x'})
+    assert a != pdf_cache.content_hash({'id': 'x', 'total_amount': 11})
+
+
+def test_least_recently_used_renders_are_evicted(monkeypatch, cache_dir):
+    monkeypatch.setattr(pdf_cache, 'PDF_CACHE_MAX_BYTES', 350)
+    for n in range(3):
+        entry = pdf_cache.store(f'inv{n}', f'h{n}', b'x' * 100, 'pdf')
+        os.utime(entry.path, (n, n))
+    pdf_cache.lookup('inv0')  # touch: now the most recently used
+    pdf_cache.store('inv3', 'h3', b'x' * 100, 'pdf')
+    assert pdf_cache.lookup('inv0') is not None
+    assert pdf_cache.lookup('inv1') is None
+    assert pdf_cache.lookup('inv3') is not None
+
+
+def test_unsafe_ids_are_not_cached(cache_dir):
+    assert pdf_cache.store('../etc', 'h', b'x', 'pdf') is None
+    assert pdf_cache.lookup('../etc') is None
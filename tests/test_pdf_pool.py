@@ -0,0 +1,76 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+from backend.app import async_repository as arepo
+from backend.app import pdf_cache, pdf_pool
+from backend.app.routes import invoice_pdf
+
+INVOICE = {'id': 'i1', 'invoice_number': 'INV/2026-27/000001', 'subtotal': 100, 'total_amount': 118,
+           'items': [{'description': 'Pen', 'qty': 1, 'unit_price': 100, 'line_total': 100}], 'customer': None}
+
+
+@pytest.fixture
+def invoice(monkeypatch, tmp_path):
+    monkeypatch.setattr(pdf_cache, 'PDF_CACHE_DIR', str(tmp_path))
+    async def fake_get_invoice(invoice_id, fields=None):
+        return dict(INVOICE, items=[dict(it) for it in INVOICE['items']])
+    monkeypatch.setattr(arepo, 'get_invoice', fake_get_invoice)
+
+
+def test_worker_process_renders_invoice(monkeypatch, invoice):
+    monkeypatch.setattr(pdf_pool, 'PDF_WORKERS', 1)
+    monkeypatch.setattr(pdf_pool, '_pool', None)
+    try:
+        resp = asyncio.run(invoice_pdf('i1', None))
+    finally:
+        pdf_pool.shutdown()
+    # WeasyPrint may be absent in the test environment: then the worker returns the HTML
+    assert resp.media_type in ('application/pdf', 'text/html')
+    if resp.media_type == 'text/html':
+        assert 'INV/2026-27/000001' in resp.body.decode()
+    assert pdf_pool.pool_stats()['renders'] >= 1
+
+
+def test_full_queue_is_rejected_with_503(monkeypatch, invoice):
+    monkeypatch.setattr(pdf_pool, 'PDF_QUEUE_LIMIT', 2)
+    monkeypatch.setattr(pdf_pool, '_pending', 2)
+    rejected = pdf_pool.pool_stats()['rejected']
+    with pytest.raises(HTTPException) as exc:
+        asyncio.run(invoice_pdf('i1', None))
+    assert exc.value.status_code == 503
+    assert exc.value.headers == {'Retry-After': '2'}
+    assert pdf_pool.pool_stats()['rejected'] == rejected + 1
+
+
+def test_threadpool_mode_releases_slot(monkeypatch, invoice):
+    monkeypatch.setattr(pdf_pool, 'PDF_WORKERS', 0)
+    asyncio.run(invoice_pdf('i1', None))
+    assert pdf_pool.pool_stats()['pending'] == 0
+
+
+def test_timed_out_render_keeps_its_slot_until_it_finishes(monkeypatch):
+    monkeypatch.setattr(pdf_pool, 'PDF_WORKERS', 0)
+    monkeypatch.setattr(pdf_pool, 'PDF_RENDER_TIMEOUT', 0.05)
+    release = __import__('threading').Event()
+
+    def slow_render(invoice):
+        release.wait(5)
+        return None, '<html></html>', 0.0
+    monkeypatch.setattr(pdf_pool, '_render', slow_render)
+
+    async def flow():
+        with pytest.raises(asyncio.TimeoutError):
+            await pdf_pool.render_invoice(INVOICE)
+        # the render is still running in its thread and still holds the slot
+        held = pdf_pool.pool_stats()['pending']
+        release.set()
+        for _ in range(100):
+            if pdf_pool.pool_stats()['pending'] == 0:
+                break
+            await asyncio.sleep(0.01)
+        return held
+
+    assert asyncio.run(flow()) == 1
+    assert pdf_pool.pool_stats()['pending'] == 0
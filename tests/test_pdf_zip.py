@@ -0,0 +1,86 @@
+import asyncio
+import csv
+import io
+import zipfile
+
+import pytest
+from fastapi import HTTPException
+
+from backend.app import async_repository as arepo
+from backend.app import pdf_cache, pdf_pool, pdf_zip
+from backend.app.routes import export_invoice_pdfs, export_invoice_pdfs_progress
+from backend.app.schemas import InvoicePdfExport
+
+HEADERS = [
+    [{'id': 'i1', 'invoice_number': 'INV/2026-27/000001'}, {'id': 'i2', 'invoice_number': 'INV/2026-27/000002'}],
+    [{'id': 'i3', 'invoice_number': 'INV/2026-27/000003'}, {'id': 'gone', 'invoice_number': None}],
+]
+
+
+@pytest.fixture
+def fakes(monkeypatch, tmp_path):
+    monkeypatch.setattr(pdf_cache, 'PDF_CACHE_DIR', str(tmp_path))
+    rendered, running = [], {'now': 0, 'peak': 0}
+
+    async def fake_headers(invoice_ids=None, start=None, end=None, page_size=None):
+        for page in HEADERS:
+            yield page
+
+    async def fake_get_invoice(invoice_id, fields=None):
+        return None if invoice_id == 'gone' else {'id': invoice_id, 'items': []}
+
+    async def fake_render(inv):
+        running['now'] += 1
+        running['peak'] = max(running['peak'], running['now'])
+        await asyncio.sleep(0.01)
+        running['now'] -= 1
+        rendered.append(inv['id'])
+        return f"%PDF {inv['id']}".encode(), None
+
+    monkeypatch.setattr(arepo, 'iter_invoice_headers', fake_headers)
+    monkeypatch.setattr(arepo, 'get_invoice', fake_get_invoice)
+    monkeypatch.setattr(pdf_pool, 'render_invoice', fake_render)
+    monkeypatch.setattr(pdf_zip, 'PDF_ZIP_CONCURRENCY', 2)
+    # i2 was downloaded before: reused from the disk cache
+    pdf_cache.store('i2', 'h2', b'%PDF cached i2', 'pdf')
+    return rendered, running
+
+
+async def _download(payload):
+    resp = await export_invoice_pdfs(payload)
+    body = b''.join([chunk async for chunk in resp.body_iterator])
+    return resp, body
+
+
+def test_zip_contains_rendered_and_cached_pdfs(fakes):
+    rendered, running = fakes
+    resp, body = asyncio.run(_download(InvoicePdfExport(date_from='2026-09-01', date_to='2026-09-30')))
+    zf = zipfile.ZipFile(io.BytesIO(body))
+    assert zf.read('INV-2026-27-000001.pdf') == b'%PDF i1'
+    assert zf.read('INV-2026-27-000002.pdf') == b'%PDF cached i2'
+    manifest = {r['invoice_id']: r['status'] for r in csv.DictReader(io.StringIO(zf.read('manifest.csv').decode()))}
+    assert manifest == {'i1': 'rendered', 'i2': 'cached', 'i3': 'rendered', 'gone': 'not_found'}
+    assert sorted(rendered) == ['i1', 'i3'] and running['peak'] <= 2
+
+    progress = asyncio.run(export_invoice_pdfs_progress(resp.headers['x-export-id']))['data']
+    assert (progress['status'], progress['done'], progress['cached'], progress['failed']) == ('done', 4, 1, 1)
+
+
+def test_export_needs_ids_or_range(fakes):
+    with pytest.raises(HTTPException) as exc:
+        asyncio.run(_download(InvoicePdfExport()))
+    assert exc.value.status_code == 400
+
+
+def test_bad_ids_and_failed_listing_are_errors_not_truncated_zips(fakes, monkeypatch):
+    with pytest.raises(HTTPException) as exc:
+        asyncio.run(_download(InvoicePdfExport(invoice_ids=['not-a-uuid'])))
+    assert exc.value.status_code == 400
+
+    async def failing_headers(invoice_ids=None, start=None, end=None, page_size=None):
+        raise RuntimeError('invoice header query failed')
+        yield
+    monkeypatch.setattr(arepo, 'iter_invoice_headers', failing_headers)
+    with pytest.raises(HTTPException) as exc:
+        asyncio.run(_download(InvoicePdfExport(date_from='2026-09-01')))
+    assert exc.value.status_code == 500
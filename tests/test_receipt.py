@@ -0,0 +1,57 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+from backend.app import async_repository as arepo
+from backend.app import pdf_pool, receipt
+from backend.app.routes import invoice_pdf
+
+INVOICE = {'id': 'i1', 'invoice_number': 'INV/2026-27/000001', 'created_at': '2026-10-17T11:42:00+05:30',
+           'subtotal': '250.00', 'cgst_amount': '22.50', 'sgst_amount': '22.50', 'igst_amount': '0',
+           'total_amount': '295.00', 'customer': {'name': 'Ramesh Café', 'state': 'Karnataka'},
+           'items': [{'description': 'Notebook A5 ruled, 200 pages, hard cover', 'qty': 2,
+                      'unit_price': '100', 'line_total': '200'},
+                     {'description': 'Pen', 'qty': 1, 'unit_price': '50', 'line_total': None}]}
+
+
+def test_receipt_fits_paper_width_and_lists_totals():
+    for paper, width in receipt.PAPER_COLUMNS.items():
+        text = receipt.render_receipt(INVOICE, paper)
+        lines = text.splitlines()
+        assert all(len(line) <= width for line in lines)
+        assert text.isascii()
+        assert 'Ramesh Cafe' in text
+        assert any(line.startswith('CGST') and line.endswith('22.50') for line in lines)
+        assert not any(line.startswith('IGST') for line in lines)
+        assert lines[[i for i, l in enumerate(lines) if l.startswith('TOTAL')][0]].endswith('295.00')
+    # missing line_total falls back to qty x price
+    assert any(line.endswith('50.00') and 'x 50.00' in line for line in receipt.render_receipt(INVOICE).splitlines())
+
+
+def test_escpos_frames_receipt():
+    job = receipt.to_escpos(receipt.render_receipt(INVOICE, 80))
+    assert job.startswith(b'\x1b@') and job.endswith(b'\x1dV\x00')
+    assert b'\x1bE\x01TOTAL' in job
+
+
+def test_route_serves_receipt_without_pdf_pool(monkeypatch):
+    async def fake_get_invoice(invoice_id, fields=None):
+        return dict(INVOICE) if invoice_id == 'i1' else None
+
+    async def no_pool(inv):
+        raise AssertionError('receipt must not use the PDF pool')
+    monkeypatch.setattr(arepo, 'get_invoice', fake_get_invoice)
+    monkeypatch.setattr(pdf_pool, 'render_invoice', no_pool)
+
+    resp = asyncio.run(invoice_pdf('i1', None, 'receipt', 58))
+    assert resp.media_type.startswith('text/plain')
+    assert b'INV/2026-27/000001' in resp.body
+    resp = asyncio.run(invoice_pdf('i1', None, 'escpos', 80))
+    assert resp.media_type == 'application/octet-stream'
+
+    for args, status in ((('i1', None, 'receipt', 72), 400), (('i1', None, 'docx', 58), 400),
+                         (('missing', None, 'receipt', 58), 404)):
+        with pytest.raises(HTTPException) as err:
+            asyncio.run(invoice_pdf(*args))
+        assert err.value.status_code == status
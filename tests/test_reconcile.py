@@ -0,0 +1,148 @@
+import uuid
+
+import pytest
+
+from backend.app import reconcile
+from backend.app import repository as repo
+
+
+class SimpleResult:
+    def __init__(self, data):
+        self.data = data
+        self.error = None
+
+
+class LedgerDb:
+    """Fake client keeping products and the stock_movements ledger, with the stock RPCs."""
+
+    def __init__(self, set_stock_rpc=True):
+        self.products = {}
+        self.movements = []
+        self.set_stock_rpc = set_stock_rpc
+
+    def table(self, name):
+        return LedgerQuery(self, name)
+
+    def rpc(self, fn, params):
+        return LedgerRpc(self, fn, params)
+
+    def apply(self, lines, reason):
+        moved = []
+        for ln in lines:
+            mv = {'product_id': ln['product_id'], 'change': ln['change'], 'reason': reason}
+            self.movements.append(mv)
+            self.products[ln['product_id']]['stock_qty'] += ln['change']
+            moved.append(mv)
+        return {'ok': True, 'movements': moved}
+
+
+class LedgerQuery:
+    def __init__(self, db, name):
+        self.db, self.name, self.op, self.pid = db, name, 'select', None
+
+    def insert(self, rec):
+        self.op, self.rec = 'insert', rec
+        return self
+
+    def update(self, rec):
+        self.op, self.rec = 'update', rec
+        return self
+
+    def select(self, *cols):
+        return self
+
+    def eq(self, k, v):
+        self.pid = v
+        return self
+
+    def single(self):
+        return self
+
+    def execute(self):
+        if self.op == 'insert':
+            row = dict(self.rec, stock_qty=self.rec.get('stock_qty', 0))
+            self.db.products[row['id']] = row
+            return SimpleResult([dict(row)])
+        row = self.db.products[self.pid]
+        if self.op == 'update':
+            row.update(self.rec)
+            return SimpleResult([dict(row)])
+        return SimpleResult(dict(row, reserved_qty=0))
+
+
+class LedgerRpc:
+    def __init__(self, db, fn, params):
+        self.db, self.fn, self.params = db, fn, params
+
+    def execute(self):
+        p = self.params
+        if self.fn == 'apply_stock_lines':
+            return SimpleResult(self.db.apply(p['p_lines'], p['p_reason']))
+        if self.fn == 'set_stock_qty' and self.db.set_stock_rpc:
+            change = p['p_qty'] - self.db.products[p['p_product_id']]['stock_qty']
+            return SimpleResult(self.db.apply([{'product_id': p['p_product_id'], 'change': change}], p['p_reason']))
+        if self.fn == 'stock_ledger_batch':
+            return SimpleResult([{'product_id': pid, 'stock_qty': row['stock_qty'],
+                                  'ledger_qty': sum(m['change'] for m in self.db.movements if m['product_id'] == pid)}
+                                 for pid, row in sorted(self.db.products.items())])
+        raise Exception("{'code': 'PGRST202', 'message': 'Could not find the function public.%s'}" % self.fn)
+
+
+def test_uuid_ranges_cover_the_id_space_in_order():
+    ranges = reconcile.uuid_ranges(4)
+    assert ranges[0][0] is None and ranges[-1][1] is None
+    assert [hi for _, hi in ranges[:-1]] == [lo for lo, _ in ranges[1:]]
+    assert ranges[1][0] == '40000000-0000-0000-0000-000000000000'
+    # every id falls in exactly one range
+    ids = [uuid.uuid4() for _ in range(200)]
+    for pid in ids:
+        hits = [(lo, hi) for lo, hi in ranges
+                if (lo is None or pid >= uuid.UUID(lo)) and (hi is None or pid < uuid.UUID(hi))]
+        assert len(hits) == 1
+    assert reconcile.uuid_ranges(1) == [(None, None)]
+
+
+def test_drift_rows_keeps_only_mismatches():
+    rows = [{'product_id': 'a', 'stock_qty': 5, 'ledger_qty': 5},
+            {'product_id': 'b', 'stock_qty': 3, 'ledger_qty': 7},
+            {'product_id': 'c', 'stock_qty': None, 'ledger_qty': '-2'}]
+    assert reconcile.drift_rows(rows) == [
+        {'product_id': 'b', 'stock_qty': 3, 'ledger_qty': 7, 'drift': -4, 'status': 'drift'},
+        {'product_id': 'c', 'stock_qty': 0, 'ledger_qty': -2, 'drift': 2, 'status': 'drift'},
+    ]
+
+
+def test_repair_sends_observed_drift_and_returns_repaired(monkeypatch):
+    calls = []
+
+    class FakeRpc:
+        def __init__(self, fn, params):
+            calls.append((fn, params))
+
+        def execute(self):
+            return SimpleResult({'ok': True, 'repaired': [{'product_id': 'b', 'stock_qty': 3, 'ledger_qty': 7}]})
+
+    class Fake:
+        def rpc(self, fn, params):
+            return FakeRpc(fn, params)
+    monkeypatch.setattr(repo, '_get_supabase', lambda: Fake())
+
+    lines = [{'product_id': 'b', 'drift': -4}, {'product_id': 'c', 'drift': 2}]
+    assert repo.repair_stock_qty(lines) == [{'product_id': 'b', 'stock_qty': 3, 'ledger_qty': 7}]
+    assert calls == [('repair_stock_qty', {'p_lines': lines})]
+
+
+@pytest.mark.parametrize('set_stock_rpc', [True, False])
+def test_opening_stock_and_stock_edits_leave_no_drift(monkeypatch, set_stock_rpc):
+    db = LedgerDb(set_stock_rpc)
+    monkeypatch.setattr(repo, '_get_supabase', lambda: db)
+
+    created = repo.create_product({'name': 'Pen', 'price': 10, 'stock_qty': 10})
+    assert created['stock_qty'] == 10
+    assert reconcile.drift_rows(repo.stock_ledger_batch(None, None, None, 100)) == []
+
+    assert repo.decrement_product_stock(created['id'], 3)
+    assert repo.update_product(created['id'], {'stock_qty': 12, 'name': 'Pencil'})['name'] == 'Pencil'
+    assert db.products[created['id']]['stock_qty'] == 12
+    assert [(m['reason'], m['change']) for m in db.movements] == [('opening', 10), ('sale', -3), ('adjustment', 5)]
+    assert reconcile.drift_rows(repo.stock_ledger_batch(None, None, None, 100)) == []
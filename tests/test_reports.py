@@ -0,0 +1,94 @@
+import asyncio
+from datetime import date
+
+import pytest
+from fastapi import HTTPException
+
+from backend.app import async_repository as arepo
+from backend.app import reports
+from backend.app.routes import sales_report
+
+
+class SimpleResult:
+    def __init__(self, data):
+        self.data = data
+        self.error = None
+
+
+class RpcOnly:
+    """Only RPCs are allowed: a report must never read the invoice tables."""
+
+    def __init__(self, data):
+        self.data = data
+        self.calls = []
+
+    def rpc(self, fn, params):
+        self.calls.append((fn, params))
+        return self
+
+    def table(self, name):
+        raise AssertionError(f'report read table {name}')
+
+    def execute(self):
+        return SimpleResult(self.data)
+
+
+def install(monkeypatch, db):
+    async def fake_get_supabase():
+        return db
+    monkeypatch.setattr(arepo, '_get_supabase', fake_get_supabase)
+    monkeypatch.setattr(reports.sequences, 'local_today', lambda: date(2026, 10, 17))
+
+
+def test_sales_report_defaults_to_this_month(monkeypatch):
+    db = RpcOnly([
+        {'key': 'c1', 'label': 'Asha', 'invoices': 3, 'qty': None, 'net': '300.00', 'tax': '54.00', 'total': '354.00'},
+        {'key': reports.WALK_IN_CUSTOMER, 'label': 'Walk-in', 'invoices': 1, 'qty': None, 'net': '10', 'tax': '0', 'total': '10'},
+    ])
+    install(monkeypatch, db)
+    res = asyncio.run(sales_report(group='customer', date_from=None, date_to=None, limit=0))
+    assert db.calls == [('sales_report', {'p_group': 'customer', 'p_from': '2026-10-01', 'p_to': '2026-10-17', 'p_limit': 1000})]
+    assert res['data'][0] == {'key': 'c1', 'label': 'Asha', 'invoices': 3, 'net': 300.0, 'tax': 54.0, 'total': 354.0}
+    assert res['data'][1]['key'] is None
+
+
+def test_product_rows_carry_quantity(monkeypatch):
+    install(monkeypatch, RpcOnly([{'key': 'p1', 'label': 'Pen', 'invoices': 4, 'qty': 9, 'net': '90', 'tax': '16.2', 'total': '106.2'}]))
+    res = asyncio.run(sales_report(group='product', date_from='2026-09-01', date_to='2026-09-30', limit=5))
+    assert res['data'][0]['qty'] == 9
+    assert (res['from'], res['to']) == ('2026-09-01', '2026-09-30')
+
+
+@pytest.mark.parametrize('kwargs', [
+    {'group': 'supplier', 'date_from': None, 'date_to': None},
+    {'group': 'day', 'date_from': '2026-10-05', 'date_to': '2026-10-01'},
+])
+def test_bad_report_parameters_are_400(monkeypatch, kwargs):
+    install(monkeypatch, RpcOnly([]))
+    with pytest.raises(HTTPException) as exc:
+        asyncio.run(sales_report(limit=0, **kwargs))
+    assert exc.value.status_code == 400
+
+
+def test_invoice_items_insert_without_tax_percent_column(monkeypatch):
+    inserted = []
+
+    class Items:
+        def table(self, name):
+            return self
+
+        def insert(self, rows):
+            self.rows = rows
+            return self
+
+        def execute(self):
+            if any('tax_percent' in r for r in self.rows):
+                raise Exception("Could not find the 'tax_percent' column of 'invoice_items' in the schema cache")
+            inserted.extend(self.rows)
+            return SimpleResult(self.rows)
+
+    async def fake_get_supabase():
+        return Items()
+    monkeypatch.setattr(arepo, '_get_supabase', fake_get_supabase)
+    ok = asyncio.run(arepo.insert_invoice_items('i1', [{'invoice_id': 'i1', 'qty': 1, 'tax_percent': 18}]))
+    assert ok and inserted == [{'invoice_id': 'i1', 'qty': 1}]
@@ -0,0 +1,122 @@
+import asyncio
+import os
+
+import pytest
+
+from backend.app import sequences
+from backend.app import repository as repo
+from backend.app import async_repository as arepo
+
+
+class SimpleResult:
+    def __init__(self, data):
+        self.data = data
+        self.error = None
+
+
+class CounterSupabase:
+    """Fake exposing the allocate_counter_block RPC over an in-memory counters table."""
+
+    def __init__(self):
+        self.counters = {}
+        self.rpc_calls = 0
+
+    def rpc(self, fn, params):
+        assert fn == 'allocate_counter_block'
+        self.rpc_calls += 1
+        value = self.counters.get(params['p_name'], 0) + params['p_size']
+        self.counters[params['p_name']] = value
+        return _Call([{'first_value': value - params['p_size'] + 1, 'last_value': value}])
+
+
+class _Call:
+    def __init__(self, data):
+        self.data = data
+
+    def execute(self):
+        return SimpleResult(self.data)
+
+
+@pytest.fixture(autouse=True)
+def _fresh_sequences(monkeypatch):
+    monkeypatch.setattr(sequences, '_sequences', {})
+    monkeypatch.setattr(sequences, 'SEQUENCE_BLOCK_SIZE', 5)
+
+
+def test_block_sequence_hands_out_queued_blocks_in_order():
+    seq = sequences.BlockSequence('x', 3)
+    assert seq.take() is None
+    seq.add_block(1, 2)
+    seq.add_block(7, 8)
+    assert [seq.take() for _ in range(5)] == [1, 2, 7, 8, None]
+    assert seq.stats()['blocks_allocated'] == 2
+
+
+def test_forked_worker_drops_parent_block(monkeypatch):
+    seq = sequences.BlockSequence('x', 3)
+    seq.add_block(1, 3)
+    monkeypatch.setattr(os, 'getpid', lambda: -1)
+    assert seq.take() is None
+
+
+def test_codes_come_from_reserved_blocks(monkeypatch):
+    fake = CounterSupabase()
+    monkeypatch.setattr(repo, '_get_supabase', lambda: fake)
+    codes = [repo._next_sequential_id('customers', 'CID') for _ in range(12)]
+    assert codes[0] == 'CID000001'
+    assert codes[-1] == 'CID000012'
+    # block size 5: 12 codes cost 3 round trips
+    assert fake.rpc_calls == 3
+
+
+def test_workers_never_share_codes(monkeypatch):
+    fake = CounterSupabase()
+
+    async def fake_get_supabase():
+        return fake
+    monkeypatch.setattr(repo, '_get_supabase', lambda: fake)
+    monkeypatch.setattr(arepo, '_get_supabase', fake_get_supabase)
+
+    # simulate two workers by giving each its own sequence registry
+    seen = []
+    for _ in range(2):
+        monkeypatch.setattr(sequences, '_sequences', {})
+        seen += [repo._next_sequential_id('suppliers', 'SID') for _ in range(3)]
+        seen += [asyncio.run(arepo._next_sequential_id('suppliers', 'SID')) for _ in range(3)]
+    assert len(set(seen)) == len(seen) == 12
+
+
+def test_financial_year_boundaries():
+    from datetime import date
+    assert sequences.financial_year(date(2026, 3, 31)) == '2025-26'
+    assert sequences.financial_year(date(2026, 4, 1)) == '2026-27'
+    assert sequences.financial_year(date(2099, 12, 31)) == '2099-00'
+
+
+def test_invoice_numbers_are_per_financial_year(monkeypatch):
+    from datetime import date
+    fake = CounterSupabase()
+
+    async def fake_get_supabase():
+        return fake
+    monkeypatch.setattr(arepo, '_get_supabase', fake_get_supabase)
+    monkeypatch.setattr(sequences, 'INVOICE_NUMBER_BLOCK_SIZE', 10)
+
+    async def run():
+        a = [await arepo.next_invoice_number(date(2026, 5, 1)) for _ in range(3)]
+        b = await arepo.next_invoice_number(date(2027, 4, 2))
+        return a, b
+
+    numbers, next_year = asyncio.run(run())
+    assert numbers == ['INV/2026-27/000001', 'INV/2026-27/000002', 'INV/2026-27/000003']
+    assert next_year == 'INV/2027-28/000001'
+    # one block per financial year
+    assert fake.rpc_calls == 2
+    assert fake.counters == {'invoice_number:2026-27': 10, 'invoice_number:2027-28': 10}
+
+
+def test_invoice_number_format_is_configurable(monkeypatch):
+    monkeypatch.setattr(sequences, 'INVOICE_NUMBER_FORMAT', 'BILL-{fy}-{seq:04d}')
+    assert sequences.format_invoice_number('2026-27', 42) == 'BILL-2026-27-0042'
+    monkeypatch.setattr(sequences, 'INVOICE_NUMBER_FORMAT', 'BILL-{year}')
+    assert sequences.format_invoice_number('2026-27', 42) == 'INV/2026-27/000042'
@@ -0,0 +1,77 @@
+import asyncio
+from datetime import date
+
+from backend.app import async_repository as arepo
+from backend.app import repository as repo
+from backend.app.routes import billing_stats
+
+
+class SimpleResult:
+    def __init__(self, data):
+        self.data = data
+        self.error = None
+
+
+class RollupQuery:
+    def __init__(self, tables, touched):
+        self.tables = tables
+        self.touched = touched
+
+    def table(self, name):
+        self.touched.append(name)
+        q = RollupQuery(self.tables, self.touched)
+        q.name = name
+        q.keys = None
+        return q
+
+    def select(self, *args):
+        return self
+
+    def in_(self, col, values):
+        self.col, self.keys = col, values
+        return self
+
+    def execute(self):
+        return SimpleResult([r for r in self.tables[self.name] if r[self.col] in self.keys])
+
+
+TABLES = {
+    'billing_stats': [
+        # periods are split into slot rows that are summed on read
+        {'period': 'all', 'slot': 0, 'revenue': '1000.00', 'tax': '180.00', 'invoices': 8},
+        {'period': 'all', 'slot': 5, 'revenue': '500.00', 'tax': '90.00', 'invoices': 4},
+        {'period': 'month:2026-10', 'slot': 3, 'revenue': '400.00', 'tax': '72.00', 'invoices': 3},
+        {'period': 'day:2026-09-30', 'revenue': '99.00', 'tax': '1.00', 'invoices': 1},
+    ],
+    'counters': [
+        {'name': 'stats:customers', 'value': 7},
+        {'name': 'stats:low_stock_products', 'value': 2},
+        {'name': 'customer_code', 'value': 40},
+    ],
+}
+
+
+def test_stats_read_only_rollups(monkeypatch):
+    touched = []
+    db = RollupQuery(TABLES, touched)
+
+    async def fake_get_supabase():
+        return db
+    monkeypatch.setattr(arepo, '_get_supabase', fake_get_supabase)
+    monkeypatch.setattr(repo.sequences, 'local_today', lambda: date(2026, 10, 17))
+
+    res = asyncio.run(billing_stats())
+    assert res['data'] == {
+        # no invoices yet today: the missing day row reads as zeros
+        'today': {'revenue': 0.0, 'tax': 0.0, 'invoices': 0},
+        'month': {'revenue': 400.0, 'tax': 72.0, 'invoices': 3},
+        'all_time': {'revenue': 1500.0, 'tax': 270.0, 'invoices': 12},
+        'active_customers': 7,
+        'low_stock_products': 2,
+    }
+    assert sorted(touched) == ['billing_stats', 'counters']
+
+
+def test_stats_periods_follow_the_ist_calendar():
+    assert repo._stats_periods(date(2026, 4, 1)) == {
+        'today': 'day:2026-04-01', 'month': 'month:2026-04', 'all_time': 'all'}
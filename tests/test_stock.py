@@ -1,12 +1,16 @@
+import asyncio
 import pytest
+from datetime import datetime, timezone
 from decimal import Decimal
 from backend.app import repository as repo
+from backend.app import async_repository as arepo
+from backend.app import reservations
 
 
 class SimpleResult:
-    def __init__(self, data):
+    def __init__(self, data, error=None):
         self.data = data
-        self.error = None
+        self.error = error
 
 
 class FakeSupabase:
@@ -14,10 +18,109 @@ class FakeSupabase:
         self.products = {}
         self.reservations = {}
         self.movements = []
+        # flip on to emulate a database with the stock RPCs from migration 0014
+        self.stock_rpcs = False
+        self.rpc_calls = []
+        # flip on to emulate products.reserved_qty kept by the trigger from migration 0020
+        self.reserved_qty_column = False
+        self.selects = []
+        # flip on (with stock_rpcs) to emulate record_purchase from migration 0024
+        self.purchase_rpc = False
+        self.purchases = []
+        self.inserts = []
+        # flip on to make updates of products.stock_qty fail
+        self.fail_stock_updates = False
 
     def table(self, name):
         return TableProxy(self, name)
 
+    def rpc(self, fn, params):
+        return RpcCall(self, fn, params)
+
+
+class RpcCall:
+    def __init__(self, db, fn, params):
+        self.db = db
+        self.fn = fn
+        self.params = params
+
+    def _available(self, pid):
+        reserved = sum(r['qty'] for r in self.db.reservations.values() if r['product_id'] == pid and r['status'] == 'active')
+        return self.db.products[pid]['stock_qty'] - reserved
+
+    def _short(self, wanted, allow_negative=False):
+        for pid, qty in wanted.items():
+            if pid not in self.db.products:
+                return {'ok': False, 'reason': 'not_found', 'product_id': pid}
+            if not allow_negative and qty > 0 and self._available(pid) < qty:
+                return {'ok': False, 'reason': 'insufficient_stock', 'product_id': pid, 'available': self._available(pid)}
+        return None
+
+    def execute(self):
+        if not self.db.stock_rpcs or (self.fn == 'record_purchase' and not self.db.purchase_rpc):
+            raise Exception("{'code': 'PGRST202', 'message': 'Could not find the function public.%s'}" % self.fn)
+        self.db.rpc_calls.append(self.fn)
+        p = self.params
+        if self.fn == 'apply_stock_lines':
+            wanted = {}
+            for ln in p['p_lines']:
+                wanted[ln['product_id']] = wanted.get(ln['product_id'], 0) - ln['change']
+            short = self._short(wanted, p['p_allow_negative'])
+            if short:
+                return SimpleResult(short)
+            movements = []
+            for ln in p['p_lines']:
+                mv = {'product_id': ln['product_id'], 'change': ln['change'], 'reason': p['p_reason'], 'reference_id': p['p_reference_id']}
+                self.db.movements.append(mv)
+                self.db.products[ln['product_id']]['stock_qty'] += ln['change']
+                movements.append(mv)
+            return SimpleResult({'ok': True, 'movements': movements})
+        if self.fn == 'record_purchase':
+            short = self._short({ln['product_id']: 0 for ln in p['p_lines']})
+            if short:
+                return SimpleResult(short)
+            for ln in p['p_lines']:
+                self.db.movements.append({'product_id': ln['product_id'], 'change': ln['change'], 'reason': 'purchase',
+                                          'reference_type': 'purchase', 'reference_id': p['p_purchase_id']})
+                self.db.products[ln['product_id']]['stock_qty'] += ln['change']
+            header = {'id': p['p_purchase_id'], 'supplier_id': p['p_supplier_id'], 'line_count': len(p['p_lines']),
+                      'total_cost': sum(ln['change'] * ln.get('unit_cost', 0) for ln in p['p_lines'])}
+            self.db.purchases.append(header)
+            return SimpleResult({'ok': True, 'purchase': header})
+        if self.fn == 'reserve_stock_lines':
+            wanted = {}
+            for ln in p['p_lines']:
+                wanted[ln['product_id']] = wanted.get(ln['product_id'], 0) + ln['qty']
+            short = self._short(wanted)
+            if short:
+                return SimpleResult(short)
+            rows = []
+            for ln in p['p_lines']:
+                rid = 'r' + str(len(self.db.reservations) + 1)
+                rec = {'id': rid, 'product_id': ln['product_id'], 'qty': ln['qty'], 'invoice_id': p['p_invoice_id'],
+                       'expires_at': p['p_expires_at'], 'status': 'active'}
+                self.db.reservations[rid] = rec
+                rows.append(rec)
+            return SimpleResult({'ok': True, 'reservations': rows})
+        if self.fn == 'consume_reservations':
+            consumed = []
+            for rid in p['p_ids']:
+                rec = self.db.reservations.get(rid)
+                if rec and rec['status'] == 'active':
+                    rec['status'] = 'consumed'
+                    self.db.movements.append({'product_id': rec['product_id'], 'change': -rec['qty'], 'reason': 'sale', 'reference_id': rid})
+                    self.db.products[rec['product_id']]['stock_qty'] -= rec['qty']
+                    consumed.append({'id': rid, 'product_id': rec['product_id'], 'qty': rec['qty']})
+            return SimpleResult({'ok': True, 'consumed': consumed})
+        if self.fn == 'release_expired_reservations':
+            now = datetime.now(timezone.utc)
+            expired = [r for r in self.db.reservations.values()
+                       if r['status'] == 'active' and r.get('expires_at') and datetime.fromisoformat(r['expires_at']) < now]
+            for rec in expired[:p['p_batch']]:
+                rec['status'] = 'released'
+            return SimpleResult(len(expired[:p['p_batch']]))
+        raise Exception('unknown rpc %s' % self.fn)
+
 
 class TableProxy:
     def __init__(self, db, name):
@@ -27,11 +130,17 @@ class TableProxy:
 
     def select(self, *args, **kwargs):
         self._op = 'select'
+        self.db.selects.append(self.name)
+        return self
+
+    def in_(self, k, values):
+        self._in = (k, list(values))
         return self
 
     def eq(self, k, v):
         # emulate simple filters
         self._filter = (k, v)
+        self._eqs = getattr(self, '_eqs', []) + [(k, v)]
         return self
 
     def single(self):
@@ -40,9 +149,14 @@ class TableProxy:
 
     def execute(self):
         if getattr(self, '_op', None) == 'select':
+            if self.name == 'products' and getattr(self, '_in', None):
+                return SimpleResult([dict(self.db.products[pid]) for pid in self._in[1] if pid in self.db.products])
             if self.name == 'products':
                 pid = self._filter[1]
                 prod = self.db.products.get(pid)
+                if prod is not None and self.db.reserved_qty_column:
+                    prod = dict(prod, reserved_qty=sum(r['qty'] for r in self.db.reservations.values()
+                                                       if r['product_id'] == pid and r['status'] == 'active'))
                 return SimpleResult(prod)
             if self.name == 'stock_reservations':
                 pid = self._filter[1]
@@ -61,17 +175,23 @@ class TableProxy:
                 self.db.reservations[rid] = rec
                 return SimpleResult([rec])
             if self.name == 'stock_movements':
-                self.db.movements.append(rec)
-                return SimpleResult([rec])
+                self.db.inserts.append(self.name)
+                rows = rec if isinstance(rec, list) else [rec]
+                self.db.movements.extend(rows)
+                return SimpleResult(rows)
             return SimpleResult(None)
 
         if getattr(self, '_op', None) == 'update':
             rec = self._update_data
-            if self.name == 'products' and getattr(self, '_filter', (None,))[0] == 'id':
-                pid = self._filter[1]
-                if pid in self.db.products:
-                    self.db.products[pid].update(rec)
-                    return SimpleResult([self.db.products[pid]])
+            eqs = dict(getattr(self, '_eqs', []))
+            if self.name == 'products' and 'id' in eqs:
+                prod = self.db.products.get(eqs['id'])
+                if prod is None or any(prod.get(k) != v for k, v in eqs.items()):
+                    return SimpleResult([])
+                if self.db.fail_stock_updates:
+                    return SimpleResult(None, error='update failed')
+                prod.update(rec)
+                return SimpleResult([prod])
             if self.name == 'stock_reservations' and getattr(self, '_filter', (None,))[0] == 'id':
                 rid = self._filter[1]
                 self.db.reservations[rid].update(rec)
@@ -129,3 +249,230 @@ def test_release_reservation(fake_supabase):
     assert ok
     cur = repo.get_current_stock('p1')
     assert cur['reserved'] == 0
+
+
+def test_async_reserve_and_consume(fake_supabase, monkeypatch):
+    # the async repository accepts synchronous query builders, so the same fake backs it
+    async def fake_get_supabase():
+        return fake_supabase
+    monkeypatch.setattr(arepo, '_get_supabase', fake_get_supabase)
+
+    async def flow():
+        res = await arepo.reserve_stock('p1', 4, invoice_id='inv2')
+        assert res is not None
+        cur = await arepo.get_current_stock('p1')
+        assert cur['available'] == 6
+        assert await arepo.consume_reservation(res['id'])
+        return await arepo.get_current_stock('p1')
+
+    cur = asyncio.run(flow())
+    assert cur['on_hand'] == 6
+    assert cur['reserved'] == 0
+
+
+def test_stock_rpcs_reserve_and_consume_atomically(fake_supabase):
+    fake_supabase.stock_rpcs = True
+    res = repo.reserve_stock('p1', 3, invoice_id='inv1')
+    assert res is not None
+    # the second hold only sees 7 available
+    assert repo.reserve_stock('p1', 8) is None
+    assert repo.consume_reservation(res['id'])
+    # consuming twice is a no-op
+    assert not repo.consume_reservation(res['id'])
+    assert fake_supabase.products['p1']['stock_qty'] == 7
+    assert fake_supabase.movements == [{'product_id': 'p1', 'change': -3, 'reason': 'sale', 'reference_id': res['id']}]
+    assert fake_supabase.rpc_calls == ['reserve_stock_lines', 'reserve_stock_lines', 'consume_reservations', 'consume_reservations']
+
+
+def test_apply_sale_uses_one_stock_rpc_call(fake_supabase):
+    fake_supabase.stock_rpcs = True
+    fake_supabase.products['p2'] = {'id': 'p2', 'stock_qty': 1}
+    items = [{'product_id': 'p1', 'qty': 4}, {'product_id': 'p2', 'qty': 1}]
+    assert repo.apply_sale('c1', items) == {'status': 'ok'}
+    assert fake_supabase.rpc_calls == ['apply_stock_lines']
+    assert fake_supabase.products['p1']['stock_qty'] == 6
+    assert fake_supabase.products['p2']['stock_qty'] == 0
+
+    # the whole sale is rejected when any line is short; nothing is applied
+    assert repo.apply_sale('c1', [{'product_id': 'p1', 'qty': 1}, {'product_id': 'p2', 'qty': 1}]) is None
+    assert fake_supabase.products['p1']['stock_qty'] == 6
+    assert len(fake_supabase.movements) == 2
+
+
+def test_sale_route_rejects_non_uuid_customer(monkeypatch):
+    from fastapi import HTTPException
+    from backend.app.routes import create_sale
+    from backend.app.schemas import SaleCreate
+
+    calls = []
+
+    async def fake_apply_sale(*args):
+        calls.append(args)
+        return {'status': 'ok'}
+    monkeypatch.setattr(arepo, 'apply_sale', fake_apply_sale)
+    items = [{'product_id': 'p1', 'qty': 1, 'unit_price': '5.00'}]
+
+    with pytest.raises(HTTPException) as err:
+        asyncio.run(create_sale(SaleCreate(customer_id='walk-in', items=items)))
+    assert err.value.status_code == 400 and calls == []
+
+    # walk-in sales (no customer) and UUIDs go through
+    assert asyncio.run(create_sale(SaleCreate(customer_id=None, items=items)))['status'] == 'success'
+    assert asyncio.run(create_sale(SaleCreate(customer_id='3f0c1a52-8a3b-4c1e-9d55-0a5b0f1f2e11', items=items)))['status'] == 'success'
+    assert len(calls) == 2
+
+
+def test_sweeper_releases_expired_reservations_in_batches(fake_supabase, monkeypatch):
+    fake_supabase.stock_rpcs = True
+    monkeypatch.setattr(repo, 'RESERVATION_TTL_SECONDS', 60)
+    live = repo.reserve_stock('p1', 1, expires_at=repo.default_reservation_expiry())
+    for _ in range(3):
+        repo.reserve_stock('p1', 2, expires_at='2026-01-01T00:00:00+00:00')
+    assert repo.get_current_stock('p1')['reserved'] == 7
+
+    async def fake_get_supabase():
+        return fake_supabase
+    monkeypatch.setattr(arepo, '_get_supabase', fake_get_supabase)
+    assert asyncio.run(reservations.sweep_once(batch=2)) == 3
+    # a short batch ends the run
+    assert fake_supabase.rpc_calls[-2:] == ['release_expired_reservations'] * 2
+    assert repo.get_current_stock('p1')['reserved'] == 1
+    assert fake_supabase.reservations[live['id']]['status'] == 'active'
+
+
+def test_reservation_ttl_can_be_disabled(monkeypatch):
+    monkeypatch.setattr(repo, 'RESERVATION_TTL_SECONDS', 0)
+    assert repo.default_reservation_expiry() is None
+    monkeypatch.setattr(repo, 'RESERVATION_TTL_SECONDS', 900)
+    expires = datetime.fromisoformat(repo.default_reservation_expiry())
+    assert 890 < (expires - datetime.now(timezone.utc)).total_seconds() <= 900
+
+
+def test_current_stock_is_one_product_read_with_reserved_qty(fake_supabase, monkeypatch):
+    fake_supabase.stock_rpcs = True
+    fake_supabase.reserved_qty_column = True
+    res = repo.reserve_stock('p1', 3)
+    fake_supabase.selects.clear()
+    assert repo.get_current_stock('p1') == {'on_hand': 10, 'reserved': 3, 'available': 7}
+    assert fake_supabase.selects == ['products']
+
+    async def fake_get_supabase():
+        return fake_supabase
+    monkeypatch.setattr(arepo, '_get_supabase', fake_get_supabase)
+    assert repo.release_reservation(res['id'])
+    assert asyncio.run(arepo.get_current_stock('p1')) == {'on_hand': 10, 'reserved': 0, 'available': 10}
+    assert fake_supabase.selects == ['products', 'products']
+
+
+def test_apply_purchase_writes_header_and_movements_in_one_rpc(fake_supabase):
+    fake_supabase.stock_rpcs = True
+    fake_supabase.purchase_rpc = True
+    fake_supabase.products['p2'] = {'id': 'p2', 'stock_qty': 0}
+    items = [{'product_id': 'p1', 'qty': 5, 'unit_cost': Decimal('2.50')}, {'product_id': 'p2', 'qty': 3, 'unit_cost': Decimal('4')}]
+    out = repo.apply_purchase('s1', items, received_by='u1')
+    assert out['status'] == 'ok' and out['purchase_id']
+    assert fake_supabase.rpc_calls == ['record_purchase']
+    assert fake_supabase.purchases == [{'id': out['purchase_id'], 'supplier_id': 's1', 'line_count': 2, 'total_cost': 24.5}]
+    assert out['purchase'] == fake_supabase.purchases[0]
+    assert {mv['reference_id'] for mv in fake_supabase.movements} == {out['purchase_id']}
+    assert fake_supabase.products['p1']['stock_qty'] == 15
+    assert fake_supabase.products['p2']['stock_qty'] == 3
+
+    # an unknown product rejects the whole purchase
+    assert repo.apply_purchase('s1', [{'product_id': 'p1', 'qty': 1, 'unit_cost': 1}, {'product_id': 'nope', 'qty': 1, 'unit_cost': 1}]) is None
+    assert fake_supabase.products['p1']['stock_qty'] == 15
+    assert len(fake_supabase.purchases) == 1
+
+
+def test_apply_purchase_uses_apply_stock_lines_before_migration_0024(fake_supabase):
+    fake_supabase.stock_rpcs = True
+    out = repo.apply_purchase('s1', [{'product_id': 'p1', 'qty': 2, 'unit_cost': 1}])
+    assert out == {'status': 'ok', 'purchase_id': None, 'purchase': None}
+    assert fake_supabase.rpc_calls == ['apply_stock_lines']
+    assert fake_supabase.movements[0]['reference_id'] == 's1'
+    assert fake_supabase.products['p1']['stock_qty'] == 12
+
+
+def test_async_apply_purchase_fallback_inserts_movements_in_bulk(fake_supabase, monkeypatch):
+    async def fake_get_supabase():
+        return fake_supabase
+    monkeypatch.setattr(arepo, '_get_supabase', fake_get_supabase)
+    fake_supabase.products['p2'] = {'id': 'p2', 'stock_qty': 1}
+    items = [{'product_id': 'p1', 'qty': 2, 'unit_cost': Decimal('1.5')}, {'product_id': 'p2', 'qty': 1, 'unit_cost': 3},
+             {'product_id': 'p1', 'qty': 3, 'unit_cost': Decimal('1.5')}]
+    assert asyncio.run(arepo.apply_purchase('s1', items))['status'] == 'ok'
+    assert fake_supabase.inserts == ['stock_movements']
+    assert [mv['change'] for mv in fake_supabase.movements] == [2, 1, 3]
+    assert fake_supabase.movements[0]['unit_cost'] == 1.5
+    assert fake_supabase.products['p1']['stock_qty'] == 15
+    assert fake_supabase.products['p2']['stock_qty'] == 2
+
+    # unknown products are caught before anything is written
+    assert asyncio.run(arepo.apply_purchase('s1', [{'product_id': 'nope', 'qty': 1, 'unit_cost': 1}])) is None
+    assert fake_supabase.inserts == ['stock_movements']
+
+
+def test_purchase_fallback_adds_to_stock_changed_by_other_writers(fake_supabase, monkeypatch):
+    async def fake_get_supabase():
+        return fake_supabase
+    monkeypatch.setattr(arepo, '_get_supabase', fake_get_supabase)
+    read_products = arepo.get_products_bulk
+
+    async def read_then_sell(ids, use_cache=True):
+        products = await read_products(ids, use_cache=use_cache)
+        fake_supabase.products['p1']['stock_qty'] -= 4  # a sale commits after the purchase read p1
+        return products
+    monkeypatch.setattr(arepo, 'get_products_bulk', read_then_sell)
+
+    assert asyncio.run(arepo.apply_purchase('s1', [{'product_id': 'p1', 'qty': 5}]))['status'] == 'ok'
+    assert fake_supabase.products['p1']['stock_qty'] == 11
+
+
+def test_purchase_fallback_reports_products_whose_stock_update_failed(fake_supabase, monkeypatch):
+    from backend.app.routes import create_purchase
+    from backend.app.schemas import PurchaseCreate
+
+    fake_supabase.fail_stock_updates = True
+    res = repo.apply_purchase('s1', [{'product_id': 'p1', 'qty': 5}])
+    assert res == {'status': 'partial', 'purchase_id': None, 'purchase': None, 'failed_product_ids': ['p1']}
+    assert fake_supabase.products['p1']['stock_qty'] == 10
+    assert len(fake_supabase.movements) == 1
+
+    # the route answers with the partial result instead of an error the client would retry
+    async def fake_get_supabase():
+        return fake_supabase
+    monkeypatch.setattr(arepo, '_get_supabase', fake_get_supabase)
+    payload = PurchaseCreate(supplier_id='s1', items=[{'product_id': 'p1', 'qty': 5, 'unit_cost': '2.00'}])
+    out = asyncio.run(create_purchase(payload))
+    assert out['status'] == 'partial' and out['data']['failed_product_ids'] == ['p1']
+
+
+def test_stock_writes_invalidate_cached_products(fake_supabase, monkeypatch):
+    from backend.app import cache
+    monkeypatch.setattr(repo, 'product_cache', cache.TTLCache('products', 10, 60))
+    fake_supabase.products['p2'] = {'id': 'p2', 'stock_qty': 4}
+    assert repo.get_product('p1')['stock_qty'] == 10
+
+    # per-line fallback (no stock RPCs installed)
+    assert repo.decrement_product_stock('p1', 2)
+    assert repo.get_product('p1')['stock_qty'] == 8
+
+    fake_supabase.stock_rpcs = True
+    assert repo.apply_sale('c1', [{'product_id': 'p1', 'qty': 3}]) == {'status': 'ok'}
+    assert repo.get_product('p1')['stock_qty'] == 5
+
+    # the group-committed path: results come back from apply_stock_batch
+    assert repo.get_product('p2')['stock_qty'] == 4
+    fake_supabase.products['p2']['stock_qty'] = 1
+
+    async def fake_batch_db():
+        class Batch:
+            def rpc(self, fn, params):
+                class Call:
+                    def execute(self):
+                        return SimpleResult({'ok': True, 'results': [{'ok': True} for _ in params['p_requests']]})
+                return Call()
+        return Batch()
+    monkeypatch.setattr(arepo, '_get_supabase', fake_batch_db)
+    asyncio.run(arepo._apply_stock_batch([repo._stock_request([repo._stock_line('p2', -3)], 'sale')]))
+    assert repo.get_product('p2')['stock_qty'] == 1
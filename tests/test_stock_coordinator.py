@@ -0,0 +1,88 @@
+import asyncio
+
+import pytest
+
+from backend.app import async_repository as arepo
+from backend.app import stock_coordinator
+
+
+class SimpleResult:
+    def __init__(self, data):
+        self.data = data
+        self.error = None
+
+
+class FakeStockDb:
+    """apply_stock_batch / apply_stock_lines over an in-memory stock table."""
+
+    def __init__(self, stock, batch_rpc=True):
+        self.stock = dict(stock)
+        self.batch_rpc = batch_rpc
+        self.calls = []
+
+    def rpc(self, fn, params):
+        db = self
+
+        class Call:
+            def execute(self):
+                db.calls.append((fn, len(params.get('p_requests', [None]))))
+                if fn == 'apply_stock_batch':
+                    if not db.batch_rpc:
+                        raise Exception("{'code': 'PGRST202', 'message': 'Could not find the function public.apply_stock_batch'}")
+                    return SimpleResult({'ok': True, 'results': [db.apply(r['lines'], r['allow_negative']) for r in params['p_requests']]})
+                return SimpleResult(db.apply(params['p_lines'], params['p_allow_negative']))
+        return Call()
+
+    def apply(self, lines, allow_negative):
+        for ln in lines:
+            if not allow_negative and self.stock[ln['product_id']] + ln['change'] < 0:
+                return {'ok': False, 'reason': 'insufficient_stock', 'product_id': ln['product_id']}
+        for ln in lines:
+            self.stock[ln['product_id']] += ln['change']
+        return {'ok': True, 'movements': []}
+
+
+@pytest.fixture
+def db(monkeypatch):
+    fake = FakeStockDb({'hot': 5})
+
+    async def fake_get_supabase():
+        return fake
+    monkeypatch.setattr(arepo, '_get_supabase', fake_get_supabase)
+    monkeypatch.setattr(stock_coordinator, '_batch_supported', True)
+    monkeypatch.setattr(stock_coordinator, '_drain', None)
+    return fake
+
+
+def _sell(n):
+    async def run():
+        return await asyncio.gather(*(arepo.apply_stock_lines([{'product_id': 'hot', 'change': -1}], 'sale')
+                                      for _ in range(n)))
+    return asyncio.run(run())
+
+
+def test_concurrent_sales_share_one_round_trip_with_individual_results(db):
+    results = _sell(8)
+    assert db.calls == [('apply_stock_batch', 8)]
+    assert [r['ok'] for r in results] == [True] * 5 + [False] * 3
+    assert results[-1]['reason'] == 'insufficient_stock'
+    assert db.stock['hot'] == 0
+
+
+def test_falls_back_to_single_calls_without_batch_rpc(db):
+    db.batch_rpc = False
+    results = _sell(3)
+    assert [r['ok'] for r in results] == [True] * 3
+    assert db.calls == [('apply_stock_batch', 3)] + [('apply_stock_lines', 1)] * 3
+    # later calls skip the batch RPC
+    _sell(1)
+    assert db.calls[-1] == ('apply_stock_lines', 1)
+
+
+def test_failed_batch_is_retried_request_by_request(db, monkeypatch):
+    async def broken_batch(requests):
+        raise RuntimeError('invalid input syntax for type uuid')
+    monkeypatch.setattr(arepo, '_apply_stock_batch', broken_batch)
+    results = _sell(2)
+    assert [r['ok'] for r in results] == [True, True]
+    assert db.calls == [('apply_stock_lines', 1)] * 2
@@ -0,0 +1,89 @@
+import asyncio
+import uuid
+
+import pytest
+from fastapi import HTTPException
+
+from backend.app import async_repository as arepo
+from backend.app import pagination, stock_snapshots
+from backend.app.routes import stock_as_of
+
+PID = '3f0c1a52-8a3b-4c1e-9d55-0a5b0f1f2e11'
+
+
+def test_parse_as_of_uses_ist_calendar():
+    # a date covers the whole IST day
+    assert stock_snapshots.parse_as_of('2026-03-31').isoformat() == '2026-04-01T00:00:00+05:30'
+    assert stock_snapshots.parse_as_of('2026-03-31T18:00').isoformat() == '2026-03-31T18:00:00+05:30'
+    assert stock_snapshots.parse_as_of('2026-03-31T12:00:00+00:00').utcoffset().total_seconds() == 0
+    assert stock_snapshots.parse_as_of(None).tzinfo is not None
+    with pytest.raises(stock_snapshots.InvalidAsOf):
+        stock_snapshots.parse_as_of('31/03/2026')
+    assert stock_snapshots.default_snapshot_time().time().isoformat() == '00:00:00'
+
+
+def test_route_returns_shaped_rows_and_total(monkeypatch):
+    calls = []
+
+    class FakeRpc:
+        def __init__(self, fn, params):
+            calls.append((fn, params))
+
+        def execute(self):
+            return type('R', (), {'error': None, 'data': [
+                {'product_id': PID, 'name': 'Pen', 'qty': 12, 'unit_cost': '4.50', 'value': '54.00',
+                 'snapshot_as_of': '2026-03-31T00:00:00+05:30'},
+            ]})()
+
+    class FakeClient:
+        def rpc(self, fn, params):
+            return FakeRpc(fn, params)
+
+    async def fake_get_supabase():
+        return FakeClient()
+    monkeypatch.setattr(arepo, '_get_supabase', fake_get_supabase)
+
+    res = asyncio.run(stock_as_of('2026-03-31', PID))
+    assert calls == [('stock_as_of', {'p_at': '2026-04-01T00:00:00+05:30', 'p_product_ids': [PID],
+                                      'p_after': None, 'p_limit': 101})]
+    assert res['data'] == [{'product_id': PID, 'name': 'Pen', 'qty': 12, 'unit_cost': 4.5, 'value': 54.0,
+                            'snapshot_as_of': '2026-03-31T00:00:00+05:30'}]
+    assert res['total_value'] == 54.0 and res['next_cursor'] is None
+
+    for args in (('yesterday', None), ('2026-03-31', 'not-a-uuid')):
+        with pytest.raises(HTTPException) as err:
+            asyncio.run(stock_as_of(*args))
+        assert err.value.status_code == 400
+
+
+def test_route_pages_products_by_id(monkeypatch):
+    ids = sorted(str(uuid.uuid4()) for _ in range(3))
+    calls = []
+
+    class FakeRpc:
+        def __init__(self, fn, params):
+            calls.append(params)
+            self.params = params
+
+        def execute(self):
+            after, limit = self.params['p_after'], self.params['p_limit']
+            rows = [{'product_id': pid, 'name': 'P', 'qty': 1, 'value': '2.00'} for pid in ids if after is None or pid > after]
+            return type('R', (), {'error': None, 'data': rows[:limit]})()
+
+    class FakeClient:
+        def rpc(self, fn, params):
+            return FakeRpc(fn, params)
+
+    async def fake_get_supabase():
+        return FakeClient()
+    monkeypatch.setattr(arepo, '_get_supabase', fake_get_supabase)
+
+    first = asyncio.run(stock_as_of('2026-03-31', None, 2))
+    assert [r['product_id'] for r in first['data']] == ids[:2] and first['total_value'] == 4.0
+    second = asyncio.run(stock_as_of('2026-03-31', None, 2, first['next_cursor']))
+    assert [r['product_id'] for r in second['data']] == ids[2:] and second['next_cursor'] is None
+    assert [c['p_after'] for c in calls] == [None, ids[1]]
+
+    with pytest.raises(HTTPException) as err:
+        asyncio.run(stock_as_of('2026-03-31', None, 2, pagination.encode_cursor({'id': 'nope'})))
+    assert err.value.status_code == 400
@@ -34,4 +34,48 @@ def test_inter_state_tax():
     assert res['igst'] == Decimal('53.99')
     assert res['total_tax'] == Decimal('53.99')
     assert res['total'] == Decimal('353.96')
- 
\ No newline at end of file
+ 
+
+def _random_invoices(rng, n):
+    invoices = []
+    for _ in range(n):
+        items = [{
+            'qty': rng.randint(-3, 50),
+            'unit_price': Decimal(rng.randint(0, 10_000_000)) / 100,
+            'tax_percent': Decimal(rng.choice([0, 5, 12, 18, 28, rng.randint(0, 4000)])) / 100,
+        } for _ in range(rng.randint(0, 6))]
+        invoices.append((rng.random() < 0.5, items))
+    return invoices
+
+
+def test_batch_engine_matches_decimal_engine():
+    import random
+    from backend.app import tax
+
+    rng = random.Random(20261017)
+    invoices = _random_invoices(rng, 2000)
+    cols = tax.invoice_columns(invoices)
+    modes = [False] + ([True] if tax._HAS_NUMPY else [])
+    for use_numpy in modes:
+        out = tax.calculate_taxes_batch(*cols, use_numpy=use_numpy)
+        for i, (intra, items) in enumerate(invoices):
+            # same-state pair for intra, different states otherwise
+            expected = calculate_invoice_taxes('Karnataka', 'Karnataka' if intra else 'Kerala', items)
+            for field in tax.BATCH_FIELDS:
+                assert out[field][i] == int(expected[field] * 100), (i, field, use_numpy)
+
+
+def test_batch_engine_rounds_half_away_from_zero():
+    from backend.app import tax
+
+    # 0.25 paise of CGST per side rounds down, 0.5 paise rounds up (and away from zero when negative)
+    assert tax.line_tax_minor(25, 100, True) == (0, 0, 0)
+    assert tax.line_tax_minor(50, 10000, False) == (0, 0, 50)
+    assert tax.line_tax_minor(1, 5000, False) == (0, 0, 1)
+    assert tax.line_tax_minor(-1, 5000, False) == (0, 0, -1)
+    try:
+        tax.to_minor(Decimal('1.005'))
+    except ValueError:
+        pass
+    else:
+        raise AssertionError('sub-paisa price accepted')